@@ -13,13 +13,19 @@ import os
 # 載入環境變數
 load_dotenv()
 
+from app.utils.rate_limit import storage_uri as rate_limit_storage_uri, record_breach
+
 # 初始化擴充套件
 db = SQLAlchemy()
 migrate = Migrate()
+# 限制計數存放在所有 worker 共用的儲存（見 app.utils.rate_limit），儲存故障時放行請求
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per minute"],
-    storage_uri="memory://",
+    storage_uri=rate_limit_storage_uri(),
+    strategy="sliding-window-counter",
+    on_breach=record_breach,
+    swallow_errors=True,
 )
 
 def create_app():
@@ -32,8 +38,13 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # 連線池設定（DB_POOL_* 環境變數）
+    from app.utils.db_metrics import engine_options, init_db_metrics
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
     # 初始化擴充
     db.init_app(app)
+    init_db_metrics(app)
     migrate.init_app(app, db)
     limiter.init_app(app)
 
@@ -60,6 +71,10 @@ def create_app():
     from app.utils.logger import setup_logging
     setup_logging(app)
 
+    # SQL 分析器（SQL_PROFILER_ENABLED 或管理員帶 X-SQL-Profile 標頭）
+    from app.utils.sql_profiler import init_sql_profiler
+    init_sql_profiler(app)
+
     # ========================================
     # 配置 CORS - 從環境變數讀取允許的來源
     # ========================================
@@ -67,10 +82,10 @@ def create_app():
     CORS(app,
          resources={r"/api/*": {
              "origins": cors_origins,
-             "allow_headers": ["Content-Type", "Authorization"],
+             "allow_headers": ["Content-Type", "Authorization", "X-SQL-Profile", "Idempotency-Key"],
              "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
              "supports_credentials": True,
-             "expose_headers": ["Content-Type", "Authorization"],
+             "expose_headers": ["Content-Type", "Authorization", "X-SQL-Profile", "Server-Timing", "Idempotent-Replayed"],
              "max_age": 3600
          }},
          supports_credentials=True,
@@ -122,13 +137,14 @@ def create_app():
         }), 500
 
     # 導入模型（讓 Flask-Migrate 能夠偵測）- 三表帳號系統
-    from app.models import User, PublicUser, TempleAdminUser, SuperAdminUser, Amulet, Checkin, Energy, Temple, Product, Address, Redemption, TempleAnnouncement, CheckinReward, RewardClaim, TempleApplication, SystemSettings, SystemLog, UserReport, Notification, NotificationSettings, TempleEvent, EventRegistration, LineUser, TempleNotification, NotificationStats, NotificationTemplate, RefreshToken
+    from app.models import User, PublicUser, TempleAdminUser, SuperAdminUser, Amulet, Checkin, Energy, Temple, Product, Address, Redemption, TempleAnnouncement, CheckinReward, RewardClaim, TempleApplication, SystemSettings, SystemLog, UserReport, Notification, NotificationSettings, TempleEvent, EventRegistration, LineUser, TempleNotification, NotificationStats, NotificationTemplate, RefreshToken, RefreshTokenFamily, TempleDailyStats, TempleVisitor, ExportJob, UserStreak, NotificationDelivery, NotificationBroadcast, NotificationReceipt, SchedulerLease, ScheduledJob, LineWebhookEvent, PointsLedgerEntry, PointsBalanceSnapshot
 
     # 註冊路由（新增 temple_admin_api 為主要廟方後台 API）
-    from app.routes import auth, user, amulet, checkin, energy, temple, product, address, redemption, upload, stats, leaderboard, temple_announcement, temple_admin, temple_stats, temple_revenue, temple_export, reward, admin, notification, temple_event_admin, temple_admin_api, public_event, line_webhook, temple_notification_admin
+    from app.routes import auth, user, amulet, checkin, energy, temple, product, address, redemption, upload, stats, leaderboard, temple_announcement, temple_admin, temple_stats, temple_revenue, temple_export, reward, admin, notification, temple_event_admin, temple_admin_api, public_event, line_webhook, temple_notification_admin, temple_export_job, metrics
 
     # 新版三表系統 - 優先註冊
     app.register_blueprint(temple_admin_api.bp)  # 廟方後台 API（新版，三表系統）
+    app.register_blueprint(temple_export_job.bp)  # 廟方背景匯出 API
 
     # 舊版路由（向後兼容）
     app.register_blueprint(auth.bp)
@@ -158,21 +174,33 @@ def create_app():
     app.register_blueprint(public_event.bp)    # 公開活動/報名 API
     app.register_blueprint(line_webhook.bp)    # LINE webhook
 
+    # 系統監控
+    app.register_blueprint(metrics.bp)
+
+    # CLI 指令（flask stats rebuild 等）
+    from app.commands import register_commands
+    register_commands(app)
+
     # 排程服務（非 debug reloader 子程序才啟動）
     if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
         from app.services.scheduler import init_scheduler
         init_scheduler(app)
 
     # LIFF SPA fallback — 所有 /liff/ 子路徑都回傳 index.html
-    from flask import send_from_directory
+    from flask import abort
+    from werkzeug.security import safe_join
+    from app.utils.media import send_media
     @app.route('/liff')
     @app.route('/liff/')
     @app.route('/liff/<path:path>')
     def serve_liff(path=''):
-        # 如果是靜態資源（有副檔名），直接回傳檔案
+        # 如果是靜態資源（有副檔名），直接回傳檔案（assets/ 帶指紋，可長期快取）
         if '.' in path:
-            return send_from_directory(liff_dist, path)
-        # 否則回傳 index.html（SPA routing）
-        return send_from_directory(liff_dist, 'index.html')
+            full_path = safe_join(liff_dist, path)
+            if full_path is None or not os.path.isfile(full_path):
+                abort(404)
+            return send_media(liff_dist, path)
+        # 否則回傳 index.html（SPA routing），每次以 ETag 重新驗證
+        return send_media(liff_dist, 'index.html', no_cache=True)
 
     return app
@@ -0,0 +1,47 @@
+"""
+Flask CLI 指令
+使用方式：
+    flask --app run stats rebuild [--temple-id 1]
+    flask --app run stats rebuild-streaks [--user-id 1]
+    flask --app run media precompress [--path ../liff/dist]
+"""
+import click
+from flask.cli import AppGroup
+
+stats_cli = AppGroup('stats', help='廟宇統計彙總維護')
+media_cli = AppGroup('media', help='靜態媒體維護')
+
+
+@stats_cli.command('rebuild')
+@click.option('--temple-id', type=int, default=None, help='只重建指定廟宇（預設全部）')
+def rebuild_stats(temple_id):
+    """由打卡/兌換原始資料回填或重建每日統計彙總"""
+    from app.services.temple_rollup import rebuild_rollups
+    count = rebuild_rollups(temple_id)
+    click.echo(f'[完成] 已重建 {count} 筆每日統計（temple_id={temple_id or "全部"}）')
+
+
+@stats_cli.command('rebuild-streaks')
+@click.option('--user-id', type=int, default=None, help='只重建指定用戶（預設全部）')
+def rebuild_streaks(user_id):
+    """由打卡紀錄回填或重建用戶連續打卡狀態"""
+    from app.services.streak import rebuild_streaks as rebuild
+    count = rebuild(user_id)
+    click.echo(f'[完成] 已重建 {count} 位用戶的連續打卡狀態（user_id={user_id or "全部"}）')
+
+
+@media_cli.command('precompress')
+@click.option('--path', 'directory', default=None, help='要壓縮的目錄（預設 LIFF dist）')
+def precompress(directory):
+    """為 LIFF build 產生 .gz / .br 預先壓縮檔（每次 build 後執行）"""
+    import pathlib
+    from app.utils.media import precompress_directory
+    directory = directory or str(pathlib.Path(__file__).resolve().parent.parent.parent / 'liff' / 'dist')
+    count, with_brotli = precompress_directory(directory)
+    click.echo(f'[完成] 已壓縮 {count} 個檔案（{"gzip + brotli" if with_brotli else "gzip，未安裝 brotli"}）：{directory}')
+
+
+def register_commands(app):
+    """在 app factory 中註冊 CLI 指令"""
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(media_cli)
@@ -28,6 +28,14 @@ from app.models.lamp_type import LampType
 from app.models.lamp_application import LampApplication
 from app.models.line_user import LineUser
 from app.models.temple_notification import TempleNotification, NotificationStats, NotificationTemplate
-from app.models.refresh_token import RefreshToken
+from app.models.refresh_token import RefreshToken, RefreshTokenFamily
+from app.models.temple_daily_stats import TempleDailyStats, TempleVisitor
+from app.models.export_job import ExportJob
+from app.models.user_streak import UserStreak
+from app.models.notification_delivery import NotificationDelivery
+from app.models.notification_broadcast import NotificationBroadcast, NotificationReceipt
+from app.models.scheduler_state import SchedulerLease, ScheduledJob
+from app.models.line_webhook_event import LineWebhookEvent
+from app.models.points_ledger import PointsLedgerEntry, PointsBalanceSnapshot
 
-__all__ = ['User', 'PublicUser', 'TempleAdminUser', 'SuperAdminUser', 'Amulet', 'Checkin', 'Energy', 'Temple', 'Product', 'Address', 'Redemption', 'TempleAnnouncement', 'CheckinReward', 'RewardClaim', 'TempleApplication', 'SystemSettings', 'SystemLog', 'UserReport', 'Notification', 'NotificationSettings', 'TempleEvent', 'EventRegistration', 'PilgrimageVisit', 'LampType', 'LampApplication', 'LineUser', 'TempleNotification', 'NotificationStats', 'NotificationTemplate', 'RefreshToken']
+__all__ = ['User', 'PublicUser', 'TempleAdminUser', 'SuperAdminUser', 'Amulet', 'Checkin', 'Energy', 'Temple', 'Product', 'Address', 'Redemption', 'TempleAnnouncement', 'CheckinReward', 'RewardClaim', 'TempleApplication', 'SystemSettings', 'SystemLog', 'UserReport', 'Notification', 'NotificationSettings', 'TempleEvent', 'EventRegistration', 'PilgrimageVisit', 'LampType', 'LampApplication', 'LineUser', 'TempleNotification', 'NotificationStats', 'NotificationTemplate', 'RefreshToken', 'RefreshTokenFamily', 'TempleDailyStats', 'TempleVisitor', 'ExportJob', 'UserStreak', 'NotificationDelivery', 'NotificationBroadcast', 'NotificationReceipt', 'SchedulerLease', 'ScheduledJob', 'LineWebhookEvent', 'PointsLedgerEntry', 'PointsBalanceSnapshot']
@@ -10,7 +10,7 @@ class Address(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     recipient_name = db.Column(db.String(50), nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
+    phone = db.Column(db.String(20), nullable=False, index=True)  # 亦用於對應 LINE 用戶（站內通知）
     postal_code = db.Column(db.String(10), nullable=True)
     city = db.Column(db.String(20), nullable=False)
     district = db.Column(db.String(20), nullable=False)
@@ -16,6 +16,17 @@ class Checkin(db.Model):
     notes = db.Column(db.Text, nullable=True)  # 打卡備註
     blessing_points = db.Column(db.Integer, default=10, nullable=False)  # 獲得的祝福點數
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    dedup_key = db.Column(db.String(100), nullable=True)  # 每日唯一鍵（同一天重複簽到由唯一索引擋下）
+    idempotency_key = db.Column(db.String(64), nullable=True)  # 客戶端 Idempotency-Key 標頭
+
+    __table_args__ = (
+        db.UniqueConstraint('dedup_key', name='unique_checkin_dedup_key'),
+        db.UniqueConstraint('user_id', 'idempotency_key', name='unique_checkin_idempotency_key'),
+        # 列表依 (timestamp, id) 游標分頁
+        db.Index('ix_checkins_timestamp', 'timestamp'),
+        db.Index('ix_checkins_temple_timestamp', 'temple_id', 'timestamp'),
+        db.Index('ix_checkins_user_timestamp', 'user_id', 'timestamp'),
+    )
 
     def to_dict(self):
         """轉換為字典"""
@@ -20,6 +20,13 @@ class EventRegistration(db.Model):
     registered_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     canceled_at = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        # 受眾判斷（活躍 / 沉睡）：依 LINE 用戶查最近報名
+        db.Index('ix_event_registrations_line_user_registered', 'line_user_id', 'registered_at'),
+        # 候補遞補：依活動取出最早的候補者
+        db.Index('ix_event_registrations_event_status_registered', 'event_id', 'status', 'registered_at'),
+    )
+
     # 關聯
     user = db.relationship('User', foreign_keys=[user_id])
 
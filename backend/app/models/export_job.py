@@ -0,0 +1,63 @@
+"""
+背景匯出工作模型（大型報表改由背景執行，完成後下載檔案）
+"""
+from app import db
+from datetime import datetime
+
+class ExportJob(db.Model):
+    __tablename__ = 'export_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    temple_id = db.Column(db.Integer, db.ForeignKey('temples.id', ondelete='CASCADE'), nullable=False, index=True)
+    requested_by = db.Column(db.Integer, nullable=False)  # 建立者帳號 ID
+    account_type = db.Column(db.String(20), nullable=False)  # 建立者帳號類型
+    export_type = db.Column(db.String(20), nullable=False)  # checkins / orders / revenue
+    file_format = db.Column(db.String(10), default='csv', nullable=False)  # csv（gzip 壓縮）/ xlsx
+    params = db.Column(db.JSON, nullable=True)  # 匯出條件（日期區間、訂單狀態）
+    # pending / running / completed / failed / expired（檔案已清除）
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    total_rows = db.Column(db.Integer, nullable=True)
+    processed_rows = db.Column(db.Integer, default=0, nullable=False)
+    file_path = db.Column(db.String(500), nullable=True)
+    file_size = db.Column(db.BigInteger, nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)  # 檔案保留期限
+
+    __table_args__ = (
+        db.Index('ix_export_jobs_status_created', 'status', 'created_at'),
+    )
+
+    @property
+    def progress(self):
+        """進度百分比（0-100）"""
+        if self.status == 'completed':
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, int(self.processed_rows * 100 / self.total_rows))
+
+    def to_dict(self):
+        """轉換為字典"""
+        return {
+            'id': self.id,
+            'temple_id': self.temple_id,
+            'export_type': self.export_type,
+            'file_format': self.file_format,
+            'params': self.params or {},
+            'status': self.status,
+            'progress': self.progress,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'file_size': self.file_size,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+    def __repr__(self):
+        return f'<ExportJob {self.id} {self.export_type} {self.status}>'
@@ -12,7 +12,7 @@ class LineUser(db.Model):
     line_user_id = db.Column(db.String(50), unique=True, nullable=False, index=True)
     display_name = db.Column(db.String(100), nullable=True)
     picture_url = db.Column(db.String(500), nullable=True)
-    phone = db.Column(db.String(20), nullable=True)
+    phone = db.Column(db.String(20), nullable=True, index=True)
     email = db.Column(db.String(120), nullable=True)
     is_following = db.Column(db.Boolean, default=True, nullable=False)
     followed_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -20,6 +20,11 @@ class LineUser(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # 受眾計數（追蹤中 / 新追蹤者）
+        db.Index('ix_line_users_following_followed', 'is_following', 'followed_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -0,0 +1,32 @@
+"""
+LINE webhook 事件收件匣（webhook 先寫入再由背景 worker 處理，依 webhookEventId 去重）
+"""
+from app import db
+from datetime import datetime
+
+class LineWebhookEvent(db.Model):
+    __tablename__ = 'line_webhook_events'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    webhook_event_id = db.Column(db.String(64), nullable=False)  # LINE webhookEventId（重送時相同）
+    event_type = db.Column(db.String(30), nullable=False)
+    source_key = db.Column(db.String(64), nullable=False)  # 來源 userId / groupId / roomId（同一來源依序處理）
+    event_timestamp = db.Column(db.BigInteger, nullable=False)  # LINE 事件時間（毫秒）
+    payload = db.Column(db.JSON, nullable=False)
+    is_redelivery = db.Column(db.Boolean, default=False, nullable=False)
+    # pending / processing / done / failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error_message = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('webhook_event_id', name='unique_line_webhook_event_id'),
+        db.Index('ix_line_webhook_events_source_status', 'source_key', 'status', 'event_timestamp'),
+        db.Index('ix_line_webhook_events_status_received', 'status', 'received_at'),
+    )
+
+    def __repr__(self):
+        return f'<LineWebhookEvent {self.webhook_event_id} {self.event_type} {self.status}>'
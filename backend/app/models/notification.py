@@ -30,6 +30,11 @@ class Notification(db.Model):
     # 關聯
     user = db.relationship('User', backref='notifications', lazy=True)
 
+    __table_args__ = (
+        # 批次寫入廟方通知時判斷是否已寫入
+        db.Index('ix_notifications_related', 'related_type', 'related_id', 'user_id'),
+    )
+
     def mark_as_read(self):
         """標記為已讀"""
         self.is_read = True
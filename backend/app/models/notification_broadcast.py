@@ -0,0 +1,45 @@
+"""
+廣播通知模型（fan-out-on-read：一則廣播只存一列，讀取時與個人已讀紀錄合併）
+"""
+from app import db
+from datetime import datetime
+
+
+class NotificationBroadcast(db.Model):
+    __tablename__ = 'notification_broadcasts'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    temple_id = db.Column(db.Integer, db.ForeignKey('temples.id', ondelete='CASCADE'), nullable=True, index=True)
+    type = db.Column(db.String(30), nullable=False)  # 同 Notification.type
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    related_type = db.Column(db.String(30), nullable=True)
+    related_id = db.Column(db.Integer, nullable=True)
+    data = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    __table_args__ = (
+        # 同一則來源（如廟方通知）只會建立一則廣播
+        db.UniqueConstraint('related_type', 'related_id', name='unique_notification_broadcast_source'),
+    )
+
+    def __repr__(self):
+        return f'<NotificationBroadcast {self.title}>'
+
+
+class NotificationReceipt(db.Model):
+    """用戶對廣播的已讀 / 刪除紀錄（沒有紀錄代表未讀）"""
+    __tablename__ = 'notification_receipts'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('notification_broadcasts.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    read_at = db.Column(db.DateTime, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'broadcast_id', name='unique_notification_receipt'),
+    )
+
+    def __repr__(self):
+        return f'<NotificationReceipt User {self.user_id} - Broadcast {self.broadcast_id}>'
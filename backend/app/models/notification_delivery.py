@@ -0,0 +1,41 @@
+"""
+LINE 推播分批進度（每批 multicast 一列；發送中斷後可由未完成的批次續傳）
+"""
+from app import db
+from datetime import datetime
+
+class NotificationDelivery(db.Model):
+    __tablename__ = 'notification_deliveries'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    notification_id = db.Column(db.Integer, db.ForeignKey('temple_notifications.id', ondelete='CASCADE'), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)  # 批次序號（從 0 開始）
+    recipients = db.Column(db.JSON, nullable=False)  # 本批 LINE user ID（建立後不再變動，續傳時沿用）
+    recipient_count = db.Column(db.Integer, nullable=False)
+    retry_key = db.Column(db.String(36), nullable=False)  # X-Line-Retry-Key（UUID），重送時 LINE 不會重複推播
+    # pending / sent / failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_status_code = db.Column(db.Integer, nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('notification_id', 'chunk_index', name='unique_notification_delivery_chunk'),
+    )
+
+    def to_dict(self):
+        """轉換為字典（不含收件者清單）"""
+        return {
+            'chunk_index': self.chunk_index,
+            'recipient_count': self.recipient_count,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_status_code': self.last_status_code,
+            'error_message': self.error_message,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+    def __repr__(self):
+        return f'<NotificationDelivery {self.notification_id}#{self.chunk_index} {self.status}>'
@@ -0,0 +1,61 @@
+"""
+功德值帳本模型
+- PointsLedgerEntry：只新增不修改的點數異動紀錄（每筆記錄異動後餘額）
+- PointsBalanceSnapshot：定期彙總的每日餘額快照（查詢歷史餘額與核對時只需掃描快照之後的異動）
+功德值同時存在 users 與 public_users，以 account_table 區分帳號所在的資料表
+"""
+from app import db
+from datetime import datetime
+
+
+class PointsLedgerEntry(db.Model):
+    __tablename__ = 'points_ledger'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    account_table = db.Column(db.String(30), nullable=False)  # users / public_users
+    user_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)  # 正數為增加，負數為扣除
+    balance_after = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(30), nullable=False)  # opening, checkin, reward, redemption, redemption_cancel, admin_adjust
+    reference_id = db.Column(db.Integer, nullable=True)  # 依 source 對應簽到 / 領獎 / 兌換紀錄 ID
+    description = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # 個人歷史（依時間 / ID 範圍掃描）
+        db.Index('ix_points_ledger_account_created', 'account_table', 'user_id', 'created_at', 'id'),
+    )
+
+    def to_dict(self):
+        """轉換為字典"""
+        return {
+            'id': self.id,
+            'delta': self.delta,
+            'balance_after': self.balance_after,
+            'source': self.source,
+            'reference_id': self.reference_id,
+            'description': self.description,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+    def __repr__(self):
+        return f'<PointsLedgerEntry {self.account_table}:{self.user_id} {self.delta:+d}>'
+
+
+class PointsBalanceSnapshot(db.Model):
+    __tablename__ = 'points_balance_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    account_table = db.Column(db.String(30), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False)
+    balance = db.Column(db.Integer, nullable=False)  # 含 last_entry_id 以前所有異動的餘額
+    last_entry_id = db.Column(db.Integer, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('account_table', 'user_id', 'snapshot_date', name='unique_points_snapshot_day'),
+    )
+
+    def __repr__(self):
+        return f'<PointsBalanceSnapshot {self.account_table}:{self.user_id} {self.snapshot_date} {self.balance}>'
@@ -3,6 +3,7 @@
 """
 from app import db
 from datetime import datetime
+from app.utils.file_upload import IMAGE_SIZES, image_variant_url
 
 class Product(db.Model):
     __tablename__ = 'products'
@@ -38,6 +39,9 @@ class Product(db.Model):
             'stock_quantity': self.stock_quantity,
             'low_stock_threshold': self.low_stock_threshold,
             'image_url': self.image_url,
+            'image_variants': {
+                size: image_variant_url(self.image_url, size) for size in IMAGE_SIZES
+            } if self.image_url else None,
             'images': self.images,
             'is_active': self.is_active,
             'is_featured': self.is_featured,
@@ -57,6 +61,7 @@ class Product(db.Model):
             'stock_quantity': self.stock_quantity,
             'low_stock_threshold': self.low_stock_threshold,
             'image_url': self.image_url,
+            'thumbnail_url': image_variant_url(self.image_url, 'thumbnail'),
             'is_featured': self.is_featured,
             'created_at': self.created_at.isoformat()
         }
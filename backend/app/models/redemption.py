@@ -40,6 +40,12 @@ class Redemption(db.Model):
     completed_at = db.Column(db.DateTime, nullable=True)
     cancelled_at = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        # 列表依 (redeemed_at, id) 游標分頁
+        db.Index('ix_redemptions_redeemed_at', 'redeemed_at'),
+        db.Index('ix_redemptions_temple_redeemed', 'temple_id', 'redeemed_at'),
+    )
+
     def to_dict(self):
         """轉換為字典"""
         return {
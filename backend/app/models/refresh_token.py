@@ -1,5 +1,8 @@
 """
 Refresh Token 模型
+- RefreshToken：每個簽發的 refresh token（過期後由排程刪除）
+- RefreshTokenFamily：每個帳號一筆的 token 世代；token 內記錄簽發時的世代，
+  「登出所有裝置」只需將世代加一，不必逐筆更新該帳號的 token
 """
 from datetime import datetime
 from app import db
@@ -12,8 +15,8 @@ class RefreshToken(db.Model):
     jti = db.Column(db.String(36), unique=True, nullable=False, index=True)
     user_id = db.Column(db.Integer, nullable=False, index=True)
     account_type = db.Column(db.String(20), nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    revoked_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     @property
@@ -27,3 +30,21 @@ class RefreshToken(db.Model):
     @property
     def is_valid(self):
         return not self.is_expired and not self.is_revoked
+
+
+class RefreshTokenFamily(db.Model):
+    __tablename__ = 'refresh_token_families'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    account_type = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    generation = db.Column(db.Integer, default=0, nullable=False)  # 世代小於此值的 token 視為已撤銷
+    revoked_at = db.Column(db.DateTime, nullable=True, index=True)  # 最近一次撤銷全部的時間（供快取增量同步）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('account_type', 'user_id', name='unique_refresh_token_family'),
+    )
+
+    def __repr__(self):
+        return f'<RefreshTokenFamily {self.account_type}:{self.user_id} gen={self.generation}>'
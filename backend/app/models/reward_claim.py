@@ -15,6 +15,11 @@ class RewardClaim(db.Model):
     related_checkin_id = db.Column(db.Integer, db.ForeignKey('checkins.id', ondelete='SET NULL'), nullable=True)
     claimed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # 個人領取紀錄依 (claimed_at, id) 游標分頁
+        db.Index('ix_reward_claims_user_claimed', 'user_id', 'claimed_at'),
+    )
+
     # 關聯
     user = db.relationship('User', backref='reward_claims', lazy=True)
     related_checkin = db.relationship('Checkin', backref='reward_claims', lazy=True)
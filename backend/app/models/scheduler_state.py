@@ -0,0 +1,58 @@
+"""
+排程器狀態模型
+- SchedulerLease：leader 租約（同一時間只有持有租約的程序觸發排程工作）
+- ScheduledJob：排程工作的下次執行時間與執行指標（跨重啟保留）
+"""
+from app import db
+from datetime import datetime
+
+
+class SchedulerLease(db.Model):
+    __tablename__ = 'scheduler_leases'
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)  # host:pid:隨機碼
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} {self.holder}>'
+
+
+class ScheduledJob(db.Model):
+    __tablename__ = 'scheduled_jobs'
+
+    name = db.Column(db.String(100), primary_key=True)
+    interval_seconds = db.Column(db.Integer, nullable=False)
+    next_run_at = db.Column(db.DateTime, nullable=False, index=True)
+    running_since = db.Column(db.DateTime, nullable=True)  # 執行中（逾時視為中斷）
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_status = db.Column(db.String(20), nullable=True)  # success / failed
+    last_error = db.Column(db.Text, nullable=True)
+    last_holder = db.Column(db.String(100), nullable=True)
+    run_count = db.Column(db.Integer, default=0, nullable=False)
+    failure_count = db.Column(db.Integer, default=0, nullable=False)
+    total_duration_ms = db.Column(db.BigInteger, default=0, nullable=False)
+
+    def to_dict(self):
+        """轉換為字典"""
+        return {
+            'name': self.name,
+            'interval_seconds': self.interval_seconds,
+            'next_run_at': self.next_run_at.isoformat() if self.next_run_at else None,
+            'running': self.running_since is not None,
+            'last_started_at': self.last_started_at.isoformat() if self.last_started_at else None,
+            'last_finished_at': self.last_finished_at.isoformat() if self.last_finished_at else None,
+            'last_duration_ms': self.last_duration_ms,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'last_holder': self.last_holder,
+            'run_count': self.run_count,
+            'failure_count': self.failure_count,
+            'avg_duration_ms': round(self.total_duration_ms / self.run_count, 1) if self.run_count else None
+        }
+
+    def __repr__(self):
+        return f'<ScheduledJob {self.name}>'
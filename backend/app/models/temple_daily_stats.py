@@ -0,0 +1,59 @@
+"""
+廟宇每日統計彙總模型（儀表板用，隨打卡/兌換寫入增量更新）
+"""
+from app import db
+from datetime import datetime
+
+class TempleDailyStats(db.Model):
+    __tablename__ = 'temple_daily_stats'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    temple_id = db.Column(db.Integer, db.ForeignKey('temples.id', ondelete='CASCADE'), nullable=False)
+    stat_date = db.Column(db.Date, nullable=False)
+    checkin_count = db.Column(db.Integer, default=0, nullable=False)  # 當日打卡次數
+    visitor_count = db.Column(db.Integer, default=0, nullable=False)  # 當日不重複訪客
+    new_visitor_count = db.Column(db.Integer, default=0, nullable=False)  # 當日首次來訪的訪客
+    order_count = db.Column(db.Integer, default=0, nullable=False)  # 當日有效訂單數（不含已取消）
+    points_spent = db.Column(db.Integer, default=0, nullable=False)  # 當日訂單使用的功德值（不含已取消）
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # 每間廟宇每天一筆
+    __table_args__ = (
+        db.UniqueConstraint('temple_id', 'stat_date', name='unique_temple_stat_date'),
+    )
+
+    def to_dict(self):
+        """轉換為字典"""
+        return {
+            'temple_id': self.temple_id,
+            'date': self.stat_date.isoformat(),
+            'checkin_count': self.checkin_count,
+            'visitor_count': self.visitor_count,
+            'new_visitor_count': self.new_visitor_count,
+            'order_count': self.order_count,
+            'points_spent': self.points_spent
+        }
+
+    def __repr__(self):
+        return f'<TempleDailyStats Temple {self.temple_id} - {self.stat_date}>'
+
+
+class TempleVisitor(db.Model):
+    """每位訪客在各廟宇的首次/最近來訪（供跨日不重複訪客計數）"""
+    __tablename__ = 'temple_visitors'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    temple_id = db.Column(db.Integer, db.ForeignKey('temples.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    first_visit_at = db.Column(db.DateTime, nullable=False)
+    last_visit_at = db.Column(db.DateTime, nullable=False)
+    visit_count = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('temple_id', 'user_id', name='unique_temple_visitor'),
+        db.Index('ix_temple_visitors_temple_last_visit', 'temple_id', 'last_visit_at'),
+        db.Index('ix_temple_visitors_temple_first_visit', 'temple_id', 'first_visit_at'),
+    )
+
+    def __repr__(self):
+        return f'<TempleVisitor Temple {self.temple_id} - User {self.user_id}>'
@@ -16,6 +16,7 @@ class TempleEvent(db.Model):
     end_at = db.Column(db.DateTime, nullable=False)
     signup_end_at = db.Column(db.DateTime, nullable=False, index=True)
     capacity = db.Column(db.Integer, nullable=False)
+    reserved_seats = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # 已佔用名額（見 app.services.event_seats）
     fee = db.Column(db.Numeric(10, 2), default=0, nullable=False)
     cover_image_url = db.Column(db.String(500), nullable=True)
     status = db.Column(db.String(20), default='draft', nullable=False, index=True)  # draft, published, closed, canceled
@@ -40,6 +41,7 @@ class TempleEvent(db.Model):
             'endAt': self.end_at.isoformat() if self.end_at else None,
             'signupEndAt': self.signup_end_at.isoformat() if self.signup_end_at else None,
             'capacity': self.capacity,
+            'reservedSeats': self.reserved_seats or 0,
             'fee': float(self.fee) if self.fee else 0,
             'coverImageUrl': self.cover_image_url,
             'status': self.status,
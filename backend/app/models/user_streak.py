@@ -0,0 +1,17 @@
+"""
+用戶連續打卡狀態（打卡時 O(1) 增量更新，讀取只需一次主鍵查詢）
+"""
+from app import db
+from datetime import datetime
+
+class UserStreak(db.Model):
+    __tablename__ = 'user_streaks'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    current_streak = db.Column(db.Integer, default=0, nullable=False)  # 截至 last_checkin_date 的連續天數
+    longest_streak = db.Column(db.Integer, default=0, nullable=False)  # 歷史最長連續天數
+    last_checkin_date = db.Column(db.Date, nullable=True)  # 最近一次打卡日期（UTC）
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UserStreak User {self.user_id} - {self.current_streak}/{self.longest_streak}>'
@@ -18,6 +18,9 @@ from app.utils.logger import get_logger
 logger = get_logger('routes.admin')
 from app.utils.response import success_response, error_response
 from app.utils.auth import generate_admin_token, admin_token_required, admin_permission_required
+from app.utils.principal_cache import invalidate_principal
+from app.utils.pagination import paginate
+from app.services import points_ledger, redemption_writer
 from sqlalchemy import func, and_, or_
 from datetime import datetime, timedelta
 
@@ -119,21 +122,17 @@ def get_users(current_admin):
     if date_to:
         query = query.filter(User.created_at <= datetime.fromisoformat(date_to))
 
-    # 排序
-    if order == 'asc':
-        query = query.order_by(getattr(User, sort_by).asc())
-    else:
-        query = query.order_by(getattr(User, sort_by).desc())
-
-    # 分頁
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    # 排序 + 分頁（依排序欄位與 id 的 keyset 游標）
+    sort_column = User.blessing_points if sort_by == 'blessing_points' else User.created_at
+    result = paginate(query, sort_column, User.id, page, per_page, descending=order != 'asc')
 
     return success_response({
-        'users': [user.to_dict() for user in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'users': [user.to_dict() for user in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/users/<int:user_id>', methods=['GET'])
@@ -208,6 +207,7 @@ def update_user_role(current_admin, user_id):
     )
 
     db.session.commit()
+    invalidate_principal('public', user_id)
 
     return success_response(user.to_dict(), '用戶角色更新成功')
 
@@ -217,10 +217,6 @@ def adjust_user_points(current_admin, user_id):
     """
     調整用戶功德點數
     """
-    user = User.query.get(user_id)
-    if not user:
-        return error_response('用戶不存在', 404)
-
     data = request.get_json()
     adjustment = data.get('adjustment')  # 正數為增加，負數為減少
     reason = data.get('reason', '').strip()
@@ -231,14 +227,17 @@ def adjust_user_points(current_admin, user_id):
     if not reason:
         return error_response('必須提供調整原因', 400)
 
-    old_points = user.blessing_points
-    user.blessing_points += adjustment
-    new_points = user.blessing_points
+    # 鎖定用戶資料列，讀到的原點數與寫入帳本的異動一致
+    user = User.query.filter_by(id=user_id).with_for_update().first()
+    if not user:
+        db.session.rollback()
+        return error_response('用戶不存在', 404)
 
-    # 防止負數
-    if user.blessing_points < 0:
-        user.blessing_points = 0
-        new_points = 0
+    # 防止負數：扣除量不超過目前點數
+    old_points = user.blessing_points
+    new_points = points_ledger.post(
+        user, max(adjustment, -old_points), 'admin_adjust', description=f'{current_admin.name}: {reason}'
+    )
 
     # 記錄日誌
     SystemLog.log_action(
@@ -280,6 +279,7 @@ def toggle_user_status(current_admin, user_id):
     # 切換使用者啟用狀態
     user.is_active = not user.is_active
     db.session.commit()
+    invalidate_principal('public', user_id)
 
     status_text = '啟用' if user.is_active else '停用'
     return success_response(
@@ -321,6 +321,8 @@ def bulk_user_action(current_admin):
     )
 
     db.session.commit()
+    for user_id in user_ids:
+        invalidate_principal('public', user_id)
 
     return success_response({
         'updated_count': updated_count,
@@ -345,15 +347,15 @@ def get_temple_applications(current_admin):
     if status:
         query = query.filter_by(status=status)
 
-    query = query.order_by(TempleApplication.submitted_at.desc())
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(query, TempleApplication.submitted_at, TempleApplication.id, page, per_page)
 
     return success_response({
-        'applications': [app.to_dict() for app in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'applications': [app.to_dict() for app in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/temple-applications/<int:application_id>/review', methods=['POST'])
@@ -430,15 +432,16 @@ def get_pending_products(current_admin):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
 
-    query = Product.query.filter_by(is_active=False).order_by(Product.created_at.desc())
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    query = Product.query.filter_by(is_active=False)
+    result = paginate(query, Product.created_at, Product.id, page, per_page)
 
     return success_response({
-        'products': [p.to_dict() for p in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'products': [p.to_dict() for p in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/products/<int:product_id>/review', methods=['POST'])
@@ -553,15 +556,15 @@ def get_all_redemptions(current_admin):
     if date_to:
         query = query.filter(Redemption.redeemed_at <= datetime.fromisoformat(date_to))
 
-    query = query.order_by(Redemption.redeemed_at.desc())
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(query, Redemption.redeemed_at, Redemption.id, page, per_page)
 
     return success_response({
-        'redemptions': [r.to_dict() for r in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'redemptions': [r.to_dict() for r in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/redemptions/<int:redemption_id>', methods=['GET'])
@@ -601,7 +604,8 @@ def update_redemption_status(current_admin, redemption_id):
         return error_response(f'無效的狀態值，必須是: {", ".join(valid_statuses)}', 400)
 
     old_status = redemption.status
-    redemption.status = new_status
+    # 進入 / 離開 cancelled 時同步調整統計彙總（與日誌同一交易）
+    redemption_writer.change_status(redemption, new_status)
 
     # 記錄日誌
     SystemLog.log_action(
@@ -653,17 +657,15 @@ def get_checkin_list(current_admin):
             pass
 
     # 排序：最新的在前
-    query = query.order_by(Checkin.timestamp.desc())
-
-    # 分頁
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(query, Checkin.timestamp, Checkin.id, page, per_page)
 
     return success_response({
-        'checkins': [checkin.to_dict() for checkin in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'checkins': [checkin.to_dict() for checkin in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/checkins/<int:checkin_id>', methods=['GET'])
@@ -706,17 +708,15 @@ def get_amulet_list(current_admin):
         )
 
     # 排序：最新的在前
-    query = query.order_by(Amulet.created_at.desc())
-
-    # 分頁
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(query, Amulet.created_at, Amulet.id, page, per_page)
 
     return success_response({
-        'amulets': [amulet.to_dict() for amulet in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'amulets': [amulet.to_dict() for amulet in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/amulets/<int:amulet_id>', methods=['GET'])
@@ -1266,15 +1266,15 @@ def get_reports(current_admin):
     if report_type:
         query = query.filter_by(report_type=report_type)
 
-    query = query.order_by(UserReport.reported_at.desc())
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(query, UserReport.reported_at, UserReport.id, page, per_page)
 
     return success_response({
-        'reports': [r.to_dict() for r in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'reports': [r.to_dict() for r in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 @bp.route('/reports/<int:report_id>/handle', methods=['POST'])
@@ -1517,15 +1517,15 @@ def get_system_logs(current_admin):
     if admin_id:
         query = query.filter_by(admin_id=admin_id)
 
-    query = query.order_by(SystemLog.created_at.desc())
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(query, SystemLog.created_at, SystemLog.id, page, per_page)
 
     return success_response({
-        'logs': [log.to_dict() for log in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages
+        'logs': [log.to_dict() for log in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'next_cursor': result.next_cursor
     })
 
 # ===== 11. 系統公告（額外功能）=====
@@ -8,6 +8,7 @@ from app.models.temple_admin_user import TempleAdminUser
 from app.models.super_admin_user import SuperAdminUser
 from app.utils.validator import validate_register_data, validate_login_data
 from app.utils.auth import generate_token, generate_refresh_token, verify_refresh_token, revoke_refresh_token, revoke_all_user_tokens, token_required, temple_admin_token_required, super_admin_token_required
+from app.utils.principal_cache import invalidate_principal
 from app.utils.response import success_response, error_response
 from app import limiter
 from datetime import datetime
@@ -74,13 +75,14 @@ def register():
         )
         new_user.set_password(data['password'])
 
-        # 儲存到資料庫
+        # 儲存到資料庫（refresh token 與帳號同一交易）
         db.session.add(new_user)
-        db.session.commit()
+        db.session.flush()
 
         # 生成雙 Token
         access_token = generate_token(new_user.id, 'public')
         refresh_token = generate_refresh_token(new_user.id, 'public')
+        db.session.commit()
 
         return success_response({
             'user': new_user.to_dict(),
@@ -168,11 +170,11 @@ def login():
 
         # 更新最後登入時間
         user.last_login_at = datetime.utcnow()
-        db.session.commit()
 
-        # 生成雙 Token
+        # 生成雙 Token（refresh token 與登入時間同一交易寫入）
         access_token = generate_token(user.id, account_type)
         refresh_token = generate_refresh_token(user.id, account_type)
+        db.session.commit()
 
         # 回傳資料
         response_data = {
@@ -185,6 +187,7 @@ def login():
         return success_response(response_data, '登入成功', 200)
 
     except Exception as e:
+        db.session.rollback()
         return error_response(f'登入失敗: {str(e)}', 500)
 
 @bp.route('/me', methods=['GET', 'OPTIONS'])
@@ -240,6 +243,7 @@ def change_password(current_user, account_type):
         # 設定新密碼
         current_user.set_password(new_password)
         db.session.commit()
+        invalidate_principal(account_type, current_user.id)
 
         return success_response(None, '密碼修改成功', 200)
 
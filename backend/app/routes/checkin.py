@@ -8,24 +8,37 @@ from app.models.checkin import Checkin
 from app.models.amulet import Amulet
 from app.models.energy import Energy
 from app.models.temple import Temple
-from app.models.checkin_reward import CheckinReward
 from app.models.reward_claim import RewardClaim
+from app.services.temple_rollup import record_checkin
+from app.services import leaderboard
+from app.services.reward_engine import evaluate_rewards
+from app.services.streak import record_checkin_day, get_streak
+from app.services.checkin_writer import (
+    IdempotencyKeyError, get_idempotency_key, daily_key, find_by_idempotency_key,
+    lock_amulet, insert_checkin, is_replay
+)
+from app.services import points_ledger
 from app.utils.auth import token_required
+from app.utils.exceptions import AppError
+from app.utils.pagination import paginate
 from app.utils.response import success_response, error_response
 from datetime import datetime, timedelta
-from sqlalchemy import func, distinct, or_
+from sqlalchemy import func, distinct
 
 logger = get_logger('routes.checkin')
 
 bp = Blueprint('checkin', __name__, url_prefix='/api/checkin')
 
+CHECKIN_ENERGY = 10  # 每次簽到增加的能量
+
 @bp.route('/', methods=['POST'])
 @token_required
-def create_checkin(current_user):
+def create_checkin(current_user, account_type):
     """
     創建簽到記錄（每次簽到增加 10 點能量）
     POST /api/checkin/
     Header: Authorization: Bearer <token>
+            Idempotency-Key: <客戶端產生的唯一值>  // 可選，重送時回傳原本結果
     Body: {
         "amulet_id": 1,
         "temple_id": 1  // 可選
@@ -40,10 +53,15 @@ def create_checkin(current_user):
         amulet_id = data['amulet_id']
         temple_id = data.get('temple_id')  # 可選的廟宇 ID
 
-        # 驗證護身符是否存在且屬於當前用戶
-        amulet = Amulet.query.filter_by(id=amulet_id, user_id=current_user.id).first()
-        if not amulet:
-            return error_response('護身符不存在或無權訪問', 404)
+        try:
+            idempotency_key = get_idempotency_key()
+        except IdempotencyKeyError as e:
+            return error_response(str(e), 400)
+
+        # 重送的請求直接回傳原本結果
+        replayed = find_by_idempotency_key(current_user.id, idempotency_key)
+        if replayed:
+            return _replay_checkin(replayed, current_user, amulet_id)
 
         # 如果指定了廟宇，驗證廟宇是否存在
         if temple_id:
@@ -51,64 +69,91 @@ def create_checkin(current_user):
             if not temple:
                 return error_response('廟宇不存在或已停用', 404)
 
-        # 檢查今天是否已經簽到過
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        existing_checkin = Checkin.query.filter(
-            Checkin.amulet_id == amulet_id,
-            Checkin.timestamp >= today_start
-        ).first()
-
-        if existing_checkin:
-            return error_response('今天已經簽到過了', 400)
+        # 鎖定護身符並驗證屬於當前用戶（同一護身符的簽到依序處理）
+        amulet = lock_amulet(amulet_id)
+        if not amulet or amulet.user_id != current_user.id:
+            db.session.rollback()
+            return error_response('護身符不存在或無權訪問', 404)
 
-        # 創建簽到記錄
+        # 創建簽到記錄（每個護身符每天一次，由唯一鍵保證）
         checkin = Checkin(
             user_id=current_user.id,
             amulet_id=amulet_id,
-            temple_id=temple_id
+            temple_id=temple_id,
+            dedup_key=daily_key('amulet', amulet_id),
+            idempotency_key=idempotency_key
         )
+        existing = insert_checkin(checkin)
+        if existing is not None:
+            if is_replay(existing, idempotency_key):
+                return _replay_checkin(existing, current_user, amulet_id)
+            return error_response('今天已經簽到過了', 400)
 
         # 增加能量（每次簽到 +10）
-        energy_added = 10
-        amulet.add_energy(energy_added)
+        amulet.add_energy(CHECKIN_ENERGY)
 
         # 記錄能量變化
         energy_log = Energy(
             user_id=current_user.id,
             amulet_id=amulet_id,
-            energy_added=energy_added
+            energy_added=CHECKIN_ENERGY
         )
-
-        db.session.add(checkin)
         db.session.add(energy_log)
-        db.session.flush()  # 先 flush 讓 checkin 有 ID
+
+        # 更新連續打卡狀態與廟宇每日統計彙總
+        record_checkin_day(current_user.id, checkin.timestamp)
+        record_checkin(checkin.temple_id, current_user.id, checkin.timestamp)
 
         # 自動檢查並發放獎勵
         granted_rewards = _check_and_grant_rewards(current_user, checkin)
 
         db.session.commit()
 
-        response_data = {
-            'checkin': checkin.to_dict(),
-            'amulet': amulet.to_dict(),
-            'energy_added': energy_added
-        }
-
-        # 如果有獲得獎勵，加入回傳資料
-        if granted_rewards:
-            response_data['rewards_granted'] = granted_rewards
-            response_data['new_blessing_points'] = current_user.blessing_points
-
-        return success_response(
-            response_data,
-            '簽到成功' + (f'，獲得 {len(granted_rewards)} 個獎勵！' if granted_rewards else ''),
-            201
-        )
+        # 增量更新排行榜
+        leaderboard.record_checkin(current_user.id, checkin.blessing_points, current_user.blessing_points)
+
+        return _checkin_response(checkin, amulet, current_user, granted_rewards)
 
     except Exception as e:
         db.session.rollback()
         return error_response(f'簽到失敗: {str(e)}', 500)
 
+def _checkin_response(checkin, amulet, user, granted_rewards):
+    """簽到成功的回應（首次寫入與冪等重送共用）"""
+    response_data = {
+        'checkin': checkin.to_dict(),
+        'amulet': amulet.to_dict(),
+        'energy_added': CHECKIN_ENERGY
+    }
+
+    # 如果有獲得獎勵，加入回傳資料
+    if granted_rewards:
+        response_data['rewards_granted'] = granted_rewards
+        response_data['new_blessing_points'] = user.blessing_points
+
+    return success_response(
+        response_data,
+        '簽到成功' + (f'，獲得 {len(granted_rewards)} 個獎勵！' if granted_rewards else ''),
+        201
+    )
+
+def _replay_checkin(checkin, user, amulet_id):
+    """相同 Idempotency-Key 重送：回傳原本的結果，不再計算獎勵"""
+    if checkin.amulet_id != amulet_id:
+        return error_response('Idempotency-Key 已用於其他簽到請求', 422)
+
+    claims = RewardClaim.query.filter_by(related_checkin_id=checkin.id, claim_type='auto').all()
+    granted_rewards = [{
+        'reward_id': claim.reward_id,
+        'reward_name': claim.reward.name if claim.reward else None,
+        'points_received': claim.points_received,
+        'reward_type': claim.reward.reward_type if claim.reward else None
+    } for claim in claims]
+
+    response = _checkin_response(checkin, checkin.amulet, user, granted_rewards)
+    response[0].headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @bp.route('/', methods=['GET'])
 @token_required
 def get_user_checkins(current_user):
@@ -198,7 +243,7 @@ def check_today_checkin(current_user):
 
 @bp.route('/history', methods=['GET'])
 @token_required
-def get_checkin_history(current_user):
+def get_checkin_history(current_user, account_type):
     """
     獲取打卡歷史記錄（支援進階篩選）
     GET /api/checkin/history
@@ -210,6 +255,7 @@ def get_checkin_history(current_user):
         - amulet_id: 護身符 ID (可選)
         - page: 頁碼 (預設: 1)
         - per_page: 每頁數量 (預設: 20, 最大: 100)
+        - cursor: 上一頁回傳的 next_cursor（可選，深層頁面不再 OFFSET 掃描）
     """
     try:
         # 獲取查詢參數
@@ -252,31 +298,30 @@ def get_checkin_history(current_user):
                 return error_response('護身符不存在或無權訪問', 404)
             query = query.filter_by(amulet_id=amulet_id)
 
-        # 分頁查詢
-        pagination = query.order_by(Checkin.timestamp.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # 分頁查詢（依時間與 id 的 keyset 游標）
+        result = paginate(query, Checkin.timestamp, Checkin.id, page, per_page)
 
         return success_response({
-            'checkins': [checkin.to_dict() for checkin in pagination.items],
+            'checkins': [checkin.to_dict() for checkin in result.items],
             'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
+                'page': result.page,
+                'per_page': result.per_page,
+                'total': result.total,
+                'pages': result.pages,
+                'has_next': result.has_next,
+                'has_prev': result.has_prev,
+                'next_cursor': result.next_cursor
             }
         }, '獲取成功', 200)
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         return error_response(f'獲取失敗: {str(e)}', 500)
 
 @bp.route('/stats', methods=['GET'])
 @token_required
-def get_checkin_stats(current_user):
+def get_checkin_stats(current_user, account_type):
     """
     獲取打卡統計總覽
     GET /api/checkin/stats
@@ -300,7 +345,7 @@ def get_checkin_stats(current_user):
         ).filter(Checkin.user_id == current_user.id).scalar() or 0
 
         # 4. 計算連續打卡天數
-        streak_data = _calculate_streak(current_user.id)
+        streak_data = get_streak(current_user.id)
 
         # 5. 最常去的前 5 座廟宇
         top_temples = db.session.query(
@@ -358,14 +403,14 @@ def get_checkin_stats(current_user):
 
 @bp.route('/streak', methods=['GET'])
 @token_required
-def get_checkin_streak(current_user):
+def get_checkin_streak(current_user, account_type):
     """
     獲取連續打卡天數
     GET /api/checkin/streak
     Header: Authorization: Bearer <token>
     """
     try:
-        streak_data = _calculate_streak(current_user.id)
+        streak_data = get_streak(current_user.id)
 
         # 獲取連續打卡的日期列表（最近 30 天）
         checkin_dates = db.session.query(
@@ -453,59 +498,9 @@ def get_monthly_stats(current_user):
     except Exception as e:
         return error_response(f'獲取失敗: {str(e)}', 500)
 
-def _calculate_streak(user_id):
-    """
-    計算連續打卡天數
-    """
-    # 獲取所有打卡記錄的日期（去重）
-    checkin_dates = db.session.query(
-        func.date(Checkin.timestamp).label('date')
-    ).filter(
-        Checkin.user_id == user_id
-    ).distinct().order_by(
-        func.date(Checkin.timestamp).desc()
-    ).all()
-
-    if not checkin_dates:
-        return {'current_streak': 0, 'longest_streak': 0}
-
-    # 轉換為日期列表
-    dates = [date[0] for date in checkin_dates]
-
-    # 計算當前連續天數
-    current_streak = 0
-    today = datetime.utcnow().date()
-    check_date = today
-
-    for date in dates:
-        if date == check_date or date == check_date - timedelta(days=1):
-            current_streak += 1
-            check_date = date - timedelta(days=1)
-        else:
-            break
-
-    # 計算最長連續天數
-    longest_streak = 0
-    temp_streak = 1
-
-    for i in range(len(dates) - 1):
-        diff = (dates[i] - dates[i + 1]).days
-        if diff == 1:
-            temp_streak += 1
-            longest_streak = max(longest_streak, temp_streak)
-        else:
-            temp_streak = 1
-
-    longest_streak = max(longest_streak, temp_streak)
-
-    return {
-        'current_streak': current_streak,
-        'longest_streak': longest_streak
-    }
-
 def _check_and_grant_rewards(user, checkin):
     """
-    檢查並自動發放符合條件的獎勵
+    檢查並自動發放符合條件的獎勵（規則與資格判斷見 services/reward_engine.py）
 
     Args:
         user: User 物件
@@ -517,68 +512,29 @@ def _check_and_grant_rewards(user, checkin):
     granted_rewards = []
 
     try:
-        # 獲取所有啟用且有效期內的獎勵規則
-        now = datetime.utcnow()
-        rewards = CheckinReward.query.filter_by(is_active=True).filter(
-            or_(
-                CheckinReward.start_date.is_(None),
-                CheckinReward.start_date <= now
+        rules = evaluate_rewards(user.id, checkin)
+
+        for rule in rules:
+            # 創建領取記錄
+            claim = RewardClaim(
+                user_id=user.id,
+                reward_id=rule.id,
+                points_received=rule.reward_points,
+                claim_type='auto',
+                related_checkin_id=checkin.id
             )
-        ).filter(
-            or_(
-                CheckinReward.end_date.is_(None),
-                CheckinReward.end_date >= now
-            )
-        ).filter(
-            or_(
-                CheckinReward.temple_id == checkin.temple_id,
-                CheckinReward.temple_id.is_(None)  # 全站通用獎勵
-            )
-        ).all()
-
-        for reward in rewards:
-            # 只自動發放特定類型的獎勵
-            auto_grant_types = ['first_time', 'daily_bonus', 'consecutive_days']
-
-            if reward.reward_type not in auto_grant_types:
-                continue
+            db.session.add(claim)
+            db.session.flush()
 
-            # 檢查是否符合條件
-            is_eligible = False
+            # 增加使用者福德點數（原子遞增並寫入帳本）
+            points_ledger.post(user, rule.reward_points, 'reward', claim.id, rule.name)
 
-            if reward.reward_type == 'first_time':
-                # 首次打卡檢查
-                is_eligible = _check_first_time_eligibility(user.id, reward, checkin)
-
-            elif reward.reward_type == 'daily_bonus':
-                # 每日打卡獎勵
-                is_eligible = _check_daily_bonus_eligibility(user.id, reward, checkin)
-
-            elif reward.reward_type == 'consecutive_days':
-                # 連續打卡檢查
-                is_eligible = _check_consecutive_eligibility(user.id, reward, checkin)
-
-            if is_eligible:
-                # 創建領取記錄
-                claim = RewardClaim(
-                    user_id=user.id,
-                    reward_id=reward.id,
-                    points_received=reward.reward_points,
-                    claim_type='auto',
-                    related_checkin_id=checkin.id
-                )
-
-                # 增加使用者福德點數
-                user.blessing_points += reward.reward_points
-
-                db.session.add(claim)
-
-                granted_rewards.append({
-                    'reward_id': reward.id,
-                    'reward_name': reward.name,
-                    'points_received': reward.reward_points,
-                    'reward_type': reward.reward_type
-                })
+            granted_rewards.append({
+                'reward_id': rule.id,
+                'reward_name': rule.name,
+                'points_received': rule.reward_points,
+                'reward_type': rule.reward_type
+            })
 
         return granted_rewards
 
@@ -586,78 +542,3 @@ def _check_and_grant_rewards(user, checkin):
         # 獎勵發放失敗不應影響打卡，記錄錯誤但繼續
         logger.error('獎勵發放錯誤: %s', e)
         return []
-
-def _check_first_time_eligibility(user_id, reward, current_checkin):
-    """檢查首次打卡獎勵資格"""
-    if not reward.temple_id:
-        return False
-
-    # 檢查是否為該廟宇的首次打卡（排除當前這次）
-    previous_checkins = Checkin.query.filter(
-        Checkin.user_id == user_id,
-        Checkin.temple_id == reward.temple_id,
-        Checkin.id != current_checkin.id
-    ).count()
-
-    if previous_checkins > 0:
-        return False
-
-    # 檢查是否已領取過
-    existing_claim = RewardClaim.query.filter_by(
-        user_id=user_id,
-        reward_id=reward.id
-    ).first()
-
-    return existing_claim is None
-
-def _check_daily_bonus_eligibility(user_id, reward, current_checkin):
-    """檢查每日打卡獎勵資格"""
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
-
-    # 檢查今天是否已領取過此獎勵
-    today_claim = RewardClaim.query.filter(
-        RewardClaim.user_id == user_id,
-        RewardClaim.reward_id == reward.id,
-        RewardClaim.claimed_at >= today_start,
-        RewardClaim.claimed_at < today_end
-    ).first()
-
-    return today_claim is None
-
-def _check_consecutive_eligibility(user_id, reward, current_checkin):
-    """檢查連續打卡獎勵資格"""
-    # 計算當前連續天數
-    streak_data = _calculate_streak(user_id)
-    current_streak = streak_data['current_streak']
-
-    # 檢查是否達到條件
-    if current_streak < reward.condition_value:
-        return False
-
-    # 如果不可重複領取，檢查是否已領取過
-    if not reward.is_repeatable:
-        existing_claim = RewardClaim.query.filter_by(
-            user_id=user_id,
-            reward_id=reward.id
-        ).first()
-
-        return existing_claim is None
-    else:
-        # 可重複領取，檢查是否在本輪連續打卡中已領取
-        # 找到最近一次領取記錄
-        last_claim = RewardClaim.query.filter_by(
-            user_id=user_id,
-            reward_id=reward.id
-        ).order_by(RewardClaim.claimed_at.desc()).first()
-
-        if not last_claim:
-            return True
-
-        # 計算距離上次領取的天數
-        days_since_last_claim = (datetime.utcnow() - last_claim.claimed_at).days
-
-        # 如果距離上次領取超過條件天數，可以再次領取
-        return days_since_last_claim >= reward.condition_value
-
-    return True
@@ -8,6 +8,7 @@ from app.models.checkin import Checkin
 from app.models.temple import Temple
 from app.utils.auth import token_required
 from app.utils.response import success_response, error_response
+from app.services.leaderboard import PERIODS, get_top, get_rank
 from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 from app.utils.logger import get_logger
@@ -16,6 +17,17 @@ logger = get_logger('routes.leaderboard')
 
 bp = Blueprint('leaderboard', __name__, url_prefix='/api/leaderboard')
 
+
+def _with_user_names(entries):
+    """把 [(user_id, score)] 補上用戶名稱，回傳 [(user_id, name, score)]"""
+    if not entries:
+        return []
+    names = dict(db.session.query(User.id, User.name).filter(
+        User.id.in_([user_id for user_id, _ in entries])
+    ).all())
+    return [(user_id, names[user_id], score) for user_id, score in entries if user_id in names]
+
+
 @bp.route('/blessing-points', methods=['GET'])
 def get_blessing_points_leaderboard():
     """
@@ -29,65 +41,11 @@ def get_blessing_points_leaderboard():
         limit = min(request.args.get('limit', default=10, type=int), 100)
         period = request.args.get('period', default='all')
 
-        # 構建查詢
-        query = User.query.filter(User.is_active == True)
+        if period not in PERIODS:
+            period = 'all'
 
-        # 根據時間範圍篩選（通過打卡記錄計算）
-        if period == 'week':
-            week_ago = datetime.utcnow() - timedelta(days=7)
-            # 查詢本週功德值總和
-            subquery = db.session.query(
-                Checkin.user_id,
-                func.sum(Checkin.blessing_points).label('period_points')
-            ).filter(
-                Checkin.timestamp >= week_ago
-            ).group_by(Checkin.user_id).subquery()
-
-            leaderboard = db.session.query(
-                User.id,
-                User.name,
-                subquery.c.period_points
-            ).join(
-                subquery, User.id == subquery.c.user_id
-            ).filter(
-                User.is_active == True
-            ).order_by(
-                desc(subquery.c.period_points)
-            ).limit(limit).all()
-
-        elif period == 'month':
-            month_ago = datetime.utcnow() - timedelta(days=30)
-            # 查詢本月功德值總和
-            subquery = db.session.query(
-                Checkin.user_id,
-                func.sum(Checkin.blessing_points).label('period_points')
-            ).filter(
-                Checkin.timestamp >= month_ago
-            ).group_by(Checkin.user_id).subquery()
-
-            leaderboard = db.session.query(
-                User.id,
-                User.name,
-                subquery.c.period_points
-            ).join(
-                subquery, User.id == subquery.c.user_id
-            ).filter(
-                User.is_active == True
-            ).order_by(
-                desc(subquery.c.period_points)
-            ).limit(limit).all()
-
-        else:  # all
-            # 使用 User 表的 blessing_points 欄位
-            leaderboard = db.session.query(
-                User.id,
-                User.name,
-                User.blessing_points
-            ).filter(
-                User.is_active == True
-            ).order_by(
-                desc(User.blessing_points)
-            ).limit(limit).all()
+        # 讀取預先計算的排行榜（sorted set），只查名次內用戶的名稱
+        leaderboard = _with_user_names(get_top('blessing_points', period, limit))
 
         # 格式化結果
         result = []
@@ -121,40 +79,20 @@ def get_checkins_leaderboard():
         limit = min(request.args.get('limit', default=10, type=int), 100)
         period = request.args.get('period', default='all')
 
-        # 根據時間範圍構建查詢
-        query = db.session.query(
-            User.id,
-            User.name,
-            func.count(Checkin.id).label('checkin_count')
-        ).join(
-            Checkin, User.id == Checkin.user_id
-        ).filter(
-            User.is_active == True
-        )
+        if period not in PERIODS:
+            period = 'all'
 
-        # 時間範圍篩選
-        if period == 'week':
-            week_ago = datetime.utcnow() - timedelta(days=7)
-            query = query.filter(Checkin.timestamp >= week_ago)
-        elif period == 'month':
-            month_ago = datetime.utcnow() - timedelta(days=30)
-            query = query.filter(Checkin.timestamp >= month_ago)
-
-        # 分組、排序、限制
-        leaderboard = query.group_by(
-            User.id, User.name
-        ).order_by(
-            desc(func.count(Checkin.id))
-        ).limit(limit).all()
+        # 讀取預先計算的排行榜（sorted set），只查名次內用戶的名稱
+        leaderboard = _with_user_names(get_top('checkins', period, limit))
 
         # 格式化結果
         result = []
         for rank, user_data in enumerate(leaderboard, start=1):
             result.append({
                 'rank': rank,
-                'user_id': user_data.id,
-                'user_name': user_data.name,
-                'checkin_count': user_data.checkin_count
+                'user_id': user_data[0],
+                'user_name': user_data[1],
+                'checkin_count': int(user_data[2])
             })
 
         return success_response({
@@ -230,7 +168,7 @@ def get_temples_leaderboard():
 
 @bp.route('/my-rank', methods=['GET'])
 @token_required
-def get_my_rank(current_user):
+def get_my_rank(current_user, account_type):
     """
     查詢當前使用者的排名
     GET /api/leaderboard/my-rank?type=blessing_points
@@ -242,29 +180,12 @@ def get_my_rank(current_user):
         rank_type = request.args.get('type', default='blessing_points')
 
         if rank_type == 'blessing_points':
-            # 計算功德值排名
-            higher_rank_count = User.query.filter(
-                User.blessing_points > current_user.blessing_points,
-                User.is_active == True
-            ).count()
-            my_rank = higher_rank_count + 1
+            # 以目前功德值在排行榜中二分查找排名
             my_value = current_user.blessing_points
+            my_rank, _ = get_rank('blessing_points', current_user.id, score=my_value)
 
         elif rank_type == 'checkins':
-            # 計算打卡次數
-            my_checkins = Checkin.query.filter_by(user_id=current_user.id).count()
-
-            # 計算排名
-            users_with_more_checkins = db.session.query(
-                func.count(func.distinct(Checkin.user_id))
-            ).group_by(
-                Checkin.user_id
-            ).having(
-                func.count(Checkin.id) > my_checkins
-            ).count()
-
-            my_rank = users_with_more_checkins + 1
-            my_value = my_checkins
+            my_rank, my_value = get_rank('checkins', current_user.id)
 
         else:
             return error_response('無效的排行榜類型', 400)
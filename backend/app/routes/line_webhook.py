@@ -1,13 +1,15 @@
 """
 LINE Webhook 處理
 接收 LINE 平台事件（訊息、加好友、postback 等）
+webhook 只驗證簽章並寫入收件匣，事件由 app.services.line_inbox 的背景 worker 呼叫 process_event 處理
 """
-from flask import Blueprint, request, abort
+from flask import Blueprint, request, abort, current_app
 from app.utils.logger import get_logger
 from app import db
 from app.models.line_user import LineUser
 from app.models.event_registration import EventRegistration
 from app.models.temple_event import TempleEvent
+from app.services import event_seats, line_inbox
 from app.services.line_service import (
     verify_signature, reply_message, get_profile, text_message
 )
@@ -18,7 +20,6 @@ from app.utils.line_flex import (
 from app.utils.response import success_response
 from datetime import datetime
 from urllib.parse import parse_qs
-from sqlalchemy import func
 
 logger = get_logger('routes.line_webhook')
 
@@ -48,23 +49,27 @@ def webhook():
     if not events:
         return success_response(None, 'OK')
 
-    for event in events:
-        event_type = event.get('type')
-        try:
-            if event_type == 'follow':
-                handle_follow(event)
-            elif event_type == 'unfollow':
-                handle_unfollow(event)
-            elif event_type == 'message':
-                handle_message(event)
-            elif event_type == 'postback':
-                handle_postback(event)
-        except Exception as e:
-            logger.error('Error handling %s: %s', event_type, e)
-
+    # 寫入收件匣後立即回應，避免處理時間過長導致 LINE 逾時重送
+    line_inbox.enqueue_events(current_app._get_current_object(), events)
     return success_response(None, 'OK')
 
 
+def process_event(event):
+    """處理單一事件（背景 worker 呼叫，例外由收件匣記錄為 failed）"""
+    event_type = event.get('type')
+    if event_type == 'follow':
+        handle_follow(event)
+    elif event_type == 'unfollow':
+        handle_unfollow(event)
+    elif event_type == 'message':
+        handle_message(event)
+    elif event_type == 'postback':
+        handle_postback(event)
+
+
+line_inbox.set_event_handler(process_event)
+
+
 # ===== 事件處理 =====
 
 def handle_follow(event):
@@ -165,11 +170,8 @@ def send_event_list(reply_token):
 
     event_dicts = []
     for e in events:
-        data = e.to_dict(include_registered_count=True)
-        total_people = db.session.query(
-            func.coalesce(func.sum(EventRegistration.people_count), 0)
-        ).filter_by(event_id=e.id, status='registered').scalar()
-        data['registeredCount'] = int(total_people)
+        data = e.to_dict()
+        data['registeredCount'] = e.reserved_seats or 0
         event_dicts.append(data)
 
     reply_message(reply_token, event_list_message(event_dicts))
@@ -207,8 +209,14 @@ def cancel_user_registration(reply_token, line_user_id, registration_id):
     event = TempleEvent.query.get(registration.event_id)
     event_title = event.title if event else '活動'
 
-    registration.status = 'canceled'
-    registration.canceled_at = datetime.utcnow()
+    # 釋出名額並依序遞補候補者
+    promoted = event_seats.cancel(registration, datetime.utcnow())
+    if promoted is None:
+        db.session.rollback()
+        reply_message(reply_token, text_message('此報名已取消。'))
+        return
     db.session.commit()
 
     reply_message(reply_token, registration_canceled_message(event_title))
+    if promoted and event:
+        event_seats.notify_status(promoted, event)
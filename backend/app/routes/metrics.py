@@ -0,0 +1,45 @@
+"""
+系統監控指標 API（系統管理員）
+"""
+from flask import Blueprint
+from app.utils.auth import super_admin_token_required
+from app.utils.response import success_response
+from app.utils.logger import get_logger
+
+logger = get_logger('routes.metrics')
+
+bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+
+
+@bp.route('', methods=['GET', 'OPTIONS'])
+@super_admin_token_required
+def get_metrics(current_super_admin):
+    """
+    取得本 worker 的執行指標
+    GET /api/metrics
+    Header: Authorization: Bearer <token> (需要系統管理員權限)
+    """
+    from app import db
+    from app.utils.db_metrics import get_stats as db_stats
+    from app.utils.principal_cache import get_stats as principal_cache_stats
+    from app.services.reward_engine import reward_rules
+    from app.services.audience import audience_counts
+    from app.services.scheduler import get_stats as scheduler_stats
+    from app.services.line_inbox import get_stats as line_webhook_stats
+    from app.services.redemption_writer import sold_out
+    from app.services.points_ledger import get_stats as points_ledger_stats
+    from app.utils.rate_limit import get_stats as rate_limit_stats
+    from app.utils.token_store import get_stats as token_store_stats
+
+    return success_response({
+        'database': db_stats(db.engine),
+        'principal_cache': principal_cache_stats(),
+        'reward_rules': reward_rules.get_stats(),
+        'audience_counts': audience_counts.get_stats(),
+        'scheduler': scheduler_stats(),
+        'line_webhook': line_webhook_stats(),
+        'redemption_sold_out': sold_out.get_stats(),
+        'points_ledger': points_ledger_stats(),
+        'rate_limit': rate_limit_stats(),
+        'refresh_tokens': token_store_stats()
+    })
@@ -1,5 +1,6 @@
 """
 通知 API 路由
+- 列表 / 未讀數合併個人通知與廣播通知（fan-out-on-read），廣播的 id 為負數
 """
 from flask import Blueprint, request
 from app import db
@@ -7,7 +8,9 @@ from app.models.notification import Notification
 from app.models.notification_settings import NotificationSettings
 from app.utils.response import success_response, error_response
 from app.utils.auth import token_required
-from sqlalchemy import func
+from app.utils.pagination import paginate
+from sqlalchemy import func, select
+from app.services import notification_fanout as fanout
 from app.utils.logger import get_logger
 
 logger = get_logger('routes.notification')
@@ -16,51 +19,50 @@ bp = Blueprint('notification', __name__, url_prefix='/api/notifications')
 
 @bp.route('', methods=['GET'])
 @token_required
-def get_notifications(current_user):
+def get_notifications(current_user, account_type):
     """
-    獲取通知列表
+    獲取通知列表（個人通知與廣播依時間合併）
     """
     # 分頁參數
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
 
     # 篩選參數
     is_read = request.args.get('is_read', type=str)  # 'true' or 'false'
     notification_type = request.args.get('type', '').strip()
 
-    # 構建查詢
-    query = Notification.query.filter_by(user_id=current_user.id)
+    inbox = fanout.inbox_select(
+        current_user,
+        is_read=(is_read == 'true') if is_read in ['true', 'false'] else None,
+        notification_type=notification_type or None,
+        include_broadcasts=fanout.broadcast_recipient(current_user)
+    )
 
-    # 已讀/未讀篩選
-    if is_read in ['true', 'false']:
-        query = query.filter_by(is_read=(is_read == 'true'))
-
-    # 類型篩選
-    if notification_type:
-        query = query.filter_by(type=notification_type)
-
-    # 按時間倒序排列
-    query = query.order_by(Notification.created_at.desc())
-
-    # 分頁
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    result = paginate(select(inbox), inbox.c.created_at, inbox.c.id, page, per_page)
 
     return success_response({
-        'notifications': [n.to_dict() for n in pagination.items],
-        'total': pagination.total,
-        'page': page,
-        'per_page': per_page,
-        'pages': pagination.pages,
-        'has_next': pagination.has_next,
-        'has_prev': pagination.has_prev
+        'notifications': [fanout.inbox_item(row) for row in result.items],
+        'total': result.total,
+        'page': result.page,
+        'per_page': result.per_page,
+        'pages': result.pages,
+        'has_next': result.has_next,
+        'has_prev': result.has_prev,
+        'next_cursor': result.next_cursor
     })
 
-@bp.route('/<int:notification_id>/read', methods=['PUT'])
+@bp.route('/<int(signed=True):notification_id>/read', methods=['PUT'])
 @token_required
-def mark_as_read(current_user, notification_id):
+def mark_as_read(current_user, account_type, notification_id):
     """
-    標記通知為已讀
+    標記通知為已讀（負數 id 為廣播通知）
     """
+    if notification_id < 0:
+        if not fanout.mark_broadcast_read(current_user, -notification_id):
+            return error_response('通知不存在', 404)
+        db.session.commit()
+        return success_response(fanout.get_broadcast_item(current_user, -notification_id), '標記為已讀成功')
+
     notification = Notification.query.filter_by(
         id=notification_id,
         user_id=current_user.id
@@ -79,9 +81,9 @@ def mark_as_read(current_user, notification_id):
 
 @bp.route('/read-all', methods=['PUT'])
 @token_required
-def mark_all_as_read(current_user):
+def mark_all_as_read(current_user, account_type):
     """
-    標記全部通知為已讀
+    標記全部通知為已讀（含廣播通知）
     """
     # 更新所有未讀通知
     updated_count = Notification.query.filter_by(
@@ -91,6 +93,7 @@ def mark_all_as_read(current_user):
         'is_read': True,
         'read_at': db.func.now()
     }, synchronize_session=False)
+    updated_count += fanout.mark_all_broadcasts_read(current_user)
 
     db.session.commit()
 
@@ -98,12 +101,18 @@ def mark_all_as_read(current_user):
         'updated_count': updated_count
     }, f'成功標記 {updated_count} 條通知為已讀')
 
-@bp.route('/<int:notification_id>', methods=['DELETE'])
+@bp.route('/<int(signed=True):notification_id>', methods=['DELETE'])
 @token_required
-def delete_notification(current_user, notification_id):
+def delete_notification(current_user, account_type, notification_id):
     """
-    刪除通知
+    刪除通知（廣播通知只對此用戶隱藏）
     """
+    if notification_id < 0:
+        if not fanout.delete_broadcasts(current_user, [-notification_id]):
+            return error_response('通知不存在', 404)
+        db.session.commit()
+        return success_response(None, '通知刪除成功')
+
     notification = Notification.query.filter_by(
         id=notification_id,
         user_id=current_user.id
@@ -119,25 +128,23 @@ def delete_notification(current_user, notification_id):
 
 @bp.route('/unread-count', methods=['GET'])
 @token_required
-def get_unread_count(current_user):
+def get_unread_count(current_user, account_type):
     """
-    獲取未讀通知數量
+    獲取未讀通知數量（含廣播通知）
     """
-    unread_count = Notification.query.filter_by(
-        user_id=current_user.id,
-        is_read=False
-    ).count()
+    unread = fanout.inbox_select(
+        current_user,
+        is_read=False,
+        include_broadcasts=fanout.broadcast_recipient(current_user)
+    )
 
     # 按類型統計未讀數量
-    type_counts = db.session.query(
-        Notification.type,
-        func.count(Notification.id).label('count')
-    ).filter(
-        Notification.user_id == current_user.id,
-        Notification.is_read == False
-    ).group_by(Notification.type).all()
+    type_counts = db.session.execute(
+        select(unread.c.type, func.count().label('count')).group_by(unread.c.type)
+    ).all()
 
     type_breakdown = {t.type: t.count for t in type_counts}
+    unread_count = sum(type_breakdown.values())
 
     return success_response({
         'unread_count': unread_count,
@@ -146,7 +153,7 @@ def get_unread_count(current_user):
 
 @bp.route('/settings', methods=['GET'])
 @token_required
-def get_notification_settings(current_user):
+def get_notification_settings(current_user, account_type):
     """
     獲取通知設定
     """
@@ -157,7 +164,7 @@ def get_notification_settings(current_user):
 
 @bp.route('/settings', methods=['PUT'])
 @token_required
-def update_notification_settings(current_user):
+def update_notification_settings(current_user, account_type):
     """
     更新通知設定
     """
@@ -195,9 +202,9 @@ def update_notification_settings(current_user):
 
 @bp.route('/batch-delete', methods=['POST'])
 @token_required
-def batch_delete_notifications(current_user):
+def batch_delete_notifications(current_user, account_type):
     """
-    批量刪除通知
+    批量刪除通知（負數 id 為廣播通知）
     """
     data = request.get_json()
     notification_ids = data.get('notification_ids', [])
@@ -210,6 +217,9 @@ def batch_delete_notifications(current_user):
         Notification.id.in_(notification_ids),
         Notification.user_id == current_user.id
     ).delete(synchronize_session=False)
+    broadcast_ids = [-i for i in notification_ids if isinstance(i, int) and i < 0]
+    if broadcast_ids:
+        deleted_count += fanout.delete_broadcasts(current_user, broadcast_ids)
 
     db.session.commit()
 
@@ -221,14 +231,15 @@ def batch_delete_notifications(current_user):
 
 @bp.route('/clear-read', methods=['DELETE'])
 @token_required
-def clear_read_notifications(current_user):
+def clear_read_notifications(current_user, account_type):
     """
-    清除所有已讀通知
+    清除所有已讀通知（含已讀的廣播通知）
     """
     deleted_count = Notification.query.filter_by(
         user_id=current_user.id,
         is_read=True
     ).delete(synchronize_session=False)
+    deleted_count += fanout.clear_read_broadcasts(current_user)
 
     db.session.commit()
 
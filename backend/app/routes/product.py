@@ -6,6 +6,7 @@ from app import db
 from app.models.product import Product
 from app.models.redemption import Redemption
 from app.models.temple import Temple
+from app.services import redemption_writer
 from app.utils.auth import token_required, admin_required
 from app.utils.response import success_response, error_response
 from sqlalchemy import func, or_
@@ -236,6 +237,9 @@ def update_product(current_user, product_id):
 
         db.session.commit()
 
+        # 補貨或重新上架後清除售完快取
+        redemption_writer.sold_out.discard(product.id)
+
         return success_response(product.to_dict(), '更新成功', 200)
 
     except Exception as e:
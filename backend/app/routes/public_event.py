@@ -9,10 +9,10 @@ from app.models.temple_event import TempleEvent
 from app.models.event_registration import EventRegistration
 from app.models.line_user import LineUser
 from app.utils.response import success_response, error_response
+from app.services import event_seats
 from app.services.line_service import push_message
-from app.utils.line_flex import registration_confirm_message
+from app.utils.line_flex import registration_confirm_message, status_changed_message
 from datetime import datetime
-from sqlalchemy import func
 
 logger = get_logger('routes.public_event')
 
@@ -38,13 +38,10 @@ def list_public_events(temple_id):
 
         events = []
         for event in query.all():
-            data = event.to_dict(include_registered_count=True)
-            # 計算報名總人數（含 people_count）
-            total_people = db.session.query(
-                func.coalesce(func.sum(EventRegistration.people_count), 0)
-            ).filter_by(event_id=event.id, status='registered').scalar()
-            data['totalPeople'] = int(total_people)
-            data['remainingCapacity'] = max(0, event.capacity - int(total_people)) if event.capacity > 0 else None
+            data = event.to_dict()
+            # 報名人數（含 people_count）由名額計數欄位取得，不逐一活動 COUNT 報名表
+            data['registeredCount'] = data['totalPeople'] = event.reserved_seats or 0
+            data['remainingCapacity'] = event_seats.remaining_seats(event)
             events.append(data)
 
         return success_response({'events': events})
@@ -68,21 +65,19 @@ def get_public_event(event_id):
         if event.status not in ['published', 'closed']:
             return error_response('此活動尚未公開', 404)
 
-        data = event.to_dict(include_registered_count=True)
+        data = event.to_dict()
 
-        total_people = db.session.query(
-            func.coalesce(func.sum(EventRegistration.people_count), 0)
-        ).filter_by(event_id=event.id, status='registered').scalar()
-        data['totalPeople'] = int(total_people)
-        data['remainingCapacity'] = max(0, event.capacity - int(total_people)) if event.capacity > 0 else None
+        remaining = event_seats.remaining_seats(event)
+        data['registeredCount'] = data['totalPeople'] = event.reserved_seats or 0
+        data['remainingCapacity'] = remaining
 
-        # 判斷是否可報名
+        # 判斷是否可報名（名額已滿時仍可報名候補）
         now = datetime.utcnow()
         data['canRegister'] = (
             event.status == 'published' and
-            event.signup_end_at > now and
-            (event.capacity == 0 or int(total_people) < event.capacity)
+            event.signup_end_at > now
         )
+        data['waitlistOnly'] = data['canRegister'] and remaining == 0
 
         return success_response(data)
 
@@ -129,27 +124,17 @@ def register_event(event_id):
 
         line_user_id = data.get('lineUserId', '').strip() or None
 
-        # 檢查容量
-        if event.capacity > 0:
-            total_people = db.session.query(
-                func.coalesce(func.sum(EventRegistration.people_count), 0)
-            ).filter_by(event_id=event.id, status='registered').scalar()
-
-            if int(total_people) + people_count > event.capacity:
-                remaining = event.capacity - int(total_people)
-                return error_response(f'名額不足，目前剩餘 {max(0, remaining)} 名', 400)
-
-        # 檢查同一 LINE 用戶是否已報名
+        # 檢查同一 LINE 用戶是否已報名（含候補）
         if line_user_id:
-            existing = EventRegistration.query.filter_by(
-                event_id=event_id,
-                line_user_id=line_user_id,
-                status='registered'
+            existing = EventRegistration.query.filter(
+                EventRegistration.event_id == event_id,
+                EventRegistration.line_user_id == line_user_id,
+                EventRegistration.status.in_(['registered', 'waitlist'])
             ).first()
             if existing:
                 return error_response('您已報名此活動', 400)
 
-        # 建立報名紀錄
+        # 建立報名紀錄：以條件式 UPDATE 佔用名額，名額不足時列入候補
         registration = EventRegistration(
             event_id=event_id,
             name=name,
@@ -158,9 +143,9 @@ def register_event(event_id):
             people_count=people_count,
             notes=data.get('notes', '').strip(),
             line_user_id=line_user_id,
-            status='registered',
         )
-        db.session.add(registration)
+        if not event_seats.register(event, registration):
+            return error_response(f'報名人數超過活動名額（{event.capacity} 名）', 400)
 
         # 更新 LINE 用戶的聯絡資訊
         if line_user_id:
@@ -174,16 +159,20 @@ def register_event(event_id):
         db.session.commit()
 
         reg_data = registration.to_dict()
+        waitlisted = registration.status == 'waitlist'
 
-        # 推播報名確認訊息
+        # 推播報名確認 / 候補訊息
         if line_user_id:
             try:
-                flex = registration_confirm_message(reg_data, event.to_dict())
+                if waitlisted:
+                    flex = status_changed_message(reg_data, event.to_dict(), 'waitlist')
+                else:
+                    flex = registration_confirm_message(reg_data, event.to_dict())
                 push_message(line_user_id, flex)
             except Exception as push_err:
                 logger.error('push confirm error: %s', push_err)
 
-        return success_response(reg_data, '報名成功', 201)
+        return success_response(reg_data, '名額已滿，已列入候補' if waitlisted else '報名成功', 201)
 
     except Exception as e:
         db.session.rollback()
@@ -247,10 +236,16 @@ def cancel_registration(registration_id):
         if registration.status == 'canceled':
             return error_response('此報名已取消', 400)
 
-        registration.status = 'canceled'
-        registration.canceled_at = datetime.utcnow()
+        # 釋出名額並依序遞補候補者
+        promoted = event_seats.cancel(registration, datetime.utcnow())
+        if promoted is None:
+            db.session.rollback()
+            return error_response('此報名已取消', 400)
         db.session.commit()
 
+        if promoted:
+            event_seats.notify_status(promoted, TempleEvent.query.get(registration.event_id))
+
         return success_response(registration.to_dict(), '已取消報名')
 
     except Exception as e:
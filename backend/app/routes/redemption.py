@@ -4,11 +4,13 @@
 from flask import Blueprint, request
 from app import db
 from app.models.user import User
-from app.models.product import Product
 from app.models.address import Address
 from app.models.redemption import Redemption
 from app.models.temple import Temple
+from app.routes.temple_admin_api import check_temple_access
+from app.services import redemption_writer
 from app.utils.auth import token_required, admin_required
+from app.utils.exceptions import AppError
 from app.utils.response import success_response, error_response
 from datetime import datetime
 from sqlalchemy import func
@@ -20,7 +22,7 @@ bp = Blueprint('redemption', __name__, url_prefix='/api/redemptions')
 
 @bp.route('/', methods=['POST'])
 @token_required
-def create_redemption(current_user):
+def create_redemption(current_user, account_type):
     """
     兌換商品
     POST /api/redemptions/
@@ -31,6 +33,7 @@ def create_redemption(current_user):
         "address_id": 1,
         "notes": "請小心包裝"
     }
+    庫存與功德值以條件式 UPDATE 原子扣減（見 app.services.redemption_writer）
     """
     try:
         data = request.get_json()
@@ -38,67 +41,26 @@ def create_redemption(current_user):
         if not data or 'product_id' not in data or 'address_id' not in data:
             return error_response('缺少必要欄位', 400)
 
-        product_id = data['product_id']
-        quantity = data.get('quantity', 1)
-        address_id = data['address_id']
-
-        # 驗證商品
-        product = Product.query.get(product_id)
-        if not product:
-            return error_response('商品不存在', 404)
-
-        if not product.is_active:
-            return error_response('商品已下架', 400)
-
-        # 驗證庫存
-        if product.stock_quantity < quantity:
-            return error_response('庫存不足', 400)
-
-        # 計算所需功德值
-        total_points = product.merit_points * quantity
-
-        # 驗證使用者功德值
-        if current_user.blessing_points < total_points:
-            return error_response(f'功德值不足，需要 {total_points} 點，目前有 {current_user.blessing_points} 點', 400)
-
         # 驗證地址
-        address = Address.query.get(address_id)
+        address = Address.query.get(data['address_id'])
         if not address:
             return error_response('地址不存在', 404)
 
-        if address.user_id != current_user.id:
-            return error_response('地址不屬於您', 403)
-
-        # 創建兌換記錄
-        redemption = Redemption(
-            user_id=current_user.id,
-            product_id=product_id,
-            quantity=quantity,
-            merit_points_used=total_points,
-            status='pending',
-            recipient_name=address.recipient_name,
-            phone=address.phone,
-            postal_code=address.postal_code,
-            city=address.city,
-            district=address.district,
-            address=address.address,
+        redemption, remaining_points = redemption_writer.create_redemption(
+            current_user,
+            data['product_id'],
+            data.get('quantity', 1),
+            address,
             notes=data.get('notes')
         )
 
-        # 扣除功德值
-        current_user.blessing_points -= total_points
-
-        # 減少庫存
-        product.stock_quantity -= quantity
-
-        db.session.add(redemption)
-        db.session.commit()
-
         return success_response({
             'redemption': redemption.to_dict(),
-            'remaining_points': current_user.blessing_points
+            'remaining_points': remaining_points
         }, '兌換成功', 201)
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         db.session.rollback()
         return error_response(f'兌換失敗: {str(e)}', 500)
@@ -171,7 +133,7 @@ def get_redemption(current_user, redemption_id):
 
 @bp.route('/<int:redemption_id>/cancel', methods=['POST'])
 @token_required
-def cancel_redemption(current_user, redemption_id):
+def cancel_redemption(current_user, account_type, redemption_id):
     """
     取消兌換
     POST /api/redemptions/<redemption_id>/cancel
@@ -190,25 +152,16 @@ def cancel_redemption(current_user, redemption_id):
         if redemption.status != 'pending':
             return error_response('此兌換無法取消', 400)
 
-        # 退還功德值
-        current_user.blessing_points += redemption.merit_points_used
-
-        # 恢復商品庫存
-        product = Product.query.get(redemption.product_id)
-        if product:
-            product.stock_quantity += redemption.quantity
-
-        # 更新兌換狀態
-        redemption.status = 'cancelled'
-        redemption.cancelled_at = datetime.utcnow()
-
-        db.session.commit()
+        refunded_points = redemption.merit_points_used
+        current_points = redemption_writer.cancel_redemption(current_user, redemption)
 
         return success_response({
-            'refunded_points': redemption.merit_points_used,
-            'current_points': current_user.blessing_points
+            'refunded_points': refunded_points,
+            'current_points': current_points
         }, '兌換已取消，功德值已退還', 200)
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         db.session.rollback()
         return error_response(f'取消失敗: {str(e)}', 500)
@@ -328,7 +281,8 @@ def admin_update_redemption_status(current_user, redemption_id):
         data = request.get_json()
 
         if 'status' in data:
-            redemption.status = data['status']
+            # 進入 / 離開 cancelled 時同步調整統計彙總
+            redemption_writer.change_status(redemption, data['status'])
 
             # 根據狀態更新時間戳
             if data['status'] == 'processing' and not redemption.processed_at:
@@ -351,6 +305,9 @@ def admin_update_redemption_status(current_user, redemption_id):
 
         return success_response(redemption.to_dict(), '更新成功', 200)
 
+    except AppError as e:
+        db.session.rollback()
+        return error_response(e.message, e.status_code)
     except Exception as e:
         db.session.rollback()
         return error_response(f'更新失敗: {str(e)}', 500)
@@ -423,7 +380,7 @@ def get_temple_redemptions(current_user, temple_id):
 
 @bp.route('/temple/<int:temple_id>/<int:redemption_id>/status', methods=['PUT'])
 @token_required
-def update_temple_redemption_status(current_user, temple_id, redemption_id):
+def update_temple_redemption_status(current_user, account_type, temple_id, redemption_id):
     """
     廟方管理員：更新訂單狀態
     PUT /api/redemptions/temple/<temple_id>/<redemption_id>/status
@@ -442,16 +399,9 @@ def update_temple_redemption_status(current_user, temple_id, redemption_id):
             return error_response('廟宇不存在或已停用', 404)
 
         # 檢查權限
-        # DEPRECATED: Permission check removed - use auth context
-        # temple_admin = TempleAdmin.query.filter_by( # Use temple_id from auth context
-        # temple_id=temple_id,
-        # user_id=current_user.id,
-        # is_active=True
-        # ).first()
-
-
-        # DEPRECATED: if not temple_admin or not temple_admin.has_permission('view_stats'):
-            return error_response('您沒有權限管理此廟宇的訂單', 403)
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
 
         redemption = Redemption.query.get(redemption_id)
 
@@ -469,7 +419,8 @@ def update_temple_redemption_status(current_user, temple_id, redemption_id):
             if data['status'] not in ['pending', 'processing', 'shipped', 'completed', 'cancelled']:
                 return error_response('無效的訂單狀態', 400)
 
-            redemption.status = data['status']
+            # 進入 / 離開 cancelled 時同步調整統計彙總
+            redemption_writer.change_status(redemption, data['status'])
 
             # 更新時間戳
             if data['status'] == 'processing':
@@ -495,6 +446,9 @@ def update_temple_redemption_status(current_user, temple_id, redemption_id):
 
         return success_response(redemption.to_dict(), '更新成功', 200)
 
+    except AppError as e:
+        db.session.rollback()
+        return error_response(e.message, e.status_code)
     except Exception as e:
         db.session.rollback()
         return error_response(f'更新失敗: {str(e)}', 500)
@@ -9,7 +9,11 @@ from app.models.temple import Temple
 from app.models.temple_admin_user import TempleAdminUser
 from app.models.user import User
 from app.models.checkin import Checkin
+from app.services import points_ledger
+from app.services.reward_engine import reward_rules
 from app.utils.auth import token_required
+from app.utils.exceptions import AppError
+from app.utils.pagination import paginate
 from app.utils.response import success_response, error_response
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
@@ -107,6 +111,7 @@ def create_reward(current_user, account_type):
 
         db.session.add(reward)
         db.session.commit()
+        reward_rules.invalidate(reward.temple_id)
 
         return success_response(
             reward.to_dict(),
@@ -208,7 +213,7 @@ def get_reward_detail(current_user, reward_id):
 
 @bp.route('/<int:reward_id>', methods=['PUT'])
 @token_required
-def update_reward(current_user, reward_id):
+def update_reward(current_user, account_type, reward_id):
     """
     更新獎勵規則（需廟方管理員權限）
     PUT /api/rewards/<reward_id>
@@ -282,6 +287,7 @@ def update_reward(current_user, reward_id):
 
         reward.updated_at = datetime.utcnow()
         db.session.commit()
+        reward_rules.invalidate(reward.temple_id)
 
         return success_response(
             reward.to_dict(),
@@ -295,7 +301,7 @@ def update_reward(current_user, reward_id):
 
 @bp.route('/<int:reward_id>', methods=['DELETE'])
 @token_required
-def delete_reward(current_user, reward_id):
+def delete_reward(current_user, account_type, reward_id):
     """
     刪除獎勵規則（需廟方管理員權限，軟刪除）
     DELETE /api/rewards/<reward_id>
@@ -320,6 +326,7 @@ def delete_reward(current_user, reward_id):
         reward.is_active = False
         reward.updated_at = datetime.utcnow()
         db.session.commit()
+        reward_rules.invalidate(reward.temple_id)
 
         return success_response(None, '獎勵規則已停用', 200)
 
@@ -550,7 +557,7 @@ def get_available_rewards(current_user):
 
 @bp.route('/<int:reward_id>/claim', methods=['POST'])
 @token_required
-def claim_reward(current_user, reward_id):
+def claim_reward(current_user, account_type, reward_id):
     """
     領取獎勵
     POST /api/rewards/<reward_id>/claim
@@ -591,16 +598,16 @@ def claim_reward(current_user, reward_id):
             points_received=reward.reward_points,
             claim_type='manual'
         )
-
-        # 增加使用者福德點數
-        current_user.blessing_points += reward.reward_points
-
         db.session.add(claim)
+        db.session.flush()
+
+        # 增加使用者福德點數（原子遞增並寫入帳本）
+        new_points = points_ledger.post(current_user, reward.reward_points, 'reward', claim.id, reward.name)
         db.session.commit()
 
         return success_response({
             'claim': claim.to_dict(),
-            'new_blessing_points': current_user.blessing_points,
+            'new_blessing_points': new_points,
             'points_received': reward.reward_points
         }, '獎勵領取成功', 201)
 
@@ -610,7 +617,7 @@ def claim_reward(current_user, reward_id):
 
 @bp.route('/my-claims', methods=['GET'])
 @token_required
-def get_my_claims(current_user):
+def get_my_claims(current_user, account_type):
     """
     獲取我的獎勵領取歷史
     GET /api/rewards/my-claims
@@ -619,6 +626,7 @@ def get_my_claims(current_user):
         - page: 頁碼 (default: 1)
         - per_page: 每頁數量 (default: 20, max: 100)
         - reward_type: 獎勵類型篩選 (可選)
+        - cursor: 上一頁回傳的 next_cursor (可選)
     """
     try:
         page = request.args.get('page', default=1, type=int)
@@ -634,14 +642,8 @@ def get_my_claims(current_user):
                 CheckinReward.reward_type == reward_type
             )
 
-        # 分頁
-        pagination = query.order_by(
-            RewardClaim.claimed_at.desc()
-        ).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # 分頁（依領取時間與 id 的 keyset 游標）
+        result = paginate(query, RewardClaim.claimed_at, RewardClaim.id, page, per_page)
 
         # 統計資料
         total_claims = RewardClaim.query.filter_by(user_id=current_user.id).count()
@@ -650,14 +652,15 @@ def get_my_claims(current_user):
         ).filter(RewardClaim.user_id == current_user.id).scalar() or 0
 
         return success_response({
-            'claims': [claim.to_dict() for claim in pagination.items],
+            'claims': [claim.to_dict() for claim in result.items],
             'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
+                'page': result.page,
+                'per_page': result.per_page,
+                'total': result.total,
+                'pages': result.pages,
+                'has_next': result.has_next,
+                'has_prev': result.has_prev,
+                'next_cursor': result.next_cursor
             },
             'summary': {
                 'total_claims': total_claims,
@@ -665,6 +668,8 @@ def get_my_claims(current_user):
             }
         }, '獲取成功', 200)
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         return error_response(f'獲取失敗: {str(e)}', 500)
 
@@ -707,10 +712,10 @@ def _check_reward_eligibility(user_id, reward):
 
 def _check_consecutive_days(user_id, reward):
     """檢查連續打卡天數"""
-    from app.routes.checkin import _calculate_streak
+    from app.services.streak import get_streak
 
     # 計算當前連續天數
-    current_streak_data = _calculate_streak(user_id)
+    current_streak_data = get_streak(user_id)
     current_streak = current_streak_data['current_streak']
 
     # 如果有指定廟宇，需檢查該廟宇的連續打卡
@@ -6,6 +6,7 @@ from app import db
 from app.models.temple import Temple
 from app.utils.auth import token_required, admin_required
 from app.utils.response import success_response, error_response
+from app.services.geo_index import temple_geo_index, find_nearby_temples
 from sqlalchemy import func, or_
 import math
 from app.utils.logger import get_logger
@@ -125,27 +126,12 @@ def get_nearby_temples():
         if latitude is None or longitude is None:
             return error_response('缺少經緯度參數', 400)
 
-        # 獲取所有有地理位置的廟宇
-        temples = Temple.query.filter(
-            Temple.latitude.isnot(None),
-            Temple.longitude.isnot(None),
-            Temple.is_active == True
-        ).all()
-
-        # 計算距離並篩選
+        # 由空間索引取得最近的廟宇（已依距離排序並限制數量）
         nearby_temples = []
-        for temple in temples:
-            distance = calculate_distance(latitude, longitude, temple.latitude, temple.longitude)
-            if distance <= radius:
-                temple_dict = temple.to_dict()
-                temple_dict['distance'] = round(distance, 2)  # 距離（公里）
-                nearby_temples.append(temple_dict)
-
-        # 按距離排序
-        nearby_temples.sort(key=lambda x: x['distance'])
-
-        # 限制返回數量
-        nearby_temples = nearby_temples[:limit]
+        for temple, distance in find_nearby_temples(latitude, longitude, radius, limit):
+            temple_dict = temple.to_dict()
+            temple_dict['distance'] = distance  # 距離（公里）
+            nearby_temples.append(temple_dict)
 
         return success_response({
             'temples': nearby_temples,
@@ -205,6 +191,7 @@ def create_temple(current_user):
 
         db.session.add(temple)
         db.session.commit()
+        temple_geo_index.invalidate()
 
         return success_response(temple.to_dict(), '廟宇創建成功', 201)
 
@@ -270,6 +257,7 @@ def update_temple(current_user, temple_id):
             temple.is_active = data['is_active']
 
         db.session.commit()
+        temple_geo_index.invalidate()
 
         return success_response(temple.to_dict(), '更新成功', 200)
 
@@ -293,6 +281,7 @@ def delete_temple(current_user, temple_id):
 
         db.session.delete(temple)
         db.session.commit()
+        temple_geo_index.invalidate()
 
         return success_response(None, '刪除成功', 200)
 
@@ -309,6 +298,7 @@ def temple_checkin(current_user, account_type, temple_id):
     在廟宇簽到
     POST /api/temples/<temple_id>/checkin
     Header: Authorization: Bearer <token>
+            Idempotency-Key: <客戶端產生的唯一值>  // 可選，重送時回傳原本結果
     Body: {
         "amulet_id": 1,
         "checkin_method": "nfc",  // nfc, qr_code, manual
@@ -318,10 +308,13 @@ def temple_checkin(current_user, account_type, temple_id):
     }
     """
     try:
-        from app.models.amulet import Amulet
         from app.models.checkin import Checkin
         from app.models.energy import Energy
-        from datetime import datetime, timedelta
+        from app.services.checkin_writer import (
+            IdempotencyKeyError, get_idempotency_key, daily_key, find_by_idempotency_key,
+            lock_amulet, insert_checkin, is_replay
+        )
+        from app.services import points_ledger
 
         data = request.get_json()
 
@@ -335,6 +328,16 @@ def temple_checkin(current_user, account_type, temple_id):
         longitude = data.get('longitude')
         notes = data.get('notes', '')
 
+        try:
+            idempotency_key = get_idempotency_key()
+        except IdempotencyKeyError as e:
+            return error_response(str(e), 400)
+
+        # 重送的請求直接回傳原本結果
+        replayed = find_by_idempotency_key(current_user.id, idempotency_key)
+        if replayed:
+            return _replay_temple_checkin(replayed, current_user, temple_id, amulet_id)
+
         # 驗證廟宇是否存在且啟用
         temple = Temple.query.get(temple_id)
         if not temple:
@@ -343,32 +346,6 @@ def temple_checkin(current_user, account_type, temple_id):
         if not temple.is_active:
             return error_response('此廟宇暫不開放簽到', 400)
 
-        # 驗證護身符是否存在且屬於當前用戶
-        amulet = Amulet.query.get(amulet_id)
-        if not amulet:
-            return error_response('護身符不存在', 404)
-
-        if amulet.user_id != current_user.id:
-            return error_response('這不是您的護身符', 403)
-
-        if amulet.status != 'active':
-            return error_response('護身符狀態異常，無法簽到', 400)
-
-        # 檢查今日是否已在此廟宇簽到
-        today = datetime.utcnow().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
-
-        existing_checkin = Checkin.query.filter(
-            Checkin.user_id == current_user.id,
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= today_start,
-            Checkin.timestamp <= today_end
-        ).first()
-
-        if existing_checkin:
-            return error_response('今日已在此廟宇簽到', 400)
-
         # 位置驗證（如果提供了經緯度且廟宇有座標）
         if latitude and longitude and temple.latitude and temple.longitude:
             distance = calculate_distance(
@@ -379,10 +356,24 @@ def temple_checkin(current_user, account_type, temple_id):
             if distance > 1.0:
                 return error_response(f'您距離廟宇太遠（{distance:.2f}公里），無法簽到', 400)
 
+        # 鎖定護身符並驗證（同一護身符的簽到依序處理）
+        amulet = lock_amulet(amulet_id)
+        if not amulet:
+            db.session.rollback()
+            return error_response('護身符不存在', 404)
+
+        if amulet.user_id != current_user.id:
+            db.session.rollback()
+            return error_response('這不是您的護身符', 403)
+
+        if amulet.status != 'active':
+            db.session.rollback()
+            return error_response('護身符狀態異常，無法簽到', 400)
+
         # 計算獲得的功德值（在廟宇簽到獲得更多）
         blessing_points = 20  # 廟宇簽到獲得 20 點（比一般簽到的 10 點多）
 
-        # 創建簽到記錄
+        # 創建簽到記錄（每人每座廟宇每天一次，由唯一鍵保證）
         checkin = Checkin(
             user_id=current_user.id,
             amulet_id=amulet_id,
@@ -390,15 +381,21 @@ def temple_checkin(current_user, account_type, temple_id):
             latitude=latitude,
             longitude=longitude,
             notes=notes,
-            blessing_points=blessing_points
+            blessing_points=blessing_points,
+            dedup_key=daily_key('temple', current_user.id, temple_id),
+            idempotency_key=idempotency_key
         )
-        db.session.add(checkin)
+        existing = insert_checkin(checkin)
+        if existing is not None:
+            if is_replay(existing, idempotency_key, temple_id=temple_id):
+                return _replay_temple_checkin(existing, current_user, temple_id, amulet_id)
+            return error_response('今日已在此廟宇簽到', 400)
 
         # 增加護身符能量
         amulet.energy += blessing_points
 
-        # 增加用戶功德值
-        current_user.blessing_points += blessing_points
+        # 增加用戶功德值（原子遞增並寫入帳本）
+        points_ledger.post(current_user, blessing_points, 'checkin', checkin.id, temple.name)
 
         # 創建能量記錄
         energy_log = Energy(
@@ -412,23 +409,46 @@ def temple_checkin(current_user, account_type, temple_id):
         if hasattr(temple, 'checkin_count'):
             temple.checkin_count = (temple.checkin_count or 0) + 1
 
+        # 更新連續打卡狀態與廟宇每日統計彙總
+        from app.services.streak import record_checkin_day
+        from app.services.temple_rollup import record_checkin
+        record_checkin_day(current_user.id, checkin.timestamp)
+        record_checkin(temple_id, current_user.id)
+
         db.session.commit()
 
-        return success_response({
-            'checkin': checkin.to_dict(),
-            'amulet': {
-                'id': amulet.id,
-                'energy': amulet.energy
-            },
-            'blessing_points_gained': blessing_points,
-            'current_blessing_points': current_user.blessing_points,
-            'temple': temple.to_dict()
-        }, f'在 {temple.name} 簽到成功！獲得 {blessing_points} 點功德值', 201)
+        # 增量更新排行榜
+        from app.services import leaderboard
+        leaderboard.record_checkin(current_user.id, blessing_points, current_user.blessing_points)
+
+        return _temple_checkin_response(checkin, amulet, current_user, temple)
 
     except Exception as e:
         db.session.rollback()
         return error_response(f'簽到失敗: {str(e)}', 500)
 
+def _temple_checkin_response(checkin, amulet, user, temple):
+    """廟宇簽到成功的回應（首次寫入與冪等重送共用）"""
+    return success_response({
+        'checkin': checkin.to_dict(),
+        'amulet': {
+            'id': amulet.id,
+            'energy': amulet.energy
+        },
+        'blessing_points_gained': checkin.blessing_points,
+        'current_blessing_points': user.blessing_points,
+        'temple': temple.to_dict()
+    }, f'在 {temple.name} 簽到成功！獲得 {checkin.blessing_points} 點功德值', 201)
+
+def _replay_temple_checkin(checkin, user, temple_id, amulet_id):
+    """相同 Idempotency-Key 重送：回傳原本的結果"""
+    if checkin.temple_id != temple_id or checkin.amulet_id != amulet_id:
+        return error_response('Idempotency-Key 已用於其他簽到請求', 422)
+
+    response = _temple_checkin_response(checkin, checkin.amulet, user, checkin.temple)
+    response[0].headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @bp.route('/<int:temple_id>/my-checkins', methods=['GET'])
 @token_required
 def get_my_temple_checkins(current_user, account_type, temple_id):
@@ -516,33 +536,14 @@ def get_nearby_available_temples(current_user, account_type):
         ).distinct().all()
         checked_in_temple_ids = [t[0] for t in checked_in_temple_ids]
 
-        # 獲取所有啟用的廟宇（有座標的）
-        temples = Temple.query.filter(
-            Temple.is_active == True,
-            Temple.latitude.isnot(None),
-            Temple.longitude.isnot(None)
-        ).all()
-
-        # 計算距離並篩選
+        # 由空間索引取得最近的廟宇（已依距離排序並限制數量）
         nearby_temples = []
-        for temple in temples:
-            distance = calculate_distance(
-                latitude, longitude,
-                temple.latitude, temple.longitude
-            )
-
-            if distance <= radius:
-                temple_dict = temple.to_dict()
-                temple_dict['distance'] = round(distance, 2)
-                temple_dict['checked_in_today'] = temple.id in checked_in_temple_ids
-                temple_dict['available'] = temple.id not in checked_in_temple_ids
-                nearby_temples.append(temple_dict)
-
-        # 按距離排序
-        nearby_temples.sort(key=lambda x: x['distance'])
-
-        # 限制返回數量
-        nearby_temples = nearby_temples[:limit]
+        for temple, distance in find_nearby_temples(latitude, longitude, radius, limit):
+            temple_dict = temple.to_dict()
+            temple_dict['distance'] = distance
+            temple_dict['checked_in_today'] = temple.id in checked_in_temple_ids
+            temple_dict['available'] = temple.id not in checked_in_temple_ids
+            nearby_temples.append(temple_dict)
 
         # 統計
         available_count = len([t for t in nearby_temples if t['available']])
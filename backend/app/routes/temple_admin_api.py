@@ -10,8 +10,10 @@ from app.utils.logger import get_logger
 from app import db
 from app.models.temple import Temple
 from app.utils.auth import token_required
+from app.utils.exceptions import AppError
+from app.utils.pagination import paginate
 from app.utils.response import success_response, error_response
-from sqlalchemy import func
+from sqlalchemy import func, case, distinct
 from datetime import datetime, timedelta
 
 logger = get_logger('routes.temple_admin_api')
@@ -190,65 +192,26 @@ def get_temple_stats(current_user, account_type, temple_id):
         if not temple:
             return error_response('廟宇不存在', 404)
 
-        # 計算統計資料（加入異常處理）
+        # 計算統計資料（讀取每日彙總，加入異常處理）
         try:
-            from app.models.checkin import Checkin
-            from app.models.redemption import Redemption
-
-            today = datetime.now().date()
-            today_start = datetime.combine(today, datetime.min.time())
-            today_end = datetime.combine(today, datetime.max.time())
-            month_start = datetime(today.year, today.month, 1)
-
-            # 今日統計
-            today_checkins = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.checkin_time >= today_start,
-                Checkin.checkin_time <= today_end
-            ).count()
-
-            today_orders = Redemption.query.filter(
-                Redemption.temple_id == temple_id,
-                Redemption.created_at >= today_start,
-                Redemption.created_at <= today_end
-            ).count()
-
-            today_revenue_result = db.session.query(func.sum(Redemption.total_points)).filter(
-                Redemption.temple_id == temple_id,
-                Redemption.created_at >= today_start,
-                Redemption.created_at <= today_end,
-                Redemption.status.in_(['completed', 'shipped'])
-            ).scalar()
-            today_revenue = int(today_revenue_result) if today_revenue_result else 0
-
-            # 本月統計
-            month_checkins = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.checkin_time >= month_start
-            ).count()
+            from app.services.temple_rollup import sum_rollups
 
-            month_orders = Redemption.query.filter(
-                Redemption.temple_id == temple_id,
-                Redemption.created_at >= month_start
-            ).count()
+            today = datetime.utcnow().date()
+            month_start = today.replace(day=1)
 
-            month_revenue_result = db.session.query(func.sum(Redemption.total_points)).filter(
-                Redemption.temple_id == temple_id,
-                Redemption.created_at >= month_start,
-                Redemption.status.in_(['completed', 'shipped'])
-            ).scalar()
-            month_revenue = int(month_revenue_result) if month_revenue_result else 0
+            today_stats = sum_rollups(temple_id, today, today)
+            month_stats = sum_rollups(temple_id, month_start)
 
             stats = {
                 'today': {
-                    'checkins': today_checkins,
-                    'orders': today_orders,
-                    'revenue': today_revenue
+                    'checkins': today_stats['checkin_count'],
+                    'orders': today_stats['order_count'],
+                    'revenue': today_stats['points_spent']
                 },
                 'month': {
-                    'checkins': month_checkins,
-                    'orders': month_orders,
-                    'revenue': month_revenue
+                    'checkins': month_stats['checkin_count'],
+                    'orders': month_stats['order_count'],
+                    'revenue': month_stats['points_spent']
                 }
             }
 
@@ -311,13 +274,13 @@ def get_temple_checkins(current_user, account_type, temple_id):
             from app.models.checkin import Checkin
             query = Checkin.query.filter(
                 Checkin.temple_id == temple_id,
-                Checkin.checkin_time >= start_time
-            ).order_by(Checkin.checkin_time.desc())
+                Checkin.timestamp >= start_time
+            )
 
-            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            result = paginate(query, Checkin.timestamp, Checkin.id, page, per_page)
 
             checkins = []
-            for c in pagination.items:
+            for c in result.items:
                 try:
                     checkins.append(c.to_dict())
                 except Exception:
@@ -326,17 +289,20 @@ def get_temple_checkins(current_user, account_type, temple_id):
                         'id': c.id,
                         'user_id': c.user_id,
                         'temple_id': c.temple_id,
-                        'checkin_time': c.checkin_time.isoformat() if c.checkin_time else None,
+                        'checkin_time': c.timestamp.isoformat() if c.timestamp else None,
                     })
 
             return success_response({
                 'checkins': checkins,
-                'total': pagination.total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pagination.pages
+                'total': result.total,
+                'page': result.page,
+                'per_page': result.per_page,
+                'pages': result.pages,
+                'next_cursor': result.next_cursor
             })
 
+        except AppError as e:
+            return error_response(e.message, e.status_code)
         except Exception as e:
             # 如果查詢失敗，返回空陣列
             return success_response({
@@ -472,17 +438,16 @@ def get_temple_orders(current_user, account_type, temple_id):
 
             if start_date:
                 from datetime import datetime
-                query = query.filter(Redemption.created_at >= datetime.fromisoformat(start_date))
+                query = query.filter(Redemption.redeemed_at >= datetime.fromisoformat(start_date))
 
             if end_date:
                 from datetime import datetime
-                query = query.filter(Redemption.created_at <= datetime.fromisoformat(end_date))
+                query = query.filter(Redemption.redeemed_at <= datetime.fromisoformat(end_date))
 
-            query = query.order_by(Redemption.created_at.desc())
-            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            result = paginate(query, Redemption.redeemed_at, Redemption.id, page, per_page)
 
             orders = []
-            for order in pagination.items:
+            for order in result.items:
                 try:
                     orders.append(order.to_dict())
                 except Exception:
@@ -500,18 +465,21 @@ def get_temple_orders(current_user, account_type, temple_id):
                         'recipient_name': getattr(order, 'recipient_name', None),
                         'recipient_phone': getattr(order, 'recipient_phone', None),
                         'recipient_address': getattr(order, 'recipient_address', None),
-                        'redeemed_at': order.created_at.isoformat() if order.created_at else None,
-                        'created_at': order.created_at.isoformat() if order.created_at else None,
+                        'redeemed_at': order.redeemed_at.isoformat() if order.redeemed_at else None,
+                        'created_at': order.redeemed_at.isoformat() if order.redeemed_at else None,
                     })
 
             return success_response({
                 'orders': orders,
-                'total': pagination.total,
-                'page': page,
-                'per_page': per_page,
-                'pages': pagination.pages
+                'total': result.total,
+                'page': result.page,
+                'per_page': result.per_page,
+                'pages': result.pages,
+                'next_cursor': result.next_cursor
             })
 
+        except AppError as e:
+            return error_response(e.message, e.status_code)
         except Exception as e:
             # 如果查詢失敗，返回空陣列
             logger.error('Orders query error: %s', e)
@@ -604,9 +572,10 @@ def update_temple_order_status(current_user, account_type, temple_id, order_id):
         if not data:
             return error_response('缺少更新資料', 400)
 
-        # 更新狀態
+        # 更新狀態（進入 / 離開 cancelled 時同步調整統計彙總）
         if 'status' in data:
-            order.status = data['status']
+            from app.services.redemption_writer import change_status
+            change_status(order, data['status'])
 
         if 'note' in data:
             order.temple_note = data['note']
@@ -626,6 +595,9 @@ def update_temple_order_status(current_user, account_type, temple_id, order_id):
 
         return success_response(order_data, '訂單狀態已更新')
 
+    except AppError as e:
+        db.session.rollback()
+        return error_response(e.message, e.status_code)
     except Exception as e:
         db.session.rollback()
         return error_response(f'更新訂單狀態失敗: {str(e)}', 500)
@@ -684,104 +656,28 @@ def get_temple_revenue(current_user, account_type, temple_id):
         from app.models.redemption import Redemption
         from app.models.product import Product
 
-        base_query = Redemption.query.filter(
-            Redemption.temple_id == temple_id,
-            Redemption.redeemed_at >= start_date,
-            Redemption.redeemed_at <= end_date,
-            Redemption.status.in_(['processing', 'shipped', 'completed'])
-        )
+        # 總收入 / 訂單數 / 趨勢：讀取每日彙總（有效訂單，不含已取消）
+        from app.services.temple_rollup import get_daily_rows
 
-        # 總收入統計（功德值）
-        total_revenue = db.session.query(
-            func.sum(Redemption.merit_points_used)
-        ).filter(
-            Redemption.temple_id == temple_id,
-            Redemption.redeemed_at >= start_date,
-            Redemption.redeemed_at <= end_date,
-            Redemption.status.in_(['processing', 'shipped', 'completed'])
-        ).scalar() or 0
-
-        # 訂單總數
-        total_orders = base_query.count()
+        daily_rows = get_daily_rows(temple_id, start_date.date(), end_date.date())
+        total_revenue = sum(r.points_spent for r in daily_rows)
+        total_orders = sum(r.order_count for r in daily_rows)
 
         # 按時間分組統計收入趨勢
-        if group_by == 'day':
-            # 按日統計
-            trend_data = db.session.query(
-                func.date(Redemption.redeemed_at).label('period'),
-                func.sum(Redemption.merit_points_used).label('revenue'),
-                func.count(Redemption.id).label('order_count')
-            ).filter(
-                Redemption.temple_id == temple_id,
-                Redemption.redeemed_at >= start_date,
-                Redemption.redeemed_at <= end_date,
-                Redemption.status.in_(['processing', 'shipped', 'completed'])
-            ).group_by(
-                func.date(Redemption.redeemed_at)
-            ).order_by(
-                func.date(Redemption.redeemed_at)
-            ).all()
-
-            trend = [
-                {
-                    'period': item.period.isoformat() if item.period else '',
-                    'revenue': item.revenue or 0,
-                    'order_count': item.order_count
-                }
-                for item in trend_data
-            ]
-
-        elif group_by == 'week':
-            # 按週統計
-            trend_data = db.session.query(
-                func.yearweek(Redemption.redeemed_at).label('period'),
-                func.sum(Redemption.merit_points_used).label('revenue'),
-                func.count(Redemption.id).label('order_count')
-            ).filter(
-                Redemption.temple_id == temple_id,
-                Redemption.redeemed_at >= start_date,
-                Redemption.redeemed_at <= end_date,
-                Redemption.status.in_(['processing', 'shipped', 'completed'])
-            ).group_by(
-                func.yearweek(Redemption.redeemed_at)
-            ).order_by(
-                func.yearweek(Redemption.redeemed_at)
-            ).all()
-
-            trend = [
-                {
-                    'period': f'Week {item.period}',
-                    'revenue': item.revenue or 0,
-                    'order_count': item.order_count
-                }
-                for item in trend_data
-            ]
-
-        else:  # month
-            # 按月統計
-            trend_data = db.session.query(
-                func.date_format(Redemption.redeemed_at, '%Y-%m').label('period'),
-                func.sum(Redemption.merit_points_used).label('revenue'),
-                func.count(Redemption.id).label('order_count')
-            ).filter(
-                Redemption.temple_id == temple_id,
-                Redemption.redeemed_at >= start_date,
-                Redemption.redeemed_at <= end_date,
-                Redemption.status.in_(['processing', 'shipped', 'completed'])
-            ).group_by(
-                func.date_format(Redemption.redeemed_at, '%Y-%m')
-            ).order_by(
-                func.date_format(Redemption.redeemed_at, '%Y-%m')
-            ).all()
-
-            trend = [
-                {
-                    'period': item.period,
-                    'revenue': item.revenue or 0,
-                    'order_count': item.order_count
-                }
-                for item in trend_data
-            ]
+        trend_buckets = {}
+        for r in daily_rows:
+            if group_by == 'day':
+                period_key = r.stat_date.isoformat()
+            elif group_by == 'week':
+                iso_year, iso_week, _ = r.stat_date.isocalendar()
+                period_key = f'Week {iso_year}{iso_week:02d}'
+            else:  # month
+                period_key = r.stat_date.strftime('%Y-%m')
+            bucket = trend_buckets.setdefault(period_key, {'period': period_key, 'revenue': 0, 'order_count': 0})
+            bucket['revenue'] += r.points_spent
+            bucket['order_count'] += r.order_count
+
+        trend = [b for b in trend_buckets.values() if b['order_count']]
 
         # 商品銷售排行（收入貢獻）
         product_sales = db.session.query(
@@ -797,7 +693,7 @@ def get_temple_revenue(current_user, account_type, temple_id):
             Product.temple_id == temple_id,
             Redemption.redeemed_at >= start_date,
             Redemption.redeemed_at <= end_date,
-            Redemption.status.in_(['processing', 'shipped', 'completed'])
+            Redemption.status != 'cancelled'
         ).group_by(
             Product.id, Product.name, Product.image_url, Product.merit_points
         ).order_by(
@@ -1254,27 +1150,28 @@ def get_pilgrimage_visits(current_user, account_type, temple_id):
         if status:
             query = query.filter_by(status=status)
 
-        # 排序
+        # 排序 + 分頁（依排序欄位與 id 的 keyset 游標）
         if sort_by == 'created_at':
-            query = query.order_by(PilgrimageVisit.created_at.desc())
+            sort_column = PilgrimageVisit.created_at
         else:  # visit_time (default)
-            query = query.order_by(PilgrimageVisit.visit_start_at.desc())
+            sort_column = PilgrimageVisit.visit_start_at
+        result = paginate(query, sort_column, PilgrimageVisit.id, page, per_page)
 
-        # 分頁
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-
-        items = [visit.to_dict() for visit in pagination.items]
+        items = [visit.to_dict() for visit in result.items]
 
         return success_response({
             'items': items,
             'pagination': {
-                'total': pagination.total,
-                'page': pagination.page,
-                'per_page': pagination.per_page,
-                'pages': pagination.pages
+                'total': result.total,
+                'page': result.page,
+                'per_page': result.per_page,
+                'pages': result.pages,
+                'next_cursor': result.next_cursor
             }
         })
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except ValueError:
         return error_response('無效的分頁參數', 400)
     except Exception as e:
@@ -1532,326 +1429,8 @@ def get_member_analytics(current_user, account_type, temple_id):
             '365d': 365
         }.get(period, 30)
 
-        now = datetime.utcnow()
-        period_start = now - timedelta(days=period_days)
-        active_threshold = now - timedelta(days=30)
-        dormant_threshold = now - timedelta(days=90)
-
-        # 取得模型
-        from app.models.checkin import Checkin
-        from app.models.public_user import PublicUser
-        from app.models.redemption import Redemption
-
-        # ===== Overview 會員總覽 =====
-        # 總會員：曾與本廟互動的不重複用戶
-        all_user_ids = db.session.query(Checkin.user_id).filter(
-            Checkin.temple_id == temple_id
-        ).distinct().all()
-        all_user_ids = [uid[0] for uid in all_user_ids]
-        total_members = len(all_user_ids)
-
-        # 活躍會員：30天內有互動
-        active_user_ids = db.session.query(Checkin.user_id).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.checkin_time >= active_threshold
-        ).distinct().all()
-        active_user_ids = [uid[0] for uid in active_user_ids]
-        active_members = len(active_user_ids)
-        active_rate = round((active_members / total_members * 100), 1) if total_members > 0 else 0
-
-        # 新會員：30天內首次互動
-        new_members_count = 0
-        for user_id in all_user_ids:
-            first_checkin = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id
-            ).order_by(Checkin.checkin_time.asc()).first()
-            if first_checkin and first_checkin.checkin_time >= active_threshold:
-                new_members_count += 1
-
-        # 休眠會員：90天以上無互動
-        dormant_count = 0
-        for user_id in all_user_ids:
-            last_checkin = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id
-            ).order_by(Checkin.checkin_time.desc()).first()
-            if last_checkin and last_checkin.checkin_time < dormant_threshold:
-                dormant_count += 1
-        dormant_rate = round((dormant_count / total_members * 100), 1) if total_members > 0 else 0
-
-        overview = {
-            'total_members': total_members,
-            'active_members': active_members,
-            'active_rate': active_rate,
-            'new_members': new_members_count,
-            'dormant_members': dormant_count,
-            'dormant_rate': dormant_rate
-        }
-
-        # ===== Activity Trend 活動趨勢 =====
-        activity_trend = []
-        for i in range(period_days):
-            day = now - timedelta(days=period_days - 1 - i)
-            day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = day.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-            checkins_count = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.checkin_time >= day_start,
-                Checkin.checkin_time <= day_end
-            ).count()
-
-            orders_count = Redemption.query.filter(
-                Redemption.temple_id == temple_id,
-                Redemption.created_at >= day_start,
-                Redemption.created_at <= day_end
-            ).count()
-
-            activity_trend.append({
-                'date': day_start.strftime('%Y-%m-%d'),
-                'checkins': checkins_count,
-                'orders': orders_count,
-                'events': 0  # TODO: 活動報名數
-            })
-
-        # ===== Interaction Types 互動類型分布 =====
-        checkin_only = 0
-        order_only = 0
-        multi_interaction = 0
-
-        for user_id in all_user_ids:
-            has_checkin = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id
-            ).first() is not None
-
-            has_order = Redemption.query.filter(
-                Redemption.temple_id == temple_id,
-                Redemption.user_id == user_id
-            ).first() is not None
-
-            if has_checkin and has_order:
-                multi_interaction += 1
-            elif has_checkin:
-                checkin_only += 1
-            elif has_order:
-                order_only += 1
-
-        interaction_types = [
-            {'type': '僅打卡', 'count': checkin_only},
-            {'type': '僅下單', 'count': order_only},
-            {'type': '多元互動', 'count': multi_interaction}
-        ]
-
-        # ===== Checkin Frequency 打卡頻率分布 =====
-        frequency_ranges = [
-            ('1次', 1, 1),
-            ('2-5次', 2, 5),
-            ('6-10次', 6, 10),
-            ('11-20次', 11, 20),
-            ('20+次', 21, 9999)
-        ]
-        checkin_frequency = []
-        for label, min_count, max_count in frequency_ranges:
-            count = 0
-            for user_id in all_user_ids:
-                user_checkins = Checkin.query.filter(
-                    Checkin.temple_id == temple_id,
-                    Checkin.user_id == user_id
-                ).count()
-                if min_count <= user_checkins <= max_count:
-                    count += 1
-            percentage = round((count / total_members * 100), 1) if total_members > 0 else 0
-            checkin_frequency.append({
-                'range': label,
-                'count': count,
-                'percentage': percentage
-            })
-
-        # ===== Spend Distribution 消費金額分布 =====
-        spend_ranges = [
-            ('未消費', 0, 0),
-            ('1-100', 1, 100),
-            ('101-500', 101, 500),
-            ('501-1000', 501, 1000),
-            ('1000+', 1001, 999999999)
-        ]
-        spend_distribution = []
-        for label, min_spend, max_spend in spend_ranges:
-            count = 0
-            for user_id in all_user_ids:
-                user_spend = db.session.query(func.sum(Redemption.total_points)).filter(
-                    Redemption.temple_id == temple_id,
-                    Redemption.user_id == user_id,
-                    Redemption.status.in_(['completed', 'shipped', 'processing'])
-                ).scalar() or 0
-                if min_spend <= user_spend <= max_spend:
-                    count += 1
-            percentage = round((count / total_members * 100), 1) if total_members > 0 else 0
-            spend_distribution.append({
-                'range': label,
-                'count': count,
-                'percentage': percentage
-            })
-
-        # ===== Top Devotees Top 10 信眾 =====
-        top_devotees = []
-        devotee_stats = []
-        for user_id in all_user_ids:
-            user = PublicUser.query.get(user_id)
-            if not user:
-                continue
-
-            checkins_count = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id
-            ).count()
-
-            spend_total = db.session.query(func.sum(Redemption.total_points)).filter(
-                Redemption.temple_id == temple_id,
-                Redemption.user_id == user_id,
-                Redemption.status.in_(['completed', 'shipped', 'processing'])
-            ).scalar() or 0
-
-            # 姓名遮罩處理
-            name = user.name or ''
-            if len(name) >= 2:
-                name_masked = name[0] + '*' * (len(name) - 1)
-            else:
-                name_masked = '***'
-
-            devotee_stats.append({
-                'public_user_id': user_id,
-                'name_masked': name_masked,
-                'checkins_count': checkins_count,
-                'spend_total': int(spend_total)
-            })
-
-        # 按打卡數排序取前10
-        devotee_stats.sort(key=lambda x: x['checkins_count'], reverse=True)
-        top_devotees = devotee_stats[:10]
-
-        # ===== Funnel 轉換漏斗 =====
-        made_order_count = 0
-        repeat_order_count = 0
-        for user_id in active_user_ids:
-            orders = Redemption.query.filter(
-                Redemption.temple_id == temple_id,
-                Redemption.user_id == user_id,
-                Redemption.status.in_(['completed', 'shipped', 'processing'])
-            ).count()
-            if orders > 0:
-                made_order_count += 1
-            if orders > 1:
-                repeat_order_count += 1
-
-        funnel = {
-            'all_members': total_members,
-            'active_30d': active_members,
-            'made_order': made_order_count,
-            'repeat_order': repeat_order_count
-        }
-
-        # ===== Retention 留存指標 =====
-        # 月留存率：上月活躍用戶本月回訪比例
-        last_month_start = now - timedelta(days=60)
-        last_month_end = now - timedelta(days=30)
-        last_month_active = db.session.query(Checkin.user_id).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.checkin_time >= last_month_start,
-            Checkin.checkin_time < last_month_end
-        ).distinct().all()
-        last_month_active_ids = [uid[0] for uid in last_month_active]
-
-        retained_count = 0
-        for user_id in last_month_active_ids:
-            has_this_month = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id,
-                Checkin.checkin_time >= active_threshold
-            ).first()
-            if has_this_month:
-                retained_count += 1
-
-        mom_retention_rate = round((retained_count / len(last_month_active_ids) * 100), 1) if last_month_active_ids else 0
-
-        # 週回訪率：一個月內 2+ 週有互動的比例
-        weeks_with_activity = {}
-        for user_id in active_user_ids:
-            week_set = set()
-            checkins = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id,
-                Checkin.checkin_time >= active_threshold
-            ).all()
-            for c in checkins:
-                week_num = c.checkin_time.isocalendar()[1]
-                week_set.add(week_num)
-            weeks_with_activity[user_id] = len(week_set)
-
-        multi_week_users = sum(1 for w in weeks_with_activity.values() if w >= 2)
-        weekly_return_rate = round((multi_week_users / active_members * 100), 1) if active_members > 0 else 0
-
-        # 本月流失數
-        churned_this_month = len(last_month_active_ids) - retained_count
-
-        # 平均回訪間隔（簡化計算）
-        avg_return_days = 12  # 預設值，完整實現需更複雜計算
-
-        retention = {
-            'mom_retention_rate': mom_retention_rate,
-            'weekly_return_rate': weekly_return_rate,
-            'churned_this_month': churned_this_month,
-            'avg_return_days': avg_return_days
-        }
-
-        # ===== Member Tenure 會員資歷 =====
-        tenure_counts = {
-            'newcomer': 0,     # <30天
-            'establishing': 0,  # 1-6個月
-            'loyal': 0,         # 6-12個月
-            'veteran': 0        # >1年
-        }
-
-        for user_id in all_user_ids:
-            first_checkin = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == user_id
-            ).order_by(Checkin.checkin_time.asc()).first()
-
-            if first_checkin:
-                days_since = (now - first_checkin.checkin_time).days
-                if days_since < 30:
-                    tenure_counts['newcomer'] += 1
-                elif days_since < 180:
-                    tenure_counts['establishing'] += 1
-                elif days_since < 365:
-                    tenure_counts['loyal'] += 1
-                else:
-                    tenure_counts['veteran'] += 1
-
-        member_tenure = []
-        for tenure, count in tenure_counts.items():
-            percentage = round((count / total_members * 100), 1) if total_members > 0 else 0
-            member_tenure.append({
-                'tenure': tenure,
-                'count': count,
-                'percentage': percentage
-            })
-
-        # 構建回應
-        return success_response({
-            'overview': overview,
-            'activity_trend': activity_trend,
-            'interaction_types': interaction_types,
-            'checkin_frequency': checkin_frequency,
-            'spend_distribution': spend_distribution,
-            'top_devotees': top_devotees,
-            'funnel': funnel,
-            'retention': retention,
-            'member_tenure': member_tenure
-        })
+        from app.services.member_analytics import build_member_analytics
+        return success_response(build_member_analytics(temple_id, period_days))
 
     except Exception as e:
         import traceback
@@ -1919,60 +1498,43 @@ def get_business_dashboard(current_user, account_type, temple_id):
         month_end = (report_date.replace(day=28) + timedelta(days=4)).replace(day=1)
         prev_month_start = (month_start - timedelta(days=1)).replace(day=1)
 
-        # ===== 計算各項指標 =====
+        from app.models.temple_daily_stats import TempleVisitor
+        from app.services.temple_rollup import sum_rollups, count_visitors, count_new_visitors
+
+        # ===== 計算各項指標（會員數讀取訪客表，營收讀取每日彙總）=====
 
         # 總會員數
-        all_user_ids = db.session.query(Checkin.user_id).filter(
-            Checkin.temple_id == temple_id
-        ).distinct().all()
-        total_members = len(all_user_ids)
+        total_members = count_visitors(temple_id)
 
         # 本月新會員
-        new_members_count = 0
-        for uid in all_user_ids:
-            first = Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == uid[0]
-            ).order_by(Checkin.checkin_time.asc()).first()
-            if first and month_start <= first.checkin_time < month_end:
-                new_members_count += 1
+        new_members_count = count_new_visitors(temple_id, month_start, month_end)
 
         # 活躍會員 (30天內)
         active_threshold = now - timedelta(days=30)
-        active_user_ids = db.session.query(Checkin.user_id).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.checkin_time >= active_threshold
-        ).distinct().all()
-        active_members = len(active_user_ids)
+        active_members = count_visitors(temple_id, active_threshold)
         active_rate = round((active_members / total_members * 100), 1) if total_members > 0 else 0
 
-        # 留存率計算
-        prev_active = db.session.query(Checkin.user_id).filter(
+        # 留存率計算：上月有打卡者中，本月也有打卡的比例（只掃描這兩個月的打卡）
+        two_month_checkins = db.session.query(
+            Checkin.user_id.label('user_id'),
+            func.min(Checkin.timestamp).label('first_at'),
+            func.max(Checkin.timestamp).label('last_at')
+        ).filter(
             Checkin.temple_id == temple_id,
-            Checkin.checkin_time >= prev_month_start,
-            Checkin.checkin_time < month_start
-        ).distinct().all()
-        prev_active_ids = set(uid[0] for uid in prev_active)
-
-        retained = 0
-        for uid in prev_active_ids:
-            if Checkin.query.filter(
-                Checkin.temple_id == temple_id,
-                Checkin.user_id == uid,
-                Checkin.checkin_time >= month_start,
-                Checkin.checkin_time < month_end
-            ).first():
-                retained += 1
+            Checkin.timestamp >= prev_month_start,
+            Checkin.timestamp < month_end
+        ).group_by(Checkin.user_id).subquery()
+        prev_active_count, retained = db.session.query(
+            func.count(),
+            func.coalesce(func.sum(case((two_month_checkins.c.last_at >= month_start, 1), else_=0)), 0)
+        ).filter(
+            two_month_checkins.c.first_at < month_start
+        ).one()
 
-        retention_rate = round((retained / len(prev_active_ids) * 100), 1) if prev_active_ids else 0
+        retention_rate = round((retained / prev_active_count * 100), 1) if prev_active_count else 0
 
         # 營收
-        revenue = db.session.query(func.sum(Redemption.total_points)).filter(
-            Redemption.temple_id == temple_id,
-            Redemption.created_at >= month_start,
-            Redemption.created_at < month_end,
-            Redemption.status.in_(['completed', 'shipped', 'processing'])
-        ).scalar() or 0
+        revenue = sum_rollups(temple_id, month_start.date(), (month_end - timedelta(days=1)).date())['points_spent']
 
         # 計算健康度分數
         acquisition_score = min(100, int(new_members_count / 100 * 100))
@@ -2016,18 +1578,18 @@ def get_business_dashboard(current_user, account_type, temple_id):
             })
 
         # ===== 轉換漏斗 =====
-        visitors_count = Checkin.query.filter(
-            Checkin.temple_id == temple_id
-        ).with_entities(Checkin.user_id).distinct().count()
+        visitors_count = total_members
 
-        made_order = 0
-        for uid in [u[0] for u in active_user_ids]:
-            if Redemption.query.filter(
-                Redemption.temple_id == temple_id,
-                Redemption.user_id == uid,
-                Redemption.status.in_(['completed', 'shipped', 'processing'])
-            ).first():
-                made_order += 1
+        made_order = db.session.query(func.count(distinct(Redemption.user_id))).join(
+            TempleVisitor, db.and_(
+                TempleVisitor.temple_id == Redemption.temple_id,
+                TempleVisitor.user_id == Redemption.user_id
+            )
+        ).filter(
+            Redemption.temple_id == temple_id,
+            Redemption.status.in_(['completed', 'shipped', 'processing']),
+            TempleVisitor.last_visit_at >= active_threshold
+        ).scalar() or 0
 
         funnel = {
             'visitors': {'count': visitors_count, 'rate': None},
@@ -7,7 +7,10 @@ from app import db
 from app.models.temple_event import TempleEvent
 from app.models.event_registration import EventRegistration
 from app.models.temple_admin import TempleAdmin
+from app.services import event_seats
 from app.utils.auth import token_required
+from app.utils.exceptions import AppError
+from app.utils.pagination import paginate
 from app.utils.response import success_response, error_response
 from datetime import datetime
 from sqlalchemy import or_
@@ -29,7 +32,7 @@ def check_temple_permission(current_user, temple_id):
 
 @bp.route('/', methods=['GET'])
 @token_required
-def list_events(current_user):
+def list_events(current_user, account_type):
     """
     獲取活動列表（限自己廟宇）
     GET /api/temple-admin/events/?status=all&q=&page=1&pageSize=20
@@ -68,23 +71,23 @@ def list_events(current_user):
                 )
             )
 
-        # 排序：最新的在前
-        query = query.order_by(TempleEvent.created_at.desc())
-
-        # 分頁
-        pagination = query.paginate(page=page, per_page=page_size, error_out=False)
+        # 排序：最新的在前（依建立時間與 id 的 keyset 游標分頁）
+        result = paginate(query, TempleEvent.created_at, TempleEvent.id, page, page_size)
 
         # 轉換為字典，包含報名人數
-        events = [event.to_dict(include_registered_count=True) for event in pagination.items]
+        events = [event.to_dict(include_registered_count=True) for event in result.items]
 
         return success_response({
             'events': events,
-            'total': pagination.total,
-            'page': page,
-            'pageSize': page_size,
-            'totalPages': pagination.pages
+            'total': result.total,
+            'page': result.page,
+            'pageSize': result.per_page,
+            'totalPages': result.pages,
+            'nextCursor': result.next_cursor
         })
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         logger.error('list_events error: %s', e)
         return error_response('載入活動列表失敗', 500)
@@ -199,7 +202,7 @@ def create_event(current_user):
 
 @bp.route('/<int:event_id>/', methods=['PUT'])
 @token_required
-def update_event(current_user, event_id):
+def update_event(current_user, account_type, event_id):
     """
     更新活動（不允許直接改 status）
     PUT /api/temple-admin/events/<id>/
@@ -238,10 +241,12 @@ def update_event(current_user, event_id):
         if event.signup_end_at > event.start_at:
             return error_response('報名截止時間不可晚於活動開始時間', 400)
 
+        capacity_raised = False
         if 'capacity' in data:
             capacity = int(data['capacity'])
             if capacity < 1:
                 return error_response('名額必須至少為 1', 400)
+            capacity_raised = capacity > event.capacity
             event.capacity = capacity
 
         if 'fee' in data:
@@ -254,7 +259,14 @@ def update_event(current_user, event_id):
             event.cover_image_url = data['coverImageUrl']
 
         event.updated_at = datetime.utcnow()
+        db.session.flush()
+
+        # 名額增加時依序遞補候補者
+        promoted = event_seats.promote_waitlist(event.id) if capacity_raised else []
         db.session.commit()
+        if promoted:
+            db.session.refresh(event)
+            event_seats.notify_status(promoted, event)
 
         return success_response(event.to_dict(), '活動更新成功')
 
@@ -362,7 +374,7 @@ def cancel_event(current_user, event_id):
 
 @bp.route('/<int:event_id>/registrations/', methods=['GET'])
 @token_required
-def list_registrations(current_user, event_id):
+def list_registrations(current_user, account_type, event_id):
     """
     獲取活動報名名單
     GET /api/temple-admin/events/<id>/registrations/?status=all&q=&page=1&pageSize=20
@@ -399,22 +411,22 @@ def list_registrations(current_user, event_id):
                 )
             )
 
-        # 排序：最新報名在前
-        query = query.order_by(EventRegistration.registered_at.desc())
-
-        # 分頁
-        pagination = query.paginate(page=page, per_page=page_size, error_out=False)
+        # 排序：最新報名在前（依報名時間與 id 的 keyset 游標分頁）
+        result = paginate(query, EventRegistration.registered_at, EventRegistration.id, page, page_size)
 
-        registrations = [reg.to_dict() for reg in pagination.items]
+        registrations = [reg.to_dict() for reg in result.items]
 
         return success_response({
             'registrations': registrations,
-            'total': pagination.total,
-            'page': page,
-            'pageSize': page_size,
-            'totalPages': pagination.pages
+            'total': result.total,
+            'page': result.page,
+            'pageSize': result.per_page,
+            'totalPages': result.pages,
+            'nextCursor': result.next_cursor
         })
 
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         logger.error('list_registrations error: %s', e)
         return error_response('載入報名名單失敗', 500)
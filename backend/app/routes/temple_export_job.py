@@ -0,0 +1,190 @@
+"""
+廟方背景匯出 API（三表帳號系統）
+路徑格式：/api/temple-admin/temples/:templeId/exports
+大型報表改為建立匯出工作，背景產生檔案後再下載（支援 HTTP Range 續傳）
+"""
+import os
+from datetime import datetime, timedelta
+from flask import Blueprint, request, send_file, current_app
+from app.models.temple import Temple
+from app.models.export_job import ExportJob
+from app.routes.temple_admin_api import check_temple_access
+from app.services.export_jobs import (
+    EXPORT_TYPES, FILE_FORMATS, create_export_job, download_name
+)
+from app.utils.auth import token_required
+from app.utils.response import success_response, error_response
+from app.utils.logger import get_logger
+
+logger = get_logger('routes.temple_export_job')
+
+bp = Blueprint('temple_export_job', __name__, url_prefix='/api/temple-admin/temples')
+
+
+@bp.route('/<int:temple_id>/exports', methods=['POST', 'OPTIONS'])
+@token_required
+def create_export(current_user, account_type, temple_id):
+    """
+    建立背景匯出工作
+    POST /api/temple-admin/temples/:templeId/exports
+    Body: {
+        "type": "checkins" | "orders" | "revenue",
+        "format": "csv" | "xlsx" (default: csv，gzip 壓縮),
+        "start_date": "YYYY-MM-DD" (optional),
+        "end_date": "YYYY-MM-DD" (optional),
+        "status": 訂單狀態 (僅 orders, optional)
+    }
+    回傳 202 與工作資訊，之後以 GET .../exports/:jobId 查詢進度
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
+
+        temple = Temple.query.filter_by(id=temple_id).first()
+        if not temple:
+            return error_response('廟宇不存在', 404)
+
+        data = request.get_json(silent=True) or {}
+        export_type = data.get('type')
+        file_format = data.get('format', 'csv')
+
+        if export_type not in EXPORT_TYPES:
+            return error_response(f'匯出類型必須為: {", ".join(EXPORT_TYPES)}', 400)
+        if file_format not in FILE_FORMATS:
+            return error_response(f'檔案格式必須為: {", ".join(FILE_FORMATS)}', 400)
+
+        params = {}
+        for key in EXPORT_TYPES[export_type][2]:
+            if data.get(key):
+                params[key] = data[key]
+        try:
+            for key in ('start_date', 'end_date'):
+                if key in params:
+                    datetime.strptime(params[key], '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return error_response('日期格式錯誤，請使用 YYYY-MM-DD', 400)
+
+        # 收入報表預設最近30天（與同步匯出相同）
+        if export_type == 'revenue':
+            end_date = params.setdefault('end_date', datetime.utcnow().strftime('%Y-%m-%d'))
+            params.setdefault(
+                'start_date',
+                (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=30)).strftime('%Y-%m-%d')
+            )
+
+        job = create_export_job(
+            current_app._get_current_object(),
+            temple_id, export_type, file_format, params,
+            requested_by=current_user.id,
+            account_type=account_type
+        )
+        return success_response(job.to_dict(), '匯出工作已建立', 202)
+
+    except Exception as e:
+        logger.exception('建立匯出工作失敗')
+        return error_response(f'建立匯出工作失敗: {str(e)}', 500)
+
+
+@bp.route('/<int:temple_id>/exports', methods=['GET', 'OPTIONS'])
+@token_required
+def list_exports(current_user, account_type, temple_id):
+    """
+    近期匯出工作列表
+    GET /api/temple-admin/temples/:templeId/exports
+    Query Parameters:
+        - limit: 返回數量 (default: 20, max: 100)
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
+
+        limit = min(request.args.get('limit', default=20, type=int), 100)
+        jobs = ExportJob.query.filter_by(temple_id=temple_id).order_by(
+            ExportJob.created_at.desc(), ExportJob.id.desc()
+        ).limit(limit).all()
+
+        return success_response({
+            'jobs': [job.to_dict() for job in jobs],
+            'count': len(jobs)
+        })
+
+    except Exception as e:
+        logger.exception('獲取匯出工作列表失敗')
+        return error_response(f'獲取匯出工作列表失敗: {str(e)}', 500)
+
+
+@bp.route('/<int:temple_id>/exports/<int:job_id>', methods=['GET', 'OPTIONS'])
+@token_required
+def get_export(current_user, account_type, temple_id, job_id):
+    """
+    查詢匯出工作狀態與進度
+    GET /api/temple-admin/temples/:templeId/exports/:jobId
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
+
+        job = ExportJob.query.filter_by(id=job_id, temple_id=temple_id).first()
+        if not job:
+            return error_response('匯出工作不存在', 404)
+
+        return success_response(job.to_dict())
+
+    except Exception as e:
+        logger.exception('獲取匯出工作失敗')
+        return error_response(f'獲取匯出工作失敗: {str(e)}', 500)
+
+
+@bp.route('/<int:temple_id>/exports/<int:job_id>/download', methods=['GET', 'OPTIONS'])
+@token_required
+def download_export(current_user, account_type, temple_id, job_id):
+    """
+    下載匯出檔案
+    GET /api/temple-admin/temples/:templeId/exports/:jobId/download
+    支援 Range / If-Range / ETag，可續傳大型檔案
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
+
+        job = ExportJob.query.filter_by(id=job_id, temple_id=temple_id).first()
+        if not job:
+            return error_response('匯出工作不存在', 404)
+        if job.status == 'expired':
+            return error_response('匯出檔案已過期，請重新匯出', 410)
+        if job.status != 'completed':
+            return error_response('匯出尚未完成', 409)
+
+        path = job.file_path
+        if not path or not os.path.exists(path):
+            return error_response('匯出檔案不存在，請重新匯出', 410)
+
+        temple = Temple.query.get(temple_id)
+        return send_file(
+            path,
+            mimetype=FILE_FORMATS[job.file_format][1],
+            as_attachment=True,
+            download_name=download_name(job, temple.name if temple else temple_id),
+            conditional=True,
+            max_age=0
+        )
+
+    except Exception as e:
+        logger.exception('下載匯出檔案失敗')
+        return error_response(f'下載匯出檔案失敗: {str(e)}', 500)
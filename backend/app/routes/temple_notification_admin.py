@@ -8,6 +8,8 @@ from app.models.temple_notification import TempleNotification, NotificationStats
 from app.models.temple_admin import TempleAdmin
 from app.models.temple_admin_user import TempleAdminUser
 from app.utils.auth import token_required
+from app.utils.exceptions import AppError
+from app.utils.pagination import paginate
 from app.utils.response import success_response, error_response
 from app.services.notification_service import count_audience, send_notification
 from datetime import datetime
@@ -34,8 +36,8 @@ def check_temple_permission(current_user, temple_id):
 
 @bp.route('/', methods=['GET'])
 @token_required
-def list_notifications(current_user):
-    """GET /api/temple-admin/notifications/?temple_id=&status=&page=&pageSize="""
+def list_notifications(current_user, account_type):
+    """GET /api/temple-admin/notifications/?temple_id=&status=&page=&pageSize=&cursor="""
     try:
         temple_id = request.args.get('temple_id', type=int)
         if not temple_id:
@@ -51,16 +53,18 @@ def list_notifications(current_user):
         if status and status != 'all':
             query = query.filter_by(status=status)
 
-        query = query.order_by(TempleNotification.created_at.desc())
-        pagination = query.paginate(page=page, per_page=page_size, error_out=False)
+        result = paginate(query, TempleNotification.created_at, TempleNotification.id, page, page_size)
 
         return success_response({
-            'items': [n.to_dict() for n in pagination.items],
-            'total': pagination.total,
-            'page': page,
-            'pageSize': page_size,
-            'totalPages': pagination.pages,
+            'items': [n.to_dict() for n in result.items],
+            'total': result.total,
+            'page': result.page,
+            'pageSize': result.per_page,
+            'totalPages': result.pages,
+            'nextCursor': result.next_cursor,
         })
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
         logger.error('list error: %s', e)
         return error_response('載入通知列表失敗', 500)
@@ -204,18 +208,21 @@ def delete_notification(current_user, notification_id):
 
 @bp.route('/<int:notification_id>/send', methods=['POST'])
 @token_required
-def send_now(current_user, notification_id):
-    """POST /api/temple-admin/notifications/<id>/send"""
+def send_now(current_user, account_type, notification_id):
+    """
+    POST /api/temple-admin/notifications/<id>/send
+    發送失敗的通知可再次呼叫，只會重送未送達的批次
+    """
     try:
         notif = TempleNotification.query.get(notification_id)
         if not notif:
             return error_response('通知不存在', 404)
         if not check_temple_permission(current_user, notif.temple_id):
             return error_response('無權限', 403)
-        if notif.status not in ('draft', 'scheduled'):
+        if notif.status not in ('draft', 'scheduled', 'failed'):
             return error_response('此通知無法發送', 400)
 
-        ok = send_notification(notification_id)
+        ok = send_notification(notification_id, resume=notif.status == 'failed')
         if ok:
             db.session.refresh(notif)
             return success_response(notif.to_dict(include_stats=True), '發送成功')
@@ -288,8 +295,11 @@ def cancel_schedule(current_user, notification_id):
 
 @bp.route('/audience-count', methods=['GET'])
 @token_required
-def audience_count(current_user):
-    """GET /api/temple-admin/notifications/audience-count?temple_id=&targetAudience=&targetEventId="""
+def audience_count(current_user, account_type):
+    """
+    GET /api/temple-admin/notifications/audience-count?temple_id=&targetAudience=&targetEventId=
+    custom 受眾可另帶 minCheckins / maxCheckins（COUNT 查詢，結果短暫快取）
+    """
     try:
         temple_id = request.args.get('temple_id', type=int)
         if not temple_id:
@@ -299,8 +309,13 @@ def audience_count(current_user):
 
         target_audience = request.args.get('targetAudience', 'all')
         target_event_id = request.args.get('targetEventId', type=int)
+        target_filters = {
+            key: request.args.get(key, type=int)
+            for key in ('minCheckins', 'maxCheckins')
+            if request.args.get(key, type=int) is not None
+        }
 
-        cnt = count_audience(temple_id, target_audience, target_event_id)
+        cnt = count_audience(temple_id, target_audience, target_event_id, target_filters or None)
         return success_response({'count': cnt})
     except Exception as e:
         logger.error('audience-count error: %s', e)
@@ -9,8 +9,10 @@ from app.models.checkin import Checkin
 from app.models.user import User
 from app.models.product import Product
 from app.models.redemption import Redemption
+from app.routes.temple_admin_api import check_temple_access
 from app.utils.auth import token_required
 from app.utils.response import success_response, error_response
+from app.services.temple_rollup import sum_rollups, count_visitors, get_daily_rows
 from sqlalchemy import func, distinct
 from datetime import datetime, timedelta
 from app.utils.logger import get_logger
@@ -21,7 +23,7 @@ bp = Blueprint('temple_stats', __name__, url_prefix='/api/temple-stats')
 
 @bp.route('/<int:temple_id>/dashboard', methods=['GET'])
 @token_required
-def get_temple_dashboard(current_user, temple_id):
+def get_temple_dashboard(current_user, account_type, temple_id):
     """
     廟方儀表板總覽（需管理員權限）
     GET /api/temple-stats/<temple_id>/dashboard
@@ -34,67 +36,31 @@ def get_temple_dashboard(current_user, temple_id):
             return error_response('廟宇不存在或已停用', 404)
 
         # 檢查權限
-        temple_admin = TempleAdmin.query.filter_by(
-            temple_id=temple_id,
-            user_id=current_user.id,
-            is_active=True
-        ).first()
-
-        if not temple_admin or not temple_admin.has_permission('view_stats'):
-            return error_response('您沒有權限查看此廟宇的統計資料', 403)
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
 
-        # 1. 總打卡次數
-        total_checkins = Checkin.query.filter_by(temple_id=temple_id).count()
-
-        # 2. 總訪客數（去重）
-        total_visitors = db.session.query(
-            func.count(distinct(Checkin.user_id))
-        ).filter(Checkin.temple_id == temple_id).scalar() or 0
-
-        # 3. 本週統計
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        weekly_checkins = Checkin.query.filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= week_ago
-        ).count()
-
-        weekly_visitors = db.session.query(
-            func.count(distinct(Checkin.user_id))
-        ).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= week_ago
-        ).scalar() or 0
-
-        # 4. 本月統計
         now = datetime.utcnow()
+        today = now.date()
+        week_ago = now - timedelta(days=7)
         month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
 
-        monthly_checkins = Checkin.query.filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= month_start
-        ).count()
-
-        monthly_visitors = db.session.query(
-            func.count(distinct(Checkin.user_id))
-        ).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= month_start
-        ).scalar() or 0
+        # 1. 總打卡次數 / 總訪客數（去重）
+        total_checkins = sum_rollups(temple_id)['checkin_count']
+        total_visitors = count_visitors(temple_id)
 
-        # 5. 今日統計
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        # 2. 本週統計
+        weekly_checkins = sum_rollups(temple_id, week_ago.date())['checkin_count']
+        weekly_visitors = count_visitors(temple_id, week_ago)
 
-        today_checkins = Checkin.query.filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= today_start
-        ).count()
+        # 3. 本月統計
+        monthly_checkins = sum_rollups(temple_id, month_start.date())['checkin_count']
+        monthly_visitors = count_visitors(temple_id, month_start)
 
-        today_visitors = db.session.query(
-            func.count(distinct(Checkin.user_id))
-        ).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= today_start
-        ).scalar() or 0
+        # 4. 今日統計
+        today_checkins = sum_rollups(temple_id, today)['checkin_count']
+        today_visitors = count_visitors(temple_id, today_start)
 
         return success_response({
             'temple': temple.to_simple_dict(),
@@ -121,7 +87,7 @@ def get_temple_dashboard(current_user, temple_id):
 
 @bp.route('/<int:temple_id>/visitors', methods=['GET'])
 @token_required
-def get_temple_visitors_stats(current_user, temple_id):
+def get_temple_visitors_stats(current_user, account_type, temple_id):
     """
     訪客統計（需管理員權限）
     GET /api/temple-stats/<temple_id>/visitors
@@ -136,14 +102,9 @@ def get_temple_visitors_stats(current_user, temple_id):
             return error_response('廟宇不存在或已停用', 404)
 
         # 檢查權限
-        temple_admin = TempleAdmin.query.filter_by(
-            temple_id=temple_id,
-            user_id=current_user.id,
-            is_active=True
-        ).first()
-
-        if not temple_admin or not temple_admin.has_permission('view_stats'):
-            return error_response('您沒有權限查看此廟宇的統計資料', 403)
+        has_access, error = check_temple_access(current_user, account_type, temple_id)
+        if not has_access:
+            return error
 
         period = request.args.get('period', default='month')
 
@@ -156,26 +117,15 @@ def get_temple_visitors_stats(current_user, temple_id):
         else:  # month
             start_date = now - timedelta(days=30)
 
-        # 按日期統計訪客
-        daily_stats = db.session.query(
-            func.date(Checkin.timestamp).label('date'),
-            func.count(Checkin.id).label('checkin_count'),
-            func.count(distinct(Checkin.user_id)).label('visitor_count')
-        ).filter(
-            Checkin.temple_id == temple_id,
-            Checkin.timestamp >= start_date
-        ).group_by(
-            func.date(Checkin.timestamp)
-        ).order_by(
-            func.date(Checkin.timestamp)
-        ).all()
+        # 按日期統計訪客（讀取每日彙總）
+        daily_stats = get_daily_rows(temple_id, start_date.date())
 
         return success_response({
             'temple': temple.to_simple_dict(),
             'period': period,
             'daily_stats': [
                 {
-                    'date': stat.date.isoformat(),
+                    'date': stat.stat_date.isoformat(),
                     'checkin_count': stat.checkin_count,
                     'visitor_count': stat.visitor_count
                 }
@@ -184,12 +134,7 @@ def get_temple_visitors_stats(current_user, temple_id):
             'summary': {
                 'total_days': len(daily_stats),
                 'total_checkins': sum(stat.checkin_count for stat in daily_stats),
-                'total_visitors': db.session.query(
-                    func.count(distinct(Checkin.user_id))
-                ).filter(
-                    Checkin.temple_id == temple_id,
-                    Checkin.timestamp >= start_date
-                ).scalar() or 0
+                'total_visitors': count_visitors(temple_id, start_date)
             }
         }, '訪客統計獲取成功', 200)
 
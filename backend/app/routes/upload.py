@@ -2,13 +2,19 @@
 檔案上傳 API
 """
 import os
-from flask import Blueprint, request, send_from_directory, current_app
+import re
+from flask import Blueprint, request, current_app
 from app import db
 from app.models.product import Product
 from app.models.user import User
 from app.utils.auth import token_required, admin_required
+from app.utils.exceptions import AppError
 from app.utils.response import success_response, error_response
-from app.utils.file_upload import save_uploaded_image, delete_file
+from app.utils.file_upload import (
+    save_uploaded_image, delete_file, is_content_addressed, image_relative_dir,
+    image_variant_urls, locate_original, is_original_name,
+    IMAGE_MANIFEST, IMAGE_ROOT, IMAGE_SIZES, VARIANT_FORMATS, ALLOWED_EXTENSIONS
+)
 from app import limiter
 from app.utils.logger import get_logger
 
@@ -20,11 +26,16 @@ upload_limit = limiter.shared_limit("10 per minute", scope="uploads")
 
 # 上傳目錄路徑
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads')
+RESIZE_CACHE_FOLDER = os.path.join('cache', 'resized')  # 即時縮圖快取（相對於 UPLOAD_FOLDER）
+# 不對外提供的子目錄（舊版匯出檔曾寫在 uploads/exports，內含個資）
+PRIVATE_FOLDERS = ('exports',)
+# images/<hh>/<sha256>/<尺寸>.<格式>
+_IMAGE_VARIANT_PATH = re.compile(r'^images/[0-9a-f]{2}/(?P<hash>[0-9a-f]{64})/(?P<size>\w+)\.(?P<fmt>\w+)$')
 
 @bp.route('/image', methods=['POST'])
 @upload_limit
 @token_required
-def upload_image(current_user):
+def upload_image(current_user, account_type):
     """
     通用圖片上傳
     POST /api/uploads/image
@@ -85,8 +96,8 @@ def upload_product_image(current_user, product_id):
 
         file = request.files['file']
 
-        # 刪除舊圖片
-        if product.image_url:
+        # 刪除舊圖片（內容定址的圖片可能被其他資料共用，不刪除）
+        if product.image_url and not is_content_addressed(product.image_url):
             old_path = os.path.join(UPLOAD_FOLDER, product.image_url.replace('/uploads/', ''))
             delete_file(old_path)
 
@@ -119,7 +130,7 @@ def upload_product_image(current_user, product_id):
 @bp.route('/avatar', methods=['POST'])
 @upload_limit
 @token_required
-def upload_avatar(current_user):
+def upload_avatar(current_user, account_type):
     """
     上傳用戶頭像
     POST /api/uploads/avatar
@@ -134,8 +145,9 @@ def upload_avatar(current_user):
 
         file = request.files['file']
 
-        # 刪除舊頭像
-        if hasattr(current_user, 'avatar_url') and current_user.avatar_url:
+        # 刪除舊頭像（內容定址的圖片可能被其他資料共用，不刪除）
+        avatar_url = getattr(current_user, 'avatar_url', None)
+        if avatar_url and not is_content_addressed(avatar_url):
             old_path = os.path.join(UPLOAD_FOLDER, current_user.avatar_url.replace('/uploads/', ''))
             delete_file(old_path)
 
@@ -164,15 +176,89 @@ def upload_avatar(current_user):
         db.session.rollback()
         return error_response(f'上傳失敗: {str(e)}', 500)
 
+@bp.route('/images/<content_hash>', methods=['GET'])
+def get_image_status(content_hash):
+    """
+    查詢圖片處理狀態與各尺寸 URL
+    GET /api/uploads/images/<content_hash>
+    """
+    import json
+
+    if len(content_hash) != 64 or any(c not in '0123456789abcdef' for c in content_hash):
+        return error_response('無效的圖片雜湊', 400)
+
+    target_dir = os.path.join(UPLOAD_FOLDER, image_relative_dir(content_hash))
+    if not os.path.isdir(target_dir) or not locate_original(content_hash, UPLOAD_FOLDER):
+        return error_response('圖片不存在', 404)
+
+    manifest_path = os.path.join(target_dir, IMAGE_MANIFEST)
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    return success_response({
+        'hash': content_hash,
+        'status': 'ready' if manifest else 'processing',
+        'variants': image_variant_urls(content_hash),
+        'manifest': manifest
+    })
+
 @bp.route('/<path:filename>')
 def serve_file(filename):
     """
-    提供檔案訪問
+    提供檔案訪問（ETag / Range；內容雜湊圖片為 immutable）
     GET /api/uploads/<filename>
+    Query: ?w=寬&h=高&fmt=jpg|webp  // 可選，即時縮圖（依 Accept 預設回傳 WebP）
+    縮圖尚在背景處理時，暫以即時縮圖（不含 EXIF）回應；原始檔案不對外提供
     """
+    from werkzeug.security import safe_join
+    from app.utils.media import send_media, parse_resize_args, negotiate_image_format, resized_image
+
     try:
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        full_path = safe_join(UPLOAD_FOLDER, filename)
+        if full_path is None:
+            return error_response('檔案不存在', 404)
+        relative_path = os.path.relpath(full_path, UPLOAD_FOLDER).replace(os.sep, '/')
+        if relative_path.split('/')[0] in PRIVATE_FOLDERS:
+            return error_response('檔案不存在', 404)
+        # 舊版存於公開目錄的原始檔案（可能含 GPS 等 EXIF）
+        if relative_path.startswith(f'{IMAGE_ROOT}/') and is_original_name(relative_path):
+            return error_response('檔案不存在', 404)
+
+        # 縮圖處理中：由原始檔案即時產生同尺寸的縮圖（重新編碼、不含中繼資料），且不可被長期快取
+        if relative_path.startswith(f'{IMAGE_ROOT}/') and not os.path.exists(full_path):
+            match = _IMAGE_VARIANT_PATH.match(relative_path)
+            if not match or match.group('size') not in IMAGE_SIZES or match.group('fmt') not in VARIANT_FORMATS:
+                return error_response('檔案不存在', 404)
+            original = locate_original(match.group('hash'), UPLOAD_FOLDER)
+            if not original:
+                return error_response('檔案不存在', 404)
+            width, height = IMAGE_SIZES[match.group('size')]
+            cache_dir = os.path.join(UPLOAD_FOLDER, RESIZE_CACHE_FOLDER)
+            resized = resized_image(original, cache_dir, width, height, match.group('fmt'))
+            return send_media(cache_dir, os.path.basename(resized), immutable=False, no_cache=True)
+        if not os.path.isfile(full_path):
+            return error_response('檔案不存在', 404)
+
+        is_image = os.path.splitext(full_path)[1].lower().lstrip('.') in ALLOWED_EXTENSIONS
+        size = parse_resize_args() if is_image else None
+        if size:
+            fmt = negotiate_image_format()
+            cache_dir = os.path.join(UPLOAD_FOLDER, RESIZE_CACHE_FOLDER)
+            resized = resized_image(full_path, cache_dir, size[0], size[1], fmt)
+            response = send_media(
+                cache_dir, os.path.basename(resized),
+                immutable=is_content_addressed(f'/uploads/{filename}')
+            )
+            response.vary.add('Accept')
+            return response
+
+        return send_media(UPLOAD_FOLDER, filename)
+    except AppError as e:
+        return error_response(e.message, e.status_code)
     except Exception as e:
+        logger.error(f'[Upload] serve {filename} failed: {e}')
         return error_response('檔案不存在', 404)
 
 @bp.route('/delete', methods=['POST'])
@@ -4,9 +4,12 @@
 from flask import Blueprint, request
 from app import db
 from app.models.user import User
+from app.services import points_ledger
 from app.utils.auth import token_required
+from app.utils.principal_cache import invalidate_principal
 from app.utils.response import success_response, error_response
 from app.utils.logger import get_logger
+from datetime import datetime, timedelta
 
 logger = get_logger('routes.user')
 
@@ -68,7 +71,7 @@ def update_profile(current_user):
 
 @bp.route('/password', methods=['PUT'])
 @token_required
-def change_password(current_user):
+def change_password(current_user, account_type):
     """
     修改密碼
     PUT /api/user/password
@@ -103,6 +106,7 @@ def change_password(current_user):
         # 更新密碼
         current_user.set_password(new_password)
         db.session.commit()
+        invalidate_principal(account_type, current_user.id)
 
         return success_response(None, '密碼修改成功', 200)
 
@@ -161,7 +165,7 @@ def change_email(current_user):
 
 @bp.route('/account', methods=['DELETE'])
 @token_required
-def delete_account(current_user):
+def delete_account(current_user, account_type):
     """
     刪除帳號（硬刪除）
     DELETE /api/user/account
@@ -195,8 +199,10 @@ def delete_account(current_user):
 
         # 刪除用戶（級聯刪除關聯資料）
         user_email = current_user.email
+        user_id = current_user.id
         db.session.delete(current_user)
         db.session.commit()
+        invalidate_principal(account_type, user_id)
 
         return success_response(
             {'deleted_email': user_email},
@@ -263,3 +269,62 @@ def get_statistics(current_user):
 
     except Exception as e:
         return error_response(f'獲取失敗: {str(e)}', 500)
+
+@bp.route('/points', methods=['GET'])
+@token_required
+def get_points(current_user, account_type):
+    """
+    獲取功德值餘額
+    GET /api/user/points
+    Header: Authorization: Bearer <token>
+    Query Parameters:
+        - as_of: 查詢該時間點的餘額（ISO 格式，例如 2026-01-31 或 2026-01-31T12:00:00；不給為目前餘額）
+    """
+    try:
+        as_of = request.args.get('as_of')
+        if not as_of:
+            return success_response({'balance': points_ledger.get_balance(current_user)}, '獲取成功', 200)
+
+        try:
+            at = datetime.fromisoformat(as_of)
+        except ValueError:
+            return error_response('as_of 格式錯誤', 400)
+        if len(as_of) <= 10:
+            # 只給日期時查詢當天結束時的餘額
+            at = at + timedelta(days=1) - timedelta(microseconds=1)
+
+        return success_response({
+            'balance': points_ledger.get_balance_as_of(current_user, at),
+            'as_of': at.isoformat()
+        }, '獲取成功', 200)
+
+    except Exception as e:
+        return error_response(f'獲取失敗: {str(e)}', 500)
+
+@bp.route('/points/history', methods=['GET'])
+@token_required
+def get_points_history(current_user, account_type):
+    """
+    獲取功德值異動紀錄（新到舊）
+    GET /api/user/points/history
+    Header: Authorization: Bearer <token>
+    Query Parameters:
+        - limit: 每頁數量 (default: 20, max: 100)
+        - before_id: 上一頁回傳的 next_before_id
+        - source: 異動來源篩選 (checkin/reward/redemption/redemption_cancel/admin_adjust/opening)
+    """
+    try:
+        entries, next_before_id = points_ledger.get_history(
+            current_user,
+            limit=request.args.get('limit', default=20, type=int),
+            before_id=request.args.get('before_id', type=int),
+            source=request.args.get('source')
+        )
+
+        return success_response({
+            'entries': [entry.to_dict() for entry in entries],
+            'next_before_id': next_before_id
+        }, '獲取成功', 200)
+
+    except Exception as e:
+        return error_response(f'獲取失敗: {str(e)}', 500)
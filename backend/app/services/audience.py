@@ -0,0 +1,186 @@
+"""
+通知受眾引擎
+- 每種受眾編譯為 line_users 上的一組 SQL 條件（半連接 / 反連接子查詢），不在 Python 端組出 ID 集合
+- iter_line_user_ids：只選取 ID 欄位，以主鍵 keyset 分批串流（發送時逐批取用）
+- count_audience：直接 COUNT(*)，結果短暫快取，供後台編輯篩選條件時即時預估
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, exists
+from app import db
+from app.models.line_user import LineUser
+from app.models.event_registration import EventRegistration
+from app.models.lamp_application import LampApplication
+from app.utils.logger import get_logger
+
+logger = get_logger('services.audience')
+
+
+COUNT_TTL_SECONDS = int(os.getenv('AUDIENCE_COUNT_TTL_SECONDS', 30))
+COUNT_CACHE_SIZE = 512
+STREAM_CHUNK_SIZE = 500
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def audience_conditions(temple_id, target_audience, target_event_id=None, target_filters=None, now=None):
+    """
+    回傳篩選 line_users 的 SQL 條件列表（只包含目前仍在追蹤的用戶）
+    回傳 None 代表受眾必定為空（例如 event_registered 未指定活動）
+    """
+    filters = target_filters or {}
+    now = now or datetime.utcnow()
+    conditions = [LineUser.is_following == True]
+
+    if target_audience == 'new':
+        conditions.append(LineUser.followed_at >= now - timedelta(days=30))
+
+    elif target_audience == 'active':
+        # 30 天內有 EventRegistration（透過 line_user_id 直接關聯）
+        recent = select(EventRegistration.line_user_id).where(
+            EventRegistration.line_user_id.isnot(None),
+            EventRegistration.registered_at >= now - timedelta(days=30)
+        )
+        conditions.append(LineUser.line_user_id.in_(recent))
+
+    elif target_audience == 'dormant':
+        # 超過 90 天無 EventRegistration 活動
+        conditions.append(~exists().where(
+            EventRegistration.line_user_id == LineUser.line_user_id,
+            EventRegistration.registered_at >= now - timedelta(days=90)
+        ))
+
+    elif target_audience == 'lamp_expiring':
+        # 30 天內點燈到期，透過電話號碼對應 LineUser
+        today = now.date()
+        expiring_phones = select(LampApplication.applicant_phone).where(
+            LampApplication.temple_id == temple_id,
+            LampApplication.status.in_(['paid', 'active', 'pending']),
+            LampApplication.end_date >= today,
+            LampApplication.end_date <= today + timedelta(days=30)
+        )
+        conditions.append(LineUser.phone.in_(expiring_phones))
+
+    elif target_audience == 'event_registered':
+        if not target_event_id:
+            return None
+        registered = select(EventRegistration.line_user_id).where(
+            EventRegistration.event_id == target_event_id,
+            EventRegistration.line_user_id.isnot(None),
+            EventRegistration.status.in_(['registered', 'waitlist'])
+        )
+        conditions.append(LineUser.line_user_id.in_(registered))
+
+    elif target_audience == 'custom':
+        # 依 EventRegistration 次數篩選（關聯子查詢，依 line_user_id 索引計數）
+        min_reg = _int_or_none(filters.get('minCheckins'))
+        max_reg = _int_or_none(filters.get('maxCheckins'))
+        if min_reg or max_reg:
+            reg_count = select(func.count(EventRegistration.id)).where(
+                EventRegistration.line_user_id == LineUser.line_user_id
+            ).correlate(LineUser).scalar_subquery()
+            if min_reg:
+                conditions.append(reg_count >= min_reg)
+            if max_reg:
+                conditions.append(reg_count <= max_reg)
+
+    # 其他（含 all 與未知類型）：全部追蹤者
+    return conditions
+
+
+def iter_line_user_ids(temple_id, target_audience, target_event_id=None, target_filters=None,
+                       chunk_size=STREAM_CHUNK_SIZE):
+    """依主鍵遞增分批產生 LINE user ID 列表（每批一次查詢，只讀取 ID 欄位）"""
+    conditions = audience_conditions(temple_id, target_audience, target_event_id, target_filters)
+    if conditions is None:
+        return
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(LineUser.id, LineUser.line_user_id)
+            .where(*conditions, LineUser.id > last_id)
+            .order_by(LineUser.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield [row.line_user_id for row in rows]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+
+class AudienceCountCache:
+    """(temple_id, 受眾, 活動, 篩選條件) -> (到期時間, 人數)，LRU 上限 COUNT_CACHE_SIZE 筆"""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, count):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, count)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0
+            }
+
+
+audience_counts = AudienceCountCache(COUNT_TTL_SECONDS, COUNT_CACHE_SIZE)
+
+
+def count_audience(temple_id, target_audience, target_event_id=None, target_filters=None, use_cache=True):
+    """受眾人數（COUNT(*)，快取 COUNT_TTL_SECONDS 秒）"""
+    key = (temple_id, target_audience, target_event_id, json.dumps(target_filters or {}, sort_keys=True))
+    if use_cache and COUNT_TTL_SECONDS > 0:
+        cached = audience_counts.get(key)
+        if cached is not None:
+            return cached
+
+    conditions = audience_conditions(temple_id, target_audience, target_event_id, target_filters)
+    if conditions is None:
+        count = 0
+    else:
+        count = db.session.execute(select(func.count()).select_from(LineUser).where(*conditions)).scalar() or 0
+
+    if COUNT_TTL_SECONDS > 0:
+        audience_counts.put(key, count)
+    return count
@@ -0,0 +1,84 @@
+"""
+打卡寫入流程（冪等、併發安全）
+- 每日唯一鍵 dedup_key：同一天的重複簽到由資料庫唯一索引擋下，不再依賴「先查再寫」
+- Idempotency-Key 標頭：同一用戶帶相同 key 重送時回傳原本的簽到結果，不會再次計算獎勵
+- 鎖定順序固定為 護身符 → 簽到 → 用戶點數 → 廟宇統計，避免死結
+- 功德值經由功德值帳本（app.services.points_ledger）以單一 UPDATE 原子遞增，併發簽到不會互相覆蓋
+"""
+from datetime import datetime
+from flask import request
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.amulet import Amulet
+from app.models.checkin import Checkin
+from app.utils.logger import get_logger
+
+logger = get_logger('services.checkin_writer')
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+class IdempotencyKeyError(ValueError):
+    """Idempotency-Key 格式錯誤"""
+
+
+def get_idempotency_key():
+    """讀取請求的 Idempotency-Key（未提供回傳 None）"""
+    key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+    if not key:
+        return None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise IdempotencyKeyError(f'{IDEMPOTENCY_HEADER} 長度不可超過 {IDEMPOTENCY_KEY_MAX_LENGTH} 字元')
+    return key
+
+
+def daily_key(scope, *parts, day=None):
+    """每日唯一鍵，例如 amulet:12:2026-10-18"""
+    day = day or datetime.utcnow().date()
+    return ':'.join([scope, *(str(p) for p in parts), day.isoformat()])
+
+
+def find_by_idempotency_key(user_id, key):
+    if not key:
+        return None
+    return Checkin.query.filter_by(user_id=user_id, idempotency_key=key).first()
+
+
+def lock_amulet(amulet_id):
+    """以 SELECT ... FOR UPDATE 鎖定護身符（同一護身符的簽到依序執行）"""
+    return Amulet.query.filter_by(id=amulet_id).with_for_update().first()
+
+
+def insert_checkin(checkin):
+    """
+    寫入簽到（須在修改其他資料前呼叫）
+    成功回傳 None；違反唯一索引時整筆交易 rollback，回傳先寫入的那筆簽到
+    """
+    try:
+        db.session.add(checkin)
+        db.session.flush()
+        return None
+    except IntegrityError:
+        # rollback 後重新開始交易，才讀得到併發請求剛 commit 的資料
+        db.session.rollback()
+
+    existing = None
+    if checkin.idempotency_key:
+        existing = find_by_idempotency_key(checkin.user_id, checkin.idempotency_key)
+    if existing is None and checkin.dedup_key:
+        existing = Checkin.query.filter_by(dedup_key=checkin.dedup_key).first()
+    logger.info(
+        f'[Checkin] duplicate rejected user={checkin.user_id} dedup_key={checkin.dedup_key} '
+        f'existing={existing.id if existing else None}'
+    )
+    return existing
+
+
+def is_replay(existing, key, **expected):
+    """重複的簽到是否為同一請求的重送（相同 Idempotency-Key 且參數一致）"""
+    if not key or existing.idempotency_key != key:
+        return False
+    return all(getattr(existing, field) == value for field, value in expected.items())
+
@@ -0,0 +1,206 @@
+"""
+廟方 CSV 匯出服務
+- 以 server-side cursor 分批讀取（yield_per），用戶/商品欄位在同一查詢 JOIN 取得
+- 逐批產生 CSV 位元組，記憶體用量與匯出筆數無關
+- 各報表回傳 (表頭, 資料列迭代器)，可串流回應也可寫入檔案
+"""
+import csv
+import io
+from sqlalchemy import select, func
+from app import db
+from app.models.checkin import Checkin
+from app.models.product import Product
+from app.models.redemption import Redemption
+from app.models.user import User
+
+
+# 每批自資料庫讀取、並輸出一次的筆數
+BATCH_SIZE = 1000
+
+# Excel 需要 BOM 才能正確顯示 UTF-8 中文
+CSV_BOM = '\ufeff'
+
+ORDER_STATUS_LABELS = {
+    'pending': '待處理',
+    'processing': '處理中',
+    'shipped': '已出貨',
+    'completed': '已完成',
+    'cancelled': '已取消'
+}
+
+REVENUE_STATUSES = ('processing', 'shipped', 'completed')
+
+
+def _stream(stmt):
+    """以 server-side cursor 分批讀取查詢結果"""
+    return db.session.execute(stmt.execution_options(yield_per=BATCH_SIZE))
+
+
+def _format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def checkin_query(temple_id, start_date=None, end_date=None):
+    """打卡記錄查詢（含用戶欄位）"""
+    stmt = select(
+        Checkin.timestamp,
+        User.name,
+        Checkin.blessing_points,
+        User.blessing_points
+    ).join(
+        User, User.id == Checkin.user_id
+    ).where(Checkin.temple_id == temple_id)
+    if start_date:
+        stmt = stmt.where(Checkin.timestamp >= start_date)
+    if end_date:
+        stmt = stmt.where(Checkin.timestamp <= end_date)
+    return stmt.order_by(Checkin.timestamp.desc(), Checkin.id.desc())
+
+
+def checkin_rows(temple_id, start_date=None, end_date=None):
+    """打卡記錄：(表頭, 資料列)"""
+    stmt = checkin_query(temple_id, start_date, end_date)
+    header = ['打卡時間', '用戶名稱', '用戶電話', '獲得福報', '累積福報', '備註']
+
+    def rows():
+        for timestamp, name, earned, balance in _stream(stmt):
+            # 用戶資料表沒有電話欄位，保留欄位維持報表格式
+            yield [_format_time(timestamp), name, '', earned, balance, '']
+
+    return header, rows()
+
+
+def order_query(temple_id, start_date=None, end_date=None, status=None):
+    """訂單記錄查詢（含商品欄位）"""
+    stmt = select(
+        Redemption.id,
+        Redemption.redeemed_at,
+        Product.name,
+        Redemption.quantity,
+        Redemption.merit_points_used,
+        Redemption.status,
+        Redemption.recipient_name,
+        Redemption.phone,
+        Redemption.postal_code,
+        Redemption.city,
+        Redemption.district,
+        Redemption.address,
+        Redemption.shipping_method,
+        Redemption.tracking_number,
+        Redemption.notes
+    ).join(
+        Product, Product.id == Redemption.product_id
+    ).where(Redemption.temple_id == temple_id)
+    if start_date:
+        stmt = stmt.where(Redemption.redeemed_at >= start_date)
+    if end_date:
+        stmt = stmt.where(Redemption.redeemed_at <= end_date)
+    if status:
+        stmt = stmt.where(Redemption.status == status)
+    return stmt.order_by(Redemption.redeemed_at.desc(), Redemption.id.desc())
+
+
+def order_rows(temple_id, start_date=None, end_date=None, status=None):
+    """訂單記錄：(表頭, 資料列)"""
+    stmt = order_query(temple_id, start_date, end_date, status)
+    header = [
+        '訂單編號', '訂單時間', '商品名稱', '數量', '使用福報',
+        '訂單狀態', '收件人', '聯絡電話', '收件地址',
+        '物流方式', '物流單號', '備註'
+    ]
+
+    def rows():
+        for (order_id, redeemed_at, product_name, quantity, points, order_status,
+             recipient_name, phone, postal_code, city, district, address,
+             shipping_method, tracking_number, notes) in _stream(stmt):
+            yield [
+                order_id,
+                _format_time(redeemed_at),
+                product_name,
+                quantity,
+                points,
+                ORDER_STATUS_LABELS.get(order_status, order_status),
+                recipient_name,
+                phone,
+                f"{postal_code or ''}{city}{district}{address}",
+                shipping_method or '',
+                tracking_number or '',
+                notes or ''
+            ]
+
+    return header, rows()
+
+
+def revenue_query(temple_id, start_date, end_date):
+    """收入報表查詢（有效訂單）"""
+    return select(
+        Redemption.redeemed_at,
+        Product.name,
+        Product.merit_points,
+        Redemption.quantity,
+        Redemption.merit_points_used,
+        Redemption.status
+    ).join(
+        Product, Product.id == Redemption.product_id
+    ).where(
+        Redemption.temple_id == temple_id,
+        Redemption.redeemed_at >= start_date,
+        Redemption.redeemed_at <= end_date,
+        Redemption.status.in_(REVENUE_STATUSES)
+    ).order_by(Redemption.redeemed_at.desc(), Redemption.id.desc())
+
+
+def revenue_rows(temple_id, start_date, end_date):
+    """收入報表：(表頭, 資料列)，最後附上總計列"""
+    stmt = revenue_query(temple_id, start_date, end_date)
+    header = ['訂單日期', '商品名稱', '單價(福報)', '數量', '小計(福報)', '訂單狀態']
+
+    def rows():
+        total_revenue = 0
+        for redeemed_at, product_name, unit_points, quantity, points, order_status in _stream(stmt):
+            yield [
+                _format_time(redeemed_at),
+                product_name,
+                unit_points,
+                quantity,
+                points,
+                ORDER_STATUS_LABELS.get(order_status, order_status)
+            ]
+            total_revenue += points
+        yield []
+        yield ['', '', '', '總計:', total_revenue, '']
+
+    return header, rows()
+
+
+def count_rows(stmt):
+    """查詢結果總筆數（背景匯出計算進度用）"""
+    return db.session.execute(
+        select(func.count()).select_from(stmt.order_by(None).subquery())
+    ).scalar() or 0
+
+
+def iter_csv(header, rows, batch_size=BATCH_SIZE):
+    """
+    逐批產生 UTF-8 CSV 位元組
+    BOM 與表頭最先送出，之後每 batch_size 筆輸出一次
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write(CSV_BOM)
+    writer.writerow(header)
+    yield buffer.getvalue().encode('utf-8')
+
+    pending = 0
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
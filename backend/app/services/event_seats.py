@@ -0,0 +1,126 @@
+"""
+活動名額庫存
+- temple_events.reserved_seats 記錄已佔用的名額（registered 報名的 people_count 總和），
+  報名時以條件式 UPDATE 原子地佔用，不再每次 SUM 全部報名紀錄，也不會超賣
+- 名額不足時報名列入候補（waitlist）；取消已報名的紀錄釋出名額後，依報名先後（FIFO）遞補
+- 剩餘名額直接由計數欄位算出（capacity - reserved_seats），公開活動頁不需再掃描報名表
+- capacity 為 0 代表不限名額
+"""
+from sqlalchemy import or_
+from app import db
+from app.models.temple_event import TempleEvent
+from app.models.event_registration import EventRegistration
+from app.utils.logger import get_logger
+
+logger = get_logger('services.event_seats')
+
+
+def remaining_seats(event):
+    """剩餘名額（不限名額時回傳 None）"""
+    if not event.capacity or event.capacity <= 0:
+        return None
+    return max(0, event.capacity - (event.reserved_seats or 0))
+
+
+def reserve_seats(event_id, people_count):
+    """
+    以條件式 UPDATE 佔用名額，回傳是否成功（不 commit，與報名紀錄在同一交易）
+    同一活動的佔用在資料列鎖上序列化，名額不足時不會更新
+    """
+    reserved = TempleEvent.query.filter(
+        TempleEvent.id == event_id,
+        or_(
+            TempleEvent.capacity <= 0,
+            TempleEvent.reserved_seats + people_count <= TempleEvent.capacity
+        )
+    ).update({'reserved_seats': TempleEvent.reserved_seats + people_count}, synchronize_session=False)
+    return reserved == 1
+
+
+def release_seats(event_id, people_count):
+    """釋出名額（不 commit）"""
+    TempleEvent.query.filter(TempleEvent.id == event_id).update({
+        'reserved_seats': TempleEvent.reserved_seats - people_count
+    }, synchronize_session=False)
+
+
+def register(event, registration):
+    """
+    新增報名：名額足夠時為 registered，否則列入 waitlist（不 commit）
+    單筆人數超過活動總名額時無法遞補，回傳 False 不新增
+    """
+    if event.capacity and event.capacity > 0 and registration.people_count > event.capacity:
+        return False
+
+    registration.status = 'registered' if reserve_seats(event.id, registration.people_count) else 'waitlist'
+    db.session.add(registration)
+    return True
+
+
+def cancel(registration, canceled_at):
+    """
+    取消報名（不 commit），回傳因此遞補為 registered 的報名列表
+    以條件式 UPDATE 改狀態，同一筆報名同時取消兩次只會釋出一次名額；已取消時回傳 None
+    """
+    previous = registration.status
+    canceled = EventRegistration.query.filter(
+        EventRegistration.id == registration.id,
+        EventRegistration.status == previous,
+        EventRegistration.status != 'canceled'
+    ).update({'status': 'canceled', 'canceled_at': canceled_at}, synchronize_session=False)
+    if not canceled:
+        return None
+    registration.status = 'canceled'
+    registration.canceled_at = canceled_at
+
+    if previous != 'registered':
+        return []
+    release_seats(registration.event_id, registration.people_count)
+    return promote_waitlist(registration.event_id)
+
+
+def promote_waitlist(event_id):
+    """
+    依報名先後遞補候補者，直到排在最前面的候補者名額不足為止（不 commit）
+    回傳遞補成功的報名列表
+    """
+    promoted = []
+    while True:
+        candidate = EventRegistration.query.filter_by(event_id=event_id, status='waitlist').order_by(
+            EventRegistration.registered_at, EventRegistration.id
+        ).first()
+        if candidate is None or not reserve_seats(event_id, candidate.people_count):
+            break
+
+        claimed = EventRegistration.query.filter_by(id=candidate.id, status='waitlist').update(
+            {'status': 'registered'}, synchronize_session=False
+        )
+        if not claimed:
+            # 候補者同時取消或已由其他請求遞補，退回名額後看下一位
+            release_seats(event_id, candidate.people_count)
+            db.session.expire(candidate)
+            continue
+        candidate.status = 'registered'
+        promoted.append(candidate)
+
+    if promoted:
+        logger.info(f'[Seats] event {event_id}: promoted {len(promoted)} waitlisted registrations')
+    return promoted
+
+
+def notify_status(registrations, event):
+    """推播報名狀態（候補 / 遞補成功）給有 LINE ID 的報名者；失敗只記錄"""
+    from app.services.line_service import push_message
+    from app.utils.line_flex import status_changed_message
+
+    event_data = event.to_dict()
+    for registration in registrations:
+        if not registration.line_user_id:
+            continue
+        try:
+            push_message(
+                registration.line_user_id,
+                status_changed_message(registration.to_dict(), event_data, registration.status)
+            )
+        except Exception as e:
+            logger.error(f'[Seats] push status to registration {registration.id} error: {e}')
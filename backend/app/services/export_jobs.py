@@ -0,0 +1,259 @@
+"""
+背景匯出工作服務
+- 建立 export_jobs 紀錄後交給 process 內的 worker pool 執行，請求立即返回
+- worker 以 csv_export 的串流查詢寫出 gzip 壓縮 CSV 或 XLSX 到 EXPORT_FOLDER
+  （含收件人姓名、電話、地址：目錄不在公開的 uploads 之下，檔名為隨機 UUID，只能經由 download_export 下載）
+- 以條件式 UPDATE（pending → running）認領工作，同一工作只會執行一次
+- 進度與結果只在工作仍為本次執行（running 且 started_at 相同）時寫入；已被排程標記逾時的工作捨棄產出的檔案
+- 排程補撈未被執行的工作、標記逾時工作並清除過期檔案
+"""
+import gzip
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app import db
+from app.models.export_job import ExportJob
+from app.services.csv_export import (
+    checkin_query, checkin_rows, order_query, order_rows,
+    revenue_query, revenue_rows, count_rows, iter_csv
+)
+from app.utils.xlsx_writer import write_xlsx
+from app.utils.logger import get_logger
+
+logger = get_logger('services.export_jobs')
+
+
+EXPORT_FOLDER = os.getenv('EXPORT_FOLDER') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'private', 'exports'
+)
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', 2))
+RETENTION_HOURS = int(os.getenv('EXPORT_RETENTION_HOURS', 24))
+JOB_TIMEOUT_MINUTES = int(os.getenv('EXPORT_JOB_TIMEOUT_MINUTES', 60))
+
+# 建立超過此秒數仍為 pending 的工作由排程補撈（例如建立後 worker 重啟）
+STALE_PENDING_SECONDS = 60
+# 每處理幾筆更新一次進度
+PROGRESS_INTERVAL = 1000
+
+# export_type -> (查詢, 資料列, 可用參數, 報表名稱)
+EXPORT_TYPES = {
+    'checkins': (checkin_query, checkin_rows, ('start_date', 'end_date'), '打卡記錄'),
+    'orders': (order_query, order_rows, ('start_date', 'end_date', 'status'), '訂單記錄'),
+    'revenue': (revenue_query, revenue_rows, ('start_date', 'end_date'), '收入報表'),
+}
+
+FILE_FORMATS = {
+    'csv': ('csv.gz', 'application/gzip'),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+    return _executor
+
+
+def _submit(app, job_id):
+    _get_executor().submit(run_export_job, app, job_id)
+
+
+class JobAbandoned(Exception):
+    """工作已不屬於本次執行（逾時被標記失敗、重新排入或已過期）"""
+
+
+def _update_job(job, **values):
+    """
+    以獨立連線更新工作狀態（不影響 worker session 上正在串流的查詢）
+    只更新仍為本次執行的工作（running 且 started_at 相同），否則拋出 JobAbandoned
+    """
+    with db.engine.begin() as conn:
+        updated = conn.execute(update(ExportJob).where(
+            ExportJob.id == job.id,
+            ExportJob.status == 'running',
+            ExportJob.started_at == job.started_at
+        ).values(**values)).rowcount
+    if not updated:
+        raise JobAbandoned(job.id)
+
+
+def _report_args(job):
+    """由工作參數還原報表查詢條件（日期為 YYYY-MM-DD，結束日含當天）"""
+    params = job.params or {}
+    allowed = EXPORT_TYPES[job.export_type][2]
+    args = {}
+    if 'start_date' in allowed:
+        start = params.get('start_date')
+        args['start_date'] = datetime.strptime(start, '%Y-%m-%d') if start else None
+    if 'end_date' in allowed:
+        end = params.get('end_date')
+        args['end_date'] = datetime.strptime(end, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if end else None
+    if 'status' in allowed:
+        args['status'] = params.get('status') or None
+    return args
+
+
+def new_export_path(job):
+    """產生無法猜測的匯出檔路徑（實際路徑記錄於 job.file_path）"""
+    extension = FILE_FORMATS[job.file_format][0]
+    return os.path.join(EXPORT_FOLDER, f'{uuid.uuid4().hex}.{extension}')
+
+
+def download_name(job, temple_name):
+    extension = FILE_FORMATS[job.file_format][0]
+    title = EXPORT_TYPES[job.export_type][3]
+    return f'{temple_name}_{title}_{job.created_at.strftime("%Y%m%d_%H%M%S")}.{extension}'
+
+
+# ===== 建立 =====
+
+def create_export_job(app, temple_id, export_type, file_format, params, requested_by, account_type):
+    """建立匯出工作並交給 worker pool，回傳 ExportJob"""
+    job = ExportJob(
+        temple_id=temple_id,
+        requested_by=requested_by,
+        account_type=account_type,
+        export_type=export_type,
+        file_format=file_format,
+        params=params
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _submit(app, job.id)
+    logger.info(f'[Export] job {job.id} queued: temple={temple_id} type={export_type} format={file_format}')
+    return job
+
+
+# ===== 執行 =====
+
+def _track_progress(job, rows):
+    processed = 0
+    for row in rows:
+        yield row
+        processed += 1
+        if processed % PROGRESS_INTERVAL == 0:
+            _update_job(job, processed_rows=processed)
+
+
+def _write_csv_gz(path, header, rows):
+    with gzip.open(path, 'wb') as f:
+        for chunk in iter_csv(header, rows):
+            f.write(chunk)
+
+
+def _write_export(job):
+    query_fn, rows_fn, _, title = EXPORT_TYPES[job.export_type]
+    args = _report_args(job)
+
+    total = count_rows(query_fn(job.temple_id, **args))
+    _update_job(job, total_rows=total)
+
+    os.makedirs(EXPORT_FOLDER, exist_ok=True)
+    path = new_export_path(job)
+    tmp_path = f'{path}.part'
+    header, rows = rows_fn(job.temple_id, **args)
+    try:
+        if job.file_format == 'xlsx':
+            write_xlsx(tmp_path, header, _track_progress(job, rows), sheet_name=title)
+        else:
+            _write_csv_gz(tmp_path, header, _track_progress(job, rows))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    now = datetime.utcnow()
+    try:
+        _update_job(
+            job,
+            status='completed',
+            processed_rows=total,
+            file_path=path,
+            file_size=os.path.getsize(path),
+            finished_at=now,
+            expires_at=now + timedelta(hours=RETENTION_HOURS)
+        )
+    except JobAbandoned:
+        # 工作已不屬於本次執行，檔案不會被下載也不會被排程清除
+        os.remove(path)
+        raise
+
+
+def run_export_job(app, job_id):
+    """worker 執行單一匯出工作（已被其他 worker 認領時直接返回）"""
+    with app.app_context():
+        job = None
+        try:
+            claimed = ExportJob.query.filter_by(id=job_id, status='pending').update(
+                {'status': 'running', 'started_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = ExportJob.query.get(job_id)
+            started = datetime.utcnow()
+            _write_export(job)
+            logger.info(f'[Export] job {job_id} completed in {(datetime.utcnow() - started).total_seconds():.1f}s')
+        except JobAbandoned:
+            db.session.rollback()
+            logger.warning(f'[Export] job {job_id} is no longer running (timed out or requeued), result discarded')
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f'[Export] job {job_id} failed')
+            if job is not None:
+                try:
+                    _update_job(job, status='failed', error_message=str(e)[:1000], finished_at=datetime.utcnow())
+                except JobAbandoned:
+                    pass
+        finally:
+            db.session.remove()
+
+
+# ===== 排程維護 =====
+
+def maintain_export_jobs(app):
+    """補撈遺漏的 pending 工作、標記逾時工作、清除過期檔案"""
+    with app.app_context():
+        now = datetime.utcnow()
+
+        stale_ids = [job_id for (job_id,) in db.session.query(ExportJob.id).filter(
+            ExportJob.status == 'pending',
+            ExportJob.created_at < now - timedelta(seconds=STALE_PENDING_SECONDS)
+        ).all()]
+        for job_id in stale_ids:
+            _submit(app, job_id)
+
+        timed_out = ExportJob.query.filter(
+            ExportJob.status == 'running',
+            ExportJob.started_at < now - timedelta(minutes=JOB_TIMEOUT_MINUTES)
+        ).update({
+            'status': 'failed',
+            'error_message': '匯出逾時',
+            'finished_at': now
+        }, synchronize_session=False)
+
+        expired = ExportJob.query.filter(
+            ExportJob.status == 'completed',
+            ExportJob.expires_at < now
+        ).all()
+        for job in expired:
+            if job.file_path and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            job.status = 'expired'
+            job.file_path = None
+        db.session.commit()
+
+        if stale_ids or timed_out or expired:
+            logger.info(f'[Export] requeued={len(stale_ids)} timed_out={timed_out} expired={len(expired)}')
@@ -0,0 +1,133 @@
+"""
+廟宇地理空間索引
+- 以經緯度網格（GRID_DEGREES 一格）分桶，常駐記憶體
+- 查詢時先以外接矩形挑出候選格，再只對候選廟宇計算 Haversine 距離
+- create_temple / update_temple / delete_temple 會主動失效；其他 worker 依 TTL 重建
+"""
+import math
+import os
+import threading
+import time
+from app import db
+from app.models.temple import Temple
+from app.utils.logger import get_logger
+
+logger = get_logger('services.geo_index')
+
+
+EARTH_RADIUS_KM = 6371  # 與 routes.temple.calculate_distance 相同
+GRID_DEGREES = 0.1      # 約 11 公里一格
+INDEX_TTL_SECONDS = int(os.getenv('GEO_INDEX_TTL_SECONDS', 300))
+
+
+def _cell(value):
+    return math.floor(value / GRID_DEGREES)
+
+
+class TempleGeoIndex:
+    """啟用中且有座標的廟宇：cell -> [(temple_id, lat, lon, lat_rad, lon_rad, cos_lat)]"""
+
+    def __init__(self):
+        self._cells = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._cells = None
+
+    def _ensure_built(self):
+        with self._lock:
+            if self._cells is not None and time.monotonic() - self._built_at < INDEX_TTL_SECONDS:
+                return self._cells
+
+        rows = db.session.query(Temple.id, Temple.latitude, Temple.longitude).filter(
+            Temple.latitude.isnot(None),
+            Temple.longitude.isnot(None),
+            Temple.is_active == True
+        ).order_by(Temple.id).all()
+
+        cells = {}
+        for temple_id, lat, lon in rows:
+            lat, lon = float(lat), float(lon)
+            lat_rad, lon_rad = math.radians(lat), math.radians(lon)
+            cells.setdefault((_cell(lat), _cell(lon)), []).append(
+                (temple_id, lat, lon, lat_rad, lon_rad, math.cos(lat_rad))
+            )
+
+        with self._lock:
+            self._cells = cells
+            self._built_at = time.monotonic()
+        logger.info(f'[GeoIndex] built: {len(rows)} temples in {len(cells)} cells')
+        return cells
+
+    def _candidates(self, cells, latitude, longitude, radius_km):
+        """外接矩形內的候選廟宇（保證不漏掉半徑內的廟宇）"""
+        angular = radius_km / EARTH_RADIUS_KM
+        delta_lat = math.degrees(angular)
+        min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+
+        # 球冠的經度範圍；矩形碰到極點時改為全經度
+        cos_lat = math.cos(math.radians(latitude))
+        if max_lat >= 90 or min_lat <= -90 or math.sin(angular) >= cos_lat:
+            delta_lon = 180
+        else:
+            delta_lon = math.degrees(math.asin(math.sin(angular) / cos_lat))
+        min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+
+        if delta_lon >= 180 or (max_lat - min_lat) * (max_lon - min_lon) / GRID_DEGREES ** 2 > len(cells):
+            # 範圍比索引還大：直接掃描所有格
+            buckets = cells.values()
+        else:
+            buckets = []
+            half_turn = round(180 / GRID_DEGREES)
+            lon_cells = range(_cell(min_lon), _cell(max_lon) + 1)
+            for i in range(_cell(min_lat), _cell(max_lat) + 1):
+                for j in lon_cells:
+                    # 跨越 ±180 度經線時換算回索引中的格號
+                    bucket = cells.get((i, (j + half_turn) % (2 * half_turn) - half_turn))
+                    if bucket:
+                        buckets.append(bucket)
+
+        for bucket in buckets:
+            for entry in bucket:
+                if min_lat <= entry[1] <= max_lat:
+                    yield entry
+
+    def nearby(self, latitude, longitude, radius_km):
+        """
+        回傳半徑內的 [(distance_km, temple_id)]
+        依四捨五入後的距離排序，同距離依 temple_id（與逐筆計算的結果一致）
+        """
+        cells = self._ensure_built()
+        lat1 = math.radians(float(latitude))
+        lon1 = math.radians(float(longitude))
+        cos_lat1 = math.cos(lat1)
+
+        results = []
+        for temple_id, _, _, lat2, lon2, cos_lat2 in self._candidates(cells, float(latitude), float(longitude), radius_km):
+            a = math.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * math.sin((lon2 - lon1) / 2) ** 2
+            distance = 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS_KM
+            if distance <= radius_km:
+                results.append((round(distance, 2), temple_id))
+
+        results.sort()
+        return results
+
+
+temple_geo_index = TempleGeoIndex()
+
+
+def find_nearby_temples(latitude, longitude, radius_km, limit):
+    """
+    取得半徑內最近的 limit 間廟宇，回傳 [(temple, distance_km)]
+    只載入結果中的廟宇；索引尚未過期期間被停用/刪除的廟宇會在此排除
+    """
+    hits = temple_geo_index.nearby(latitude, longitude, radius_km)[:max(limit, 0)]
+    if not hits:
+        return []
+    temples = {t.id: t for t in Temple.query.filter(
+        Temple.id.in_([temple_id for _, temple_id in hits]),
+        Temple.is_active == True
+    ).all()}
+    return [(temples[temple_id], distance) for distance, temple_id in hits if temple_id in temples]
@@ -0,0 +1,69 @@
+"""
+圖片處理管線
+- 上傳請求只負責驗證與存放原圖，縮圖在 ProcessPoolExecutor 中產生（不佔用請求執行緒與 GIL）
+- 同一張圖（內容雜湊）在本程序處理中時不重複送出
+- IMAGE_PIPELINE_WORKERS=0 時改為在請求內同步處理（開發/測試用）
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from app.utils.file_upload import render_image_variants
+from app.utils.logger import get_logger
+
+logger = get_logger('services.image_pipeline')
+
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = {}  # target_dir -> Future
+_in_flight_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # 子程序只做圖片運算，不使用資料庫連線
+                _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def _on_done(target_dir, future):
+    with _in_flight_lock:
+        _in_flight.pop(target_dir, None)
+    error = future.exception()
+    if error is not None:
+        logger.error(f'[ImagePipeline] failed {target_dir}: {error}')
+    else:
+        logger.info(f'[ImagePipeline] ready {target_dir} ({len(future.result()["variants"])} sizes)')
+
+
+def submit_variants(source_path, target_dir):
+    """
+    排入縮圖工作；同步處理時回傳 True（已完成），背景處理回傳 False
+    """
+    if IMAGE_WORKERS <= 0:
+        render_image_variants(source_path, target_dir)
+        return True
+
+    with _in_flight_lock:
+        if target_dir in _in_flight:
+            return False
+        try:
+            future = _get_executor().submit(render_image_variants, source_path, target_dir)
+        except RuntimeError as e:
+            # 程序池已關閉（例如程序結束中），改為同步處理
+            logger.warning(f'[ImagePipeline] pool unavailable, rendering inline: {e}')
+            render_image_variants(source_path, target_dir)
+            return True
+        _in_flight[target_dir] = future
+    future.add_done_callback(lambda f: _on_done(target_dir, f))
+    return False
+
+
+def pending_count():
+    with _in_flight_lock:
+        return len(_in_flight)
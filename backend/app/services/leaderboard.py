@@ -0,0 +1,249 @@
+"""
+排行榜服務
+- 以 sorted set 維護 all / week / month 的排名分數
+- 後端可抽換：單機用 process 內記憶體，有設定 REDIS_URL 時使用 Redis ZSET
+- 打卡寫入後增量更新，週/月滑動視窗由排程定期重建
+  （Redis 後端由 scheduler leader 重建一次；記憶體後端每個 worker 以本地排程各自重建）
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from sortedcontainers import SortedList
+from sqlalchemy import func
+from app import db
+from app.models.checkin import Checkin
+from app.models.user import User
+from app.utils.logger import get_logger
+
+logger = get_logger('services.leaderboard')
+
+
+METRICS = ('blessing_points', 'checkins')
+PERIODS = ('all', 'week', 'month')
+PERIOD_DAYS = {'week': 7, 'month': 30}
+
+# 排程重建間隔（分鐘）
+REFRESH_MINUTES = int(os.getenv('LEADERBOARD_REFRESH_MINUTES', 5))
+
+
+def board_key(metric, period):
+    return f'leaderboard:{metric}:{period}'
+
+
+class _SortedSet:
+    """
+    記憶體 sorted set：member -> score，並以 (-score, member) 排序供二分搜尋
+    SortedList 的新增 / 刪除為 O(log n)，每次打卡更新各排行榜的成本不隨用戶數線性成長
+    """
+
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})
+        self.ordered = SortedList((-score, member) for member, score in self.scores.items())
+
+    def set(self, member, score):
+        old = self.scores.get(member)
+        if old is not None:
+            self.ordered.remove((-old, member))
+        self.scores[member] = score
+        self.ordered.add((-score, member))
+
+    def top(self, n):
+        return [(member, -neg) for neg, member in self.ordered.islice(0, n)]
+
+    def count_above(self, score):
+        return self.ordered.bisect_left((-score, float('-inf')))
+
+
+class MemoryLeaderboardBackend:
+    """單機記憶體後端（每個 worker 各自一份，靠排程重建收斂）"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def exists(self, key):
+        return key in self._sets
+
+    def replace(self, key, scores):
+        board = _SortedSet(scores)
+        with self._lock:
+            self._sets[key] = board
+
+    def incr(self, key, member, amount):
+        with self._lock:
+            board = self._sets.get(key)
+            if board is not None:
+                board.set(member, board.scores.get(member, 0) + amount)
+
+    def set_score(self, key, member, score):
+        with self._lock:
+            board = self._sets.get(key)
+            if board is not None:
+                board.set(member, score)
+
+    def top(self, key, n):
+        with self._lock:
+            board = self._sets.get(key)
+            if board is None:
+                return []
+            return board.top(n)
+
+    def score(self, key, member):
+        with self._lock:
+            board = self._sets.get(key)
+            return board.scores.get(member) if board else None
+
+    def count_above(self, key, score):
+        with self._lock:
+            board = self._sets.get(key)
+            return board.count_above(score) if board else 0
+
+
+class RedisLeaderboardBackend:
+    """Redis ZSET 後端（多 worker / 多節點共用）"""
+
+    name = 'redis'
+    CHUNK_SIZE = 1000
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def exists(self, key):
+        return bool(self._redis.exists(f'{key}:built'))
+
+    def replace(self, key, scores):
+        # 先寫入暫存 key 再 RENAME，讀取端不會看到半成品
+        tmp_key = f'{key}:rebuild'
+        pipe = self._redis.pipeline()
+        pipe.delete(tmp_key)
+        items = list(scores.items())
+        for i in range(0, len(items), self.CHUNK_SIZE):
+            pipe.zadd(tmp_key, dict(items[i:i + self.CHUNK_SIZE]))
+        if items:
+            pipe.rename(tmp_key, key)
+        else:
+            pipe.delete(key)
+        pipe.set(f'{key}:built', 1)
+        pipe.execute()
+
+    def incr(self, key, member, amount):
+        if self.exists(key):
+            self._redis.zincrby(key, amount, member)
+
+    def set_score(self, key, member, score):
+        if self.exists(key):
+            self._redis.zadd(key, {member: score})
+
+    def top(self, key, n):
+        return [(int(m), s) for m, s in self._redis.zrevrange(key, 0, n - 1, withscores=True)]
+
+    def score(self, key, member):
+        return self._redis.zscore(key, member)
+
+    def count_above(self, key, score):
+        return self._redis.zcount(key, f'({score}', '+inf')
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """依環境變數選擇後端；Redis 不可用時退回記憶體"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                redis_url = os.getenv('REDIS_URL')
+                if redis_url:
+                    try:
+                        _backend = RedisLeaderboardBackend(redis_url)
+                    except ImportError:
+                        logger.warning('[Leaderboard] REDIS_URL 已設定但未安裝 redis 套件，改用記憶體後端')
+                if _backend is None:
+                    _backend = MemoryLeaderboardBackend()
+                logger.info(f'[Leaderboard] backend={_backend.name}')
+    return _backend
+
+
+def is_shared_backend():
+    """排行榜是否為各 worker 共用（決定重建由 leader 執行或每個 worker 各自執行）"""
+    return get_backend().name == 'redis'
+
+
+# ===== 重建 =====
+
+def _load_scores(metric, period):
+    """由資料庫計算單一排行榜的完整分數"""
+    if metric == 'blessing_points' and period == 'all':
+        rows = db.session.query(User.id, User.blessing_points).filter(User.is_active == True).all()
+    else:
+        value = func.count(Checkin.id) if metric == 'checkins' else func.sum(Checkin.blessing_points)
+        query = db.session.query(Checkin.user_id, value).join(
+            User, User.id == Checkin.user_id
+        ).filter(User.is_active == True)
+        if period in PERIOD_DAYS:
+            query = query.filter(Checkin.timestamp >= datetime.utcnow() - timedelta(days=PERIOD_DAYS[period]))
+        rows = query.group_by(Checkin.user_id).all()
+    return {user_id: int(score or 0) for user_id, score in rows}
+
+
+def rebuild_board(metric, period):
+    get_backend().replace(board_key(metric, period), _load_scores(metric, period))
+
+
+def rebuild_leaderboards(periods=PERIODS):
+    """重建指定期間的所有排行榜（排程呼叫，修正滑動視窗與增量誤差）"""
+    for period in periods:
+        for metric in METRICS:
+            rebuild_board(metric, period)
+    logger.info(f'[Leaderboard] rebuilt periods={",".join(periods)}')
+
+
+def _ensure_board(metric, period):
+    if not get_backend().exists(board_key(metric, period)):
+        rebuild_board(metric, period)
+
+
+# ===== 寫入 =====
+
+def record_checkin(user_id, checkin_points, balance=None):
+    """
+    打卡 commit 後呼叫，增量更新排行榜
+    balance 為用戶目前功德值（更新 all 期間的功德值榜）
+    """
+    try:
+        backend = get_backend()
+        for period in PERIODS:
+            backend.incr(board_key('checkins', period), user_id, 1)
+        for period in PERIOD_DAYS:
+            backend.incr(board_key('blessing_points', period), user_id, checkin_points)
+        if balance is not None:
+            backend.set_score(board_key('blessing_points', 'all'), user_id, balance)
+    except Exception as e:
+        # 排行榜只是快取，更新失敗不影響打卡，等排程重建
+        logger.error(f'[Leaderboard] incremental update failed: {e}')
+
+
+# ===== 讀取 =====
+
+def get_top(metric, period, limit):
+    """取前 N 名，回傳 [(user_id, score)]"""
+    _ensure_board(metric, period)
+    return get_backend().top(board_key(metric, period), limit)
+
+
+def get_rank(metric, user_id, period='all', score=None):
+    """
+    回傳 (rank, score)；rank = 分數嚴格大於自己的人數 + 1
+    score 未提供時取排行榜中記錄的分數
+    """
+    _ensure_board(metric, period)
+    backend = get_backend()
+    key = board_key(metric, period)
+    if score is None:
+        score = backend.score(key, user_id) or 0
+    return backend.count_above(key, score) + 1, int(score)
@@ -0,0 +1,151 @@
+"""
+LINE multicast 發送器
+- 共用 line_service 的 keep-alive 連線池，以有上限的執行緒數並行發送各批次
+- token bucket 控制每秒請求數（同一 worker 內所有發送共用），不超過 LINE 的速率限制
+- 429 / 5xx / 連線錯誤以指數退避重試（優先採用 Retry-After）；每批帶固定的 X-Line-Retry-Key，
+  重送已被 LINE 接受的批次時回傳 409，視為已送達而不會重複推播
+- HTTP 在背景執行緒進行，結果交回呼叫端執行緒處理（資料庫寫入不跨執行緒）
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from app.services import line_service
+from app.utils.logger import get_logger
+
+logger = get_logger('services.line_dispatcher')
+
+
+# LINE multicast 速率限制為每秒 200 次請求（每個 channel），預設保留餘裕
+MULTICAST_RATE_PER_SECOND = float(os.getenv('LINE_MULTICAST_RATE', 100))
+MULTICAST_BURST = int(os.getenv('LINE_MULTICAST_BURST', 20))
+SEND_CONCURRENCY = int(os.getenv('LINE_SEND_CONCURRENCY', 8))
+MAX_RETRIES = int(os.getenv('LINE_SEND_MAX_RETRIES', 5))
+BACKOFF_BASE_SECONDS = float(os.getenv('LINE_SEND_BACKOFF_BASE', 0.5))
+BACKOFF_MAX_SECONDS = float(os.getenv('LINE_SEND_BACKOFF_MAX', 30))
+
+
+class TokenBucket:
+    """每秒補充 rate 個 token、最多累積 capacity 個；acquire 在 token 不足時等待"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self.waited_seconds += wait
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """收到 429 時讓所有執行緒一起暫停（清空 token 並延後補充）"""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = max(self._updated, time.monotonic() + seconds)
+
+
+multicast_bucket = TokenBucket(MULTICAST_RATE_PER_SECOND, MULTICAST_BURST)
+
+
+class ChunkResult:
+    """單一批次的發送結果"""
+
+    __slots__ = ('ok', 'status_code', 'attempts', 'error', 'duplicate')
+
+    def __init__(self, ok, status_code=None, attempts=0, error=None, duplicate=False):
+        self.ok = ok
+        self.status_code = status_code
+        self.attempts = attempts
+        self.error = error
+        self.duplicate = duplicate  # 409：此 retry key 已被 LINE 接受過
+
+
+def _retry_after(resp):
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _backoff(attempt):
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def send_chunk(recipients, messages, retry_key, bucket=None):
+    """發送單一批次（含重試），回傳 ChunkResult"""
+    bucket = bucket or multicast_bucket
+    status_code = None
+    error = None
+
+    for attempt in range(1, MAX_RETRIES + 2):
+        bucket.acquire()
+        try:
+            resp = line_service.multicast_message(recipients, messages, retry_key=retry_key)
+        except requests.RequestException as e:
+            status_code, error = None, str(e)
+            delay = _backoff(attempt)
+        else:
+            status_code = resp.status_code
+            if resp.ok:
+                return ChunkResult(True, status_code, attempt)
+            if status_code == 409:
+                return ChunkResult(True, status_code, attempt, duplicate=True)
+
+            error = resp.text[:500]
+            if status_code == 429:
+                # 每月訊息額度用完時重試無效
+                if 'monthly limit' in error:
+                    return ChunkResult(False, status_code, attempt, error)
+                delay = _retry_after(resp) or _backoff(attempt)
+                bucket.pause(delay)
+            elif status_code >= 500:
+                delay = _retry_after(resp) or _backoff(attempt)
+            else:
+                # 其餘 4xx（格式錯誤、token 無效）重試也不會成功
+                return ChunkResult(False, status_code, attempt, error)
+
+        if attempt <= MAX_RETRIES:
+            logger.warning(f'[LINE] multicast retry {attempt}/{MAX_RETRIES} in {delay:.2f}s (status={status_code})')
+            time.sleep(delay)
+
+    return ChunkResult(False, status_code, MAX_RETRIES + 1, error)
+
+
+def dispatch_multicast(chunks, messages, on_result, concurrency=None):
+    """
+    並行發送多個批次
+    chunks：[(key, recipients, retry_key), ...]
+    on_result(key, ChunkResult) 於呼叫端執行緒依完成順序呼叫（可在其中寫入進度）
+    """
+    if not chunks:
+        return
+    workers = max(1, min(concurrency or SEND_CONCURRENCY, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='line-multicast') as executor:
+        futures = {
+            executor.submit(send_chunk, recipients, messages, retry_key): key
+            for key, recipients, retry_key in chunks
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = ChunkResult(False, error=str(e))
+            on_result(futures[future], result)
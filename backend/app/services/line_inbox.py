@@ -0,0 +1,266 @@
+"""
+LINE webhook 事件收件匣
+- webhook 驗證簽章後只把事件寫入 line_webhook_events（webhookEventId 唯一，LINE 重送的事件直接略過）並立即回應
+- 背景執行緒池依來源（userId）處理：每次只認領該來源最早一筆未完成的事件，
+  前一筆仍在處理中時不會處理後面的事件，多個 gunicorn worker 同時處理也能維持同一用戶的順序
+- 排程補撈遺漏的事件（例如寫入後 worker 重啟）、清除過期紀錄；處理延遲與佇列深度見 get_stats
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.line_webhook_event import LineWebhookEvent
+from app.utils.logger import get_logger
+
+logger = get_logger('services.line_inbox')
+
+
+WEBHOOK_WORKERS = int(os.getenv('LINE_WEBHOOK_WORKERS', 4))
+# processing 超過此秒數視為處理中斷，可由其他 worker 重新認領
+PROCESSING_TIMEOUT_SECONDS = int(os.getenv('LINE_WEBHOOK_PROCESSING_TIMEOUT', 120))
+RETENTION_DAYS = int(os.getenv('LINE_WEBHOOK_RETENTION_DAYS', 7))
+# 寫入超過此秒數仍為 pending 的事件由排程補撈
+STALE_PENDING_SECONDS = 30
+LATENCY_WINDOW = 1000
+
+_handler = None
+_executor = None
+_executor_lock = threading.Lock()
+
+# 本程序正在處理 / 處理期間又收到新事件的來源
+_active_sources = set()
+_rerun_sources = set()
+_state_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {'received': 0, 'duplicates': 0, 'processed': 0, 'failed': 0}
+_latencies_ms = deque(maxlen=LATENCY_WINDOW)
+
+
+def set_event_handler(handler):
+    """註冊事件處理函式 handler(event_dict)（由 routes.line_webhook 於載入時註冊）"""
+    global _handler
+    _handler = handler
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='line-webhook')
+    return _executor
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _source_key(event):
+    source = event.get('source') or {}
+    return source.get('userId') or source.get('groupId') or source.get('roomId') or '-'
+
+
+def _event_id(event):
+    """webhookEventId；舊格式事件沒有時以事件內容雜湊代替"""
+    event_id = event.get('webhookEventId')
+    if event_id:
+        return event_id
+    return 'sha1:' + hashlib.sha1(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# ===== 寫入 =====
+
+def enqueue_events(app, events):
+    """
+    寫入收件匣並交給背景處理，回傳新寫入的筆數
+    已存在的 webhookEventId（LINE 重送）不會再寫入
+    """
+    if not events:
+        return 0
+    _count('received', len(events))
+
+    rows = {}
+    for event in events:
+        rows.setdefault(_event_id(event), event)
+    existing = {event_id for (event_id,) in db.session.query(LineWebhookEvent.webhook_event_id).filter(
+        LineWebhookEvent.webhook_event_id.in_(list(rows))
+    ).all()}
+
+    now = datetime.utcnow()
+    sources = set()
+    inserted = 0
+    for event_id, event in rows.items():
+        if event_id in existing:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(LineWebhookEvent(
+                    webhook_event_id=event_id,
+                    event_type=event.get('type') or 'unknown',
+                    source_key=_source_key(event),
+                    event_timestamp=int(event.get('timestamp') or now.timestamp() * 1000),
+                    payload=event,
+                    is_redelivery=bool((event.get('deliveryContext') or {}).get('isRedelivery')),
+                    received_at=now
+                ))
+            sources.add(_source_key(event))
+            inserted += 1
+        except IntegrityError:
+            # 同一事件同時由另一個請求寫入
+            pass
+    db.session.commit()
+
+    duplicates = len(events) - inserted
+    if duplicates:
+        _count('duplicates', duplicates)
+    for source_key in sources:
+        schedule_source(app, source_key)
+    return inserted
+
+
+# ===== 處理 =====
+
+def schedule_source(app, source_key):
+    """安排處理某來源的事件；本程序已在處理時只標記需重新檢查"""
+    with _state_lock:
+        if source_key in _active_sources:
+            _rerun_sources.add(source_key)
+            return
+        _active_sources.add(source_key)
+    _get_executor().submit(_drain_source, app, source_key)
+
+
+def _drain_source(app, source_key):
+    while True:
+        try:
+            with app.app_context():
+                while _process_next(source_key):
+                    pass
+        except Exception as e:
+            logger.error(f'[LineInbox] drain {source_key} error: {e}')
+
+        with _state_lock:
+            if source_key in _rerun_sources:
+                _rerun_sources.discard(source_key)
+                continue
+            _active_sources.discard(source_key)
+            return
+
+
+def _process_next(source_key):
+    """
+    認領並處理該來源最早一筆未完成的事件，回傳是否處理了事件
+    最早一筆仍在其他 worker 處理中時回傳 False（由該 worker 接續處理）
+    """
+    now = datetime.utcnow()
+    event = LineWebhookEvent.query.filter(
+        LineWebhookEvent.source_key == source_key,
+        LineWebhookEvent.status.in_(('pending', 'processing'))
+    ).order_by(LineWebhookEvent.event_timestamp, LineWebhookEvent.id).first()
+    if event is None:
+        return False
+    event_id, received_at, payload = event.id, event.received_at, event.payload
+
+    stale_before = now - timedelta(seconds=PROCESSING_TIMEOUT_SECONDS)
+    claimed = LineWebhookEvent.query.filter(
+        LineWebhookEvent.id == event_id,
+        or_(
+            LineWebhookEvent.status == 'pending',
+            (LineWebhookEvent.status == 'processing') & (LineWebhookEvent.started_at < stale_before)
+        )
+    ).update({
+        'status': 'processing',
+        'started_at': now,
+        'attempts': LineWebhookEvent.attempts + 1
+    }, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return False
+
+    status, error = 'done', None
+    try:
+        if _handler is None:
+            raise RuntimeError('LINE webhook handler not registered')
+        _handler(payload)
+    except Exception as e:
+        db.session.rollback()
+        status, error = 'failed', str(e)[:2000]
+        logger.error(f'[LineInbox] event {event_id} ({payload.get("type")}) failed: {e}')
+
+    finished = datetime.utcnow()
+    LineWebhookEvent.query.filter_by(id=event_id).update({
+        'status': status,
+        'error_message': error,
+        'processed_at': finished
+    }, synchronize_session=False)
+    db.session.commit()
+
+    _count('processed' if status == 'done' else 'failed')
+    with _stats_lock:
+        _latencies_ms.append((finished - received_at).total_seconds() * 1000)
+    return True
+
+
+# ===== 排程維護 =====
+
+def maintain_inbox(app):
+    """補撈遺漏的 pending / 中斷的 processing 事件，清除超過保留天數的已完成紀錄"""
+    now = datetime.utcnow()
+    sources = [source for (source,) in db.session.query(LineWebhookEvent.source_key).filter(
+        or_(
+            (LineWebhookEvent.status == 'pending')
+            & (LineWebhookEvent.received_at < now - timedelta(seconds=STALE_PENDING_SECONDS)),
+            (LineWebhookEvent.status == 'processing')
+            & (LineWebhookEvent.started_at < now - timedelta(seconds=PROCESSING_TIMEOUT_SECONDS))
+        )
+    ).distinct().all()]
+    for source_key in sources:
+        schedule_source(app, source_key)
+
+    purged = LineWebhookEvent.query.filter(
+        LineWebhookEvent.status.in_(('done', 'failed')),
+        LineWebhookEvent.received_at < now - timedelta(days=RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    if sources or purged:
+        logger.info(f'[LineInbox] requeued sources={len(sources)} purged={purged}')
+
+
+def get_stats():
+    """佇列深度（資料庫）與本程序的處理計數、延遲（需在 app context 內呼叫）"""
+    depth = dict(db.session.query(LineWebhookEvent.status, func.count()).filter(
+        LineWebhookEvent.status.in_(('pending', 'processing'))
+    ).group_by(LineWebhookEvent.status).all())
+    oldest = db.session.query(func.min(LineWebhookEvent.received_at)).filter(
+        LineWebhookEvent.status == 'pending'
+    ).scalar()
+
+    with _stats_lock:
+        stats = dict(_stats)
+        latencies = sorted(_latencies_ms)
+    with _state_lock:
+        active = len(_active_sources)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1) if latencies else None
+
+    stats.update({
+        'pending': depth.get('pending', 0),
+        'processing': depth.get('processing', 0),
+        'oldest_pending_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0,
+        'active_sources': active,
+        'latency_ms_avg': round(sum(latencies) / len(latencies), 1) if latencies else None,
+        'latency_ms_p50': percentile(0.5),
+        'latency_ms_p95': percentile(0.95),
+        'latency_ms_max': round(latencies[-1], 1) if latencies else None
+    })
+    return stats
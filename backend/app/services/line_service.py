@@ -5,7 +5,9 @@ import os
 import hmac
 import hashlib
 import base64
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
 from app.utils.logger import get_logger
 
@@ -14,7 +16,14 @@ logger = get_logger('services.line_service')
 
 LINE_API_BASE = 'https://api.line.me/v2'
 LINE_API_DATA = 'https://api-data.line.me/v2'
-LINE_API_MESSAGING = 'https://api.line.me/v2/bot'
+# 可指向本機的 LINE API stub 以測試推播流程
+LINE_API_MESSAGING = os.getenv('LINE_API_MESSAGING_URL', 'https://api.line.me/v2/bot').rstrip('/')
+
+LINE_HTTP_POOL_SIZE = int(os.getenv('LINE_HTTP_POOL_SIZE', 10))
+LINE_HTTP_TIMEOUT = (3.05, float(os.getenv('LINE_HTTP_TIMEOUT', 15)))  # (連線, 讀取) 秒
+
+_session = None
+_session_lock = threading.Lock()
 
 
 def get_channel_token():
@@ -48,16 +57,31 @@ def _headers():
     }
 
 
+def get_session():
+    """共用的 HTTP session（keep-alive 連線池，多執行緒共用）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=LINE_HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
 # ===== 回覆訊息 =====
 
 def reply_message(reply_token, messages):
     """回覆訊息（回覆用戶觸發的事件）"""
     if not isinstance(messages, list):
         messages = [messages]
-    resp = requests.post(
+    resp = get_session().post(
         f'{LINE_API_MESSAGING}/message/reply',
         headers=_headers(),
-        json={'replyToken': reply_token, 'messages': messages}
+        json={'replyToken': reply_token, 'messages': messages},
+        timeout=LINE_HTTP_TIMEOUT
     )
     if not resp.ok:
         logger.error(f'[LINE] reply_message error: {resp.status_code} {resp.text}')
@@ -68,10 +92,11 @@ def push_message(to, messages):
     """主動推播訊息給單一用戶"""
     if not isinstance(messages, list):
         messages = [messages]
-    resp = requests.post(
+    resp = get_session().post(
         f'{LINE_API_MESSAGING}/message/push',
         headers=_headers(),
-        json={'to': to, 'messages': messages}
+        json={'to': to, 'messages': messages},
+        timeout=LINE_HTTP_TIMEOUT
     )
     if not resp.ok:
         logger.error(f'[LINE] push_message error: {resp.status_code} {resp.text}')
@@ -82,26 +107,35 @@ def broadcast_message(messages):
     """群發訊息給所有好友"""
     if not isinstance(messages, list):
         messages = [messages]
-    resp = requests.post(
+    resp = get_session().post(
         f'{LINE_API_MESSAGING}/message/broadcast',
         headers=_headers(),
-        json={'messages': messages}
+        json={'messages': messages},
+        timeout=LINE_HTTP_TIMEOUT
     )
     if not resp.ok:
         logger.error(f'[LINE] broadcast_message error: {resp.status_code} {resp.text}')
     return resp
 
 
-def multicast_message(to_list, messages):
-    """推播訊息給多個用戶"""
+def multicast_message(to_list, messages, retry_key=None):
+    """
+    推播訊息給多個用戶（每次最多 500 人）
+    retry_key：X-Line-Retry-Key（UUID），以同一個 key 重送時 LINE 回傳 409 而不會重複推播
+    連線錯誤會拋出 requests.RequestException，由呼叫端決定是否重試
+    """
     if not isinstance(messages, list):
         messages = [messages]
-    resp = requests.post(
+    headers = _headers()
+    if retry_key:
+        headers['X-Line-Retry-Key'] = retry_key
+    resp = get_session().post(
         f'{LINE_API_MESSAGING}/message/multicast',
-        headers=_headers(),
-        json={'to': to_list, 'messages': messages}
+        headers=headers,
+        json={'to': to_list, 'messages': messages},
+        timeout=LINE_HTTP_TIMEOUT
     )
-    if not resp.ok:
+    if not resp.ok and not (retry_key and resp.status_code == 409):
         logger.error(f'[LINE] multicast_message error: {resp.status_code} {resp.text}')
     return resp
 
@@ -110,9 +144,10 @@ def multicast_message(to_list, messages):
 
 def get_profile(user_id):
     """取得 LINE 用戶基本資料"""
-    resp = requests.get(
+    resp = get_session().get(
         f'{LINE_API_MESSAGING}/profile/{user_id}',
-        headers=_headers()
+        headers=_headers(),
+        timeout=LINE_HTTP_TIMEOUT
     )
     if resp.ok:
         return resp.json()
@@ -0,0 +1,258 @@
+"""
+會員分析服務
+- 以少量分組聚合查詢計算 /analytics/members 所有區塊
+- 查詢次數固定，不隨會員人數增加
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from app import db
+from app.models.checkin import Checkin
+from app.models.public_user import PublicUser
+from app.models.redemption import Redemption
+
+
+# 計入消費金額的訂單狀態
+SPEND_STATUSES = ('completed', 'shipped', 'processing')
+
+FREQUENCY_RANGES = [
+    ('1次', 1, 1),
+    ('2-5次', 2, 5),
+    ('6-10次', 6, 10),
+    ('11-20次', 11, 20),
+    ('20+次', 21, 9999)
+]
+
+SPEND_RANGES = [
+    ('未消費', 0, 0),
+    ('1-100', 1, 100),
+    ('101-500', 101, 500),
+    ('501-1000', 501, 1000),
+    ('1000+', 1001, 999999999)
+]
+
+TOP_DEVOTEES_LIMIT = 10
+
+
+def _percentage(count, total):
+    return round((count / total * 100), 1) if total > 0 else 0
+
+
+def _mask_name(name):
+    name = name or ''
+    if len(name) >= 2:
+        return name[0] + '*' * (len(name) - 1)
+    return '***'
+
+
+def _daily_counts(date_column, temple_column, temple_id, since):
+    """單次 GROUP BY 取得每日筆數 {'YYYY-MM-DD': count}"""
+    day = func.date(date_column)
+    rows = db.session.query(day, func.count()).filter(
+        temple_column == temple_id,
+        date_column >= since
+    ).group_by(day).all()
+    return {str(d)[:10]: c for d, c in rows}
+
+
+def build_member_analytics(temple_id, period_days, now=None):
+    """
+    計算會員分析資料（回應格式與 get_member_analytics 相同）
+    共 6 次查詢：打卡聚合、訂單聚合、Top 信眾、兩組每日趨勢、近 30 天打卡日期
+    """
+    now = now or datetime.utcnow()
+    active_threshold = now - timedelta(days=30)
+    dormant_threshold = now - timedelta(days=90)
+    last_month_start = now - timedelta(days=60)
+
+    # ===== 每位會員的打卡聚合（首次/最後/次數/上月是否活躍）=====
+    checkin_rows = db.session.query(
+        Checkin.user_id,
+        func.min(Checkin.timestamp),
+        func.max(Checkin.timestamp),
+        func.count(Checkin.id),
+        func.sum(case(
+            ((Checkin.timestamp >= last_month_start) & (Checkin.timestamp < active_threshold), 1),
+            else_=0
+        ))
+    ).filter(
+        Checkin.temple_id == temple_id
+    ).group_by(Checkin.user_id).all()
+
+    # ===== 每位會員的訂單聚合（任意訂單數/有效訂單數/消費金額）=====
+    is_spend = Redemption.status.in_(SPEND_STATUSES)
+    order_rows = db.session.query(
+        Redemption.user_id,
+        func.count(Redemption.id),
+        func.sum(case((is_spend, 1), else_=0)),
+        func.sum(case((is_spend, Redemption.merit_points_used), else_=0))
+    ).filter(
+        Redemption.temple_id == temple_id
+    ).group_by(Redemption.user_id).all()
+    orders_by_user = {
+        uid: (any_count, int(valid_count or 0), int(spend or 0))
+        for uid, any_count, valid_count, spend in order_rows
+    }
+
+    total_members = len(checkin_rows)
+    active_members = 0
+    new_members = 0
+    dormant_count = 0
+    multi_interaction = 0
+    made_order_count = 0
+    repeat_order_count = 0
+    last_month_active = 0
+    retained_count = 0
+    frequency_counts = [0] * len(FREQUENCY_RANGES)
+    spend_counts = [0] * len(SPEND_RANGES)
+    tenure_counts = {
+        'newcomer': 0,      # <30天
+        'establishing': 0,  # 1-6個月
+        'loyal': 0,         # 6-12個月
+        'veteran': 0        # >1年
+    }
+
+    for user_id, first_at, last_at, checkin_count, last_month_hits in checkin_rows:
+        any_orders, valid_orders, spend = orders_by_user.get(user_id, (0, 0, 0))
+        is_active = last_at >= active_threshold
+
+        if is_active:
+            active_members += 1
+            if valid_orders > 0:
+                made_order_count += 1
+            if valid_orders > 1:
+                repeat_order_count += 1
+        if first_at >= active_threshold:
+            new_members += 1
+        if last_at < dormant_threshold:
+            dormant_count += 1
+        if last_month_hits:
+            last_month_active += 1
+            if is_active:
+                retained_count += 1
+        if any_orders:
+            multi_interaction += 1
+
+        for idx, (_, low, high) in enumerate(FREQUENCY_RANGES):
+            if low <= checkin_count <= high:
+                frequency_counts[idx] += 1
+                break
+        for idx, (_, low, high) in enumerate(SPEND_RANGES):
+            if low <= spend <= high:
+                spend_counts[idx] += 1
+                break
+
+        days_since = (now - first_at).days
+        if days_since < 30:
+            tenure_counts['newcomer'] += 1
+        elif days_since < 180:
+            tenure_counts['establishing'] += 1
+        elif days_since < 365:
+            tenure_counts['loyal'] += 1
+        else:
+            tenure_counts['veteran'] += 1
+
+    overview = {
+        'total_members': total_members,
+        'active_members': active_members,
+        'active_rate': _percentage(active_members, total_members),
+        'new_members': new_members,
+        'dormant_members': dormant_count,
+        'dormant_rate': _percentage(dormant_count, total_members)
+    }
+
+    # ===== Activity Trend 活動趨勢（每日一次 GROUP BY）=====
+    trend_start = (now - timedelta(days=period_days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    daily_checkins = _daily_counts(Checkin.timestamp, Checkin.temple_id, temple_id, trend_start)
+    daily_orders = _daily_counts(Redemption.redeemed_at, Redemption.temple_id, temple_id, trend_start)
+    activity_trend = []
+    for i in range(period_days):
+        date_key = (trend_start + timedelta(days=i)).strftime('%Y-%m-%d')
+        activity_trend.append({
+            'date': date_key,
+            'checkins': daily_checkins.get(date_key, 0),
+            'orders': daily_orders.get(date_key, 0),
+            'events': 0  # TODO: 活動報名數
+        })
+
+    # ===== Interaction Types 互動類型分布 =====
+    # 會員母體來自打卡紀錄，因此「僅下單」恆為 0
+    interaction_types = [
+        {'type': '僅打卡', 'count': total_members - multi_interaction},
+        {'type': '僅下單', 'count': 0},
+        {'type': '多元互動', 'count': multi_interaction}
+    ]
+
+    checkin_frequency = [
+        {'range': label, 'count': count, 'percentage': _percentage(count, total_members)}
+        for (label, _, _), count in zip(FREQUENCY_RANGES, frequency_counts)
+    ]
+    spend_distribution = [
+        {'range': label, 'count': count, 'percentage': _percentage(count, total_members)}
+        for (label, _, _), count in zip(SPEND_RANGES, spend_counts)
+    ]
+
+    # ===== Top Devotees（資料庫排序後只取前 10 名）=====
+    checkin_count_col = func.count(Checkin.id)
+    top_rows = db.session.query(
+        Checkin.user_id,
+        PublicUser.name,
+        checkin_count_col
+    ).join(
+        PublicUser, PublicUser.id == Checkin.user_id
+    ).filter(
+        Checkin.temple_id == temple_id
+    ).group_by(
+        Checkin.user_id, PublicUser.name
+    ).order_by(
+        checkin_count_col.desc(), Checkin.user_id.asc()
+    ).limit(TOP_DEVOTEES_LIMIT).all()
+    top_devotees = [{
+        'public_user_id': user_id,
+        'name_masked': _mask_name(name),
+        'checkins_count': checkins_count,
+        'spend_total': orders_by_user.get(user_id, (0, 0, 0))[2]
+    } for user_id, name, checkins_count in top_rows]
+
+    funnel = {
+        'all_members': total_members,
+        'active_30d': active_members,
+        'made_order': made_order_count,
+        'repeat_order': repeat_order_count
+    }
+
+    # ===== Retention 留存指標 =====
+    # 週回訪率：近 30 天內跨 2 個以上 ISO 週有打卡（依日期去重後在 Python 換算週次）
+    day = func.date(Checkin.timestamp)
+    recent_days = db.session.query(Checkin.user_id, day).filter(
+        Checkin.temple_id == temple_id,
+        Checkin.timestamp >= active_threshold
+    ).group_by(Checkin.user_id, day).all()
+    weeks_by_user = {}
+    for user_id, checkin_day in recent_days:
+        week_num = datetime.strptime(str(checkin_day)[:10], '%Y-%m-%d').isocalendar()[1]
+        weeks_by_user.setdefault(user_id, set()).add(week_num)
+    multi_week_users = sum(1 for weeks in weeks_by_user.values() if len(weeks) >= 2)
+
+    retention = {
+        'mom_retention_rate': _percentage(retained_count, last_month_active),
+        'weekly_return_rate': _percentage(multi_week_users, active_members),
+        'churned_this_month': last_month_active - retained_count,
+        'avg_return_days': 12  # 預設值，完整實現需更複雜計算
+    }
+
+    member_tenure = [
+        {'tenure': tenure, 'count': count, 'percentage': _percentage(count, total_members)}
+        for tenure, count in tenure_counts.items()
+    ]
+
+    return {
+        'overview': overview,
+        'activity_trend': activity_trend,
+        'interaction_types': interaction_types,
+        'checkin_frequency': checkin_frequency,
+        'spend_distribution': spend_distribution,
+        'top_devotees': top_devotees,
+        'funnel': funnel,
+        'retention': retention,
+        'member_tenure': member_tenure
+    }
@@ -0,0 +1,294 @@
+"""
+廟方通知的站內通知發送（fan-out）
+- write 模式（預設）：以 INSERT ... SELECT 依用戶 ID 區間分批寫入 notifications，每批獨立交易，
+  符合的用戶由 SQL 計算（LINE 用戶電話對應用戶收件地址電話），重複執行不會重複寫入
+- read 模式：受眾為全部追蹤者時只寫入一列 notification_broadcasts，
+  用戶讀取通知列表時與個人已讀紀錄（notification_receipts）合併；其餘受眾仍以 write 模式寫入
+"""
+import os
+from datetime import datetime
+from sqlalchemy import select, insert, func, literal, exists, and_, union_all
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.address import Address
+from app.models.line_user import LineUser
+from app.models.notification import Notification
+from app.models.notification_broadcast import NotificationBroadcast, NotificationReceipt
+from app.services.audience import audience_conditions
+from app.utils.logger import get_logger
+
+logger = get_logger('services.notification_fanout')
+
+
+FANOUT_MODE = os.getenv('APP_NOTIFICATION_FANOUT', 'write')  # write / read
+FANOUT_BATCH_SIZE = int(os.getenv('APP_NOTIFICATION_BATCH_SIZE', 1000))
+
+TEMPLE_NOTIFICATION_TYPE = 'temple_announcement'
+TEMPLE_NOTIFICATION_SOURCE = 'temple_notification'
+
+
+def _linked_line_phones(conditions):
+    return select(LineUser.phone).where(*conditions, LineUser.phone.isnot(None))
+
+
+def _matched_user_ids(conditions):
+    """符合受眾的用戶 ID（用戶收件地址電話與 LINE 用戶電話相同）"""
+    return select(Address.user_id).where(Address.phone.in_(_linked_line_phones(conditions)))
+
+
+def fan_out_temple_notification(notif):
+    """發送廟方通知的站內通知，回傳收件人數"""
+    conditions = audience_conditions(
+        notif.temple_id,
+        notif.target_audience,
+        notif.target_event_id,
+        notif.target_filters
+    )
+    if conditions is None:
+        return 0
+    if FANOUT_MODE == 'read' and notif.target_audience == 'all':
+        return _create_broadcast(notif, conditions)
+    return _insert_notifications(notif, conditions)
+
+
+def _insert_notifications(notif, conditions):
+    """依用戶 ID 區間分批 INSERT ... SELECT，每批 commit 一次"""
+    matched = _matched_user_ids(conditions)
+    now = datetime.utcnow()
+    already_sent = exists().where(
+        Notification.related_type == TEMPLE_NOTIFICATION_SOURCE,
+        Notification.related_id == notif.id,
+        Notification.user_id == Address.user_id
+    )
+
+    total = 0
+    last_id = 0
+    while True:
+        # 只取本批 ID 範圍的上界，資料本身不經過應用程式
+        batch = db.session.execute(
+            select(Address.user_id)
+            .where(Address.user_id.in_(matched), Address.user_id > last_id)
+            .distinct()
+            .order_by(Address.user_id)
+            .limit(FANOUT_BATCH_SIZE)
+        ).scalars().all()
+        if not batch:
+            break
+        upper = batch[-1]
+
+        rows = select(
+            Address.user_id,
+            literal(TEMPLE_NOTIFICATION_TYPE),
+            literal(notif.title),
+            literal(notif.content),
+            literal(TEMPLE_NOTIFICATION_SOURCE),
+            literal(notif.id),
+            literal(False),
+            literal(now)
+        ).where(
+            Address.user_id > last_id,
+            Address.user_id <= upper,
+            Address.user_id.in_(matched),
+            ~already_sent
+        ).distinct()
+        result = db.session.execute(insert(Notification).from_select(
+            ['user_id', 'type', 'title', 'content', 'related_type', 'related_id', 'is_read', 'created_at'],
+            rows
+        ))
+        db.session.commit()
+
+        total += len(batch)
+        last_id = upper
+        if len(batch) < FANOUT_BATCH_SIZE:
+            break
+        logger.info(f'[Fanout] notification {notif.id}: {total} users so far (inserted {result.rowcount})')
+    return total
+
+
+def _create_broadcast(notif, conditions):
+    """只寫入一則廣播，回傳目前對應到的用戶數"""
+    try:
+        with db.session.begin_nested():
+            db.session.add(NotificationBroadcast(
+                temple_id=notif.temple_id,
+                type=TEMPLE_NOTIFICATION_TYPE,
+                title=notif.title,
+                content=notif.content,
+                related_type=TEMPLE_NOTIFICATION_SOURCE,
+                related_id=notif.id
+            ))
+    except IntegrityError:
+        # 續傳時廣播已存在
+        pass
+    db.session.commit()
+
+    return db.session.execute(
+        select(func.count(func.distinct(Address.user_id)))
+        .where(Address.phone.in_(_linked_line_phones(conditions)))
+    ).scalar() or 0
+
+
+# ===== 讀取端（fan-out-on-read 合併） =====
+
+def broadcast_recipient(user):
+    """用戶是否收得到廣播（有收件地址電話對應到追蹤中的 LINE 用戶）"""
+    return db.session.query(exists().where(
+        Address.user_id == user.id,
+        Address.phone.in_(_linked_line_phones(audience_conditions(None, 'all')))
+    )).scalar()
+
+
+def _broadcast_query(user, *columns):
+    """用戶可見的廣播（註冊後建立、未刪除），外接該用戶的已讀紀錄"""
+    return select(*columns).select_from(NotificationBroadcast).outerjoin(
+        NotificationReceipt,
+        and_(NotificationReceipt.broadcast_id == NotificationBroadcast.id,
+             NotificationReceipt.user_id == user.id)
+    ).where(
+        NotificationReceipt.deleted_at.is_(None),
+        NotificationBroadcast.created_at >= user.created_at
+    )
+
+
+def inbox_select(user, is_read=None, notification_type=None, include_broadcasts=True):
+    """
+    個人通知與廣播合併的查詢（欄位同 Notification.to_dict，另加 is_broadcast）
+    廣播的 id 以負數表示，與個人通知的 id 不衝突
+    """
+    personal = select(
+        Notification.id,
+        Notification.type,
+        Notification.title,
+        Notification.content,
+        Notification.related_type,
+        Notification.related_id,
+        Notification.data,
+        Notification.is_read,
+        Notification.read_at,
+        Notification.created_at,
+        literal(False).label('is_broadcast')
+    ).where(Notification.user_id == user.id)
+    if is_read is not None:
+        personal = personal.where(Notification.is_read == is_read)
+    if notification_type:
+        personal = personal.where(Notification.type == notification_type)
+    if not include_broadcasts:
+        return personal.subquery()
+
+    broadcasts = _broadcast_query(
+        user,
+        (-NotificationBroadcast.id).label('id'),
+        NotificationBroadcast.type,
+        NotificationBroadcast.title,
+        NotificationBroadcast.content,
+        NotificationBroadcast.related_type,
+        NotificationBroadcast.related_id,
+        NotificationBroadcast.data,
+        NotificationReceipt.read_at.isnot(None).label('is_read'),
+        NotificationReceipt.read_at,
+        NotificationBroadcast.created_at,
+        literal(True).label('is_broadcast')
+    )
+    if is_read is not None:
+        broadcasts = broadcasts.where(
+            NotificationReceipt.read_at.isnot(None) if is_read else NotificationReceipt.read_at.is_(None)
+        )
+    if notification_type:
+        broadcasts = broadcasts.where(NotificationBroadcast.type == notification_type)
+    return union_all(personal, broadcasts).subquery()
+
+
+def inbox_item(row):
+    return {
+        'id': row.id,
+        'type': row.type,
+        'title': row.title,
+        'content': row.content,
+        'related_type': row.related_type,
+        'related_id': row.related_id,
+        'data': row.data,
+        'is_read': bool(row.is_read),
+        'read_at': row.read_at.isoformat() if row.read_at else None,
+        'created_at': row.created_at.isoformat(),
+        'is_broadcast': bool(row.is_broadcast)
+    }
+
+
+def _upsert_receipt(user_id, broadcast_id, **values):
+    receipt = NotificationReceipt.query.filter_by(user_id=user_id, broadcast_id=broadcast_id).first()
+    if receipt is None:
+        try:
+            with db.session.begin_nested():
+                receipt = NotificationReceipt(user_id=user_id, broadcast_id=broadcast_id, **values)
+                db.session.add(receipt)
+            return receipt
+        except IntegrityError:
+            receipt = NotificationReceipt.query.filter_by(user_id=user_id, broadcast_id=broadcast_id).first()
+    for key, value in values.items():
+        if getattr(receipt, key) is None:
+            setattr(receipt, key, value)
+    return receipt
+
+
+def get_broadcast_item(user, broadcast_id):
+    """單則廣播的通知 dict（不可見時回傳 None）"""
+    inbox = inbox_select(user)
+    row = db.session.execute(select(inbox).where(inbox.c.id == -broadcast_id)).first()
+    return inbox_item(row) if row else None
+
+
+def mark_broadcast_read(user, broadcast_id):
+    """標記單則廣播已讀，廣播不存在或不可見時回傳 False"""
+    if not broadcast_recipient(user):
+        return False
+    visible = db.session.execute(_broadcast_query(user, NotificationBroadcast.id).where(
+        NotificationBroadcast.id == broadcast_id
+    )).first()
+    if visible is None:
+        return False
+    _upsert_receipt(user.id, broadcast_id, read_at=datetime.utcnow())
+    return True
+
+
+def mark_all_broadcasts_read(user):
+    """補建未讀廣播的已讀紀錄，回傳更新數"""
+    if not broadcast_recipient(user):
+        return 0
+    now = datetime.utcnow()
+    unread = _broadcast_query(
+        user,
+        NotificationBroadcast.id,
+        literal(user.id),
+        literal(now)
+    ).where(NotificationReceipt.id.is_(None))
+    inserted = db.session.execute(insert(NotificationReceipt).from_select(
+        ['broadcast_id', 'user_id', 'read_at'], unread
+    )).rowcount
+    updated = NotificationReceipt.query.filter(
+        NotificationReceipt.user_id == user.id,
+        NotificationReceipt.read_at.is_(None),
+        NotificationReceipt.deleted_at.is_(None)
+    ).update({'read_at': now}, synchronize_session=False)
+    return inserted + updated
+
+
+def delete_broadcasts(user, broadcast_ids):
+    """對用戶隱藏指定廣播，回傳刪除數"""
+    if not broadcast_recipient(user):
+        return 0
+    now = datetime.utcnow()
+    visible = db.session.execute(_broadcast_query(user, NotificationBroadcast.id).where(
+        NotificationBroadcast.id.in_(broadcast_ids)
+    )).scalars().all()
+    for broadcast_id in visible:
+        _upsert_receipt(user.id, broadcast_id, deleted_at=now)
+    return len(visible)
+
+
+def clear_read_broadcasts(user):
+    """隱藏已讀的廣播，回傳刪除數"""
+    return NotificationReceipt.query.filter(
+        NotificationReceipt.user_id == user.id,
+        NotificationReceipt.read_at.isnot(None),
+        NotificationReceipt.deleted_at.is_(None)
+    ).update({'deleted_at': datetime.utcnow()}, synchronize_session=False)
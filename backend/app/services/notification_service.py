@@ -1,16 +1,20 @@
 """
 廟方通知服務
-- 受眾解析
-- 發送邏輯（LINE multicast + APP 站內通知）
+- 受眾解析（SQL 條件編譯見 app.services.audience）
+- 發送邏輯（LINE multicast + APP 站內通知，站內通知見 app.services.notification_fanout）
+- LINE 推播依批次記錄進度（notification_deliveries），失敗或中斷後續傳不會重複發送
 """
+import os
+import uuid
 from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
 from app import db
-from app.models.line_user import LineUser
-from app.models.event_registration import EventRegistration
-from app.models.lamp_application import LampApplication
-from app.models.notification import Notification
 from app.models.temple_notification import TempleNotification, NotificationStats
-from app.services import line_service
+from app.models.notification_delivery import NotificationDelivery
+from app.services import audience
+from app.services.audience import iter_line_user_ids
+from app.services.line_dispatcher import dispatch_multicast
+from app.services.notification_fanout import fan_out_temple_notification
 from app.utils.line_flex import temple_notification_message
 from app.utils.logger import get_logger
 
@@ -20,244 +24,230 @@ logger = get_logger('services.notification_service')
 # LINE multicast 每次上限 500 人
 MULTICAST_CHUNK_SIZE = 500
 
+# sending 狀態超過此分鐘數未更新進度，視為發送中斷，可續傳
+SEND_STALE_MINUTES = int(os.getenv('NOTIFICATION_SEND_STALE_MINUTES', 10))
+
 
 def resolve_line_user_ids(temple_id, target_audience, target_event_id=None, target_filters=None):
     """
     根據受眾條件查出 LINE user ID 字串列表。
     只回傳目前仍在追蹤 (is_following=True) 的用戶。
     """
-    filters = target_filters or {}
-    now = datetime.utcnow()
+    return [
+        line_id
+        for chunk in iter_line_user_ids(temple_id, target_audience, target_event_id, target_filters)
+        for line_id in chunk
+    ]
+
+
+def count_audience(temple_id, target_audience, target_event_id=None, target_filters=None):
+    """預估受眾人數（COUNT 查詢，短暫快取）"""
+    return audience.count_audience(temple_id, target_audience, target_event_id, target_filters)
+
 
-    if target_audience == 'all':
-        users = LineUser.query.filter_by(is_following=True).all()
-        return [u.line_user_id for u in users]
-
-    if target_audience == 'new':
-        cutoff = now - timedelta(days=30)
-        users = LineUser.query.filter(
-            LineUser.is_following == True,
-            LineUser.followed_at >= cutoff
-        ).all()
-        return [u.line_user_id for u in users]
-
-    if target_audience == 'active':
-        # 30 天內有 EventRegistration（透過 line_user_id 直接關聯）
-        cutoff = now - timedelta(days=30)
-        active_ids = db.session.query(EventRegistration.line_user_id).filter(
-            EventRegistration.line_user_id.isnot(None),
-            EventRegistration.registered_at >= cutoff
-        ).distinct().all()
-        active_set = {r[0] for r in active_ids}
-        users = LineUser.query.filter(
-            LineUser.is_following == True,
-            LineUser.line_user_id.in_(active_set)
-        ).all()
-        return [u.line_user_id for u in users]
-
-    if target_audience == 'dormant':
-        # 超過 90 天無 EventRegistration 活動
-        cutoff = now - timedelta(days=90)
-        active_ids = db.session.query(EventRegistration.line_user_id).filter(
-            EventRegistration.line_user_id.isnot(None),
-            EventRegistration.registered_at >= cutoff
-        ).distinct().all()
-        active_set = {r[0] for r in active_ids}
-        users = LineUser.query.filter(
-            LineUser.is_following == True,
-            ~LineUser.line_user_id.in_(active_set)
-        ).all()
-        return [u.line_user_id for u in users]
-
-    if target_audience == 'lamp_expiring':
-        # 30 天內點燈到期，透過電話號碼對應 LineUser
-        today = now.date()
-        expiry_cutoff = today + timedelta(days=30)
-        expiring_phones = db.session.query(LampApplication.applicant_phone).filter(
-            LampApplication.temple_id == temple_id,
-            LampApplication.status.in_(['paid', 'active', 'pending']),
-            LampApplication.end_date >= today,
-            LampApplication.end_date <= expiry_cutoff
-        ).distinct().all()
-        phone_set = {r[0] for r in expiring_phones if r[0]}
-        if not phone_set:
-            return []
-        users = LineUser.query.filter(
-            LineUser.is_following == True,
-            LineUser.phone.in_(phone_set)
-        ).all()
-        return [u.line_user_id for u in users]
-
-    if target_audience == 'event_registered':
-        if not target_event_id:
-            return []
-        regs = EventRegistration.query.filter(
-            EventRegistration.event_id == target_event_id,
-            EventRegistration.line_user_id.isnot(None),
-            EventRegistration.status.in_(['registered', 'waitlist'])
-        ).all()
-        line_ids = {r.line_user_id for r in regs}
-        users = LineUser.query.filter(
-            LineUser.is_following == True,
-            LineUser.line_user_id.in_(line_ids)
-        ).all()
-        return [u.line_user_id for u in users]
-
-    if target_audience == 'custom':
-        # 依 EventRegistration 次數篩選
-        min_reg = filters.get('minCheckins')
-        max_reg = filters.get('maxCheckins')
-        # 取得所有追蹤者
-        all_users = LineUser.query.filter_by(is_following=True).all()
-        if not min_reg and not max_reg:
-            return [u.line_user_id for u in all_users]
-
-        # 計算每個 line_user_id 的報名次數
-        from sqlalchemy import func
-        reg_counts = dict(
-            db.session.query(
-                EventRegistration.line_user_id,
-                func.count(EventRegistration.id)
-            ).filter(
-                EventRegistration.line_user_id.isnot(None)
-            ).group_by(EventRegistration.line_user_id).all()
+def _claim_notification(notification_id, resume):
+    """
+    以條件式 UPDATE 將通知改為 sending，確保同一時間只有一個 worker 發送
+    resume=True 時也接受發送失敗、或 sending 但已超過 SEND_STALE_MINUTES 未更新（worker 中斷）的通知
+    """
+    now = datetime.utcnow()
+    condition = TempleNotification.status.in_(('draft', 'scheduled'))
+    if resume:
+        stale_before = now - timedelta(minutes=SEND_STALE_MINUTES)
+        condition = or_(
+            condition,
+            TempleNotification.status == 'failed',
+            and_(TempleNotification.status == 'sending', TempleNotification.updated_at < stale_before)
+        )
+    claimed = TempleNotification.query.filter(
+        TempleNotification.id == notification_id,
+        condition
+    ).update({'status': 'sending', 'updated_at': now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _plan_line_deliveries(notif, chunks):
+    """第一次發送時將各批收件者寫入 notification_deliveries（續傳時沿用同一份名單與 retry key）"""
+    deliveries = NotificationDelivery.query.filter_by(notification_id=notif.id) \
+        .order_by(NotificationDelivery.chunk_index).all()
+    if deliveries:
+        return deliveries
+
+    for index, chunk in enumerate(chunks):
+        delivery = NotificationDelivery(
+            notification_id=notif.id,
+            chunk_index=index,
+            recipients=chunk,
+            recipient_count=len(chunk),
+            retry_key=str(uuid.uuid4())
         )
+        db.session.add(delivery)
+        deliveries.append(delivery)
+    db.session.commit()
+    return deliveries
+
 
-        result = []
-        for u in all_users:
-            count = reg_counts.get(u.line_user_id, 0)
-            if min_reg and count < int(min_reg):
-                continue
-            if max_reg and count > int(max_reg):
-                continue
-            result.append(u.line_user_id)
-        return result
+def _record_chunk_result(notif, delivery_id, result):
+    """每批完成後立即寫入進度，中斷後只需重送未完成的批次"""
+    now = datetime.utcnow()
+    values = {
+        'attempts': NotificationDelivery.attempts + result.attempts,
+        'last_status_code': result.status_code,
+    }
+    if result.ok:
+        values.update(status='sent', sent_at=now, error_message=None)
+    else:
+        values.update(status='failed', error_message=result.error)
+        logger.error(f'[Notify] LINE multicast chunk {delivery_id} failed: {result.status_code} {result.error}')
+    NotificationDelivery.query.filter_by(id=delivery_id).update(values, synchronize_session=False)
+    # 更新 updated_at 作為心跳，避免仍在發送中的通知被判定為中斷
+    TempleNotification.query.filter_by(id=notif.id).update({'updated_at': now}, synchronize_session=False)
+    db.session.commit()
 
-    # 預設回傳全部
-    users = LineUser.query.filter_by(is_following=True).all()
-    return [u.line_user_id for u in users]
 
+def _send_line_deliveries(notif, deliveries):
+    """發送尚未成功的批次，回傳 (已送達人數, 失敗批次數)"""
+    flex_msg = temple_notification_message(
+        title=notif.title,
+        content=notif.content,
+        image_url=notif.image_url,
+    )
+    pending = [(d.id, d.recipients, d.retry_key) for d in deliveries if d.status != 'sent']
+    if len(pending) < len(deliveries):
+        logger.info(f'[Notify] notification {notif.id} resuming: {len(pending)}/{len(deliveries)} chunks left')
+
+    dispatch_multicast(
+        pending,
+        [flex_msg],
+        lambda delivery_id, result: _record_chunk_result(notif, delivery_id, result)
+    )
+
+    rows = db.session.query(NotificationDelivery.status, NotificationDelivery.recipient_count).filter(
+        NotificationDelivery.notification_id == notif.id
+    ).all()
+    sent = sum(count for status, count in rows if status == 'sent')
+    failed = sum(1 for status, _ in rows if status != 'sent')
+    return sent, failed
 
-def count_audience(temple_id, target_audience, target_event_id=None, target_filters=None):
-    """預估受眾人數（不做完整查詢，盡量輕量）"""
-    ids = resolve_line_user_ids(temple_id, target_audience, target_event_id, target_filters)
-    return len(ids)
+
+def _set_stats(notif, channel, sent):
+    stats = NotificationStats.query.filter_by(notification_id=notif.id, channel=channel).first()
+    if stats is None:
+        stats = NotificationStats(notification_id=notif.id, channel=channel)
+        db.session.add(stats)
+    stats.sent = sent
+    return stats
+
+
+def claim_due_notifications(limit):
+    """
+    認領到期的排程通知（scheduled -> sending），回傳通知 ID 列表
+    以 FOR UPDATE SKIP LOCKED 鎖定，多個程序同時認領時各自取得不同的通知
+    """
+    now = datetime.utcnow()
+    ids = [row[0] for row in db.session.query(TempleNotification.id).filter(
+        TempleNotification.status == 'scheduled',
+        TempleNotification.scheduled_at <= now
+    ).order_by(TempleNotification.scheduled_at).limit(limit).with_for_update(skip_locked=True).all()]
+    claimed = []
+    for notification_id in ids:
+        if TempleNotification.query.filter(
+            TempleNotification.id == notification_id,
+            TempleNotification.status == 'scheduled'
+        ).update({'status': 'sending', 'updated_at': now}, synchronize_session=False):
+            claimed.append(notification_id)
+    db.session.commit()
+    return claimed
 
 
-def send_notification(notification_id):
+def send_notification(notification_id, resume=False, claimed=False):
     """
     執行通知發送。
     更新 status -> sending -> sent/failed
+    resume=True 時續傳發送失敗或中斷的通知（已送達的批次不會重送）
+    claimed=True 表示已由 claim_due_notifications 改為 sending
     """
-    notif = TempleNotification.query.get(notification_id)
-    if not notif:
-        logger.info(f'[Notify] notification {notification_id} not found')
-        return False
-
-    if notif.status not in ('draft', 'scheduled'):
-        logger.info(f'[Notify] notification {notification_id} status={notif.status}, skip')
+    if not claimed and not _claim_notification(notification_id, resume):
+        logger.info(f'[Notify] notification {notification_id} not found or not sendable, skip')
         return False
 
-    notif.status = 'sending'
-    db.session.commit()
-
+    notif = db.session.get(TempleNotification, notification_id)
     try:
         channels = notif.channels or ['line']
-        line_ids = resolve_line_user_ids(
-            notif.temple_id,
-            notif.target_audience,
-            notif.target_event_id,
-            notif.target_filters
-        )
-        notif.target_count = len(line_ids)
-        total_sent = 0
-
-        # ── LINE 推播 ──────────────────────────────────────────
-        if 'line' in channels and line_ids:
-            flex_msg = temple_notification_message(
-                title=notif.title,
-                content=notif.content,
-                image_url=notif.image_url,
+        chunks = []
+        if 'line' in channels:
+            deliveries = NotificationDelivery.query.filter_by(notification_id=notif.id) \
+                .order_by(NotificationDelivery.chunk_index).all()
+            if deliveries:
+                # 續傳：沿用第一次發送時的收件者名單
+                chunks = [d.recipients for d in deliveries]
+            else:
+                chunks = list(iter_line_user_ids(
+                    notif.temple_id,
+                    notif.target_audience,
+                    notif.target_event_id,
+                    notif.target_filters,
+                    chunk_size=MULTICAST_CHUNK_SIZE
+                ))
+                notif.target_count = sum(len(chunk) for chunk in chunks)
+                db.session.commit()
+        else:
+            notif.target_count = count_audience(
+                notif.temple_id,
+                notif.target_audience,
+                notif.target_event_id,
+                notif.target_filters
             )
+            db.session.commit()
 
-            # 分批發送（每批 500）
-            line_sent = 0
-            for i in range(0, len(line_ids), MULTICAST_CHUNK_SIZE):
-                chunk = line_ids[i:i + MULTICAST_CHUNK_SIZE]
-                resp = line_service.multicast_message(chunk, [flex_msg])
-                if resp and resp.ok:
-                    line_sent += len(chunk)
-                else:
-                    logger.error(f'[Notify] LINE multicast chunk {i} failed')
-
-            # 寫入統計
-            stats = NotificationStats(
-                notification_id=notif.id,
-                channel='line',
-                sent=line_sent,
-            )
-            db.session.add(stats)
-            total_sent += line_sent
+        total_sent = 0
+        line_failed = 0
 
-        # ── APP 站內通知 ───────────────────────────────────────
+        # ── APP 站內通知（分批寫入，完成後寫入統計；已有統計代表已發送過）───
         if 'app' in channels:
-            # 透過 LineUser.phone 找到對應 User，發站內通知
-            app_sent = _send_app_notifications(notif, line_ids)
-            stats_app = NotificationStats(
-                notification_id=notif.id,
-                channel='app',
-                sent=app_sent,
-            )
-            db.session.add(stats_app)
-            total_sent += app_sent
+            stats_app = NotificationStats.query.filter_by(notification_id=notif.id, channel='app').first()
+            if stats_app is None:
+                app_sent = fan_out_temple_notification(notif)
+                stats_app = _set_stats(notif, 'app', app_sent)
+                db.session.commit()
+            total_sent += stats_app.sent or 0
+
+        # ── LINE 推播 ──────────────────────────────────────────
+        if chunks:
+            deliveries = _plan_line_deliveries(notif, chunks)
+            line_sent, line_failed = _send_line_deliveries(notif, deliveries)
+            _set_stats(notif, 'line', line_sent)
+            total_sent += line_sent
 
         notif.sent_count = total_sent
-        notif.status = 'sent'
-        notif.sent_at = datetime.utcnow()
+        if line_failed:
+            # 可再次發送（resume）只重送失敗的批次
+            notif.status = 'failed'
+            logger.error(f'[Notify] notification {notification_id}: {line_failed} LINE chunks failed')
+        else:
+            notif.status = 'sent'
+            notif.sent_at = datetime.utcnow()
         db.session.commit()
         logger.info(f'[Notify] notification {notification_id} sent to {total_sent} users')
-        return True
+        return not line_failed
 
     except Exception as e:
         logger.error(f'[Notify] send error: {e}')
-        notif.status = 'failed'
+        db.session.rollback()
+        TempleNotification.query.filter_by(id=notification_id).update({'status': 'failed'}, synchronize_session=False)
         db.session.commit()
         return False
 
 
-def _send_app_notifications(notif, line_ids):
-    """透過 phone 對應找 User，發站內 Notification"""
-    if not line_ids:
-        return 0
-
-    # 找出有 phone 的 LineUser
-    line_users = LineUser.query.filter(
-        LineUser.line_user_id.in_(line_ids),
-        LineUser.phone.isnot(None)
-    ).all()
-
-    if not line_users:
-        return 0
-
-    phones = [u.phone for u in line_users]
-
-    # 透過 phone 找 User
-    from app.models.user import User
-    users = User.query.filter(User.phone.in_(phones)).all()
-    if not users:
-        return 0
-
-    count = 0
-    for user in users:
-        n = Notification(
-            user_id=user.id,
-            type='temple_announcement',
-            title=notif.title,
-            content=notif.content,
-            related_type='temple_notification',
-            related_id=notif.id,
-        )
-        db.session.add(n)
-        count += 1
-
-    return count
+def resume_stale_notifications():
+    """續傳 sending 狀態但已超過 SEND_STALE_MINUTES 未更新的通知（發送中的 worker 已中斷）"""
+    stale_before = datetime.utcnow() - timedelta(minutes=SEND_STALE_MINUTES)
+    stale_ids = [row[0] for row in db.session.query(TempleNotification.id).filter(
+        TempleNotification.status == 'sending',
+        TempleNotification.updated_at < stale_before
+    ).all()]
+    for notification_id in stale_ids:
+        logger.info(f'[Notify] resuming interrupted notification {notification_id}')
+        send_notification(notification_id, resume=True)
+    return len(stale_ids)
@@ -0,0 +1,279 @@
+"""
+功德值帳本
+- 所有功德值異動都經由 post()：同一交易內以單一 UPDATE 原子更新用戶的快取餘額（blessing_points），
+  並寫入一筆只新增不修改的帳本紀錄（含異動後餘額），讀取餘額仍是 O(1)
+- 排程定期將新異動彙總為每日餘額快照；「某時間點的餘額」= 該時間前最近的快照 + 快照之後的少量異動
+- 核對工作以快照 + 之後的異動批次重算所有帳號餘額，與快取餘額比對並記錄不一致的帳號
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, func, and_, or_
+from app import db
+from app.models.points_ledger import PointsLedgerEntry, PointsBalanceSnapshot
+from app.utils.logger import get_logger
+from app.utils.principal_cache import CachedPrincipal
+
+logger = get_logger('services.points_ledger')
+
+
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('POINTS_SNAPSHOT_INTERVAL_SECONDS', 3600))
+VERIFY_INTERVAL_SECONDS = int(os.getenv('POINTS_VERIFY_INTERVAL_SECONDS', 86400))
+# 只彙總寫入超過此秒數的異動，避免略過仍在交易中、較小 ID 尚未 commit 的紀錄
+SNAPSHOT_LAG_SECONDS = 300
+VERIFY_BATCH_SIZE = 1000
+MISMATCH_SAMPLE_SIZE = 20
+HISTORY_MAX_LIMIT = 100
+
+_stats_lock = threading.Lock()
+_stats = {'last_snapshot_at': None, 'snapshot_accounts': 0, 'last_verified_at': None,
+          'verified_accounts': 0, 'mismatches': 0, 'mismatch_sample': []}
+
+
+def _account_models():
+    """帳本的 account_table -> 有功德值欄位的用戶模型"""
+    from app.models.user import User
+    from app.models.public_user import PublicUser
+    return {model.__tablename__: model for model in (User, PublicUser)}
+
+
+def account_of(user):
+    """(模型, account_table)；CachedPrincipal 的 __class__ 即為實際模型"""
+    model = user.__class__
+    return model, model.__tablename__
+
+
+# ===== 寫入 =====
+
+def post(user, delta, source, reference_id=None, description=None, require_funds=False):
+    """
+    異動功德值並寫入帳本（不 commit，與觸發異動的資料在同一交易），回傳異動後餘額
+    require_funds=True 時扣除後不得為負，餘額不足回傳 None 且不做任何異動
+    """
+    model, account_table = account_of(user)
+    if not delta:
+        return db.session.query(model.blessing_points).filter(model.id == user.id).scalar()
+
+    conditions = [model.id == user.id]
+    if require_funds and delta < 0:
+        conditions.append(model.blessing_points >= -delta)
+    updated = db.session.execute(
+        update(model)
+        .where(*conditions)
+        .values(blessing_points=model.blessing_points + delta)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        return None
+
+    # 用戶資料列在 commit 前保持鎖定，讀到的即為本筆異動後的餘額
+    balance = db.session.query(model.blessing_points).filter(model.id == user.id).scalar()
+    db.session.add(PointsLedgerEntry(
+        account_table=account_table,
+        user_id=user.id,
+        delta=delta,
+        balance_after=balance,
+        source=source,
+        reference_id=reference_id,
+        description=description[:200] if description else None
+    ))
+
+    # 已載入的物件改為下次存取時重新讀取
+    instance = user._instance if isinstance(user, CachedPrincipal) else user
+    if instance is not None and instance in db.session:
+        db.session.expire(instance, ['blessing_points'])
+    return balance
+
+
+# ===== 讀取 =====
+
+def get_balance(user):
+    """目前餘額（快取欄位）"""
+    model, _ = account_of(user)
+    return db.session.query(model.blessing_points).filter(model.id == user.id).scalar() or 0
+
+
+def get_balance_as_of(user, at):
+    """at 時間點的餘額：at 當天以前最近的快照，加上快照之後、at 以前的異動"""
+    _, account_table = account_of(user)
+    snapshot = PointsBalanceSnapshot.query.filter(
+        PointsBalanceSnapshot.account_table == account_table,
+        PointsBalanceSnapshot.user_id == user.id,
+        PointsBalanceSnapshot.snapshot_date < at.date()
+    ).order_by(PointsBalanceSnapshot.snapshot_date.desc()).first()
+
+    base, after_id = (snapshot.balance, snapshot.last_entry_id) if snapshot else (0, 0)
+    tail = db.session.query(func.coalesce(func.sum(PointsLedgerEntry.delta), 0)).filter(
+        PointsLedgerEntry.account_table == account_table,
+        PointsLedgerEntry.user_id == user.id,
+        PointsLedgerEntry.id > after_id,
+        PointsLedgerEntry.created_at <= at
+    ).scalar()
+    return base + int(tail)
+
+
+def get_history(user, limit=20, before_id=None, source=None):
+    """
+    個人功德值異動紀錄（新到舊），只查帳本一張表
+    before_id 為上一頁最後一筆的 ID；回傳 (紀錄列表, 下一頁的 before_id 或 None)
+    """
+    _, account_table = account_of(user)
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    query = PointsLedgerEntry.query.filter(
+        PointsLedgerEntry.account_table == account_table,
+        PointsLedgerEntry.user_id == user.id
+    )
+    if source:
+        query = query.filter(PointsLedgerEntry.source == source)
+    if before_id:
+        cursor = db.session.get(PointsLedgerEntry, before_id)
+        if cursor is not None:
+            query = query.filter(or_(
+                PointsLedgerEntry.created_at < cursor.created_at,
+                and_(PointsLedgerEntry.created_at == cursor.created_at, PointsLedgerEntry.id < cursor.id)
+            ))
+
+    entries = query.order_by(
+        PointsLedgerEntry.created_at.desc(), PointsLedgerEntry.id.desc()
+    ).limit(limit + 1).all()
+    next_before = entries[limit - 1].id if len(entries) > limit else None
+    return entries[:limit], next_before
+
+
+# ===== 排程：快照與核對 =====
+
+def _snapshot_watermark():
+    """已彙總進快照的最大帳本 ID"""
+    return db.session.query(func.max(PointsBalanceSnapshot.last_entry_id)).scalar() or 0
+
+
+def _latest_snapshots(account_table, user_ids):
+    """指定帳號最近一筆快照：user_id -> PointsBalanceSnapshot"""
+    latest = select(
+        PointsBalanceSnapshot.user_id,
+        func.max(PointsBalanceSnapshot.snapshot_date).label('snapshot_date')
+    ).where(
+        PointsBalanceSnapshot.account_table == account_table,
+        PointsBalanceSnapshot.user_id.in_(user_ids)
+    ).group_by(PointsBalanceSnapshot.user_id).subquery()
+    rows = PointsBalanceSnapshot.query.join(latest, and_(
+        PointsBalanceSnapshot.user_id == latest.c.user_id,
+        PointsBalanceSnapshot.snapshot_date == latest.c.snapshot_date
+    )).filter(PointsBalanceSnapshot.account_table == account_table).all()
+    return {row.user_id: row for row in rows}
+
+
+def snapshot_balances():
+    """
+    將上次快照之後的異動依帳號加總，寫入當天的餘額快照（同一天多次執行時更新當天那筆）
+    整批在同一交易內完成，中斷時不會留下部分快照；回傳更新的帳號數
+    """
+    now = datetime.utcnow()
+    today = now.date()
+    watermark = _snapshot_watermark()
+    upper = db.session.query(func.max(PointsLedgerEntry.id)).filter(
+        PointsLedgerEntry.id > watermark,
+        PointsLedgerEntry.created_at < now - timedelta(seconds=SNAPSHOT_LAG_SECONDS)
+    ).scalar()
+    if not upper:
+        db.session.commit()
+        return 0
+
+    groups = db.session.query(
+        PointsLedgerEntry.account_table,
+        PointsLedgerEntry.user_id,
+        func.sum(PointsLedgerEntry.delta),
+        func.max(PointsLedgerEntry.id)
+    ).filter(
+        PointsLedgerEntry.id > watermark,
+        PointsLedgerEntry.id <= upper
+    ).group_by(PointsLedgerEntry.account_table, PointsLedgerEntry.user_id).all()
+
+    by_table = {}
+    for account_table, user_id, delta, last_id in groups:
+        by_table.setdefault(account_table, []).append((user_id, int(delta), last_id))
+
+    for account_table, rows in by_table.items():
+        for start in range(0, len(rows), VERIFY_BATCH_SIZE):
+            batch = rows[start:start + VERIFY_BATCH_SIZE]
+            latest = _latest_snapshots(account_table, [user_id for user_id, _, _ in batch])
+            for user_id, delta, last_id in batch:
+                snapshot = latest.get(user_id)
+                base = snapshot.balance if snapshot else 0
+                if snapshot is not None and snapshot.snapshot_date == today:
+                    snapshot.balance = base + delta
+                    snapshot.last_entry_id = last_id
+                else:
+                    db.session.add(PointsBalanceSnapshot(
+                        account_table=account_table,
+                        user_id=user_id,
+                        snapshot_date=today,
+                        balance=base + delta,
+                        last_entry_id=last_id
+                    ))
+    db.session.commit()
+
+    with _stats_lock:
+        _stats['last_snapshot_at'] = now.isoformat()
+        _stats['snapshot_accounts'] = len(groups)
+    logger.info(f'[PointsLedger] snapshot {len(groups)} accounts up to entry {upper}')
+    return len(groups)
+
+
+def verify_balances():
+    """
+    批次重算所有帳號餘額（最近快照 + 之後的異動），與快取的 blessing_points 比對
+    在同一個讀取交易內完成，不會把核對期間的新異動誤判為不一致；回傳不一致的帳號數
+    """
+    db.session.commit()
+    watermark = _snapshot_watermark()
+    tail = {}
+    for account_table, user_id, delta in db.session.query(
+        PointsLedgerEntry.account_table,
+        PointsLedgerEntry.user_id,
+        func.sum(PointsLedgerEntry.delta)
+    ).filter(PointsLedgerEntry.id > watermark).group_by(
+        PointsLedgerEntry.account_table, PointsLedgerEntry.user_id
+    ).all():
+        tail[(account_table, user_id)] = int(delta)
+
+    checked = 0
+    mismatches = []
+    for account_table, model in _account_models().items():
+        last_id = 0
+        while True:
+            users = db.session.query(model.id, model.blessing_points).filter(
+                model.id > last_id
+            ).order_by(model.id).limit(VERIFY_BATCH_SIZE).all()
+            if not users:
+                break
+            snapshots = _latest_snapshots(account_table, [user_id for user_id, _ in users])
+            for user_id, cached in users:
+                snapshot = snapshots.get(user_id)
+                expected = (snapshot.balance if snapshot else 0) + tail.get((account_table, user_id), 0)
+                if (cached or 0) != expected:
+                    mismatches.append({
+                        'account_table': account_table,
+                        'user_id': user_id,
+                        'cached': cached,
+                        'ledger': expected
+                    })
+            checked += len(users)
+            last_id = users[-1][0]
+    db.session.commit()
+
+    for mismatch in mismatches[:MISMATCH_SAMPLE_SIZE]:
+        logger.warning(f'[PointsLedger] balance mismatch {mismatch}')
+    with _stats_lock:
+        _stats['last_verified_at'] = datetime.utcnow().isoformat()
+        _stats['verified_accounts'] = checked
+        _stats['mismatches'] = len(mismatches)
+        _stats['mismatch_sample'] = mismatches[:MISMATCH_SAMPLE_SIZE]
+    logger.info(f'[PointsLedger] verified {checked} accounts, {len(mismatches)} mismatches')
+    return len(mismatches)
+
+
+def get_stats():
+    """本程序最近一次快照 / 核對結果"""
+    with _stats_lock:
+        return dict(_stats)
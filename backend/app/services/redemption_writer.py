@@ -0,0 +1,210 @@
+"""
+兌換交易（防超賣、併發安全）
+- 庫存與功德值都以條件式 UPDATE 原子扣減（stock_quantity - q WHERE stock_quantity >= q），
+  不再先讀出數值在 Python 判斷後寫回，併發請求不會超賣或互相覆蓋餘額（功德值異動經由 app.services.points_ledger 寫入帳本）
+- 管理端變更訂單狀態同樣以條件式 UPDATE 轉換，進入 / 離開 cancelled 時在同一交易調整廟宇統計彙總
+- 鎖定順序固定為 兌換紀錄 → 商品庫存 → 用戶點數 → 廟宇統計，建立與取消同時進行也不會死結
+- 售完快取：商品扣減失敗且庫存為 0 時記在本程序記憶體，短時間內的同商品請求直接拒絕、不查資料庫
+  （補貨或取消退回庫存時清除；多 worker 間以 TTL 限制誤判時間）
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from app.models.product import Product
+from app.models.redemption import Redemption
+from app.services import points_ledger
+from app.services.temple_rollup import record_redemption, record_redemption_cancelled
+from app.utils.exceptions import ValidationError, NotFoundError, PermissionDeniedError, ConflictError
+from app.utils.logger import get_logger
+
+logger = get_logger('services.redemption_writer')
+
+
+# 售完快取秒數（0 停用）
+SOLD_OUT_TTL_SECONDS = float(os.getenv('REDEMPTION_SOLD_OUT_TTL_SECONDS', 5))
+
+
+class SoldOutCache:
+    """product_id -> 到期時間；只記錄本程序確認售完的商品"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.rejections = 0
+
+    def is_sold_out(self, product_id):
+        if self.ttl <= 0:
+            return False
+        with self._lock:
+            expires_at = self._entries.get(product_id)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[product_id]
+                return False
+            self.rejections += 1
+            return True
+
+    def mark(self, product_id):
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[product_id] = time.monotonic() + self.ttl
+
+    def discard(self, product_id):
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'ttl_seconds': self.ttl,
+                'sold_out_products': sum(1 for expires_at in self._entries.values() if expires_at > now),
+                'fast_rejections': self.rejections
+            }
+
+
+sold_out = SoldOutCache(SOLD_OUT_TTL_SECONDS)
+
+
+def _take_stock(product_id, quantity):
+    """原子扣減庫存，回傳是否成功"""
+    return db.session.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.is_active == True, Product.stock_quantity >= quantity)
+        .values(stock_quantity=Product.stock_quantity - quantity)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def _return_stock(product_id, quantity):
+    db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(stock_quantity=Product.stock_quantity + quantity)
+        .execution_options(synchronize_session=False)
+    )
+    sold_out.discard(product_id)
+
+
+def create_redemption(user, product_id, quantity, address, notes=None):
+    """
+    建立兌換並 commit，回傳 (兌換紀錄, 剩餘功德值)
+    庫存或功德值不足時 rollback 並拋出 ValidationError
+    """
+    if not isinstance(quantity, int) or quantity < 1:
+        raise ValidationError('兌換數量必須為正整數')
+    if sold_out.is_sold_out(product_id):
+        raise ValidationError('庫存不足')
+
+    product = db.session.get(Product, product_id)
+    if not product:
+        raise NotFoundError('商品不存在')
+    if not product.is_active:
+        raise ValidationError('商品已下架')
+    if address.user_id != user.id:
+        raise PermissionDeniedError('地址不屬於您')
+
+    temple_id = product.temple_id
+    total_points = product.merit_points * quantity
+
+    if not _take_stock(product_id, quantity):
+        db.session.rollback()
+        db.session.refresh(product)
+        if product.stock_quantity <= 0:
+            sold_out.mark(product_id)
+        if not product.is_active:
+            raise ValidationError('商品已下架')
+        raise ValidationError('庫存不足')
+
+    redemption = Redemption(
+        user_id=user.id,
+        product_id=product_id,
+        temple_id=temple_id,
+        quantity=quantity,
+        merit_points_used=total_points,
+        status='pending',
+        recipient_name=address.recipient_name,
+        phone=address.phone,
+        postal_code=address.postal_code,
+        city=address.city,
+        district=address.district,
+        address=address.address,
+        notes=notes
+    )
+    db.session.add(redemption)
+    db.session.flush()
+
+    remaining = points_ledger.post(user, -total_points, 'redemption', redemption.id, product.name,
+                                   require_funds=True)
+    if remaining is None:
+        # 退回本交易已扣的庫存與兌換紀錄
+        db.session.rollback()
+        current = points_ledger.get_balance(user)
+        raise ValidationError(f'功德值不足，需要 {total_points} 點，目前有 {current} 點')
+
+    # 更新廟宇每日統計彙總
+    record_redemption(temple_id, total_points)
+
+    db.session.commit()
+    return redemption, remaining
+
+
+def cancel_redemption(user, redemption):
+    """
+    取消待處理的兌換並 commit（退還庫存與功德值），回傳目前功德值
+    以條件式 UPDATE 改狀態，同一筆兌換同時取消兩次只會退還一次
+    """
+    cancelled_at = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Redemption)
+        .where(Redemption.id == redemption.id, Redemption.status == 'pending')
+        .values(status='cancelled', cancelled_at=cancelled_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        raise ValidationError('此兌換無法取消')
+
+    if redemption.product_id:
+        _return_stock(redemption.product_id, redemption.quantity)
+    current = points_ledger.post(user, redemption.merit_points_used, 'redemption_cancel', redemption.id)
+
+    # 自原下單日的統計彙總扣回
+    record_redemption_cancelled(redemption.temple_id, redemption.merit_points_used, redemption.redeemed_at)
+
+    db.session.commit()
+    return current
+
+
+def change_status(redemption, new_status):
+    """
+    管理端變更兌換狀態（不 commit），回傳是否有變更
+    以條件式 UPDATE 自目前狀態轉換，併發更新時只有一方生效；
+    進入 cancelled 時自原下單日的統計彙總扣回，離開 cancelled 時加回
+    """
+    old_status = redemption.status
+    if new_status == old_status:
+        return False
+
+    changed = db.session.execute(
+        update(Redemption)
+        .where(Redemption.id == redemption.id, Redemption.status == old_status)
+        .values(status=new_status)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not changed:
+        db.session.rollback()
+        raise ConflictError('訂單狀態已被更新，請重新整理後再試')
+    set_committed_value(redemption, 'status', new_status)
+
+    if new_status == 'cancelled':
+        record_redemption_cancelled(redemption.temple_id, redemption.merit_points_used, redemption.redeemed_at)
+    elif old_status == 'cancelled':
+        record_redemption(redemption.temple_id, redemption.merit_points_used, redemption.redeemed_at)
+    return True
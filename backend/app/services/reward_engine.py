@@ -0,0 +1,177 @@
+"""
+打卡自動獎勵引擎
+- 規則集：每座廟宇（含全站通用，key 為 None）的啟用規則編譯後常駐記憶體，附版本號
+- create_reward / update_reward / delete_reward 會主動失效；其他 worker 依 TTL 重新載入
+- 評估時一次載入用戶活動快照（連續天數取自 user_streaks、先前造訪、各規則領取紀錄），查詢次數固定，
+  不隨規則數量或打卡歷史長度成長
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func, case
+from app import db
+from app.models.checkin import Checkin
+from app.models.checkin_reward import CheckinReward
+from app.models.reward_claim import RewardClaim
+from app.services.streak import get_streak
+from app.utils.logger import get_logger
+
+logger = get_logger('services.reward_engine')
+
+
+RULES_TTL_SECONDS = int(os.getenv('REWARD_RULES_TTL_SECONDS', 60))
+
+# 打卡時自動發放的獎勵類型
+AUTO_GRANT_TYPES = ('first_time', 'daily_bonus', 'consecutive_days')
+
+
+class CompiledRule:
+    """規則的唯讀快照（與 session 無關，可跨請求共用）"""
+
+    __slots__ = ('id', 'temple_id', 'name', 'reward_type', 'condition_value',
+                 'reward_points', 'is_repeatable', 'start_date', 'end_date')
+
+    def __init__(self, reward):
+        for field in self.__slots__:
+            setattr(self, field, getattr(reward, field))
+
+    def active_at(self, now):
+        if self.start_date and now < self.start_date:
+            return False
+        if self.end_date and now > self.end_date:
+            return False
+        return True
+
+
+class RewardRuleCache:
+    """temple_id -> (version, loaded_at, [CompiledRule])"""
+
+    def __init__(self):
+        self._rule_sets = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, temple_id=None):
+        """規則異動後呼叫（temple_id 為 None 代表全站通用規則）"""
+        with self._lock:
+            self._version += 1
+            self._rule_sets.pop(temple_id, None)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._version += 1
+            self._rule_sets.clear()
+
+    def rules_for(self, temple_id):
+        with self._lock:
+            entry = self._rule_sets.get(temple_id)
+            if entry is not None and time.monotonic() - entry[1] < RULES_TTL_SECONDS:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            version = self._version
+
+        rewards = CheckinReward.query.filter(
+            CheckinReward.is_active == True,
+            CheckinReward.reward_type.in_(AUTO_GRANT_TYPES),
+            CheckinReward.temple_id == temple_id if temple_id is not None else CheckinReward.temple_id.is_(None)
+        ).order_by(CheckinReward.id).all()
+        rules = [CompiledRule(reward) for reward in rewards]
+
+        with self._lock:
+            # 載入期間規則又被修改時不寫入，下次重新載入
+            if version == self._version:
+                self._rule_sets[temple_id] = (version, time.monotonic(), rules)
+        return rules
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self._version,
+                'cached_rule_sets': len(self._rule_sets),
+                'ttl_seconds': RULES_TTL_SECONDS,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0
+            }
+
+
+reward_rules = RewardRuleCache()
+
+
+class UserActivity:
+    """評估規則所需的用戶活動快照"""
+
+    def __init__(self, user_id, checkin, rules, now):
+        self.now = now
+        today = now.date()
+        today_start = datetime.combine(today, datetime.min.time())
+        types = {rule.reward_type for rule in rules}
+
+        # 連續天數：讀取 user_streaks（打卡時已先更新）
+        self.streak = 0
+        if 'consecutive_days' in types:
+            self.streak = get_streak(user_id, today)['current_streak']
+
+        # 本次打卡之前是否造訪過此廟宇（首次打卡獎勵）
+        self.visited_before = False
+        if 'first_time' in types and checkin.temple_id:
+            self.visited_before = db.session.query(Checkin.id).filter(
+                Checkin.user_id == user_id,
+                Checkin.temple_id == checkin.temple_id,
+                Checkin.id != checkin.id
+            ).first() is not None
+
+        # 各規則的領取紀錄：reward_id -> (最後領取時間, 今日領取次數)
+        self.claims = {}
+        if rules:
+            rows = db.session.query(
+                RewardClaim.reward_id,
+                func.max(RewardClaim.claimed_at),
+                func.sum(case((RewardClaim.claimed_at >= today_start, 1), else_=0))
+            ).filter(
+                RewardClaim.user_id == user_id,
+                RewardClaim.reward_id.in_([rule.id for rule in rules])
+            ).group_by(RewardClaim.reward_id).all()
+            self.claims = {reward_id: (last, int(today_count or 0)) for reward_id, last, today_count in rows}
+
+    def is_eligible(self, rule, checkin):
+        claim = self.claims.get(rule.id)
+
+        if rule.reward_type == 'first_time':
+            # 只適用於指定廟宇的規則，且為該廟宇的首次打卡、未曾領取
+            return bool(rule.temple_id) and rule.temple_id == checkin.temple_id \
+                and not self.visited_before and claim is None
+
+        if rule.reward_type == 'daily_bonus':
+            return claim is None or claim[1] == 0
+
+        if rule.reward_type == 'consecutive_days':
+            if self.streak < rule.condition_value:
+                return False
+            if claim is None:
+                return True
+            if not rule.is_repeatable:
+                return False
+            # 可重複領取：距離上次領取需滿條件天數
+            return (self.now - claim[0]).days >= rule.condition_value
+
+        return False
+
+
+def evaluate_rewards(user_id, checkin):
+    """回傳本次打卡符合資格的規則（呼叫端負責寫入領取紀錄）"""
+    now = datetime.utcnow()
+    rules = list(reward_rules.rules_for(None))
+    if checkin.temple_id:
+        rules.extend(reward_rules.rules_for(checkin.temple_id))
+    rules = [rule for rule in rules if rule.active_at(now)]
+    if not rules:
+        return []
+
+    activity = UserActivity(user_id, checkin, rules, now)
+    return [rule for rule in rules if activity.is_eligible(rule, checkin)]
@@ -1,51 +1,346 @@
 """
-排程服務 - 處理排程通知的自動發送
-使用 APScheduler BackgroundScheduler
+排程服務
+- 每個 gunicorn worker 都啟動 APScheduler，但只定時執行 tick；以資料庫租約（scheduler_leases）選出 leader，
+  只有 leader 觸發到期的排程工作
+- 工作的下次執行時間與執行指標存於 scheduled_jobs（重啟後延續），以條件式 UPDATE 認領，同一工作不會重疊執行
+- 工作在執行緒池中、於啟動時的 app context 內執行（不再每次重新建立 app）
+- 維護本程序記憶體內快取的工作（例如記憶體後端的排行榜）不經 leader，每個 worker 各自定時執行
 """
-from datetime import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import case, or_
+from sqlalchemy.exc import IntegrityError
 from app.utils.logger import get_logger
 
 logger = get_logger('services.scheduler')
 
+
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+TICK_SECONDS = int(os.getenv('SCHEDULER_TICK_SECONDS', 15))
+LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', 60))  # leader 未續約超過此秒數由其他程序接手
+JOB_TIMEOUT_SECONDS = int(os.getenv('SCHEDULER_JOB_TIMEOUT_SECONDS', 1800))  # 執行中超過此秒數視為中斷
+JOB_WORKERS = int(os.getenv('SCHEDULER_JOB_WORKERS', 4))
+
+LEASE_NAME = 'scheduler'
+# 每次認領的到期通知數（認領後逐一發送，直到沒有到期通知）
+NOTIFICATION_CLAIM_BATCH = 20
+
 _scheduler = None
+_app = None
+_holder = None
+_is_leader = False
+_jobs_synced = False
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# ===== 排程工作 =====
+
+def check_scheduled_notifications(app):
+    """認領到期的排程通知並發送；續傳發送途中中斷的通知"""
+    from app.services.notification_service import (
+        claim_due_notifications, send_notification, resume_stale_notifications
+    )
+
+    while True:
+        claimed = claim_due_notifications(NOTIFICATION_CLAIM_BATCH)
+        for notification_id in claimed:
+            logger.info(f'[Scheduler] firing notification {notification_id}')
+            send_notification(notification_id, claimed=True)
+        if len(claimed) < NOTIFICATION_CLAIM_BATCH:
+            break
+
+    # 發送途中 worker 中斷的通知由未完成的批次續傳
+    resume_stale_notifications()
+
+
+def refresh_leaderboards(app):
+    """定期重建排行榜（週/月滑動視窗過期、修正增量誤差）"""
+    from app.services.leaderboard import rebuild_leaderboards
+    rebuild_leaderboards()
+
+
+def maintain_exports(app):
+    """補撈未執行的匯出工作、清除過期匯出檔案"""
+    from app.services.export_jobs import maintain_export_jobs
+    maintain_export_jobs(app)
+
+
+def maintain_line_inbox(app):
+    """補撈未處理的 LINE webhook 事件、清除過期紀錄"""
+    from app.services.line_inbox import maintain_inbox
+    maintain_inbox(app)
+
+
+def snapshot_points_balances(app):
+    """將新的功德值異動彙總為每日餘額快照"""
+    from app.services.points_ledger import snapshot_balances
+    snapshot_balances()
+
+
+def verify_points_balances(app):
+    """以帳本重算所有帳號餘額，與快取的功德值比對"""
+    from app.services.points_ledger import snapshot_balances, verify_balances
+    snapshot_balances()
+    verify_balances()
+
+
+def compact_refresh_tokens(app):
+    """分批刪除已過期的 refresh token"""
+    from app.utils.token_store import compact_expired
+    compact_expired()
+
+
+def _job_registry():
+    """leader 執行的工作：名稱 -> (函式, 間隔秒數)"""
+    from app.services.leaderboard import REFRESH_MINUTES, is_shared_backend
+    from app.services.points_ledger import SNAPSHOT_INTERVAL_SECONDS, VERIFY_INTERVAL_SECONDS
+    from app.utils.token_store import COMPACT_INTERVAL_SECONDS
+    registry = {
+        'check_scheduled_notifications': (check_scheduled_notifications, 60),
+        'maintain_exports': (maintain_exports, 60),
+        'maintain_line_inbox': (maintain_line_inbox, 60),
+        'snapshot_points_balances': (snapshot_points_balances, SNAPSHOT_INTERVAL_SECONDS),
+        'verify_points_balances': (verify_points_balances, VERIFY_INTERVAL_SECONDS),
+        'compact_refresh_tokens': (compact_refresh_tokens, COMPACT_INTERVAL_SECONDS),
+    }
+    if is_shared_backend():
+        # Redis 排行榜各 worker 共用，由 leader 重建一次即可
+        registry['refresh_leaderboards'] = (refresh_leaderboards, REFRESH_MINUTES * 60)
+    return registry
+
+
+def _local_job_registry():
+    """每個 worker 各自執行的工作（維護本程序記憶體內的快取）：名稱 -> (函式, 間隔秒數)"""
+    from app.services.leaderboard import REFRESH_MINUTES, is_shared_backend
+    registry = {}
+    if not is_shared_backend():
+        # 記憶體排行榜每個 worker 各一份，各自重建週/月視窗並收斂到資料庫
+        registry['refresh_leaderboards'] = (refresh_leaderboards, REFRESH_MINUTES * 60)
+    return registry
+
+
+# ===== leader 租約與工作認領 =====
+
+def _renew_lease(now):
+    """取得或續約 leader 租約，回傳本程序是否為 leader"""
+    from app import db
+    from app.models.scheduler_state import SchedulerLease
+
+    expires_at = now + timedelta(seconds=LEASE_SECONDS)
+    renewed = SchedulerLease.query.filter(
+        SchedulerLease.name == LEASE_NAME,
+        or_(SchedulerLease.holder == _holder, SchedulerLease.expires_at < now)
+    ).update({
+        'acquired_at': case((SchedulerLease.holder == _holder, SchedulerLease.acquired_at), else_=now),
+        'holder': _holder,
+        'expires_at': expires_at
+    }, synchronize_session=False)
+
+    if not renewed and db.session.get(SchedulerLease, LEASE_NAME) is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(SchedulerLease(name=LEASE_NAME, holder=_holder, acquired_at=now, expires_at=expires_at))
+            renewed = 1
+        except IntegrityError:
+            # 其他程序同時建立租約
+            renewed = 0
+    db.session.commit()
+    return renewed == 1
 
 
-def check_scheduled_notifications():
-    """每分鐘執行：掃描到期的排程通知並發送"""
-    from app import create_app
-    app = create_app()
-    with app.app_context():
+def _release_lease():
+    from app import db
+    from app.models.scheduler_state import SchedulerLease
+
+    with _app.app_context():
+        SchedulerLease.query.filter_by(name=LEASE_NAME, holder=_holder).update(
+            {'expires_at': datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+
+
+def _sync_jobs(now):
+    """將程式中的工作清單同步到 scheduled_jobs（新工作立即到期、間隔以程式為準）"""
+    from app import db
+    from app.models.scheduler_state import ScheduledJob
+
+    existing = {job.name: job for job in ScheduledJob.query.all()}
+    for name, (_, interval) in _job_registry().items():
+        job = existing.get(name)
+        if job is None:
+            db.session.add(ScheduledJob(name=name, interval_seconds=interval, next_run_at=now))
+        elif job.interval_seconds != interval:
+            job.interval_seconds = interval
+    db.session.commit()
+
+
+def _claim_due_jobs(now):
+    """認領到期且未在執行中的工作（條件式 UPDATE，租約交接期間也不會重複執行）"""
+    from app import db
+    from app.models.scheduler_state import ScheduledJob
+
+    registry = _job_registry()
+    runnable = or_(
+        ScheduledJob.running_since.is_(None),
+        ScheduledJob.running_since < now - timedelta(seconds=JOB_TIMEOUT_SECONDS)
+    )
+    due = [name for (name,) in db.session.query(ScheduledJob.name).filter(
+        ScheduledJob.next_run_at <= now, runnable
+    ).all() if name in registry]
+
+    claimed = []
+    for name in due:
+        if ScheduledJob.query.filter(
+            ScheduledJob.name == name,
+            ScheduledJob.next_run_at <= now,
+            runnable
+        ).update({'running_since': now, 'last_holder': _holder}, synchronize_session=False):
+            claimed.append(name)
+    db.session.commit()
+    return claimed
+
+
+def _run_job(name):
+    """執行工作並寫入執行指標"""
+    from app import db
+    from app.models.scheduler_state import ScheduledJob
+
+    func, interval = _job_registry()[name]
+    with _app.app_context():
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        status, error = 'success', None
         try:
-            from app.models.temple_notification import TempleNotification
-            from app.services.notification_service import send_notification
+            func(_app)
+        except Exception as e:
+            db.session.rollback()
+            status, error = 'failed', str(e)[:2000]
+            logger.error(f'[Scheduler] job {name} failed: {e}')
+        duration_ms = int((time.monotonic() - started) * 1000)
+
+        try:
+            ScheduledJob.query.filter_by(name=name).update({
+                'running_since': None,
+                'next_run_at': started_at + timedelta(seconds=interval),
+                'last_started_at': started_at,
+                'last_finished_at': datetime.utcnow(),
+                'last_duration_ms': duration_ms,
+                'last_status': status,
+                'last_error': error,
+                'run_count': ScheduledJob.run_count + 1,
+                'failure_count': ScheduledJob.failure_count + (1 if error else 0),
+                'total_duration_ms': ScheduledJob.total_duration_ms + duration_ms
+            }, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'[Scheduler] failed to record job {name}: {e}')
 
+
+def _run_local_job(name):
+    """執行本程序的本地工作（不認領、不寫入 scheduled_jobs）"""
+    from app import db
+
+    func, _ = _local_job_registry()[name]
+    with _app.app_context():
+        try:
+            func(_app)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'[Scheduler] local job {name} failed: {e}')
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='scheduler-job')
+    return _executor
+
+
+def scheduler_tick():
+    """每 TICK_SECONDS 秒：續約租約；leader 認領到期工作交給執行緒池"""
+    global _is_leader, _jobs_synced
+    from app import db
+
+    with _app.app_context():
+        try:
             now = datetime.utcnow()
-            due = TempleNotification.query.filter(
-                TempleNotification.status == 'scheduled',
-                TempleNotification.scheduled_at <= now
-            ).all()
-
-            for notif in due:
-                logger.info(f'[Scheduler] firing notification {notif.id}: {notif.title}')
-                send_notification(notif.id)
+            leader = _renew_lease(now)
+            if leader != _is_leader:
+                logger.info(f'[Scheduler] {_holder} {"acquired" if leader else "lost"} leadership')
+                _is_leader = leader
+            if not leader:
+                return
+
+            if not _jobs_synced:
+                _sync_jobs(now)
+                _jobs_synced = True
+            for name in _claim_due_jobs(now):
+                _get_executor().submit(_run_job, name)
         except Exception as e:
-            logger.error(f'[Scheduler] error: {e}')
+            db.session.rollback()
+            logger.error(f'[Scheduler] tick error: {e}')
+
+
+def get_stats():
+    """排程器狀態與各工作執行指標（需在 app context 內呼叫）"""
+    from app.models.scheduler_state import SchedulerLease, ScheduledJob
+    from app import db
+
+    lease = db.session.get(SchedulerLease, LEASE_NAME)
+    return {
+        'enabled': _scheduler is not None,
+        'holder': _holder,
+        'is_leader': _is_leader,
+        'local_jobs': sorted(_local_job_registry()),
+        'leader': lease.holder if lease and lease.expires_at >= datetime.utcnow() else None,
+        'jobs': [job.to_dict() for job in ScheduledJob.query.order_by(ScheduledJob.name).all()]
+    }
 
 
 def init_scheduler(app):
     """在 app factory 中呼叫以啟動排程器"""
-    global _scheduler
+    global _scheduler, _app, _holder
     if _scheduler is not None:
         return  # 避免重複初始化（werkzeug reloader 會啟動兩次）
+    if not SCHEDULER_ENABLED:
+        logger.info('[Scheduler] disabled by SCHEDULER_ENABLED')
+        return
 
+    _app = app
+    _holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
     _scheduler = BackgroundScheduler(daemon=True)
     _scheduler.add_job(
-        func=check_scheduled_notifications,
-        trigger=IntervalTrigger(minutes=1),
-        id='check_scheduled_notifications',
+        func=scheduler_tick,
+        trigger=IntervalTrigger(seconds=TICK_SECONDS),
+        id='scheduler_tick',
+        next_run_time=datetime.now(),
+        max_instances=1,
+        coalesce=True,
         replace_existing=True,
     )
+    for name, (_, interval) in _local_job_registry().items():
+        _scheduler.add_job(
+            func=_run_local_job,
+            args=[name],
+            trigger=IntervalTrigger(seconds=interval),
+            id=f'local:{name}',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True,
+        )
     _scheduler.start()
-    logger.info('[Scheduler] started — checking scheduled notifications every minute')
+
+    import atexit
+    atexit.register(_release_lease)
+    logger.info(f'[Scheduler] started as {_holder} — tick every {TICK_SECONDS}s, lease {LEASE_SECONDS}s')
@@ -0,0 +1,107 @@
+"""
+連續打卡狀態服務
+- 打卡寫入時於同一交易內以 O(1) 更新 user_streaks（鎖定該用戶一列）
+- 讀取連續天數只需一次主鍵查詢，不再掃描所有打卡日期
+- rebuild_streaks 供 `flask stats rebuild-streaks` 由打卡紀錄重建
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.checkin import Checkin
+from app.models.user_streak import UserStreak
+from app.utils.logger import get_logger
+
+logger = get_logger('services.streak')
+
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def _advance(state, day):
+    """依新的打卡日期推進狀態（同一天或較舊的日期不影響）"""
+    last = state.last_checkin_date
+    if last is not None and day <= last:
+        return
+    if last is not None and day == last + timedelta(days=1):
+        state.current_streak += 1
+    else:
+        state.current_streak = 1
+    state.longest_streak = max(state.longest_streak or 0, state.current_streak)
+    state.last_checkin_date = day
+
+
+def record_checkin_day(user_id, checked_at=None):
+    """打卡寫入後呼叫（與打卡同一交易，由呼叫端 commit）"""
+    day = (checked_at or datetime.utcnow()).date()
+
+    state = UserStreak.query.filter_by(user_id=user_id).with_for_update().first()
+    if state is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(UserStreak(
+                    user_id=user_id,
+                    current_streak=1,
+                    longest_streak=1,
+                    last_checkin_date=day
+                ))
+            return
+        except IntegrityError:
+            # 併發的打卡已先建立狀態
+            state = UserStreak.query.filter_by(user_id=user_id).with_for_update().first()
+
+    _advance(state, day)
+
+
+def get_streak(user_id, today=None):
+    """目前 / 最長連續天數（最近一次打卡早於昨天時，目前連續天數歸零）"""
+    today = today or datetime.utcnow().date()
+    state = db.session.get(UserStreak, user_id)
+    if state is None or state.last_checkin_date is None:
+        return {'current_streak': 0, 'longest_streak': 0, 'last_checkin_date': None}
+
+    current = state.current_streak if state.last_checkin_date >= today - timedelta(days=1) else 0
+    return {
+        'current_streak': current,
+        'longest_streak': state.longest_streak,
+        'last_checkin_date': state.last_checkin_date.isoformat()
+    }
+
+
+def rebuild_streaks(user_id=None):
+    """
+    由 checkins 重建 user_streaks
+    user_id 為 None 時重建所有用戶，回傳寫入的筆數
+    """
+    day = func.date(Checkin.timestamp, type_=db.Date)
+    stmt = select(Checkin.user_id, day).distinct().order_by(Checkin.user_id, day)
+    if user_id:
+        stmt = stmt.where(Checkin.user_id == user_id)
+
+    # 依用戶、日期遞增逐筆推進（每位用戶只保留一個狀態物件）
+    states = {}
+    for uid, checkin_day in db.session.execute(stmt.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        state = states.get(uid)
+        if state is None:
+            state = states[uid] = UserStreak(user_id=uid, current_streak=0, longest_streak=0)
+        _advance(state, checkin_day)
+
+    delete_query = UserStreak.query
+    if user_id:
+        delete_query = delete_query.filter(UserStreak.user_id == user_id)
+    delete_query.delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': state.user_id,
+        'current_streak': state.current_streak,
+        'longest_streak': state.longest_streak,
+        'last_checkin_date': state.last_checkin_date,
+        'updated_at': now
+    } for state in states.values()]
+    for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+        db.session.execute(insert(UserStreak), rows[start:start + REBUILD_BATCH_SIZE])
+    db.session.commit()
+
+    logger.info(f'[Streak] rebuilt {len(rows)} user streaks (user_id={user_id or "all"})')
+    return len(rows)
@@ -0,0 +1,202 @@
+"""
+廟宇每日統計彙總服務
+- 打卡 / 兌換寫入時於同一交易內增量更新 temple_daily_stats、temple_visitors
+- 儀表板改讀彙總表，查詢成本只與顯示的天數相關
+- rebuild_rollups 供 `flask stats rebuild` 由原始資料重建
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, distinct, insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.checkin import Checkin
+from app.models.product import Product
+from app.models.redemption import Redemption
+from app.models.temple_daily_stats import TempleDailyStats, TempleVisitor
+from app.utils.logger import get_logger
+
+logger = get_logger('services.temple_rollup')
+
+
+ROLLUP_FIELDS = ('checkin_count', 'visitor_count', 'new_visitor_count', 'order_count', 'points_spent')
+
+
+def _bump_daily(temple_id, stat_date, **deltas):
+    """對 (temple_id, stat_date) 做原子遞增，該日尚無資料時建立"""
+    values = {getattr(TempleDailyStats, k): getattr(TempleDailyStats, k) + v for k, v in deltas.items()}
+    row_filter = TempleDailyStats.query.filter_by(temple_id=temple_id, stat_date=stat_date)
+
+    if row_filter.update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(TempleDailyStats(temple_id=temple_id, stat_date=stat_date, **deltas))
+    except IntegrityError:
+        # 併發寫入已先建立該日資料
+        row_filter.update(values, synchronize_session=False)
+
+
+def record_checkin(temple_id, user_id, checked_at=None):
+    """打卡寫入後呼叫（與打卡同一交易，由呼叫端 commit）"""
+    if not temple_id:
+        return
+    checked_at = checked_at or datetime.utcnow()
+    day_start = checked_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    visitor = TempleVisitor.query.filter_by(
+        temple_id=temple_id, user_id=user_id
+    ).with_for_update().first()
+
+    if visitor is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(TempleVisitor(
+                    temple_id=temple_id,
+                    user_id=user_id,
+                    first_visit_at=checked_at,
+                    last_visit_at=checked_at,
+                    visit_count=1
+                ))
+        except IntegrityError:
+            # 併發的第一次打卡已先建立訪客資料
+            visitor = TempleVisitor.query.filter_by(
+                temple_id=temple_id, user_id=user_id
+            ).with_for_update().first()
+        else:
+            _bump_daily(temple_id, checked_at.date(), checkin_count=1, visitor_count=1, new_visitor_count=1)
+            return
+
+    first_today = visitor.last_visit_at < day_start
+    visitor.last_visit_at = max(visitor.last_visit_at, checked_at)
+    visitor.visit_count += 1
+    _bump_daily(temple_id, checked_at.date(), checkin_count=1, visitor_count=1 if first_today else 0)
+
+
+def record_redemption(temple_id, points, redeemed_at=None):
+    """兌換建立後呼叫"""
+    if not temple_id:
+        return
+    redeemed_at = redeemed_at or datetime.utcnow()
+    _bump_daily(temple_id, redeemed_at.date(), order_count=1, points_spent=points)
+
+
+def record_redemption_cancelled(temple_id, points, redeemed_at):
+    """兌換取消（退還功德值）後呼叫，自原下單日扣回"""
+    if not temple_id:
+        return
+    _bump_daily(temple_id, redeemed_at.date(), order_count=-1, points_spent=-points)
+
+
+# ===== 讀取 =====
+
+def get_daily_rows(temple_id, start_date, end_date=None):
+    """取得日期區間內的每日彙總（依日期排序，無資料的日期不回傳）"""
+    query = TempleDailyStats.query.filter(
+        TempleDailyStats.temple_id == temple_id,
+        TempleDailyStats.stat_date >= start_date
+    )
+    if end_date:
+        query = query.filter(TempleDailyStats.stat_date <= end_date)
+    return query.order_by(TempleDailyStats.stat_date.asc()).all()
+
+
+def sum_rollups(temple_id, start_date=None, end_date=None):
+    """加總日期區間的彙總欄位（不給日期則為全部）"""
+    query = db.session.query(
+        *[func.coalesce(func.sum(getattr(TempleDailyStats, f)), 0) for f in ROLLUP_FIELDS]
+    ).filter(TempleDailyStats.temple_id == temple_id)
+    if start_date:
+        query = query.filter(TempleDailyStats.stat_date >= start_date)
+    if end_date:
+        query = query.filter(TempleDailyStats.stat_date <= end_date)
+    return {f: int(v) for f, v in zip(ROLLUP_FIELDS, query.one())}
+
+
+def count_visitors(temple_id, since=None):
+    """不重複訪客數：since 之後有來訪者（不給 since 則為全部訪客）"""
+    query = db.session.query(func.count(TempleVisitor.id)).filter(TempleVisitor.temple_id == temple_id)
+    if since:
+        query = query.filter(TempleVisitor.last_visit_at >= since)
+    return query.scalar() or 0
+
+
+def count_new_visitors(temple_id, start, end):
+    """首次來訪落在 [start, end) 的訪客數"""
+    return db.session.query(func.count(TempleVisitor.id)).filter(
+        TempleVisitor.temple_id == temple_id,
+        TempleVisitor.first_visit_at >= start,
+        TempleVisitor.first_visit_at < end
+    ).scalar() or 0
+
+
+# ===== 重建 =====
+
+def rebuild_rollups(temple_id=None):
+    """
+    由 checkins / redemptions 原始資料重建彙總表
+    temple_id 為 None 時重建所有廟宇，回傳寫入的每日資料筆數
+    """
+    def scoped(query, column):
+        return query.filter(column == temple_id) if temple_id else query.filter(column.isnot(None))
+
+    # 1. 訪客表：每位訪客的首次/最近來訪
+    visitors_delete = TempleVisitor.query
+    daily_delete = TempleDailyStats.query
+    if temple_id:
+        visitors_delete = visitors_delete.filter(TempleVisitor.temple_id == temple_id)
+        daily_delete = daily_delete.filter(TempleDailyStats.temple_id == temple_id)
+    visitors_delete.delete(synchronize_session=False)
+    daily_delete.delete(synchronize_session=False)
+
+    visitor_select = scoped(db.session.query(
+        Checkin.temple_id,
+        Checkin.user_id,
+        func.min(Checkin.timestamp),
+        func.max(Checkin.timestamp),
+        func.count(Checkin.id)
+    ), Checkin.temple_id).group_by(Checkin.temple_id, Checkin.user_id)
+    db.session.execute(insert(TempleVisitor).from_select(
+        ['temple_id', 'user_id', 'first_visit_at', 'last_visit_at', 'visit_count'],
+        visitor_select
+    ))
+
+    # 2. 每日彙總：打卡、不重複訪客、新訪客、有效訂單
+    rows = {}
+
+    def row(tid, day):
+        key = (tid, str(day)[:10])
+        if key not in rows:
+            rows[key] = dict.fromkeys(ROLLUP_FIELDS, 0)
+        return rows[key]
+
+    checkin_day = func.date(Checkin.timestamp)
+    for tid, day, checkins, visitors in scoped(db.session.query(
+        Checkin.temple_id, checkin_day, func.count(Checkin.id), func.count(distinct(Checkin.user_id))
+    ), Checkin.temple_id).group_by(Checkin.temple_id, checkin_day):
+        row(tid, day).update(checkin_count=checkins, visitor_count=visitors)
+
+    first_day = func.date(TempleVisitor.first_visit_at)
+    for tid, day, new_visitors in scoped(db.session.query(
+        TempleVisitor.temple_id, first_day, func.count(TempleVisitor.id)
+    ), TempleVisitor.temple_id).group_by(TempleVisitor.temple_id, first_day):
+        row(tid, day)['new_visitor_count'] = new_visitors
+
+    # 舊資料的 redemptions.temple_id 可能為空，改以商品所屬廟宇歸戶
+    order_temple = func.coalesce(Redemption.temple_id, Product.temple_id)
+    order_day = func.date(Redemption.redeemed_at)
+    for tid, day, orders, points in scoped(db.session.query(
+        order_temple, order_day, func.count(Redemption.id), func.sum(Redemption.merit_points_used)
+    ).join(
+        Product, Product.id == Redemption.product_id
+    ).filter(
+        Redemption.status != 'cancelled'
+    ), order_temple).group_by(order_temple, order_day):
+        row(tid, day).update(order_count=orders, points_spent=int(points or 0))
+
+    if rows:
+        db.session.execute(insert(TempleDailyStats), [
+            dict(temple_id=tid, stat_date=datetime.strptime(day, '%Y-%m-%d').date(), **values)
+            for (tid, day), values in rows.items()
+        ])
+    db.session.commit()
+    logger.info(f'[Rollup] rebuilt {len(rows)} daily rows (temple_id={temple_id or "all"})')
+    return len(rows)
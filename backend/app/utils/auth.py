@@ -9,7 +9,7 @@ from functools import wraps
 from flask import request
 from app.utils.response import error_response
 from app.utils.logger import get_logger
-from app import db
+from app.utils.principal_cache import load_principal
 
 logger = get_logger('utils.auth')
 
@@ -39,43 +39,35 @@ def generate_token(user_id, account_type='public'):
 
 def generate_refresh_token(user_id, account_type='public'):
     """
-    生成 Refresh Token（長期），並寫入資料庫
+    生成 Refresh Token（長期），並寫入資料庫 session（由呼叫端與登入資料一起 commit）
     """
-    from app.models.refresh_token import RefreshToken
+    from app.utils import token_store
 
     secret_key = os.getenv('JWT_SECRET_KEY')
     jti = str(uuid.uuid4())
     expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_DAYS)
+    generation = token_store.record_issued(jti, user_id, account_type, expires_at)
 
     payload = {
         'user_id': user_id,
         'account_type': account_type,
         'type': 'refresh',
         'jti': jti,
+        'gen': generation,
         'exp': expires_at,
         'iat': datetime.utcnow()
     }
 
     token = jwt.encode(payload, secret_key, algorithm='HS256')
-
-    # 寫入資料庫
-    rt = RefreshToken(
-        jti=jti,
-        user_id=user_id,
-        account_type=account_type,
-        expires_at=expires_at,
-    )
-    db.session.add(rt)
-    db.session.commit()
-
     return token
 
 
 def verify_refresh_token(token):
     """
     驗證 Refresh Token，回傳 (payload, error)
+    撤銷狀態由 token_store 的記憶體快取判斷，有效的 token 不需查詢資料庫
     """
-    from app.models.refresh_token import RefreshToken
+    from app.utils import token_store
 
     payload, error = decode_token(token)
     if error:
@@ -88,12 +80,9 @@ def verify_refresh_token(token):
     if not jti:
         return None, 'Token 缺少 jti'
 
-    rt = RefreshToken.query.filter_by(jti=jti).first()
-    if not rt:
-        return None, 'Refresh Token 不存在'
-
-    if not rt.is_valid:
-        return None, 'Refresh Token 已失效'
+    error = token_store.check(payload)
+    if error:
+        return None, error
 
     return payload, None
 
@@ -102,31 +91,16 @@ def revoke_refresh_token(jti):
     """
     撤銷指定的 Refresh Token
     """
-    from app.models.refresh_token import RefreshToken
-
-    rt = RefreshToken.query.filter_by(jti=jti).first()
-    if rt and not rt.is_revoked:
-        rt.revoked_at = datetime.utcnow()
-        db.session.commit()
-        return True
-    return False
+    from app.utils import token_store
+    return token_store.revoke(jti)
 
 
 def revoke_all_user_tokens(user_id, account_type):
     """
-    撤銷該用戶所有 Refresh Token（強制登出所有裝置）
+    撤銷該用戶所有 Refresh Token（強制登出所有裝置），單一 UPDATE 將帳號的 token 世代加一
     """
-    from app.models.refresh_token import RefreshToken
-
-    tokens = RefreshToken.query.filter_by(
-        user_id=user_id,
-        account_type=account_type,
-        revoked_at=None
-    ).all()
-    now = datetime.utcnow()
-    for t in tokens:
-        t.revoked_at = now
-    db.session.commit()
+    from app.utils import token_store
+    token_store.revoke_all(user_id, account_type)
 
 
 def decode_token(token):
@@ -178,21 +152,9 @@ def token_required(f):
         if not user_id:
             return error_response('Token 缺少用戶 ID', 401)
 
-        # 根據 account_type 查詢對應的用戶（向後兼容）
-        current_user = None
-
+        # 根據 account_type 取得對應的用戶（向後兼容；先查 principal 快取）
         try:
-            if account_type == 'public' or account_type == 'user':
-                from app.models.public_user import PublicUser
-                current_user = PublicUser.query.get(user_id)
-
-            elif account_type == 'temple_admin':
-                from app.models.temple_admin_user import TempleAdminUser
-                current_user = TempleAdminUser.query.get(user_id)
-
-            elif account_type == 'super_admin' or account_type == 'admin':
-                from app.models.super_admin_user import SuperAdminUser
-                current_user = SuperAdminUser.query.get(user_id)
+            current_user = load_principal(account_type, user_id)
 
         except Exception as e:
             logger.exception('查詢用戶失敗')
@@ -239,8 +201,7 @@ def public_user_required(f):
         if account_type not in ['public', 'user']:
             return error_response('此功能僅限一般使用者', 403)
 
-        from app.models.public_user import PublicUser
-        current_user = PublicUser.query.get(payload['user_id'])
+        current_user = load_principal('public', payload['user_id'])
 
         if not current_user or (hasattr(current_user, 'is_active') and not current_user.is_active):
             return error_response('用戶不存在或已停用', 401)
@@ -278,8 +239,7 @@ def temple_admin_token_required(f):
         if account_type != 'temple_admin':
             return error_response('此功能僅限廟方管理員', 403)
 
-        from app.models.temple_admin_user import TempleAdminUser
-        current_user = TempleAdminUser.query.get(payload['user_id'])
+        current_user = load_principal('temple_admin', payload['user_id'])
 
         if not current_user or (hasattr(current_user, 'is_active') and not current_user.is_active):
             return error_response('廟方管理員不存在或已停用', 401)
@@ -317,8 +277,7 @@ def super_admin_token_required(f):
         if account_type not in ['super_admin', 'admin']:
             return error_response('此功能僅限系統管理員', 403)
 
-        from app.models.super_admin_user import SuperAdminUser
-        current_user = SuperAdminUser.query.get(payload['user_id'])
+        current_user = load_principal('super_admin', payload['user_id'])
 
         if not current_user or (hasattr(current_user, 'is_active') and not current_user.is_active):
             return error_response('系統管理員不存在或已停用', 401)
@@ -0,0 +1,207 @@
+"""
+資料庫連線池設定與監控
+- engine_options()：由環境變數組出 SQLALCHEMY_ENGINE_OPTIONS（pool 大小、overflow、recycle、pre-ping、statement timeout）
+- InstrumentedQueuePool：記錄取得連線的等待時間與逾時次數
+- 監聽 cursor 事件累計每個請求的查詢次數與 DB 時間（並交給 SQL 分析器）
+- get_stats() 供 /api/metrics（數值為本 worker 自啟動以來的累計）
+"""
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from app.utils.logger import get_logger
+
+logger = get_logger('utils.db_metrics')
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # 等待可用連線的秒數
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # 秒，需小於 MySQL wait_timeout
+DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))  # 0 表示不限制
+
+
+class _Metrics:
+    """執行緒安全的累計數值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_wait_total = 0.0
+            self.checkout_wait_max = 0.0
+            self.checkout_timeouts = 0
+            self.requests = 0
+            self.request_queries = 0
+            self.request_query_time = 0.0
+            self.max_request_queries = 0
+            self.max_request_query_time = 0.0
+
+    def record_checkout(self, waited, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+            if timed_out:
+                self.checkout_timeouts += 1
+
+    def record_request(self, queries, query_time):
+        with self._lock:
+            self.requests += 1
+            self.request_queries += queries
+            self.request_query_time += query_time
+            self.max_request_queries = max(self.max_request_queries, queries)
+            self.max_request_query_time = max(self.max_request_query_time, query_time)
+
+    def snapshot(self):
+        with self._lock:
+            return {k: v for k, v in vars(self).items() if not k.startswith('_')}
+
+
+metrics = _Metrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """記錄 checkout 等待時間的 QueuePool（含 overflow 建立新連線的時間）"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            metrics.record_checkout(time.perf_counter() - start, timed_out=True)
+            logger.warning(f'[DB] pool checkout timed out after {self._timeout}s ({self.status()})')
+            raise
+        metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+# SQLAlchemy 的 pool logger 名稱取自類別所在模組（app.utils.db_metrics.InstrumentedQueuePool），
+# 會繼承 app logger 的 DEBUG 等級而記錄每次 checkout / checkin / reset / pre-ping；
+# 固定為 WARNING，與內建 QueuePool 未開啟 echo_pool 時相同
+logging.getLogger(f'{InstrumentedQueuePool.__module__}.{InstrumentedQueuePool.__name__}').setLevel(logging.WARNING)
+
+
+def engine_options(database_uri):
+    """依環境變數產生 engine options（非 MySQL 連線維持 Flask-SQLAlchemy 預設）"""
+    if not database_uri.startswith('mysql'):
+        return {}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        # MySQL 5.7.8+：超過時間的 SELECT 由伺服器中止
+        options['connect_args'] = {
+            'init_command': f'SET SESSION max_execution_time={DB_STATEMENT_TIMEOUT_MS}'
+        }
+    return options
+
+
+# ===== 每個請求的查詢統計 =====
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if has_request_context():
+        g.db_query_count = g.get('db_query_count', 0) + 1
+        g.db_query_time = g.get('db_query_time', 0.0) + elapsed
+        # 啟用 SQL 分析的請求（見 utils/sql_profiler.py）
+        profile = g.get('sql_profile')
+        if profile is not None:
+            profile.record(statement, elapsed)
+
+
+def _handle_error(context):
+    # 執行失敗的語句不會觸發 after_cursor_execute，移除其開始時間
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start_time')
+        if starts:
+            starts.pop()
+
+
+def _record_request(error=None):
+    if has_request_context():
+        metrics.record_request(g.get('db_query_count', 0), g.get('db_query_time', 0.0))
+
+
+_listeners_installed = False
+
+
+def init_db_metrics(app):
+    """在 app factory 中呼叫：掛上 cursor 事件與請求結束的統計"""
+    global _listeners_installed
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listeners_installed = True
+    app.teardown_request(_record_request)
+
+
+def pool_status(engine):
+    """目前連線池使用狀況"""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {'pool_class': type(pool).__name__}
+
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        'pool_class': type(pool).__name__,
+        'pool_size': pool.size(),
+        'max_overflow': pool._max_overflow,
+        'checked_out': checked_out,
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+        'saturation': round(checked_out / capacity, 4) if capacity else 0,
+        'pre_ping': pool._pre_ping,
+        'recycle_seconds': pool._recycle,
+        'timeout_seconds': pool._timeout,
+    }
+
+
+def get_stats(engine):
+    """連線池與請求查詢統計（供 metrics 端點）"""
+    data = metrics.snapshot()
+    checkouts = data['checkouts']
+    requests = data['requests']
+    return {
+        'pool': pool_status(engine),
+        'checkout': {
+            'count': checkouts,
+            'timeouts': data['checkout_timeouts'],
+            'avg_wait_ms': round(data['checkout_wait_total'] * 1000 / checkouts, 3) if checkouts else 0,
+            'max_wait_ms': round(data['checkout_wait_max'] * 1000, 3),
+        },
+        'requests': {
+            'count': requests,
+            'avg_queries': round(data['request_queries'] / requests, 2) if requests else 0,
+            'avg_query_time_ms': round(data['request_query_time'] * 1000 / requests, 3) if requests else 0,
+            'max_queries': data['max_request_queries'],
+            'max_query_time_ms': round(data['max_request_query_time'] * 1000, 3),
+        }
+    }
@@ -1,10 +1,18 @@
 """
 檔案上傳工具
+- 圖片以內容雜湊（SHA-256）存放於 images/<前兩碼>/<雜湊>/，相同檔案重複上傳只存一份
+- 上傳請求只做驗證與存檔，各尺寸（JPEG + WebP）由 services/image_pipeline.py 在背景程序產生
+- 原始檔案可能含 EXIF（GPS、裝置資訊），存於不公開的 IMAGE_ORIGINALS_FOLDER，只作為縮圖來源；
+  對外只提供重新編碼、不含中繼資料的各尺寸圖片
 """
+import hashlib
+import json
 import os
+import re
+import shutil
 import uuid
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageOps
 from werkzeug.utils import secure_filename
 
 # 允許的圖片格式
@@ -20,6 +28,21 @@ IMAGE_SIZES = {
     'large': (1920, 1920)     # 大尺寸
 }
 
+# 內容定址儲存
+IMAGE_ROOT = 'images'
+IMAGE_MANIFEST = 'manifest.json'
+VARIANT_FORMATS = ('jpg', 'webp')
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+HASH_CHUNK_SIZE = 64 * 1024
+
+# 原始檔案目錄（不可位於公開的 uploads 之下）
+ORIGINALS_FOLDER = os.getenv('IMAGE_ORIGINALS_FOLDER') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'private', 'originals'
+)
+
+_VARIANT_URL = re.compile(r'^(?P<base>/uploads/images/[0-9a-f]{2}/[0-9a-f]{64})/(?P<size>\w+)\.(?P<fmt>jpg|webp)$')
+
 def allowed_file(filename):
     """
     檢查檔案格式是否允許
@@ -138,6 +161,137 @@ def compress_and_resize_image(input_path, output_path, size_name='medium', quali
     except Exception as e:
         return False, f'圖片處理失敗: {str(e)}'
 
+def to_rgb(img):
+    """轉換為 RGB（PNG 透明度以白底處理）"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _save_atomic(img, path, fmt, **options):
+    tmp_path = f'{path}.tmp'
+    img.save(tmp_path, fmt, **options)
+    os.replace(tmp_path, path)
+
+
+def render_image_variants(source_path, target_dir):
+    """
+    由原圖產生 IMAGE_SIZES 所有尺寸的 JPEG 與 WebP，最後寫入 manifest.json（代表完成）
+    在 image_pipeline 的背景程序中執行；原圖只解碼一次，由大到小逐級縮圖
+    """
+    with Image.open(source_path) as img:
+        largest = max(IMAGE_SIZES.values())
+        img.draft('RGB', largest)  # JPEG 直接以較低解析度解碼
+        img = to_rgb(ImageOps.exif_transpose(img))
+        width, height = img.size
+
+        variants = {}
+        current = img
+        for size_name, target_size in sorted(IMAGE_SIZES.items(), key=lambda item: item[1], reverse=True):
+            current = current.copy()
+            current.thumbnail(target_size, Image.Resampling.LANCZOS)
+            _save_atomic(current, os.path.join(target_dir, f'{size_name}.jpg'), 'JPEG',
+                         quality=JPEG_QUALITY, optimize=True, progressive=True)
+            _save_atomic(current, os.path.join(target_dir, f'{size_name}.webp'), 'WEBP',
+                         quality=WEBP_QUALITY, method=4)
+            variants[size_name] = {'width': current.width, 'height': current.height}
+
+    manifest = {
+        'width': width,
+        'height': height,
+        'variants': variants,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    tmp_path = os.path.join(target_dir, f'{IMAGE_MANIFEST}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(target_dir, IMAGE_MANIFEST))
+    return manifest
+
+
+def image_relative_dir(content_hash):
+    return f'{IMAGE_ROOT}/{content_hash[:2]}/{content_hash}'
+
+
+def image_variant_urls(content_hash):
+    """各尺寸的 URL：{size: {'jpg': url, 'webp': url}}"""
+    base = f'/uploads/{image_relative_dir(content_hash)}'
+    return {
+        size_name: {fmt: f'{base}/{size_name}.{fmt}' for fmt in VARIANT_FORMATS}
+        for size_name in IMAGE_SIZES
+    }
+
+
+def image_variant_url(url, size_name='thumbnail', fmt='jpg'):
+    """
+    由已儲存的圖片 URL 推得其他尺寸的 URL（舊版非內容定址的 URL 原樣回傳）
+    例：product.image_url（medium）-> 列表用的 thumbnail
+    """
+    if not url:
+        return url
+    match = _VARIANT_URL.match(url)
+    if not match or size_name not in IMAGE_SIZES:
+        return url
+    return f'{match.group("base")}/{size_name}.{fmt}'
+
+
+def is_content_addressed(url):
+    """內容定址的圖片可能被多筆資料共用，不可隨舊資料刪除"""
+    return bool(url) and url.startswith(f'/uploads/{IMAGE_ROOT}/')
+
+
+def is_original_name(filename):
+    return os.path.basename(filename).startswith('original.')
+
+
+def find_original(target_dir):
+    if not os.path.isdir(target_dir):
+        return None
+    for name in os.listdir(target_dir):
+        if is_original_name(name):
+            return os.path.join(target_dir, name)
+    return None
+
+
+def original_dir(content_hash):
+    return os.path.join(ORIGINALS_FOLDER, content_hash[:2], content_hash)
+
+
+def locate_original(content_hash, upload_folder):
+    """
+    原始檔案路徑；舊版存於公開目錄的原始檔在此移入 ORIGINALS_FOLDER
+    """
+    original = find_original(original_dir(content_hash))
+    if original:
+        return original
+    legacy = find_original(os.path.join(upload_folder, image_relative_dir(content_hash)))
+    if legacy is None:
+        return None
+    os.makedirs(original_dir(content_hash), exist_ok=True)
+    moved = os.path.join(original_dir(content_hash), os.path.basename(legacy))
+    shutil.move(legacy, moved)
+    return moved
+
+
+def _save_with_hash(file, temp_path):
+    """串流寫入暫存檔並同時計算 SHA-256"""
+    digest = hashlib.sha256()
+    with open(temp_path, 'wb') as out:
+        while True:
+            chunk = file.stream.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
 def save_uploaded_image(file, upload_folder, category='products', resize=True, user_id=None):
     """
     儲存上傳的圖片
@@ -145,14 +299,14 @@ def save_uploaded_image(file, upload_folder, category='products', resize=True, u
     Args:
         file: 上傳的檔案物件
         upload_folder: 上傳根目錄
-        category: 類別 (products, avatars, temp)
-        resize: 是否壓縮調整大小
-        user_id: 用戶ID（用於建立用戶專屬資料夾）
+        category: 類別 (products, avatars, temp)；內容定址後不影響存放位置，保留供相容
+        resize: url 是否為 medium 尺寸（False 時為 large）；各尺寸一律在背景產生，原始檔案不對外提供
+        user_id: 用戶ID（記錄於回傳資訊以便追溯）
 
     Returns:
         success: 是否成功
         message: 訊息
-        file_info: 檔案資訊字典
+        file_info: 檔案資訊字典（url 為 medium 尺寸，variants 為各尺寸 URL）
     """
     try:
         # 檢查檔案
@@ -163,58 +317,55 @@ def save_uploaded_image(file, upload_folder, category='products', resize=True, u
         if not allowed_file(file.filename):
             return False, f'不支援的檔案格式，只允許: {", ".join(ALLOWED_EXTENSIONS)}', None
 
-        # 生成檔案名稱（使用時間戳，不使用UUID以便追溯）
         original_filename = secure_filename(file.filename)
-        new_filename = generate_unique_filename(original_filename, include_uuid=False)
-
-        # 建立分類目錄（如果有 user_id，則在分類下建立用戶資料夾）
-        if user_id:
-            category_folder = os.path.join(upload_folder, category, f'user_{user_id}')
-        else:
-            category_folder = os.path.join(upload_folder, category)
-        os.makedirs(category_folder, exist_ok=True)
 
-        # 暫存原始檔案
-        temp_path = os.path.join(upload_folder, 'temp', new_filename)
+        # 暫存原始檔案（同時計算內容雜湊；同樣不放在公開目錄）
+        temp_path = os.path.join(ORIGINALS_FOLDER, 'tmp', f'upload_{uuid.uuid4().hex}')
         os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-        file.save(temp_path)
+        content_hash = _save_with_hash(file, temp_path)
 
         # 驗證圖片
         is_valid, message = validate_image(temp_path)
         if not is_valid:
             os.remove(temp_path)
             return False, message, None
+        _, image_format = verify_magic_bytes(temp_path)
 
-        # 最終路徑
-        final_path = os.path.join(category_folder, new_filename)
+        # 內容定址目錄：相同內容的檔案只保留一份；原始檔案存於不公開的目錄
+        relative_dir = image_relative_dir(content_hash)
+        target_dir = os.path.join(upload_folder, relative_dir)
+        os.makedirs(target_dir, exist_ok=True)
 
-        if resize:
-            # 壓縮並調整大小
-            success, result = compress_and_resize_image(temp_path, final_path)
-            if not success:
-                os.remove(temp_path)
-                return False, result, None
-
-            # 刪除暫存檔
+        original_path = locate_original(content_hash, upload_folder)
+        deduplicated = original_path is not None
+        if deduplicated:
             os.remove(temp_path)
         else:
-            # 直接移動檔案
-            os.rename(temp_path, final_path)
+            os.makedirs(original_dir(content_hash), exist_ok=True)
+            original_path = os.path.join(original_dir(content_hash), f'original.{image_format}')
+            os.replace(temp_path, original_path)
 
-        # 計算相對路徑 (用於資料庫儲存和 URL)
-        if user_id:
-            relative_path = os.path.join(category, f'user_{user_id}', new_filename).replace('\\', '/')
-        else:
-            relative_path = os.path.join(category, new_filename).replace('\\', '/')
+        ready = os.path.exists(os.path.join(target_dir, IMAGE_MANIFEST))
+        if not ready:
+            from app.services.image_pipeline import submit_variants
+            ready = submit_variants(original_path, target_dir)
+
+        original_name = os.path.basename(original_path)
+        variants = image_variant_urls(content_hash)
+        url = variants['medium' if resize else 'large']['jpg']
 
         # 取得檔案資訊
         file_info = {
-            'filename': new_filename,
+            'filename': original_name,
             'original_filename': original_filename,
-            'path': relative_path,
-            'full_path': final_path,
-            'size': os.path.getsize(final_path),
-            'url': f'/uploads/{relative_path}',
+            'path': url[len('/uploads/'):],
+            'full_path': original_path,
+            'size': os.path.getsize(original_path),
+            'url': url,
+            'hash': content_hash,
+            'variants': variants,
+            'status': 'ready' if ready else 'processing',
+            'deduplicated': deduplicated,
             'user_id': user_id  # 記錄用戶ID以便追溯
         }
 
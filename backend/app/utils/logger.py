@@ -24,6 +24,9 @@ class JsonFormatter(logging.Formatter):
             'function': record.funcName,
             'line': record.lineno,
         }
+        # logger.info(msg, extra={'data': {...}}) 附帶的結構化資料
+        if hasattr(record, 'data'):
+            log_data['data'] = record.data
         if record.exc_info and record.exc_info[0]:
             log_data['exception'] = self.formatException(record.exc_info)
         return json.dumps(log_data, ensure_ascii=False)
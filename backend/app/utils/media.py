@@ -0,0 +1,236 @@
+"""
+靜態媒體回應
+- send_media：ETag / If-None-Match、Range、Cache-Control；帶指紋的路徑（內容雜湊圖片、Vite assets）標記 immutable
+- 有預先壓縮的 .br / .gz 檔且用戶端支援時直接回傳（Content-Encoding + Vary）
+- resized_image：?w=&h= 即時縮圖（尺寸限於 MEDIA_RESIZE_SIZES 允許清單），結果存於有容量上限的磁碟 LRU 快取
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import threading
+from flask import request, send_file
+from PIL import Image, ImageOps
+from app.utils.exceptions import ValidationError
+from app.utils.file_upload import to_rgb, JPEG_QUALITY, WEBP_QUALITY
+from app.utils.logger import get_logger
+
+logger = get_logger('utils.media')
+
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 3600))  # 未帶指紋的檔案（秒）
+# 即時縮圖允許的邊長（含上傳時產生的 150 / 800 / 1920）；任意尺寸組合會讓每個請求都重新縮圖並占用磁碟快取
+RESIZE_SIZES = sorted({int(value) for value in os.getenv(
+    'MEDIA_RESIZE_SIZES', '150,320,480,640,800,1080,1280,1920'
+).split(',') if value.strip()})
+RESIZE_MAX_DIMENSION = RESIZE_SIZES[-1]
+RESIZE_CACHE_BYTES = int(os.getenv('MEDIA_RESIZE_CACHE_MB', 200)) * 1024 * 1024
+
+# images/<hh>/<sha256>/...（內容定址）或 Vite 輸出的 name-<hash>.ext
+_FINGERPRINTED = re.compile(r'(^|/)images/[0-9a-f]{2}/[0-9a-f]{64}/|(^|/)assets/[^/]+-[A-Za-z0-9_-]{8,}\.\w+$')
+
+# 預先壓縮檔（依偏好順序）
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_EXTENSIONS = {'.js', '.mjs', '.css', '.html', '.svg', '.json', '.map', '.txt', '.xml', '.wasm'}
+
+
+def is_fingerprinted(path):
+    return bool(_FINGERPRINTED.search(path.replace('\\', '/')))
+
+
+def _accepted_encodings():
+    header = request.headers.get('Accept-Encoding', '')
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if name and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(name.lower())
+    return accepted
+
+
+def send_media(directory, filename, immutable=None, no_cache=False):
+    """
+    由 directory 回傳檔案（路徑須已由呼叫端確認位於 directory 內）
+    immutable 為 None 時依路徑是否帶指紋判斷；no_cache 用於 index.html 等入口檔
+    """
+    path = os.path.join(directory, filename)
+    if immutable is None:
+        immutable = is_fingerprinted(filename)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    source = path
+    if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        accepted = _accepted_encodings()
+        for name, suffix in PRECOMPRESSED:
+            candidate = path + suffix
+            if name in accepted and os.path.exists(candidate) \
+                    and os.path.getmtime(candidate) >= os.path.getmtime(path):
+                encoding, source = name, candidate
+                break
+
+    response = send_file(source, mimetype=mimetype, conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        response.vary.add('Accept-Encoding')
+
+    if no_cache:
+        response.headers['Cache-Control'] = 'no-cache'
+    elif immutable:
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}'
+    return response
+
+
+# ===== 即時縮圖 =====
+
+class ResizeCache:
+    """磁碟 LRU：檔案 mtime 作為最近使用時間，超過容量時刪除最舊的檔案"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._directory = None
+        self._total = None
+        self._lock = threading.Lock()
+
+    def _init(self, directory):
+        if self._directory != directory:
+            os.makedirs(directory, exist_ok=True)
+            self._directory = directory
+            self._total = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def get(self, directory, key):
+        path = os.path.join(directory, key)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        return None
+
+    def put(self, directory, key, render):
+        """render(tmp_path) 產生檔案後放入快取"""
+        with self._lock:
+            self._init(directory)
+        path = os.path.join(directory, key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        render(tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict(directory)
+        return path
+
+    def _evict(self, directory):
+        # 其他 worker 也會寫入，重新掃描取得實際用量
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.endswith('.tmp')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self._total = total
+        logger.info(f'[Media] resize cache evicted {removed} files, {total // 1024} KB in use')
+
+
+resize_cache = ResizeCache(RESIZE_CACHE_BYTES)
+
+
+def parse_resize_args():
+    """
+    讀取 ?w=&h=，兩者皆未提供回傳 None；未提供的一邊以最大尺寸計
+    不在 RESIZE_SIZES 內的尺寸拋出 ValidationError
+    """
+    width = request.args.get('w')
+    height = request.args.get('h')
+    if not width and not height:
+        return None
+
+    def dimension(value):
+        if not value:
+            return RESIZE_MAX_DIMENSION
+        if not value.isdigit() or int(value) not in RESIZE_SIZES:
+            raise ValidationError(f'不支援的縮圖尺寸，可用：{", ".join(map(str, RESIZE_SIZES))}')
+        return int(value)
+
+    return dimension(width), dimension(height)
+
+
+def negotiate_image_format():
+    fmt = request.args.get('fmt')
+    if fmt in ('jpg', 'webp'):
+        return fmt
+    return 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+
+
+def resized_image(source_path, cache_dir, width, height, fmt):
+    """回傳縮圖檔路徑（快取鍵含來源路徑與 mtime，來源更新後自動產生新版）"""
+    stat = os.stat(source_path)
+    digest = hashlib.sha1(f'{source_path}:{stat.st_mtime_ns}:{width}x{height}'.encode()).hexdigest()
+    key = f'{digest}.{fmt}'
+
+    cached = resize_cache.get(cache_dir, key)
+    if cached:
+        return cached
+
+    def render(tmp_path):
+        with Image.open(source_path) as img:
+            img.draft('RGB', (width, height))
+            img = to_rgb(ImageOps.exif_transpose(img))
+            img.thumbnail((width, height), Image.Resampling.LANCZOS)
+            if fmt == 'webp':
+                img.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                img.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+    return resize_cache.put(cache_dir, key, render)
+
+
+# ===== 預先壓縮 =====
+
+def precompress_directory(directory, min_size=1024):
+    """
+    為目錄中可壓縮的檔案產生 .gz（及安裝 brotli 時的 .br），供 send_media 直接回傳
+    回傳 (處理檔案數, 是否產生 brotli)
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    count = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            if os.path.getsize(path) < min_size:
+                continue
+
+            with open(path, 'rb') as src, gzip.open(f'{path}.gz.tmp', 'wb', compresslevel=9) as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(f'{path}.gz.tmp', f'{path}.gz')
+
+            if brotli is not None:
+                with open(path, 'rb') as src:
+                    data = brotli.compress(src.read(), quality=11)
+                with open(f'{path}.br.tmp', 'wb') as dst:
+                    dst.write(data)
+                os.replace(f'{path}.br.tmp', f'{path}.br')
+            count += 1
+    return count, brotli is not None
@@ -0,0 +1,182 @@
+"""
+列表分頁（keyset / cursor）
+- 依 (排序欄位, id) 排序，下一頁以「上一頁最後一筆之後」為條件（WHERE key < ? OR (key = ? AND id < ?)），
+  搭配 (key) 或 (篩選欄位, key) 索引，任何深度的頁面成本都與第一頁相同，不再 OFFSET 掃描
+- 回應附 next_cursor（不透明字串）；帶 cursor 參數即為游標模式，預設不計算總數（with_total=true 時回傳快取的估計總數）
+- 向後相容：沒有 cursor 時仍接受 page / per_page 並回傳 total / pages；第 1 頁同樣走 keyset，
+  第 2 頁以後退回 OFFSET，總數以 COUNT 計算並短暫快取（同一篩選條件不必每頁重算）
+"""
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime, date
+from flask import request
+from sqlalchemy import and_, or_, func, select
+from app import db
+from app.utils.exceptions import ValidationError
+
+COUNT_TTL_SECONDS = int(os.getenv('PAGINATION_COUNT_TTL_SECONDS', 30))
+COUNT_CACHE_MAX_ENTRIES = 1000
+MAX_PER_PAGE = 1000
+
+
+# ===== 游標編碼 =====
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+
+def encode_cursor(key_name, key_value, item_id):
+    raw = json.dumps({'k': key_name, 'v': _encode_value(key_value), 'i': item_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, key_name):
+    """回傳 (排序欄位值, id)；格式錯誤或不屬於此列表時拋出 ValidationError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if data['k'] != key_name:
+            raise ValueError(key_name)
+        return _decode_value(data['v']), int(data['i'])
+    except (ValueError, KeyError, TypeError):
+        raise ValidationError('無效的分頁游標')
+
+
+# ===== 總數快取 =====
+
+class CountCache:
+    """查詢語句與參數 -> (總數, 計算時間)"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(statement):
+        compiled = statement.compile()
+        return str(compiled), repr(sorted(compiled.params.items(), key=lambda item: item[0]))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                return None
+            return entry[0]
+
+    def set(self, key, total):
+        with self._lock:
+            if len(self._entries) >= COUNT_CACHE_MAX_ENTRIES:
+                self._entries.clear()
+            self._entries[key] = (total, time.monotonic())
+
+
+count_cache = CountCache(COUNT_TTL_SECONDS)
+
+
+# ===== 分頁 =====
+
+class Page:
+    """一頁的結果；page 為 None 代表游標模式"""
+
+    def __init__(self, items, per_page, page, cursor, next_cursor, total):
+        self.items = items
+        self.per_page = per_page
+        self.page = page
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return bool(self.cursor) or (self.page or 1) > 1
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return (self.total + self.per_page - 1) // self.per_page
+
+
+def _is_nullable(column):
+    prop = getattr(column, 'property', None)
+    if prop is not None and hasattr(prop, 'columns'):
+        return prop.columns[0].nullable
+    return getattr(column, 'nullable', True)
+
+
+def _after(key, id_column, key_value, item_id, descending):
+    """排在 (key_value, item_id) 之後的條件；NULL 在遞減排序時排最後、遞增排序時排最前"""
+    if descending:
+        if key_value is None:
+            return and_(key.is_(None), id_column < item_id)
+        condition = or_(key < key_value, and_(key == key_value, id_column < item_id))
+        return or_(condition, key.is_(None)) if _is_nullable(key) else condition
+    if key_value is None:
+        return or_(key.isnot(None), and_(key.is_(None), id_column > item_id))
+    return or_(key > key_value, and_(key == key_value, id_column > item_id))
+
+
+def _count(query):
+    if hasattr(query, 'statement'):
+        statement = query.order_by(None).statement
+    else:
+        statement = query.order_by(None)
+    key = count_cache.key_for(statement)
+    total = count_cache.get(key)
+    if total is None:
+        total = db.session.execute(select(func.count()).select_from(statement.subquery())).scalar()
+        count_cache.set(key, total)
+    return total
+
+
+def paginate(query, key, id_column, page=1, per_page=20, descending=True):
+    """
+    依 (key, id_column) 分頁；query 可為 ORM Query（回傳模型物件）或 select()（回傳 Row）
+    游標取自 request 參數 cursor；呼叫端既有的排序會被取代
+    """
+    per_page = max(1, min(per_page or 1, MAX_PER_PAGE))
+    page = max(page or 1, 1)
+    cursor = request.args.get('cursor') or None
+    key_name = key.key
+    order = (key.desc(), id_column.desc()) if descending else (key.asc(), id_column.asc())
+
+    ordered = query.order_by(None)
+    if cursor:
+        key_value, item_id = decode_cursor(cursor, key_name)
+        ordered = ordered.filter(_after(key, id_column, key_value, item_id, descending))
+    ordered = ordered.order_by(*order).limit(per_page + 1)
+    if not cursor and page > 1:
+        ordered = ordered.offset((page - 1) * per_page)
+
+    rows = ordered.all() if hasattr(ordered, 'statement') else db.session.execute(ordered).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(key_name, getattr(last, key_name), getattr(last, id_column.key))
+
+    if cursor:
+        with_total = request.args.get('with_total', '').lower() in ('1', 'true')
+        return Page(items, per_page, None, cursor, next_cursor, _count(query) if with_total else None)
+    return Page(items, per_page, page, None, next_cursor, _count(query))
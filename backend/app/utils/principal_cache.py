@@ -0,0 +1,237 @@
+"""
+已驗證身分（principal）快取
+- token_required 等 decorator 以 (account_type, user_id) 快取帳號的識別欄位，TTL 內不必每個請求查詢帳號表
+- 命中時傳給路由的是 CachedPrincipal：id / is_active / temple_id 直接取自快取，
+  存取其他屬性（功德值、姓名、to_dict() 等）或寫入時才載入 ORM 物件，避免使用過期資料
+- 停用帳號、變更角色、修改/重設密碼、刪除帳號時呼叫 invalidate_principal
+- 後端可抽換：預設為各 worker 記憶體（其他 worker 最晚 TTL 後生效），有設定 REDIS_URL 時共用 Redis
+"""
+import json
+import os
+import threading
+import time
+from app.utils.logger import get_logger
+
+logger = get_logger('utils.principal_cache')
+
+
+PRINCIPAL_CACHE_TTL = int(os.getenv('PRINCIPAL_CACHE_TTL', 30))  # 秒，0 表示停用快取
+MEMORY_MAX_ENTRIES = 10000
+
+# 快取的欄位：只放由 invalidate_principal 涵蓋的變更路徑才會修改的欄位
+SNAPSHOT_FIELDS = ('id', 'is_active', 'temple_id')
+
+# token 內的帳號類型別名（向後兼容舊 token 的 role）
+_ACCOUNT_ALIASES = {'user': 'public', 'admin': 'super_admin'}
+
+
+def normalize_account_type(account_type):
+    return _ACCOUNT_ALIASES.get(account_type, account_type)
+
+
+def _account_model(account_type):
+    account_type = normalize_account_type(account_type)
+    if account_type == 'public':
+        from app.models.public_user import PublicUser
+        return PublicUser
+    if account_type == 'temple_admin':
+        from app.models.temple_admin_user import TempleAdminUser
+        return TempleAdminUser
+    if account_type == 'super_admin':
+        from app.models.super_admin_user import SuperAdminUser
+        return SuperAdminUser
+    return None
+
+
+def _cache_key(account_type, user_id):
+    return f'principal:{normalize_account_type(account_type)}:{user_id}'
+
+
+class CachedPrincipal:
+    """快取命中時的 current_user 代理物件（行為與 ORM 物件相同，isinstance 也相容）"""
+
+    __slots__ = ('_model', '_snapshot', '_instance')
+
+    def __init__(self, model, snapshot):
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_instance', None)
+
+    @property
+    def __class__(self):
+        return self._model
+
+    def _get_current_object(self):
+        """載入實際的 ORM 物件（同一請求只查詢一次）"""
+        instance = self._instance
+        if instance is None:
+            instance = self._model.query.get(self._snapshot['id'])
+            if instance is None:
+                raise LookupError(f'{self._model.__name__} {self._snapshot["id"]} 已不存在')
+            object.__setattr__(self, '_instance', instance)
+        return instance
+
+    def __getattr__(self, name):
+        if self._instance is None and name in self._snapshot:
+            return self._snapshot[name]
+        return getattr(self._get_current_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current_object(), name, value)
+
+    def __repr__(self):
+        if self._instance is not None:
+            return repr(self._instance)
+        return f'<CachedPrincipal {self._model.__name__} {self._snapshot["id"]}>'
+
+
+class MemoryPrincipalBackend:
+    """單機記憶體後端"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return snapshot
+
+    def set(self, key, snapshot, ttl):
+        with self._lock:
+            if len(self._entries) >= MEMORY_MAX_ENTRIES:
+                now = time.monotonic()
+                for k in [k for k, (exp, _) in self._entries.items() if exp < now]:
+                    del self._entries[k]
+                while len(self._entries) >= MEMORY_MAX_ENTRIES:
+                    del self._entries[next(iter(self._entries))]
+            self._entries[key] = (time.monotonic() + ttl, snapshot)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisPrincipalBackend:
+    """Redis 後端（多 worker 共用，失效立即生效）"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key):
+        value = self._redis.get(key)
+        return json.loads(value) if value else None
+
+    def set(self, key, snapshot, ttl):
+        self._redis.setex(key, ttl, json.dumps(snapshot))
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def size(self):
+        return None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_backend():
+    """依環境變數選擇後端；Redis 不可用時退回記憶體"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                redis_url = os.getenv('REDIS_URL')
+                if redis_url:
+                    try:
+                        _backend = RedisPrincipalBackend(redis_url)
+                    except ImportError:
+                        logger.warning('[PrincipalCache] REDIS_URL 已設定但未安裝 redis 套件，改用記憶體後端')
+                if _backend is None:
+                    _backend = MemoryPrincipalBackend()
+                logger.info(f'[PrincipalCache] backend={_backend.name} ttl={PRINCIPAL_CACHE_TTL}s')
+    return _backend
+
+
+def load_principal(account_type, user_id):
+    """
+    取得 token 對應的帳號，帳號不存在回傳 None
+    命中快取回傳 CachedPrincipal，未命中查詢資料庫並寫入快取後回傳 ORM 物件
+    """
+    model = _account_model(account_type)
+    if model is None:
+        return None
+    if PRINCIPAL_CACHE_TTL <= 0:
+        return model.query.get(user_id)
+
+    key = _cache_key(account_type, user_id)
+    try:
+        snapshot = get_backend().get(key)
+    except Exception as e:
+        # 快取故障時退回直接查詢
+        _count('errors')
+        logger.error(f'[PrincipalCache] get failed: {e}')
+        snapshot = None
+
+    if snapshot is not None:
+        _count('hits')
+        return CachedPrincipal(model, snapshot)
+
+    _count('misses')
+    user = model.query.get(user_id)
+    if user is not None:
+        snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS if hasattr(user, field)}
+        try:
+            get_backend().set(key, snapshot, PRINCIPAL_CACHE_TTL)
+        except Exception as e:
+            _count('errors')
+            logger.error(f'[PrincipalCache] set failed: {e}')
+    return user
+
+
+def invalidate_principal(account_type, user_id):
+    """帳號狀態/角色/密碼變更後呼叫，下一個請求會重新查詢"""
+    try:
+        get_backend().delete(_cache_key(account_type, user_id))
+        _count('invalidations')
+    except Exception as e:
+        _count('errors')
+        logger.error(f'[PrincipalCache] invalidate failed: {e}')
+
+
+def get_stats():
+    """命中率等統計（供 metrics 端點）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    backend = get_backend()
+    stats.update(
+        backend=backend.name,
+        ttl_seconds=PRINCIPAL_CACHE_TTL,
+        size=backend.size(),
+        hit_rate=round(stats['hits'] / lookups, 4) if lookups else 0
+    )
+    return stats
@@ -0,0 +1,495 @@
+"""
+API 頻率限制的共用儲存（Flask-Limiter storage）
+- 各 gunicorn worker 共用同一份計數，限制值不再因 worker 數放大；後端依 RATELIMIT_STORAGE_URI 選擇：
+  batched+redis://...（多主機共用，需 redis 套件）、batched+sqlite:///path（同主機共用的本機檔案，預設）、
+  batched+memory://（單一程序，開發用）
+- 採 sliding window counter：每個 key 只有目前與前一個時間窗兩個計數器，前一窗依剩餘比例加權
+- 批次遞增：額度大的限制（全站 200/分）先在本程序累計，累計達額度的一小部分或超過同步間隔才寫入共用儲存，
+  多數請求不需任何 I/O；額度小的限制（登入 5/分、註冊 3/分）每個請求都同步遞增，多 worker 下仍精確
+- 依路由統計被拒絕的次數與限制器耗時（供 metrics 端點）
+"""
+import atexit
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport
+from app.utils.logger import get_logger
+
+logger = get_logger('utils.rate_limit')
+
+
+# 批次大小 = 限制額度 × 比例（上限 RATELIMIT_BATCH_MAX）；小於 2 時不批次，每個請求同步寫入
+BATCH_RATIO = float(os.getenv('RATELIMIT_BATCH_RATIO', 0.02))
+BATCH_MAX = int(os.getenv('RATELIMIT_BATCH_MAX', 20))
+# 批次模式下多久與共用儲存同步一次（寫入本程序累計、讀回其他 worker 的計數）
+SYNC_INTERVAL_SECONDS = float(os.getenv('RATELIMIT_SYNC_INTERVAL_SECONDS', 0.25))
+SQLITE_PURGE_INTERVAL_SECONDS = 60
+KEY_PREFIX = 'LIMITER'
+
+_stats_lock = threading.Lock()
+_stats = {'acquires': 0, 'round_trips': 0, 'acquire_seconds': 0.0, 'max_acquire_ms': 0.0, 'errors': 0}
+_rejections = {}
+_active_storage = None
+
+
+def storage_uri():
+    """RATELIMIT_STORAGE_URI 優先；否則有 REDIS_URL 時共用 Redis，再否則使用本機 SQLite 檔案"""
+    uri = os.getenv('RATELIMIT_STORAGE_URI')
+    if uri:
+        return uri
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        return f'batched+{redis_url}'
+    path = os.getenv('RATELIMIT_SQLITE_PATH') or os.path.join(tempfile.gettempdir(), 'tep_ratelimit.sqlite')
+    return f'batched+sqlite://{os.path.abspath(path)}'
+
+
+# ===== 計數後端 =====
+
+class MemoryCounters:
+    """單一程序記憶體"""
+
+    name = 'memory'
+    exceptions = ()
+
+    def __init__(self):
+        self._entries = {}  # key -> [value, expires_at]
+        self._lock = threading.Lock()
+
+    def incr_many(self, increments, expiry):
+        now = time.time()
+        values = {}
+        with self._lock:
+            for key, amount in increments.items():
+                entry = self._entries.get(key)
+                if entry is None or entry[1] <= now:
+                    entry = self._entries[key] = [0, now + expiry]
+                entry[0] += amount
+                values[key] = entry[0]
+            if len(self._entries) > 10000:
+                for key in [k for k, (_, exp) in self._entries.items() if exp <= now]:
+                    del self._entries[key]
+        return values
+
+    def get_many(self, keys):
+        now = time.time()
+        values = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    values[key] = entry[0]
+        return values
+
+    def expires_at(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else time.time()
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear_all(self):
+        with self._lock:
+            self._entries.clear()
+
+    def check(self):
+        return True
+
+
+class SQLiteCounters:
+    """
+    本機 SQLite 檔案（同主機所有 worker 共用，不需外部服務）
+    WAL + synchronous=OFF：計數不需耐久保存，寫入只是一次頁面快取更新
+    """
+
+    name = 'sqlite'
+    exceptions = sqlite3.Error
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._next_purge = 0.0
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_counters ('
+            'key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID'
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def incr_many(self, increments, expiry):
+        now = time.time()
+        conn = self._conn()
+        values = {}
+        if len(increments) > 1:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key, amount in increments.items():
+                # 已過期的計數從頭開始
+                values[key] = conn.execute(
+                    'INSERT INTO rate_limit_counters (key, value, expires_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET '
+                    'value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END, '
+                    'expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END '
+                    'RETURNING value',
+                    (key, amount, now + expiry, now, now)
+                ).fetchone()[0]
+            if len(increments) > 1:
+                conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+        if now >= self._next_purge:
+            self._next_purge = now + SQLITE_PURGE_INTERVAL_SECONDS
+            conn.execute('DELETE FROM rate_limit_counters WHERE expires_at <= ?', (now,))
+        return values
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        keys = list(keys)
+        rows = self._conn().execute(
+            f'SELECT key, value FROM rate_limit_counters WHERE expires_at > ? '
+            f'AND key IN ({",".join("?" * len(keys))})',
+            [time.time(), *keys]
+        ).fetchall()
+        return dict(rows)
+
+    def expires_at(self, key):
+        row = self._conn().execute('SELECT expires_at FROM rate_limit_counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def delete(self, keys):
+        keys = list(keys)
+        if keys:
+            self._conn().execute(
+                f'DELETE FROM rate_limit_counters WHERE key IN ({",".join("?" * len(keys))})', keys
+            )
+
+    def clear_all(self):
+        self._conn().execute('DELETE FROM rate_limit_counters')
+
+    def check(self):
+        self._conn().execute('SELECT 1').fetchone()
+        return True
+
+
+class RedisCounters:
+    """Redis（多主機共用）；一批遞增以 pipeline 一次送出"""
+
+    name = 'redis'
+
+    # 只在計數建立時設定過期時間，之後的遞增不延長
+    INCR_SCRIPT = """
+    local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+    if value == tonumber(ARGV[1]) then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return value
+    """
+
+    def __init__(self, url):
+        import redis
+        self.exceptions = redis.RedisError
+        self._redis = redis.Redis.from_url(url)
+        self._incr = self._redis.register_script(self.INCR_SCRIPT)
+
+    def incr_many(self, increments, expiry):
+        pipe = self._redis.pipeline(transaction=False)
+        for key, amount in increments.items():
+            self._incr(keys=[key], args=[amount, int(expiry)], client=pipe)
+        return dict(zip(increments, (int(value) for value in pipe.execute())))
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        return {key: int(value) for key, value in zip(keys, self._redis.mget(keys)) if value is not None}
+
+    def expires_at(self, key):
+        ttl = self._redis.ttl(key)
+        return time.time() + max(ttl, 0)
+
+    def delete(self, keys):
+        keys = list(keys)
+        if keys:
+            self._redis.delete(*keys)
+
+    def clear_all(self):
+        for key in self._redis.scan_iter(match=f'{KEY_PREFIX}*', count=1000):
+            self._redis.delete(key)
+
+    def check(self):
+        return self._redis.ping()
+
+
+# ===== Flask-Limiter storage =====
+
+class _Window:
+    """
+    本程序對某個時間窗計數的檢視：shared 為上次同步時共用儲存的值，pending 為尚未寫入的累計
+    ttl 為共用儲存中計數的保存秒數（兩個時間窗長度）
+    """
+
+    __slots__ = ('shared', 'pending', 'synced_at', 'expires_at', 'ttl')
+
+    def __init__(self, now, ttl):
+        self.shared = 0
+        self.pending = 0
+        self.synced_at = 0.0
+        self.expires_at = now + ttl
+        self.ttl = ttl
+
+
+def _window_keys(key, expiry, now):
+    """(前一窗 key, 目前窗 key, 前一窗權重)；權重為前一窗仍落在滑動視窗內的比例"""
+    index = int(now // expiry)
+    weight = 1 - (now % expiry) / expiry
+    return f'{key}/{index - 1}', f'{key}/{index}', weight
+
+
+class BatchedWindowStorage(Storage, SlidingWindowCounterSupport):
+    """
+    批次遞增的 sliding window counter storage
+    每個限制依額度決定批次大小；批次模式下多個 worker 合計最多超出 worker 數 × 批次大小
+    """
+
+    STORAGE_SCHEME = ['batched+memory', 'batched+sqlite', 'batched+redis', 'batched+rediss']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        global _active_storage
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        target = uri.split('+', 1)[1]
+        scheme, _, location = target.partition('://')
+        if scheme in ('redis', 'rediss'):
+            try:
+                self.backend = RedisCounters(target)
+            except ImportError:
+                logger.warning('[RateLimit] 未安裝 redis 套件，改用本機 SQLite 計數（僅同主機 worker 共用）')
+                scheme, location = 'sqlite', os.path.join(tempfile.gettempdir(), 'tep_ratelimit.sqlite')
+        if scheme == 'sqlite':
+            self.backend = SQLiteCounters(location)
+        elif scheme == 'memory':
+            self.backend = MemoryCounters()
+
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        _active_storage = self
+        atexit.register(self._flush_quietly)
+        logger.info(f'[RateLimit] backend={self.backend.name} batch_ratio={BATCH_RATIO} '
+                    f'sync_interval={SYNC_INTERVAL_SECONDS}s')
+
+    @property
+    def base_exceptions(self):
+        return self.backend.exceptions or Exception
+
+    # ----- sliding window counter -----
+
+    @staticmethod
+    def batch_size(limit):
+        return max(1, min(BATCH_MAX, int(limit * BATCH_RATIO)))
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        started = time.perf_counter()
+        round_trips = 0
+        try:
+            if self.batch_size(limit) <= 1:
+                allowed, round_trips = self._acquire_exact(key, limit, expiry, amount)
+            else:
+                allowed, round_trips = self._acquire_batched(key, limit, expiry, amount)
+            return allowed
+        except Exception:
+            with _stats_lock:
+                _stats['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with _stats_lock:
+                _stats['acquires'] += 1
+                _stats['round_trips'] += round_trips
+                _stats['acquire_seconds'] += elapsed
+                _stats['max_acquire_ms'] = max(_stats['max_acquire_ms'], elapsed * 1000)
+
+    def _acquire_exact(self, key, limit, expiry, amount):
+        """先遞增再判斷，超出時退回；前一窗計數已不再變動，同步間隔內重用"""
+        now = time.time()
+        prev_key, cur_key, weight = _window_keys(key, expiry, now)
+        round_trips = 0
+        with self._lock:
+            prev = self._windows.get(prev_key)
+            if prev is None or now - prev.synced_at >= SYNC_INTERVAL_SECONDS:
+                prev = self._windows[prev_key] = prev or _Window(now, expiry)
+                prev.shared = self.backend.get_many([prev_key]).get(prev_key, 0)
+                prev.synced_at = now
+                round_trips += 1
+            previous = prev.shared
+
+        current = self.backend.incr_many({cur_key: amount}, expiry * 2)[cur_key]
+        round_trips += 1
+        if int(previous * weight + current) > limit:
+            self.backend.incr_many({cur_key: -amount}, expiry * 2)
+            return False, round_trips + 1
+        return True, round_trips
+
+    def _acquire_batched(self, key, limit, expiry, amount):
+        now = time.time()
+        prev_key, cur_key, weight = _window_keys(key, expiry, now)
+        round_trips = 0
+        with self._lock:
+            prev = self._windows.get(prev_key)
+            cur = self._windows.get(cur_key)
+            if prev is None:
+                prev = self._windows[prev_key] = _Window(now, expiry)
+            if cur is None:
+                cur = self._windows[cur_key] = _Window(now, expiry * 2)
+            if now - cur.synced_at >= SYNC_INTERVAL_SECONDS or now - prev.synced_at >= SYNC_INTERVAL_SECONDS:
+                round_trips += self._sync(now, [prev_key, cur_key])
+
+            weighted = (prev.shared + prev.pending) * weight + cur.shared + cur.pending
+            if int(weighted) + amount > limit:
+                return False, round_trips
+            cur.pending += amount
+            if cur.pending >= self.batch_size(limit):
+                round_trips += self._sync(now, [])
+        return True, round_trips
+
+    def _sync(self, now, refresh_keys):
+        """
+        寫入所有尚未送出的累計並讀回 refresh_keys 的最新值（呼叫端持有鎖），回傳 I/O 次數
+        其他已閒置的 key 的累計也在此一併送出，不會一直停在本程序
+        """
+        round_trips = 0
+        pending = {}
+        for key, window in self._windows.items():
+            if window.pending:
+                pending.setdefault(window.ttl, {})[key] = window.pending
+        for ttl, increments in pending.items():
+            for key, value in self.backend.incr_many(increments, ttl).items():
+                window = self._windows[key]
+                window.shared = value
+                window.pending = 0
+                window.synced_at = now
+            round_trips += 1
+        flushed = set().union(*pending.values()) if pending else set()
+        refresh_keys = [key for key in refresh_keys if key not in flushed]
+        if refresh_keys:
+            values = self.backend.get_many(refresh_keys)
+            for key in refresh_keys:
+                window = self._windows[key]
+                window.shared = values.get(key, 0)
+                window.synced_at = now
+            round_trips += 1
+
+        if now - self._last_sync >= SYNC_INTERVAL_SECONDS:
+            self._last_sync = now
+            for key in [k for k, window in self._windows.items() if window.expires_at <= now and not window.pending]:
+                del self._windows[key]
+        return round_trips
+
+    def flush(self):
+        """立即寫入本程序所有累計"""
+        with self._lock:
+            self._sync(time.time(), [])
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        prev_key, cur_key, weight = _window_keys(key, expiry, now)
+        with self._lock:
+            self._sync(now, [])
+        values = self.backend.get_many([prev_key, cur_key])
+        previous, current = values.get(prev_key, 0), values.get(cur_key, 0)
+        prev_ttl = weight * expiry if previous else 0
+        cur_ttl = (1 - (now % expiry) / expiry) * expiry + expiry
+        return previous, prev_ttl, current, cur_ttl
+
+    def clear_sliding_window(self, key, expiry):
+        prev_key, cur_key, _ = _window_keys(key, expiry, time.time())
+        with self._lock:
+            self._windows.pop(prev_key, None)
+            self._windows.pop(cur_key, None)
+        self.backend.delete([prev_key, cur_key])
+
+    # ----- fixed window（直接存取共用儲存）-----
+
+    def incr(self, key, expiry, amount=1):
+        return self.backend.incr_many({key: amount}, expiry)[key]
+
+    def get(self, key):
+        return self.backend.get_many([key]).get(key, 0)
+
+    def get_expiry(self, key):
+        return self.backend.expires_at(key)
+
+    def check(self):
+        try:
+            return bool(self.backend.check())
+        except Exception:
+            return False
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+        self.backend.clear_all()
+        return None
+
+    def clear(self, key):
+        self.backend.delete([key])
+
+
+# ===== 統計 =====
+
+def record_breach(request_limit):
+    """Flask-Limiter on_breach：依路由與限制統計拒絕次數"""
+    from flask import request
+    endpoint = request.endpoint or request.path
+    with _stats_lock:
+        per_endpoint = _rejections.setdefault(endpoint, {})
+        limit = str(request_limit.limit)
+        per_endpoint[limit] = per_endpoint.get(limit, 0) + 1
+
+
+def get_stats():
+    """本 worker 的限制器統計（供 metrics 端點）"""
+    with _stats_lock:
+        stats = dict(_stats)
+        rejections = {endpoint: dict(limits) for endpoint, limits in _rejections.items()}
+    acquires = stats['acquires']
+    return {
+        'backend': _active_storage.backend.name if _active_storage else None,
+        'batch_ratio': BATCH_RATIO,
+        'sync_interval_seconds': SYNC_INTERVAL_SECONDS,
+        'acquires': acquires,
+        'storage_round_trips': stats['round_trips'],
+        'avg_acquire_ms': round(stats['acquire_seconds'] * 1000 / acquires, 4) if acquires else 0,
+        'max_acquire_ms': round(stats['max_acquire_ms'], 3),
+        'errors': stats['errors'],
+        'rejections': rejections,
+        'total_rejections': sum(sum(limits.values()) for limits in rejections.values())
+    }
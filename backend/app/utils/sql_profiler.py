@@ -0,0 +1,155 @@
+"""
+每個請求的 SQL 分析器（N+1 偵測）
+- 啟用方式：SQL_PROFILER_ENABLED=true 分析所有請求，或系統管理員帶 X-SQL-Profile: 1 標頭分析單一請求
+- 記錄查詢次數、DB 總時間、相同語句形狀的重複次數與第一次執行的程式位置
+- 同一形狀的 SELECT 重複達 SQL_PROFILER_N1_THRESHOLD 次視為疑似 N+1
+- 結果寫入 JSON 日誌（data 欄位），並以 X-SQL-Profile / Server-Timing 回應標頭回傳
+"""
+import os
+import re
+import traceback
+from flask import g, request
+from app.utils.logger import get_logger
+
+logger = get_logger('utils.sql_profiler')
+
+
+PROFILE_HEADER = 'X-SQL-Profile'
+N1_THRESHOLD = int(os.getenv('SQL_PROFILER_N1_THRESHOLD', 5))
+TOP_SHAPES = 5
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_FILES = (os.path.abspath(__file__), os.path.join(_APP_ROOT, 'utils', 'db_metrics.py'))
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)', re.IGNORECASE)
+_POSTCOMPILE = re.compile(r'\(?__\[POSTCOMPILE_\w+\]\)?')
+
+
+def statement_shape(statement):
+    """將 SQL 正規化為形狀（去除字面值、IN 清單長度），同形狀代表同一段程式重複執行"""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _STRING_LITERAL.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _POSTCOMPILE.sub('(...)', shape)
+    return _IN_LIST.sub('IN (...)', shape)
+
+
+def _caller():
+    """呼叫查詢的第一個 app 內程式位置（略過 ORM 與本模組）"""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_APP_ROOT) and filename not in _SKIP_FILES:
+            return f'{os.path.relpath(filename, os.path.dirname(_APP_ROOT))}:{frame.lineno} {frame.name}'
+    return None
+
+
+class SqlProfile:
+    """單一請求的查詢紀錄"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = {}  # shape -> [count, total_time, first_caller]
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        shape = statement_shape(statement)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            self.shapes[shape] = [1, elapsed, _caller()]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def suspected_n_plus_one(self):
+        return [
+            (shape, entry) for shape, entry in self.shapes.items()
+            if entry[0] >= N1_THRESHOLD and shape.upper().startswith('SELECT')
+        ]
+
+    def report(self):
+        def describe(shape, entry):
+            return {
+                'statement': shape[:300],
+                'count': entry[0],
+                'time_ms': round(entry[1] * 1000, 2),
+                'first_caller': entry[2]
+            }
+
+        repeated = sorted(self.shapes.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'query_count': self.count,
+            'db_time_ms': round(self.total_time * 1000, 2),
+            'distinct_statements': len(self.shapes),
+            'n_plus_one': [describe(s, e) for s, e in self.suspected_n_plus_one()],
+            'top_statements': [describe(s, e) for s, e in repeated[:TOP_SHAPES]]
+        }
+
+
+def _admin_requested_profile():
+    """帶 X-SQL-Profile 標頭且為啟用中的系統管理員"""
+    if request.headers.get(PROFILE_HEADER) not in ('1', 'true'):
+        return False
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return False
+
+    from app.utils.auth import decode_token
+    from app.utils.principal_cache import load_principal
+
+    payload, error = decode_token(auth_header[7:])
+    if error:
+        return False
+    account_type = payload.get('account_type') or payload.get('role')
+    if account_type not in ('super_admin', 'admin'):
+        return False
+    admin = load_principal(account_type, payload.get('user_id'))
+    return bool(admin and admin.is_active)
+
+
+def _start_profile():
+    if request.method == 'OPTIONS':
+        return
+    from flask import current_app
+    if current_app.config.get('SQL_PROFILER_ENABLED') or _admin_requested_profile():
+        g.sql_profile = SqlProfile()
+
+
+def _finish_profile(response):
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+        return response
+
+    report = profile.report()
+    n_plus_one = len(report['n_plus_one'])
+    response.headers[PROFILE_HEADER] = (
+        f'queries={profile.count}; db_time_ms={report["db_time_ms"]}; n_plus_one={n_plus_one}'
+    )
+    response.headers['Server-Timing'] = f'db;desc="{profile.count} queries";dur={report["db_time_ms"]}'
+
+    message = (
+        f'[SQLProfile] {request.method} {request.path} '
+        f'queries={profile.count} db_time={report["db_time_ms"]}ms n_plus_one={n_plus_one}'
+    )
+    if n_plus_one:
+        logger.warning(message, extra={'data': report})
+    else:
+        logger.info(message, extra={'data': report})
+    return response
+
+
+def init_sql_profiler(app):
+    """在 app factory 中呼叫"""
+    app.config.setdefault(
+        'SQL_PROFILER_ENABLED',
+        os.getenv('SQL_PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+    )
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
@@ -0,0 +1,264 @@
+"""
+Refresh Token 儲存與撤銷快取
+- 驗證 refresh token 不再每次查詢 refresh_tokens：各 worker 在記憶體保存「已撤銷且未過期」的 jti 與各帳號的 token 世代，
+  每 REFRESH_REVOCATION_SYNC_SECONDS 秒依 revoked_at 增量同步；本 worker 的撤銷立即生效，其他 worker 最晚一個同步間隔後生效
+  （快取同步失敗或停用時退回逐次查詢資料庫）
+- 撤銷全部（登出所有裝置）：帳號的 RefreshTokenFamily 世代加一，單一 UPDATE；token 內的 gen 小於目前世代即失效
+- 簽發只寫入 session 不 commit，與登入 / 註冊的資料在同一交易
+- 排程分批刪除已過期的 token（撤銷紀錄在過期前保留，過期後 JWT 本身即無效）
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.utils.logger import get_logger
+from app.utils.principal_cache import normalize_account_type
+
+logger = get_logger('utils.token_store')
+
+
+SYNC_SECONDS = int(os.getenv('REFRESH_REVOCATION_SYNC_SECONDS', 5))  # 0 表示停用快取，每次查詢資料庫
+COMPACT_INTERVAL_SECONDS = int(os.getenv('REFRESH_TOKEN_COMPACT_INTERVAL_SECONDS', 3600))
+COMPACT_BATCH_SIZE = 1000
+# 增量同步往前多讀的秒數，涵蓋各 worker 時鐘誤差與同步當下尚未 commit 的撤銷
+SYNC_OVERLAP_SECONDS = 10
+# 超過此秒數未成功同步時不信任快取
+STALE_AFTER_SECONDS = max(SYNC_SECONDS * 3, 30)
+
+
+def _family_key(account_type, user_id):
+    return normalize_account_type(account_type), user_id
+
+
+class RevocationCache:
+    """已撤銷 jti -> 到期時間；(account_type, user_id) -> 世代（只記錄撤銷過的帳號）"""
+
+    def __init__(self):
+        self._revoked = {}
+        self._generations = {}
+        self._watermark = None  # 下次增量同步的 revoked_at 下限
+        self._synced_at = None  # 最近一次成功同步（monotonic）
+        self._syncing = False
+        self._lock = threading.Lock()
+        self.fast_checks = 0
+        self.db_checks = 0
+        self.syncs = 0
+        self.sync_errors = 0
+
+    def is_fresh(self):
+        return self._synced_at is not None and time.monotonic() - self._synced_at < STALE_AFTER_SECONDS
+
+    def ensure_fresh(self):
+        """距上次同步超過間隔時同步（同一時間只有一個執行緒同步，其他沿用目前內容）"""
+        with self._lock:
+            if self._syncing or (self._synced_at is not None and time.monotonic() - self._synced_at < SYNC_SECONDS):
+                return
+            self._syncing = True
+        try:
+            self._sync()
+        except Exception as e:
+            self.sync_errors += 1
+            logger.error(f'[TokenStore] revocation sync failed: {e}')
+        finally:
+            with self._lock:
+                self._syncing = False
+
+    def _sync(self):
+        from app.models.refresh_token import RefreshToken, RefreshTokenFamily
+
+        now = datetime.utcnow()
+        since = self._watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS) if self._watermark else None
+
+        tokens = db.session.query(RefreshToken.jti, RefreshToken.expires_at).filter(
+            RefreshToken.revoked_at.isnot(None) if since is None else RefreshToken.revoked_at >= since,
+            RefreshToken.expires_at > now
+        ).all()
+        families = db.session.query(
+            RefreshTokenFamily.account_type, RefreshTokenFamily.user_id, RefreshTokenFamily.generation
+        ).filter(
+            RefreshTokenFamily.generation > 0 if since is None else RefreshTokenFamily.revoked_at >= since
+        ).all()
+        db.session.commit()
+
+        with self._lock:
+            for jti, expires_at in tokens:
+                self._revoked[jti] = expires_at
+            for account_type, user_id, generation in families:
+                key = _family_key(account_type, user_id)
+                self._generations[key] = max(generation, self._generations.get(key, 0))
+            for jti in [jti for jti, expires_at in self._revoked.items() if expires_at <= now]:
+                del self._revoked[jti]
+            self._watermark = now
+            self._synced_at = time.monotonic()
+            self.syncs += 1
+
+    def mark_revoked(self, jti, expires_at):
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def set_generation(self, account_type, user_id, generation):
+        key = _family_key(account_type, user_id)
+        with self._lock:
+            self._generations[key] = max(generation, self._generations.get(key, 0))
+
+    def is_revoked(self, jti, account_type, user_id, generation):
+        with self._lock:
+            self.fast_checks += 1
+            return jti in self._revoked or generation < self._generations.get(_family_key(account_type, user_id), 0)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'sync_seconds': SYNC_SECONDS,
+                'fresh': self.is_fresh(),
+                'revoked_tokens': len(self._revoked),
+                'revoked_families': len(self._generations),
+                'fast_checks': self.fast_checks,
+                'db_checks': self.db_checks,
+                'syncs': self.syncs,
+                'sync_errors': self.sync_errors
+            }
+
+
+revocations = RevocationCache()
+
+_compaction = {'last_compacted_at': None, 'deleted': 0}
+
+
+# ===== 簽發 / 驗證 / 撤銷 =====
+
+def current_generation(user_id, account_type):
+    """帳號目前的 token 世代（沒有 family 時建立，不 commit）"""
+    from app.models.refresh_token import RefreshTokenFamily
+
+    account_type = normalize_account_type(account_type)
+    generation = db.session.query(RefreshTokenFamily.generation).filter_by(
+        account_type=account_type, user_id=user_id
+    ).scalar()
+    if generation is not None:
+        return generation
+    try:
+        with db.session.begin_nested():
+            db.session.add(RefreshTokenFamily(account_type=account_type, user_id=user_id, generation=0))
+        return 0
+    except IntegrityError:
+        # 同帳號同時登入，已由其他請求建立
+        return db.session.query(RefreshTokenFamily.generation).filter_by(
+            account_type=account_type, user_id=user_id
+        ).scalar()
+
+
+def record_issued(jti, user_id, account_type, expires_at):
+    """記錄新簽發的 refresh token（不 commit），回傳要寫入 token 的世代"""
+    from app.models.refresh_token import RefreshToken
+
+    generation = current_generation(user_id, account_type)
+    db.session.add(RefreshToken(
+        jti=jti,
+        user_id=user_id,
+        account_type=account_type,
+        expires_at=expires_at,
+    ))
+    return generation
+
+
+def check(payload):
+    """檢查已通過簽章與效期驗證的 refresh token 是否仍有效，回傳錯誤訊息或 None"""
+    jti = payload['jti']
+    user_id = payload.get('user_id')
+    account_type = payload.get('account_type')
+    generation = payload.get('gen', 0)
+
+    if SYNC_SECONDS > 0:
+        revocations.ensure_fresh()
+        if revocations.is_fresh():
+            if revocations.is_revoked(jti, account_type, user_id, generation):
+                return 'Refresh Token 已失效'
+            return None
+
+    from app.models.refresh_token import RefreshToken, RefreshTokenFamily
+
+    revocations.db_checks += 1
+    rt = RefreshToken.query.filter_by(jti=jti).first()
+    if not rt:
+        return 'Refresh Token 不存在'
+    if not rt.is_valid:
+        return 'Refresh Token 已失效'
+    current = db.session.query(RefreshTokenFamily.generation).filter_by(
+        account_type=normalize_account_type(account_type), user_id=user_id
+    ).scalar() or 0
+    if generation < current:
+        return 'Refresh Token 已失效'
+    return None
+
+
+def revoke(jti):
+    """撤銷單一 token 並 commit，回傳是否有撤銷"""
+    from app.models.refresh_token import RefreshToken
+
+    revoked = RefreshToken.query.filter(
+        RefreshToken.jti == jti,
+        RefreshToken.revoked_at.is_(None)
+    ).update({'revoked_at': datetime.utcnow()}, synchronize_session=False)
+    expires_at = db.session.query(RefreshToken.expires_at).filter_by(jti=jti).scalar() if revoked else None
+    db.session.commit()
+    if revoked:
+        revocations.mark_revoked(jti, expires_at)
+    return revoked == 1
+
+
+def revoke_all(user_id, account_type):
+    """撤銷帳號所有 token 並 commit：世代加一，先前簽發的 token 全部失效"""
+    from app.models.refresh_token import RefreshTokenFamily
+
+    account_type = normalize_account_type(account_type)
+    family = RefreshTokenFamily.query.filter_by(account_type=account_type, user_id=user_id)
+    updated = family.update({
+        'generation': RefreshTokenFamily.generation + 1,
+        'revoked_at': datetime.utcnow()
+    }, synchronize_session=False)
+    generation = db.session.query(RefreshTokenFamily.generation).filter_by(
+        account_type=account_type, user_id=user_id
+    ).scalar() if updated else None
+    db.session.commit()
+    if updated:
+        revocations.set_generation(account_type, user_id, generation)
+    return updated == 1
+
+
+# ===== 排程：清除過期 token =====
+
+def compact_expired():
+    """分批刪除已過期的 token（每批各自 commit，不長時間鎖表），回傳刪除筆數"""
+    from app.models.refresh_token import RefreshToken
+
+    now = datetime.utcnow()
+    deleted = 0
+    while True:
+        ids = [row[0] for row in db.session.query(RefreshToken.id).filter(
+            RefreshToken.expires_at <= now
+        ).order_by(RefreshToken.id).limit(COMPACT_BATCH_SIZE).all()]
+        if not ids:
+            break
+        RefreshToken.query.filter(RefreshToken.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < COMPACT_BATCH_SIZE:
+            break
+    db.session.commit()
+
+    _compaction['last_compacted_at'] = now.isoformat()
+    _compaction['deleted'] = deleted
+    if deleted:
+        logger.info(f'[TokenStore] deleted {deleted} expired refresh tokens')
+    return deleted
+
+
+def get_stats():
+    """撤銷快取與清除統計（供 metrics 端點）"""
+    stats = revocations.get_stats()
+    stats['last_compacted_at'] = _compaction['last_compacted_at']
+    stats['last_compaction_deleted'] = _compaction['deleted']
+    return stats
@@ -0,0 +1,24 @@
+"""add audience indexes on line_users and event_registrations
+
+Revision ID: audience_indexes_001
+Revises: notification_deliveries_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+revision = 'audience_indexes_001'
+down_revision = 'notification_deliveries_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_line_users_following_followed', 'line_users', ['is_following', 'followed_at'], unique=False)
+    op.create_index('ix_event_registrations_line_user_registered', 'event_registrations',
+                    ['line_user_id', 'registered_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_event_registrations_line_user_registered', table_name='event_registrations')
+    op.drop_index('ix_line_users_following_followed', table_name='line_users')
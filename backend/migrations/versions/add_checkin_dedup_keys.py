@@ -0,0 +1,29 @@
+"""add checkin dedup / idempotency keys
+
+Revision ID: checkin_dedup_001
+Revises: export_jobs_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'checkin_dedup_001'
+down_revision = 'export_jobs_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 既有資料的兩個欄位保持 NULL（唯一索引不限制 NULL）
+    op.add_column('checkins', sa.Column('dedup_key', sa.String(100), nullable=True))
+    op.add_column('checkins', sa.Column('idempotency_key', sa.String(64), nullable=True))
+    op.create_unique_constraint('unique_checkin_dedup_key', 'checkins', ['dedup_key'])
+    op.create_unique_constraint('unique_checkin_idempotency_key', 'checkins', ['user_id', 'idempotency_key'])
+
+
+def downgrade():
+    op.drop_constraint('unique_checkin_idempotency_key', 'checkins', type_='unique')
+    op.drop_constraint('unique_checkin_dedup_key', 'checkins', type_='unique')
+    op.drop_column('checkins', 'idempotency_key')
+    op.drop_column('checkins', 'dedup_key')
@@ -0,0 +1,35 @@
+"""add temple_events.reserved_seats seat counter
+
+Revision ID: event_reserved_seats_001
+Revises: line_webhook_events_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'event_reserved_seats_001'
+down_revision = 'line_webhook_events_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('temple_events', sa.Column('reserved_seats', sa.Integer(), nullable=False, server_default='0'))
+    # 以既有的 registered 報名回填已佔用名額
+    op.execute(
+        "UPDATE temple_events SET reserved_seats = ("
+        "SELECT COALESCE(SUM(people_count), 0) FROM event_registrations "
+        "WHERE event_registrations.event_id = temple_events.id AND event_registrations.status = 'registered')"
+    )
+    # 候補遞補依活動取出最早的候補者
+    op.create_index(
+        'ix_event_registrations_event_status_registered',
+        'event_registrations',
+        ['event_id', 'status', 'registered_at']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_event_registrations_event_status_registered', table_name='event_registrations')
+    op.drop_column('temple_events', 'reserved_seats')
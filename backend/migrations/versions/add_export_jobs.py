@@ -0,0 +1,47 @@
+"""add export_jobs table
+
+Revision ID: export_jobs_001
+Revises: temple_daily_stats_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'export_jobs_001'
+down_revision = 'temple_daily_stats_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'export_jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('temple_id', sa.Integer(), nullable=False),
+        sa.Column('requested_by', sa.Integer(), nullable=False),
+        sa.Column('account_type', sa.String(20), nullable=False),
+        sa.Column('export_type', sa.String(20), nullable=False),
+        sa.Column('file_format', sa.String(10), nullable=False, server_default='csv'),
+        sa.Column('params', sa.JSON(), nullable=True),
+        sa.Column('status', sa.String(20), nullable=False, server_default='pending'),
+        sa.Column('total_rows', sa.Integer(), nullable=True),
+        sa.Column('processed_rows', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('file_path', sa.String(500), nullable=True),
+        sa.Column('file_size', sa.BigInteger(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['temple_id'], ['temples.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_export_jobs_temple_id', 'export_jobs', ['temple_id'], unique=False)
+    op.create_index('ix_export_jobs_status_created', 'export_jobs', ['status', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_export_jobs_status_created', 'export_jobs')
+    op.drop_index('ix_export_jobs_temple_id', 'export_jobs')
+    op.drop_table('export_jobs')
@@ -0,0 +1,32 @@
+"""add indexes for keyset pagination
+
+Revision ID: keyset_pagination_001
+Revises: refresh_token_families_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+revision = 'keyset_pagination_001'
+down_revision = 'refresh_token_families_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # InnoDB 次要索引隱含主鍵，(篩選欄位, 時間) 即可涵蓋 ORDER BY 時間, id 的游標掃描
+    op.create_index('ix_checkins_timestamp', 'checkins', ['timestamp'])
+    op.create_index('ix_checkins_temple_timestamp', 'checkins', ['temple_id', 'timestamp'])
+    op.create_index('ix_checkins_user_timestamp', 'checkins', ['user_id', 'timestamp'])
+    op.create_index('ix_redemptions_redeemed_at', 'redemptions', ['redeemed_at'])
+    op.create_index('ix_redemptions_temple_redeemed', 'redemptions', ['temple_id', 'redeemed_at'])
+    op.create_index('ix_reward_claims_user_claimed', 'reward_claims', ['user_id', 'claimed_at'])
+
+
+def downgrade():
+    op.drop_index('ix_reward_claims_user_claimed', 'reward_claims')
+    op.drop_index('ix_redemptions_temple_redeemed', 'redemptions')
+    op.drop_index('ix_redemptions_redeemed_at', 'redemptions')
+    op.drop_index('ix_checkins_user_timestamp', 'checkins')
+    op.drop_index('ix_checkins_temple_timestamp', 'checkins')
+    op.drop_index('ix_checkins_timestamp', 'checkins')
@@ -0,0 +1,45 @@
+"""add line_webhook_events inbox table
+
+Revision ID: line_webhook_events_001
+Revises: scheduler_state_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'line_webhook_events_001'
+down_revision = 'scheduler_state_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'line_webhook_events',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('webhook_event_id', sa.String(length=64), nullable=False),
+        sa.Column('event_type', sa.String(length=30), nullable=False),
+        sa.Column('source_key', sa.String(length=64), nullable=False),
+        sa.Column('event_timestamp', sa.BigInteger(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('is_redelivery', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('webhook_event_id', name='unique_line_webhook_event_id')
+    )
+    op.create_index('ix_line_webhook_events_source_status', 'line_webhook_events',
+                    ['source_key', 'status', 'event_timestamp'], unique=False)
+    op.create_index('ix_line_webhook_events_status_received', 'line_webhook_events',
+                    ['status', 'received_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_line_webhook_events_status_received', table_name='line_webhook_events')
+    op.drop_index('ix_line_webhook_events_source_status', table_name='line_webhook_events')
+    op.drop_table('line_webhook_events')
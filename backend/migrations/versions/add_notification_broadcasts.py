@@ -0,0 +1,63 @@
+"""add notification broadcasts, receipts and fan-out indexes
+
+Revision ID: notification_broadcasts_001
+Revises: audience_indexes_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'notification_broadcasts_001'
+down_revision = 'audience_indexes_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'notification_broadcasts',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('temple_id', sa.Integer(), nullable=True),
+        sa.Column('type', sa.String(length=30), nullable=False),
+        sa.Column('title', sa.String(length=200), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('related_type', sa.String(length=30), nullable=True),
+        sa.Column('related_id', sa.Integer(), nullable=True),
+        sa.Column('data', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['temple_id'], ['temples.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('related_type', 'related_id', name='unique_notification_broadcast_source')
+    )
+    op.create_index('ix_notification_broadcasts_temple_id', 'notification_broadcasts', ['temple_id'], unique=False)
+    op.create_index('ix_notification_broadcasts_created_at', 'notification_broadcasts', ['created_at'], unique=False)
+
+    op.create_table(
+        'notification_receipts',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('broadcast_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('read_at', sa.DateTime(), nullable=True),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['broadcast_id'], ['notification_broadcasts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'broadcast_id', name='unique_notification_receipt')
+    )
+
+    # 批次寫入站內通知時以來源判斷是否已寫入（可重複執行）
+    op.create_index('ix_notifications_related', 'notifications', ['related_type', 'related_id', 'user_id'], unique=False)
+    # LINE 用戶與用戶收件地址以電話對應
+    op.create_index('ix_line_users_phone', 'line_users', ['phone'], unique=False)
+    op.create_index('ix_addresses_phone', 'addresses', ['phone'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_addresses_phone', table_name='addresses')
+    op.drop_index('ix_line_users_phone', table_name='line_users')
+    op.drop_index('ix_notifications_related', table_name='notifications')
+    op.drop_table('notification_receipts')
+    op.drop_index('ix_notification_broadcasts_created_at', table_name='notification_broadcasts')
+    op.drop_index('ix_notification_broadcasts_temple_id', table_name='notification_broadcasts')
+    op.drop_table('notification_broadcasts')
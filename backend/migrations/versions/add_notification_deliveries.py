@@ -0,0 +1,39 @@
+"""add notification_deliveries table
+
+Revision ID: notification_deliveries_001
+Revises: user_streaks_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'notification_deliveries_001'
+down_revision = 'user_streaks_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'notification_deliveries',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('notification_id', sa.Integer(), nullable=False),
+        sa.Column('chunk_index', sa.Integer(), nullable=False),
+        sa.Column('recipients', sa.JSON(), nullable=False),
+        sa.Column('recipient_count', sa.Integer(), nullable=False),
+        sa.Column('retry_key', sa.String(length=36), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_status_code', sa.Integer(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['notification_id'], ['temple_notifications.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('notification_id', 'chunk_index', name='unique_notification_delivery_chunk')
+    )
+
+
+def downgrade():
+    op.drop_table('notification_deliveries')
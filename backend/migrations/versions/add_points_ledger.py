@@ -0,0 +1,64 @@
+"""add points ledger and balance snapshots
+
+Revision ID: points_ledger_001
+Revises: event_reserved_seats_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'points_ledger_001'
+down_revision = 'event_reserved_seats_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'points_ledger',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('account_table', sa.String(length=30), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('balance_after', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(length=30), nullable=False),
+        sa.Column('reference_id', sa.Integer(), nullable=True),
+        sa.Column('description', sa.String(length=200), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_points_ledger_account_created',
+        'points_ledger',
+        ['account_table', 'user_id', 'created_at', 'id']
+    )
+
+    op.create_table(
+        'points_balance_snapshots',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('account_table', sa.String(length=30), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('snapshot_date', sa.Date(), nullable=False),
+        sa.Column('balance', sa.Integer(), nullable=False),
+        sa.Column('last_entry_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('account_table', 'user_id', 'snapshot_date', name='unique_points_snapshot_day')
+    )
+    op.create_index('ix_points_balance_snapshots_last_entry_id', 'points_balance_snapshots', ['last_entry_id'])
+
+    # 既有餘額寫入期初紀錄，之後的帳本加總即等於快取的 blessing_points
+    for table in ('users', 'public_users'):
+        op.execute(
+            "INSERT INTO points_ledger (account_table, user_id, delta, balance_after, source, created_at) "
+            f"SELECT '{table}', id, blessing_points, blessing_points, 'opening', UTC_TIMESTAMP() "
+            f"FROM {table} WHERE blessing_points <> 0"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_points_balance_snapshots_last_entry_id', table_name='points_balance_snapshots')
+    op.drop_table('points_balance_snapshots')
+    op.drop_index('ix_points_ledger_account_created', table_name='points_ledger')
+    op.drop_table('points_ledger')
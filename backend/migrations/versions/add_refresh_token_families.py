@@ -0,0 +1,47 @@
+"""add refresh token families and compaction indexes
+
+Revision ID: refresh_token_families_001
+Revises: points_ledger_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'refresh_token_families_001'
+down_revision = 'points_ledger_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'refresh_token_families',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('account_type', sa.String(20), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('generation', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revoked_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('account_type', 'user_id', name='unique_refresh_token_family')
+    )
+    op.create_index('ix_refresh_token_families_revoked_at', 'refresh_token_families', ['revoked_at'])
+
+    # 過期刪除與撤銷清單增量同步
+    op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'])
+    op.create_index('ix_refresh_tokens_revoked_at', 'refresh_tokens', ['revoked_at'])
+
+    # 既有帳號各建立一筆世代 0 的 family（既有 token 不含世代，視為 0）
+    op.execute(
+        "INSERT INTO refresh_token_families (account_type, user_id, generation, created_at) "
+        "SELECT account_type, user_id, 0, UTC_TIMESTAMP() FROM refresh_tokens "
+        "GROUP BY account_type, user_id"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_refresh_tokens_revoked_at', 'refresh_tokens')
+    op.drop_index('ix_refresh_tokens_expires_at', 'refresh_tokens')
+    op.drop_index('ix_refresh_token_families_revoked_at', 'refresh_token_families')
+    op.drop_table('refresh_token_families')
@@ -0,0 +1,49 @@
+"""add scheduler_leases and scheduled_jobs tables
+
+Revision ID: scheduler_state_001
+Revises: notification_broadcasts_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'scheduler_state_001'
+down_revision = 'notification_broadcasts_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scheduler_leases',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('holder', sa.String(length=100), nullable=False),
+        sa.Column('acquired_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table(
+        'scheduled_jobs',
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('interval_seconds', sa.Integer(), nullable=False),
+        sa.Column('next_run_at', sa.DateTime(), nullable=False),
+        sa.Column('running_since', sa.DateTime(), nullable=True),
+        sa.Column('last_started_at', sa.DateTime(), nullable=True),
+        sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+        sa.Column('last_duration_ms', sa.Integer(), nullable=True),
+        sa.Column('last_status', sa.String(length=20), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('last_holder', sa.String(length=100), nullable=True),
+        sa.Column('run_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failure_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_duration_ms', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.create_index('ix_scheduled_jobs_next_run_at', 'scheduled_jobs', ['next_run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_scheduled_jobs_next_run_at', table_name='scheduled_jobs')
+    op.drop_table('scheduled_jobs')
+    op.drop_table('scheduler_leases')
@@ -0,0 +1,58 @@
+"""add temple_daily_stats and temple_visitors tables
+
+Revision ID: temple_daily_stats_001
+Revises: refresh_tokens_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'temple_daily_stats_001'
+down_revision = 'refresh_tokens_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'temple_daily_stats',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('temple_id', sa.Integer(), nullable=False),
+        sa.Column('stat_date', sa.Date(), nullable=False),
+        sa.Column('checkin_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('visitor_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('new_visitor_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('order_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('points_spent', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['temple_id'], ['temples.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('temple_id', 'stat_date', name='unique_temple_stat_date')
+    )
+
+    op.create_table(
+        'temple_visitors',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('temple_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('first_visit_at', sa.DateTime(), nullable=False),
+        sa.Column('last_visit_at', sa.DateTime(), nullable=False),
+        sa.Column('visit_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['temple_id'], ['temples.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('temple_id', 'user_id', name='unique_temple_visitor')
+    )
+    op.create_index('ix_temple_visitors_user_id', 'temple_visitors', ['user_id'], unique=False)
+    op.create_index('ix_temple_visitors_temple_last_visit', 'temple_visitors', ['temple_id', 'last_visit_at'], unique=False)
+    op.create_index('ix_temple_visitors_temple_first_visit', 'temple_visitors', ['temple_id', 'first_visit_at'], unique=False)
+
+    # 建表後請執行 `flask stats rebuild` 回填歷史資料
+
+
+def downgrade():
+    op.drop_index('ix_temple_visitors_temple_first_visit', 'temple_visitors')
+    op.drop_index('ix_temple_visitors_temple_last_visit', 'temple_visitors')
+    op.drop_index('ix_temple_visitors_user_id', 'temple_visitors')
+    op.drop_table('temple_visitors')
+    op.drop_table('temple_daily_stats')
@@ -0,0 +1,31 @@
+"""add user_streaks table
+
+Revision ID: user_streaks_001
+Revises: checkin_dedup_001
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'user_streaks_001'
+down_revision = 'checkin_dedup_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 建立後執行 `flask stats rebuild-streaks` 由既有打卡紀錄回填
+    op.create_table(
+        'user_streaks',
+        sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('current_streak', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('longest_streak', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_checkin_date', sa.Date(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_streaks')
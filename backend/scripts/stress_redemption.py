@@ -0,0 +1,206 @@
+"""
+兌換併發壓力測試（驗證不會超賣、功德值不會遺失更新）
+- 建立一個限量商品與一批測試用戶，以多執行緒同時兌換（每個執行緒各自的資料庫連線）
+- 再同時取消部分兌換（同一筆送出兩次），確認只退還一次
+- 檢查：庫存不為負、售出數量不超過限量、庫存 + 有效兌換數 = 原始庫存、每位用戶的功德值與兌換紀錄一致
+- 初始功德值經由帳本寫入（opening），--keep 保留資料時帳本核對結果仍一致
+- 結束後刪除測試資料與其帳本紀錄（--keep 保留）；任何檢查失敗時 exit code 為 1
+
+使用方式：
+    cd backend
+    python scripts/stress_redemption.py --stock 20 --users 50 --requests 500 --workers 32
+"""
+
+import argparse
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, '.')
+
+from app import create_app, db
+from app.models.user import User
+from app.models.product import Product
+from app.models.address import Address
+from app.models.redemption import Redemption
+from app.models.points_ledger import PointsLedgerEntry, PointsBalanceSnapshot
+from app.services import points_ledger, redemption_writer
+from app.utils.exceptions import AppError
+
+
+MERIT_POINTS = 10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='兌換併發壓力測試')
+    parser.add_argument('--stock', type=int, default=20, help='商品限量')
+    parser.add_argument('--users', type=int, default=50, help='測試用戶數')
+    parser.add_argument('--requests', type=int, default=500, help='兌換請求總數')
+    parser.add_argument('--workers', type=int, default=32, help='同時執行的執行緒數')
+    parser.add_argument('--points', type=int, default=MERIT_POINTS * 3, help='每位用戶的初始功德值')
+    parser.add_argument('--keep', action='store_true', help='保留測試資料')
+    return parser.parse_args()
+
+
+def setup(args, tag):
+    product = Product(
+        name=f'壓力測試商品 {tag}',
+        category='stress-test',
+        merit_points=MERIT_POINTS,
+        stock_quantity=args.stock,
+        is_active=True
+    )
+    db.session.add(product)
+
+    users = [
+        User(name=f'stress-{i}', email=f'stress-{tag}-{i}@example.com', password_hash='x',
+             blessing_points=0)
+        for i in range(args.users)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    for user in users:
+        points_ledger.post(user, args.points, 'opening', description='壓力測試初始功德值')
+
+    addresses = [
+        Address(user_id=user.id, recipient_name=user.name, phone='0900000000',
+                city='台北市', district='信義區', address='壓力測試路 1 號')
+        for user in users
+    ]
+    db.session.add_all(addresses)
+    db.session.commit()
+    return product.id, {user.id: address.id for user, address in zip(users, addresses)}
+
+
+def run_redemptions(app, args, product_id, user_addresses):
+    def redeem(user_id):
+        with app.app_context():
+            user = db.session.get(User, user_id)
+            address = db.session.get(Address, user_addresses[user_id])
+            try:
+                redemption, _ = redemption_writer.create_redemption(
+                    user, product_id, random.choice([1, 1, 1, 2]), address
+                )
+                return 'ok', redemption.id
+            except AppError as e:
+                db.session.rollback()
+                return e.message.split('，')[0], None
+
+    user_ids = list(user_addresses)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        return list(executor.map(redeem, [random.choice(user_ids) for _ in range(args.requests)]))
+
+
+def run_cancels(app, args, redemption_ids):
+    def cancel(redemption_id):
+        with app.app_context():
+            redemption = db.session.get(Redemption, redemption_id)
+            user = db.session.get(User, redemption.user_id)
+            try:
+                redemption_writer.cancel_redemption(user, redemption)
+                return 'ok'
+            except AppError as e:
+                db.session.rollback()
+                return e.message
+
+    # 每筆送出兩次，模擬重複點擊
+    targets = redemption_ids * 2
+    random.shuffle(targets)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        return list(executor.map(cancel, targets))
+
+
+def verify(args, product_id, user_addresses):
+    errors = []
+    product = db.session.get(Product, product_id)
+    active = Redemption.query.filter(
+        Redemption.product_id == product_id,
+        Redemption.status != 'cancelled'
+    ).all()
+    sold = sum(r.quantity for r in active)
+
+    if product.stock_quantity < 0:
+        errors.append(f'庫存為負數：{product.stock_quantity}')
+    if sold > args.stock:
+        errors.append(f'超賣：售出 {sold}，限量 {args.stock}')
+    if product.stock_quantity + sold != args.stock:
+        errors.append(f'庫存不一致：剩餘 {product.stock_quantity} + 售出 {sold} != {args.stock}')
+
+    spent = Counter()
+    for redemption in active:
+        spent[redemption.user_id] += redemption.merit_points_used
+    for user in User.query.filter(User.id.in_(list(user_addresses))).all():
+        if user.blessing_points < 0:
+            errors.append(f'用戶 {user.id} 功德值為負數：{user.blessing_points}')
+        if user.blessing_points + spent[user.id] != args.points:
+            errors.append(
+                f'用戶 {user.id} 功德值不一致：{user.blessing_points} + 已兌換 {spent[user.id]} != {args.points}'
+            )
+    return errors, sold, product.stock_quantity
+
+
+def cleanup(product_id, user_addresses):
+    user_ids = list(user_addresses)
+    for model in (PointsLedgerEntry, PointsBalanceSnapshot):
+        model.query.filter(
+            model.account_table == User.__tablename__,
+            model.user_id.in_(user_ids)
+        ).delete(synchronize_session=False)
+    Redemption.query.filter_by(product_id=product_id).delete(synchronize_session=False)
+    Address.query.filter(Address.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    Product.query.filter_by(id=product_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def stress_redemption():
+    args = parse_args()
+    app = create_app()
+    tag = uuid.uuid4().hex[:8]
+
+    with app.app_context():
+        print("=" * 60)
+        print(f"兌換壓力測試：限量 {args.stock}、{args.users} 位用戶、{args.requests} 個請求、{args.workers} 執行緒")
+        print("=" * 60)
+        product_id, user_addresses = setup(args, tag)
+
+    try:
+        started = time.monotonic()
+        results = run_redemptions(app, args, product_id, user_addresses)
+        elapsed = time.monotonic() - started
+        outcomes = Counter(outcome for outcome, _ in results)
+        print(f"\n[兌換] {elapsed:.2f}s，{args.requests / elapsed:.0f} req/s")
+        for outcome, count in outcomes.most_common():
+            print(f"  {outcome}: {count}")
+        print(f"  售完快取直接拒絕: {redemption_writer.sold_out.get_stats()['fast_rejections']}")
+
+        created = [redemption_id for outcome, redemption_id in results if outcome == 'ok']
+        to_cancel = created[:len(created) // 2]
+        cancel_outcomes = Counter(run_cancels(app, args, to_cancel))
+        print(f"\n[取消] {len(to_cancel)} 筆，各送出兩次")
+        for outcome, count in cancel_outcomes.most_common():
+            print(f"  {outcome}: {count}")
+
+        with app.app_context():
+            errors, sold, remaining = verify(args, product_id, user_addresses)
+            if cancel_outcomes.get('ok', 0) != len(to_cancel):
+                errors.append(f"取消成功 {cancel_outcomes.get('ok', 0)} 次，應為 {len(to_cancel)} 次")
+        print(f"\n[結果] 售出 {sold}，剩餘庫存 {remaining}")
+    finally:
+        if not args.keep:
+            with app.app_context():
+                cleanup(product_id, user_addresses)
+
+    if errors:
+        print("\n[FAIL]")
+        for error in errors:
+            print(f"  - {error}")
+        sys.exit(1)
+    print("\n[PASS] 沒有超賣，功德值與兌換紀錄一致")
+
+
+if __name__ == '__main__':
+    stress_redemption()